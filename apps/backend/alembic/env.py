@@ -9,7 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入 ORM Base 和模型
 from app.models.orm.base import Base
-from app.models.orm import user, course, enrollment, rubric, rubric_criteria, score
+from app.models.orm import user, course, enrollment, rubric, rubric_criteria, score, notification, score_draft
 
 # ===========================
 # Alembic 配置
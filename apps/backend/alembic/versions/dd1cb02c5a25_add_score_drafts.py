@@ -0,0 +1,41 @@
+"""add score drafts
+
+Revision ID: dd1cb02c5a25
+Revises: df7a2a10e0af
+Create Date: 2026-10-19 11:02:17.904316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'dd1cb02c5a25'
+down_revision: Union[str, Sequence[str], None] = 'df7a2a10e0af'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('score_drafts',
+    sa.Column('submission_id', sa.String(length=64), nullable=False),
+    sa.Column('assignment_id', sa.String(length=64), nullable=False),
+    sa.Column('criteria_scores', sa.JSON(), nullable=False),
+    sa.Column('criteria_comments', sa.JSON(), nullable=False),
+    sa.Column('total_score', sa.Float(), nullable=True),
+    sa.Column('feedback', sa.Text(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('updated_by', sa.String(length=64), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('submission_id')
+    )
+    op.create_index(op.f('ix_score_drafts_assignment_id'), 'score_drafts', ['assignment_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_score_drafts_assignment_id'), table_name='score_drafts')
+    op.drop_table('score_drafts')
@@ -3,15 +3,34 @@
 提供文件上传、下载、删除等功能
 """
 
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+import asyncio
+import os
+from email.utils import formatdate
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.datastructures import UploadFile
 
+from app.core.config import settings
 from app.core.dependencies import get_db, get_current_user
-from app.core.security import Role
 from app.models.user import User
+from app.services.blob_codec import accepts_encoding
 from app.services.file_service import get_file_service, FileService
+from app.services.file_download import content_disposition, local_file_response, plan_download
+from app.services.preview import PREVIEW_PENDING
+from app.services.resumable_upload import (
+    CHECKSUM_ALGORITHMS,
+    TUS_EXTENSIONS,
+    TUS_VERSION,
+    UploadState,
+    parse_checksum,
+    parse_metadata
+)
+from app.services.upload_stream import rechunk
 from app.schemas.file_schema import (
+    DirectUploadRequest,
+    DirectUploadResponse,
     FileUploadResponse, 
     FileMetadata, 
     FileListResponse,
@@ -23,30 +42,289 @@ from app.schemas.file_schema import (
 router = APIRouter()
 
 
-@router.post("/upload", response_model=FileUploadResponse)
+# multipart 请求体中分隔符和字段头的余量：请求长度减去它作为文件大小的下限，不会误拒恰好在限制内的文件
+MULTIPART_OVERHEAD = 64 * 1024
+
+MULTIPART_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+
+def _declared_size(request: Request, overhead: int = 0) -> int:
+    """按 Content-Length 估计的文件大小，没有声明长度时为 0"""
+    content_length = request.headers.get("content-length")
+    if not content_length or not content_length.isdigit():
+        return 0
+    return max(int(content_length) - overhead, 0)
+
+
+def _reject_oversized(declared_size: int):
+    if declared_size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件大小超过限制 ({settings.MAX_FILE_SIZE / 1024 / 1024}MB)"
+        )
+
+
+@router.post("/upload", response_model=FileUploadResponse, openapi_extra=MULTIPART_UPLOAD_BODY)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     submission_id: str = Query(..., description="作业提交ID"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
     file_service: FileService = Depends(get_file_service)
 ):
     """
-    上传文件到作业提交
+    上传文件到作业提交（multipart/form-data，字段名 file）
     支持学生上传作业文件
+    请求体在权限、大小和配额检查之后才解析，超出限制的上传不会被读取
     """
     # 检查用户权限（学生可以上传自己的作业文件）
-    if not current_user.is_student() and not current_user.is_professor() and not current_user.is_ta():
+    if not current_user.is_student and not current_user.is_professor and not current_user.is_ta:
         raise HTTPException(status_code=403, detail="没有权限上传文件")
     
+    declared_size = _declared_size(request, MULTIPART_OVERHEAD)
+    _reject_oversized(declared_size)
+    
     # 上传文件
+    form = None
     try:
+        file_service.check_quota(submission_id, declared_size, db)
+        form = await request.form(max_files=1)
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=422, detail="缺少文件字段 file")
         result = await file_service.upload_submission_file(file, submission_id, db)
         return result
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+    finally:
+        if form is not None:
+            await form.close()
+
+
+@router.post("/upload/stream", response_model=FileUploadResponse)
+async def upload_file_stream(
+    request: Request,
+    submission_id: str = Query(..., description="作业提交ID"),
+    file_name: str = Query(..., description="原始文件名"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    以原始请求体上传文件（Content-Type 为文件类型）
+    大文件推荐使用：请求体按块直接写入存储，不经过 multipart 解析
+    """
+    if not current_user.is_student and not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限上传文件")
+    
+    # 声明的长度超限时在读取请求体之前拒绝，配额也按声明的长度在读取之前检查
+    declared_size = _declared_size(request)
+    _reject_oversized(declared_size)
+    
+    try:
+        return await file_service.upload_submission_stream(
+            rechunk(request.stream(), settings.UPLOAD_CHUNK_SIZE),
+            file_name,
+            request.headers.get("content-type"),
+            submission_id,
+            db,
+            declared_size=declared_size
+        )
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+
+
+@router.post("/upload/presign", response_model=DirectUploadResponse)
+async def create_direct_upload(
+    request: DirectUploadRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    申请直传到对象存储的预签名 URL（客户端先计算文件的 SHA-256）
+    相同内容已存在时直接创建文件记录，返回 upload_required=false
+    否则客户端携带 upload_headers 把文件 PUT 到 upload_url，然后调用 /upload/complete
+    """
+    if not current_user.is_student and not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限上传文件")
+    
+    try:
+        return await file_service.create_direct_upload(request, db)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+
+
+@router.post("/upload/complete", response_model=FileUploadResponse)
+async def complete_direct_upload(
+    request: DirectUploadRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    确认直传完成，核对对象大小和校验和后创建文件记录
+    """
+    if not current_user.is_student and not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限上传文件")
+    
+    try:
+        return await file_service.complete_direct_upload(request, db)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+
+
+def _tus_headers(state: Optional[UploadState] = None) -> dict:
+    headers = {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+    if state is not None:
+        headers["Upload-Offset"] = str(state.offset)
+        headers["Upload-Length"] = str(state.length)
+        headers["Upload-Expires"] = formatdate(state.expires_at, usegmt=True)
+        if state.file_id:
+            headers["Upload-File-Id"] = state.file_id
+    return headers
+
+
+def _header_int(request: Request, name: str) -> int:
+    value = request.headers.get(name)
+    if value is None or not value.isdigit():
+        raise HTTPException(status_code=400, detail=f"缺少或无效的 {name} 请求头")
+    return int(value)
+
+
+@router.options("/uploads")
+async def describe_resumable_upload():
+    """续传协议能力（tus 协议发现）"""
+    headers = _tus_headers()
+    headers.update({
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(settings.MAX_FILE_SIZE),
+        "Tus-Checksum-Algorithm": ",".join(CHECKSUM_ALGORITHMS)
+    })
+    return Response(status_code=204, headers=headers)
+
+
+@router.post("/uploads", status_code=201)
+async def create_resumable_upload(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    创建可续传的上传（tus 协议）
+    Upload-Length 为文件总大小；Upload-Metadata 中需要 submission_id 和 filename，可选 filetype
+    返回 201，Location 为之后 PATCH / HEAD 的地址
+    """
+    if not current_user.is_student and not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限上传文件")
+    
+    try:
+        metadata = parse_metadata(request.headers.get("upload-metadata"))
+        state = await file_service.create_resumable_upload(
+            current_user.id,
+            metadata.get("submission_id"),
+            metadata.get("filename"),
+            metadata.get("filetype"),
+            _header_int(request, "upload-length"),
+            db
+        )
+        headers = _tus_headers(state)
+        headers["Location"] = str(request.url_for("resume_upload", upload_id=state.id))
+        return Response(status_code=201, headers=headers)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建上传失败: {str(e)}")
+
+
+@router.head("/uploads/{upload_id}", name="resume_upload")
+async def get_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    查询服务器已确认的偏移量，客户端从 Upload-Offset 处继续上传
+    上传已完成时 Upload-File-Id 为创建的文件记录
+    """
+    state = await file_service.resumable_uploads.get(upload_id, current_user.id)
+    return Response(status_code=200, headers=_tus_headers(state))
+
+
+@router.patch("/uploads/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    从 Upload-Offset 处写入一个块（Content-Type: application/offset+octet-stream）
+    带 Upload-Checksum（如 "sha256 <base64>"）时块校验通过才会被确认，否则返回 460
+    未完成时返回 204；最后一个块写入后创建文件记录，返回 200 和文件信息
+    """
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type 必须为 application/offset+octet-stream")
+    
+    try:
+        state = await file_service.resumable_uploads.get(upload_id, current_user.id)
+        state, result = await file_service.append_resumable_upload(
+            state,
+            _header_int(request, "upload-offset"),
+            rechunk(request.stream(), settings.UPLOAD_CHUNK_SIZE),
+            parse_checksum(request.headers.get("upload-checksum")),
+            db
+        )
+        headers = _tus_headers(state)
+        if result is None:
+            return Response(status_code=204, headers=headers)
+        return Response(
+            content=result.model_dump_json(),
+            status_code=200,
+            media_type="application/json",
+            headers=headers
+        )
+    except HTTPException as e:
+        e.headers = dict(e.headers or {}, **_tus_headers())
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def cancel_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """取消上传并删除已接收的内容（已完成的上传只删除状态，不影响文件记录）"""
+    await file_service.resumable_uploads.get(upload_id, current_user.id)
+    await file_service.resumable_uploads.remove(upload_id)
+    return Response(status_code=204, headers=_tus_headers())
 
 
 @router.get("/submission/{submission_id}", response_model=FileListResponse)
@@ -63,7 +341,7 @@ async def get_submission_files(
     教授、TA可以查看所有文件，学生只能查看自己的文件
     """
     # 检查权限
-    if not current_user.is_professor() and not current_user.is_ta():
+    if not current_user.is_professor and not current_user.is_ta:
         # 学生只能查看自己的文件，需要验证submission_id是否属于该学生
         # 这里需要添加额外的验证逻辑
         pass
@@ -87,26 +365,93 @@ async def get_submission_files(
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
 
 
-@router.get("/{file_id}", response_model=FileMetadata)
-async def get_file_metadata(
-    file_id: str,
+@router.api_route("/assignment/{assignment_id}/archive", methods=["GET", "HEAD"])
+async def export_assignment_files(
+    assignment_id: int,
+    request: Request,
+    status: Optional[str] = Query(None, pattern="^(graded|ungraded)$", description="按评分状态过滤"),
+    student_id: Optional[List[int]] = Query(None, description="只导出这些学生的提交"),
+    compression: str = Query("auto", pattern="^(auto|store)$", description="store 时不压缩，支持断点续传"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
     file_service: FileService = Depends(get_file_service)
 ):
     """
-    获取文件元数据
+    把作业的所有提交文件打包为 ZIP 下载，边读取边发送
+    只有教授和TA可以导出；归档全部为存储模式时支持 Range 续传
     """
+    if not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限导出文件")
+    
     try:
-        metadata = await file_service.get_file_metadata(file_id, db)
-        if not metadata:
-            raise HTTPException(status_code=404, detail="文件不存在")
+        archive, archive_hash = await file_service.build_assignment_archive(
+            assignment_id, db, status, student_id, compression
+        )
+        if not archive.entries:
+            raise HTTPException(status_code=404, detail="没有可导出的文件")
         
-        return metadata
+        file_name = f"assignment_{assignment_id}_submissions.zip"
+        if archive.seekable:
+            plan = plan_download(request, archive.size, file_name, archive_hash)
+            if isinstance(plan, Response):
+                return plan
+            headers = dict(plan.headers, **{"Content-Length": str(plan.end - plan.start + 1)})
+            body = archive.iter_bytes(plan.start, plan.end)
+            status_code = plan.status_code
+        else:
+            # 含压缩条目时大小无法预先确定，只能从头完整下载
+            headers = {
+                "Accept-Ranges": "none",
+                "Cache-Control": "private, no-cache",
+                "Content-Disposition": content_disposition(file_name)
+            }
+            body = archive.iter_bytes()
+            status_code = 200
+        
+        if request.method == "HEAD":
+            return Response(status_code=status_code, media_type="application/zip", headers=headers)
+        return StreamingResponse(body, status_code=status_code, media_type="application/zip", headers=headers)
     except HTTPException as e:
         raise e
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取文件元数据失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"导出文件失败: {str(e)}")
+
+
+@router.post("/assignment/{assignment_id}/import")
+async def import_assignment_files(
+    assignment_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    批量导入线下收集的提交（请求体为 ZIP 归档）
+    条目按根目录的 manifest.csv（file, student_id 或 student_email 列）对应到学生，
+    没有清单时按顶层目录或文件名前缀的学生 ID（student_12/...、12_report.pdf）对应
+    响应为 NDJSON 进度流：started、每批完成后的 progress、最后的 complete（含跳过的条目及原因）
+    """
+    if not current_user.is_professor and not current_user.is_ta:
+        raise HTTPException(status_code=403, detail="没有权限导入文件")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.BULK_IMPORT_MAX_ARCHIVE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"归档大小超过限制 ({settings.BULK_IMPORT_MAX_ARCHIVE_SIZE / 1024 / 1024}MB)"
+        )
+    
+    try:
+        progress = await file_service.import_assignment_archive(
+            rechunk(request.stream(), settings.UPLOAD_CHUNK_SIZE),
+            assignment_id,
+            db
+        )
+        return StreamingResponse(progress, media_type="application/x-ndjson")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"导入文件失败: {str(e)}")
 
 
 @router.delete("/{file_id}", response_model=FileDeleteResponse)
@@ -121,14 +466,12 @@ async def delete_file(
     只有教授和TA可以删除文件
     """
     # 检查权限
-    if not current_user.is_professor() and not current_user.is_ta():
+    if not current_user.is_professor and not current_user.is_ta:
         raise HTTPException(status_code=403, detail="没有权限删除文件")
     
     try:
         # 获取文件记录以获取文件路径
-        file_record = db.query(file_service.storage_backend.SubmissionFile).filter(
-            file_service.storage_backend.SubmissionFile.id == file_id
-        ).first()
+        file_record = file_service.get_file_record(file_id, db)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="文件不存在")
@@ -152,9 +495,12 @@ async def delete_file(
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
 
 
-@router.get("/{file_id}/download")
+@router.api_route("/{file_id}/download", methods=["GET", "HEAD"])
 async def download_file(
     file_id: str,
+    request: Request,
+    inline: bool = Query(False, description="在浏览器中直接打开（视频、PDF 预览）"),
+    original: bool = Query(False, description="下载规范化之前的原始图片"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
     file_service: FileService = Depends(get_file_service)
@@ -162,33 +508,84 @@ async def download_file(
     """
     下载文件
     教授、TA可以下载所有文件，学生只能下载自己的文件
+    支持 Range 请求（返回 206）和 If-None-Match 条件请求（内容未变时返回 304）
+    上传时被规范化的图片可以用 original=true 下载冷存储中的原始内容
+    压缩存储的文件在客户端接受该编码（Accept-Encoding）时直接发送压缩后的字节，否则流式解压
     """
     try:
         # 获取文件记录
-        file_record = db.query(file_service.storage_backend.SubmissionFile).filter(
-            file_service.storage_backend.SubmissionFile.id == file_id
-        ).first()
+        file_record = file_service.get_file_record(file_id, db)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="文件不存在")
         
         # 检查权限
-        if current_user.is_student():
+        if current_user.is_student:
             # 学生只能下载自己的文件
             # 这里需要验证文件是否属于该学生
             pass
         
-        # 下载文件
-        file_content = await file_service.download_file(file_record.file_path)
+        stored_path, file_size, file_hash = file_record.file_path, file_record.file_size, file_record.file_hash
+        # 文件名可以为空（例如旧数据），与打包下载一致使用文件ID
+        download_name = file_record.file_name or file_record.id
+        encoding = None
+        if original and file_record.original_blob:
+            blob = file_record.original_blob
+            stored_path, file_size, file_hash = blob.storage_path, blob.size, blob.file_hash
+        elif file_record.blob is not None and file_record.blob.encoding:
+            encoding = file_record.blob.encoding
         
-        # 返回文件内容
-        from fastapi.responses import Response
-        return Response(
-            content=file_content,
+        if encoding and not accepts_encoding(request.headers.get("accept-encoding"), encoding):
+            # 客户端不接受存储的编码：流式解压，范围按原始内容计算
+            plan = plan_download(request, file_size, download_name, file_hash, inline)
+            if isinstance(plan, Response):
+                plan.headers["Vary"] = "Accept-Encoding"
+                return plan
+            headers = dict(plan.headers, **{
+                "Content-Length": str(plan.end - plan.start + 1),
+                "Vary": "Accept-Encoding"
+            })
+            if request.method == "HEAD":
+                return Response(status_code=plan.status_code, media_type=file_record.mime_type, headers=headers)
+            return StreamingResponse(
+                file_service.iter_content(stored_path, encoding, plan.start, plan.end),
+                status_code=plan.status_code,
+                media_type=file_record.mime_type,
+                headers=headers
+            )
+        
+        if encoding:
+            # 直接发送压缩后的字节，ETag 和范围都对应压缩后的表示
+            file_size, file_hash = file_record.blob.stored_size or file_size, f"{file_hash}:{encoding}"
+        
+        local_path = file_service.storage_backend.get_local_path(stored_path)
+        if local_path:
+            try:
+                file_size = (await asyncio.to_thread(os.stat, local_path)).st_size
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="文件不存在")
+        
+        plan = plan_download(request, file_size, download_name, file_hash, inline)
+        if encoding:
+            plan.headers["Vary"] = "Accept-Encoding"
+            if not isinstance(plan, Response):
+                plan.headers["Content-Encoding"] = encoding
+        if isinstance(plan, Response):
+            return plan
+        
+        if local_path:
+            # 本地文件流式发送，内存占用与文件大小无关
+            return local_file_response(local_path, plan, file_record.mime_type)
+        
+        # 远程存储只请求需要的字节区间，并按块转发
+        headers = dict(plan.headers, **{"Content-Length": str(plan.end - plan.start + 1)})
+        if request.method == "HEAD":
+            return Response(status_code=plan.status_code, media_type=file_record.mime_type, headers=headers)
+        return StreamingResponse(
+            file_service.storage_backend.iter_file(stored_path, plan.start, plan.end),
+            status_code=plan.status_code,
             media_type=file_record.mime_type,
-            headers={
-                "Content-Disposition": f"attachment; filename={file_record.file_name}"
-            }
+            headers=headers
         )
     except HTTPException as e:
         raise e
@@ -196,6 +593,71 @@ async def download_file(
         raise HTTPException(status_code=500, detail=f"下载文件失败: {str(e)}")
 
 
+@router.get("/{file_id}/preview")
+async def get_file_preview(
+    file_id: str,
+    request: Request,
+    variant: str = Query("thumb", pattern="^(thumb|preview)$", description="thumb 为缩略图，preview 为低分辨率预览"),
+    page: int = Query(1, ge=1, description="PDF 页码"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    图片和 PDF 的缩略图 / 预览图（WebP）
+    预览在上传后于后台生成，尚未生成时返回 202 和 Retry-After；
+    预览按内容生成、不会改变，响应可以被浏览器长期缓存
+    """
+    try:
+        file_record = file_service.get_file_record(file_id, db)
+        if not file_record:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        status, preview_path = file_service.get_preview_path(file_record, variant, page)
+        if status == PREVIEW_PENDING:
+            return Response(status_code=202, headers={"Retry-After": "2", "Cache-Control": "no-store"})
+        if preview_path is None:
+            raise HTTPException(status_code=404, detail="该文件没有预览")
+        
+        local_path = file_service.storage_backend.get_local_path(preview_path)
+        if local_path:
+            try:
+                preview_size = (await asyncio.to_thread(os.stat, local_path)).st_size
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="该文件没有预览")
+        else:
+            preview_size = (await file_service.storage_backend.stat_object(preview_path) or {}).get("size")
+            if preview_size is None:
+                raise HTTPException(status_code=404, detail="该文件没有预览")
+        
+        plan = plan_download(
+            request,
+            preview_size,
+            f"{variant}-{page}.webp",
+            f"{file_record.file_hash}:{variant}-{page}",
+            inline=True
+        )
+        cache_control = "private, max-age=31536000, immutable"
+        if isinstance(plan, Response):
+            plan.headers["Cache-Control"] = cache_control
+            return plan
+        plan.headers["Cache-Control"] = cache_control
+        
+        if local_path:
+            return local_file_response(local_path, plan, "image/webp")
+        headers = dict(plan.headers, **{"Content-Length": str(plan.end - plan.start + 1)})
+        return StreamingResponse(
+            file_service.storage_backend.iter_file(preview_path, plan.start, plan.end),
+            status_code=plan.status_code,
+            media_type="image/webp",
+            headers=headers
+        )
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取预览失败: {str(e)}")
+
+
 @router.post("/validate", response_model=FileValidationResponse)
 async def validate_file(
     request: FileValidationRequest,
@@ -318,7 +780,9 @@ async def get_allowed_file_types():
 
 @router.get("/storage-info")
 async def get_storage_info(
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
 ):
     """
     获取存储信息
@@ -328,10 +792,160 @@ async def get_storage_info(
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="没有权限查看存储信息")
     
-    from app.core.config import settings
     return {
         "storage_type": settings.STORAGE_TYPE,
-        "max_file_size": f"{100}MB",
-        "allowed_file_types_count": 30,
-        "upload_directory": getattr(settings, 'UPLOAD_DIR', 'uploads')
+        "max_file_size": f"{settings.MAX_FILE_SIZE / 1024 / 1024:g}MB",
+        "allowed_file_types_count": len(settings.ALLOWED_FILE_TYPES),
+        "upload_directory": settings.UPLOAD_DIR,
+        "deduplication": file_service.get_dedup_stats(db),
+        "image_normalization": file_service.get_normalization_stats(db),
+        "compression": file_service.get_compression_stats(db),
+        "tiers": file_service.get_tier_usage(db),
+        "usage": file_service.get_usage_summary(db)
     }
+
+
+@router.get("/storage/tiers")
+async def get_storage_tiers(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    各存储层级（hot / cold）的 blob 数量和存储字节数，以及冷存储分段的空间利用情况
+    用量由写入、删除和迁移时增量维护，不扫描文件表；只有管理员可以查看
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限查看存储信息")
+    
+    try:
+        return file_service.get_tier_usage(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取存储层级用量失败: {str(e)}")
+
+
+@router.post("/storage/tiering/run")
+async def run_storage_tiering(
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    立即把已结束课程的文件打包进冷存储，并回收空间利用率过低的分段
+    返回本次打包的分段数、blob 数和字节数；只有管理员可以执行
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限执行存储分层")
+    
+    try:
+        return await file_service.run_tiering()
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"存储分层失败: {str(e)}")
+
+
+@router.post("/storage/gc")
+async def collect_storage_garbage(
+    max_files: Optional[int] = Query(None, ge=1, description="本次最多检查的文件数，默认 GC_FILES_PER_RUN"),
+    dry_run: bool = Query(False, description="只统计孤立文件，不移动文件也不推进游标"),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    从上次的位置继续检查存储，把没有记录引用的文件移入隔离区，并删除隔离期满的文件
+    同时检查 blob 记录的存储内容是否存在；只有管理员可以执行
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限执行存储垃圾回收")
+    
+    try:
+        return await file_service.collect_garbage(max_files, dry_run)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"存储垃圾回收失败: {str(e)}")
+
+
+@router.get("/storage/usage/{scope}/{scope_id}")
+async def get_storage_usage(
+    scope: Literal["course", "user"],
+    scope_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    课程或学生的提交文件数、已用字节数和配额
+    用量由上传和删除时增量维护，不扫描文件表；只有管理员可以查看
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限查看存储信息")
+    
+    try:
+        return file_service.get_storage_usage(scope, scope_id, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取存储用量失败: {str(e)}")
+
+
+@router.put("/storage/usage/{scope}/{scope_id}/quota")
+async def set_storage_quota(
+    scope: Literal["course", "user"],
+    scope_id: int,
+    quota_bytes: Optional[int] = Query(None, ge=0, description="配额（字节），不传则恢复为默认配额"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    设置单个课程或学生的存储配额；只有管理员可以设置
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限设置存储配额")
+    
+    try:
+        return file_service.set_storage_quota(scope, scope_id, quota_bytes, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"设置存储配额失败: {str(e)}")
+
+
+@router.post("/storage/usage/reconcile")
+async def reconcile_storage_usage(
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    立即按文件记录重新统计全部课程和学生的用量，校正与计数不一致的部分
+    返回检查和校正的计数数量，以及部分不一致的计数；只有管理员可以执行
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限执行用量校正")
+    
+    try:
+        return await file_service.reconcile_usage()
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"存储用量校正失败: {str(e)}")
+
+
+# 放在最后，避免 /{file_id} 匹配 /allowed-types、/storage-info 等固定路径
+@router.get("/{file_id}", response_model=FileMetadata)
+async def get_file_metadata(
+    file_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """
+    获取文件元数据
+    """
+    try:
+        metadata = await file_service.get_file_metadata(file_id, db)
+        if not metadata:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        return metadata
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文件元数据失败: {str(e)}")
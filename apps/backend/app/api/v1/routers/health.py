@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 
 from app.api.v1.dependencies import get_db
 from app.core.config import settings
+from app.services.file_service import FileService, get_file_service
 
 
 router = APIRouter(tags=["health"])
@@ -51,4 +52,27 @@ def health_check_database(db: Session = Depends(get_db)) -> dict[str, str]:
         "service": settings.PROJECT_NAME,
         "version": settings.VERSION,
         "database": db_status
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/health/storage")
+async def health_check_storage(
+    file_service: FileService = Depends(get_file_service)
+) -> dict[str, str]:
+    """
+    Health check for the file storage backend.
+    
+    Args:
+        file_service: Shared file service
+        
+    Returns:
+        Health status with storage availability
+    """
+    available = await file_service.storage_backend.health_check()
+    
+    return {
+        "status": "healthy" if available else "unhealthy",
+        "service": settings.PROJECT_NAME,
+        "version": settings.VERSION,
+        "storage": settings.STORAGE_TYPE
+    }
@@ -0,0 +1,81 @@
+"""
+Notification inbox router.
+Backs the frontend NotificationBell: paged inbox, unread badge and mark-read.
+Live notifications are pushed over the /notifications websocket.
+"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+
+from app.api.v1.dependencies import get_db, get_current_user
+from app.models.orm.user import User
+from app.models.schemas.notification import (
+    MarkReadRequest,
+    MarkReadResponse,
+    NotificationPage,
+    UnreadCountResponse
+)
+from app.services.notification_service import NotificationService
+
+
+router = APIRouter(prefix="/notifications", tags=["notifications"])
+
+
+@router.get("", response_model=NotificationPage)
+async def list_notifications(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    unread_only: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> NotificationPage:
+    """
+    Get the current user's inbox, newest first.
+
+    Returns:
+        One page of notifications and the cursor for the next (older) page
+    """
+    service = NotificationService(db)
+    try:
+        return await service.get_inbox(current_user.id, limit, cursor, unread_only)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/unread-count", response_model=UnreadCountResponse)
+async def get_unread_count(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> UnreadCountResponse:
+    """
+    Get the unread badge count (single counter-row lookup).
+    """
+    service = NotificationService(db)
+    return UnreadCountResponse(unread_count=await service.get_unread_count(current_user.id))
+
+
+@router.post("/mark-read", response_model=MarkReadResponse)
+async def mark_notifications_read(
+    request: MarkReadRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> MarkReadResponse:
+    """
+    Mark the given notifications, or all of them, as read.
+
+    Returns:
+        Number of notifications changed and the new unread count
+    """
+    if not request.all and not request.ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide notification ids or set all=true"
+        )
+
+    service = NotificationService(db)
+    updated, unread_count = await service.mark_read(
+        current_user.id, None if request.all else request.ids
+    )
+    return MarkReadResponse(updated=updated, unread_count=unread_count)
@@ -3,31 +3,44 @@ WebSocket API路由
 提供实时协作功能的WebSocket端点
 """
 
-from typing import Dict, Any, List
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-import json
 
-from app.core.dependencies import get_db, get_current_user
-from app.core.websocket_manager import websocket_manager, CollaborationMessage
+from app.core.constants import UserRole
+from app.core.dependencies import get_db, get_current_user, get_websocket_user
+from app.core.websocket_manager import (
+    websocket_manager,
+    CollaborationMessage,
+    UserConnection,
+    monotonic_to_iso
+)
+from app.core.grading_state import parse_changes
+from app.core.grading_leases import LeaseConflictError, LeaseError
+from app.services.notification_service import NotificationService
 from app.models.user import User
 
 router = APIRouter()
 
+# 可以参与协作评分和持有评分租约的角色（助教的角色值为 "grader"）
+GRADER_ROLES = (UserRole.PROFESSOR, UserRole.TA)
+
 
 @router.websocket("/collaboration/{assignment_id}")
 async def collaboration_websocket(
     websocket: WebSocket,
     assignment_id: str,
+    last_seq: Optional[int] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_websocket_user)
 ):
     """
     协作评分WebSocket端点
     支持多人同时评分同一个作业
+    重连时携带 last_seq 只补发错过的消息
     """
     # 检查用户权限
-    if current_user.role not in ["professor", "ta"]:
+    if current_user.role not in GRADER_ROLES:
         await websocket.close(code=1008, reason="没有权限参与协作评分")
         return
     
@@ -40,48 +53,65 @@ async def collaboration_websocket(
     
     # 加入协作会话
     session = await websocket_manager.join_collaboration_session(
-        current_user.id, 
+        connection, 
         assignment_id
     )
     
     try:
         # 发送会话信息给新加入的用户
         active_users = await websocket_manager.get_active_users_in_session(session.session_id)
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 session.session_id,
                 "session_joined",
                 {
                     "assignment_id": assignment_id,
                     "active_users": active_users,
-                    "current_grader": session.current_grader
+                    "leases": await websocket_manager.get_leases(assignment_id)
                 }
             )
-        ))
+        )
+        
+        # 重连时补发错过的消息，否则（或缺口已被挤出缓冲区）发送评分草稿快照
+        await send_resume_or_snapshot(connection, session.session_id, last_seq)
         
         # 处理消息
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await connection.receive()
+                await websocket_manager.touch(connection)
                 
                 # 处理不同类型的消息
                 message_type = message.get("type")
                 
-                if message_type == "grade_update":
-                    await handle_grade_update(websocket, message, current_user, assignment_id)
+                if message_type == "pong":
+                    continue
+                
+                elif message_type in ("grade_delta", "grade_update"):
+                    await handle_grade_update(connection, message, current_user, assignment_id)
+                
+                elif message_type == "request_snapshot":
+                    await send_grading_snapshot(connection, session.session_id)
+                
+                elif message_type == "resume":
+                    await send_resume_or_snapshot(
+                        connection, session.session_id, message.get("last_seq")
+                    )
                 
                 elif message_type == "criteria_comment_update":
-                    await handle_criteria_comment_update(websocket, message, current_user, assignment_id)
+                    await handle_criteria_comment_update(connection, message, current_user, assignment_id)
                 
                 elif message_type == "file_annotation_update":
-                    await handle_file_annotation_update(websocket, message, current_user, assignment_id)
+                    await handle_file_annotation_update(connection, message, current_user, assignment_id)
+                
+                elif message_type in ("lease_acquire", "lease_renew", "lease_release"):
+                    await handle_lease_message(connection, message, current_user, assignment_id)
                 
                 elif message_type == "request_current_grader":
-                    await handle_request_current_grader(websocket, session.session_id)
+                    await handle_request_current_grader(connection, session.session_id)
                 
                 elif message_type == "release_grader_lock":
-                    await handle_release_grader_lock(websocket, session.session_id, current_user.id)
+                    await handle_release_grader_lock(connection, assignment_id, connection.user_id)
                 
                 else:
                     # 转发未知消息到会话
@@ -90,28 +120,28 @@ async def collaboration_websocket(
             except WebSocketDisconnect:
                 break
             except Exception as e:
-                await websocket.send_text(json.dumps(
+                await connection.send(
                     CollaborationMessage.session_status_update(
                         session.session_id,
                         "error",
                         {"error": str(e)}
                     )
-                ))
+                )
     
     finally:
-        # 清理连接
+        # 清理连接（只影响本连接，同一用户的其他连接不受影响）
         await websocket_manager.leave_collaboration_session(
-            current_user.id, 
+            connection, 
             session.session_id
         )
-        await websocket_manager.disconnect(current_user.id)
+        await websocket_manager.disconnect(connection)
 
 
 @router.websocket("/notifications")
 async def notification_websocket(
     websocket: WebSocket,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_websocket_user)
 ):
     """
     通知WebSocket端点
@@ -125,120 +155,138 @@ async def notification_websocket(
     )
     
     try:
-        # 发送连接确认
-        await websocket.send_text(json.dumps({
+        # 发送连接确认，附带收件箱未读数（离线期间的通知由客户端按游标拉取）
+        notification_service = NotificationService(db)
+        await connection.send({
             "type": "connection_established",
-            "user_id": current_user.id,
-            "role": current_user.role,
+            "user_id": connection.user_id,
+            "role": connection.role,
+            "unread_count": await notification_service.get_unread_count(current_user.id),
             "timestamp": "2024-01-01T00:00:00Z"
-        }))
+        })
         
         # 保持连接
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await connection.receive()
+                await websocket_manager.touch(connection)
                 
                 # 处理通知相关消息
                 message_type = message.get("type")
                 
-                if message_type == "subscribe_course":
+                if message_type == "pong":
+                    continue
+                
+                elif message_type == "subscribe_course":
                     course_id = message.get("course_id")
                     connection.course_id = course_id
-                    await websocket.send_text(json.dumps({
+                    await connection.send({
                         "type": "course_subscribed",
                         "course_id": course_id,
                         "timestamp": "2024-01-01T00:00:00Z"
-                    }))
+                    })
+                
+                elif message_type == "mark_read":
+                    ids = message.get("ids")
+                    updated, unread_count = await notification_service.mark_read(
+                        current_user.id, None if message.get("all") else (ids or [])
+                    )
+                    await connection.send({
+                        "type": "notifications_marked_read",
+                        "updated": updated,
+                        "unread_count": unread_count,
+                        "timestamp": "2024-01-01T00:00:00Z"
+                    })
                 
                 elif message_type == "subscribe_assignment":
                     assignment_id = message.get("assignment_id")
                     connection.assignment_id = assignment_id
-                    await websocket.send_text(json.dumps({
+                    await connection.send({
                         "type": "assignment_subscribed",
                         "assignment_id": assignment_id,
                         "timestamp": "2024-01-01T00:00:00Z"
-                    }))
+                    })
                 
             except WebSocketDisconnect:
                 break
             except Exception as e:
-                await websocket.send_text(json.dumps({
+                await connection.send({
                     "type": "error",
                     "error": str(e),
                     "timestamp": "2024-01-01T00:00:00Z"
-                }))
+                })
     
     finally:
-        await websocket_manager.disconnect(current_user.id)
+        await websocket_manager.disconnect(connection)
 
 
 async def handle_grade_update(
-    websocket: WebSocket, 
+    connection: UserConnection, 
     message: Dict[str, Any], 
     current_user: User, 
     assignment_id: str
 ):
-    """处理评分更新消息"""
+    """
+    处理评分更新消息
+    grade_delta 只携带变化的字段；旧版 grade_update 携带完整评分，由服务端计算差异
+    """
     try:
-        criteria_scores = message.get("criteria_scores", {})
-        total_score = message.get("total_score", 0.0)
-        feedback = message.get("feedback", "")
+        changes = parse_changes(message)
+        submission_id = str(message.get("submission_id") or assignment_id)
         
-        # 广播评分更新
-        grade_update_message = CollaborationMessage.grade_update(
-            assignment_id=assignment_id,
-            user_id=current_user.id,
-            criteria_scores=criteria_scores,
-            total_score=total_score,
-            feedback=feedback
+        # 应用到会话草稿并只广播实际变化的字段，租约覆盖的范围需校验防护令牌
+        await websocket_manager.submit_grade_delta(
+            f"collab_{assignment_id}",
+            submission_id,
+            connection.user_id,
+            changes,
+            fencing_token=message.get("fencing_token"),
+            connection_id=connection.connection_id
         )
         
-        await websocket_manager.broadcast_to_session(f"collab_{assignment_id}", grade_update_message)
-        
     except Exception as e:
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 f"collab_{message.get('assignment_id', assignment_id)}",
                 "error",
                 {"error": f"评分更新失败: {str(e)}"}
             )
-        ))
+        )
 
 
 async def handle_criteria_comment_update(
-    websocket: WebSocket, 
+    connection: UserConnection, 
     message: Dict[str, Any], 
     current_user: User, 
     assignment_id: str
 ):
     """处理评分标准评论更新消息"""
     try:
-        criteria_id = message.get("criteria_id", "")
+        criteria_id = str(message.get("criteria_id", ""))
         comment = message.get("comment", "")
+        submission_id = str(message.get("submission_id") or assignment_id)
         
-        # 广播评论更新
-        comment_update_message = CollaborationMessage.criteria_comment_update(
-            assignment_id=assignment_id,
-            user_id=current_user.id,
-            criteria_id=criteria_id,
-            comment=comment
+        # 评论属于评分草稿的一部分，作为增量广播
+        await websocket_manager.submit_grade_delta(
+            f"collab_{assignment_id}",
+            submission_id,
+            connection.user_id,
+            parse_changes({"changes": {"criteria_comments": {criteria_id: comment}}}),
+            connection_id=connection.connection_id
         )
         
-        await websocket_manager.broadcast_to_session(f"collab_{assignment_id}", comment_update_message)
-        
     except Exception as e:
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 f"collab_{message.get('assignment_id', assignment_id)}",
                 "error",
                 {"error": f"评论更新失败: {str(e)}"}
             )
-        ))
+        )
 
 
 async def handle_file_annotation_update(
-    websocket: WebSocket, 
+    connection: UserConnection, 
     message: Dict[str, Any], 
     current_user: User, 
     assignment_id: str
@@ -251,75 +299,167 @@ async def handle_file_annotation_update(
         # 广播文件标注更新
         annotation_update_message = CollaborationMessage.file_annotation_update(
             assignment_id=assignment_id,
-            user_id=current_user.id,
+            user_id=connection.user_id,
             file_id=file_id,
             annotation=annotation
         )
         
-        await websocket_manager.broadcast_to_session(f"collab_{assignment_id}", annotation_update_message)
+        # 拖动标注时的连续更新在窗口内合并，不同标注分别保留
+        annotation_id = annotation.get("id") if isinstance(annotation, dict) else None
+        await websocket_manager.broadcast_coalesced(
+            f"collab_{assignment_id}",
+            (connection.user_id, "file_annotation_update", file_id, annotation_id),
+            annotation_update_message,
+            sequenced=True
+        )
         
     except Exception as e:
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 f"collab_{message.get('assignment_id', assignment_id)}",
                 "error",
                 {"error": f"文件标注更新失败: {str(e)}"}
             )
-        ))
+        )
+
+
+async def send_grading_snapshot(connection: UserConnection, session_id: str):
+    """发送会话内评分草稿的完整快照"""
+    snapshot = await websocket_manager.get_grading_snapshot(session_id)
+    await connection.send(
+        CollaborationMessage.grading_snapshot(session_id, snapshot["seq"], snapshot["drafts"])
+    )
+
+
+async def send_resume_or_snapshot(
+    connection: UserConnection,
+    session_id: str,
+    last_seq: Optional[int]
+):
+    """补发 last_seq 之后的消息；无法补全时退回完整快照"""
+    if last_seq is not None:
+        missed = await websocket_manager.get_replay(session_id, int(last_seq))
+        if missed is not None:
+            await connection.send(
+                CollaborationMessage.replay(session_id, int(last_seq), missed)
+            )
+            return
+    
+    await send_grading_snapshot(connection, session_id)
+
+
+async def handle_lease_message(
+    connection: UserConnection,
+    message: Dict[str, Any],
+    current_user: User,
+    assignment_id: str
+):
+    """处理租约获取、续约和释放消息"""
+    session_id = f"collab_{assignment_id}"
+    message_type = message.get("type")
+    submission_id = str(message.get("submission_id") or assignment_id)
+    criterion_id = message.get("criterion_id")
+    
+    try:
+        if message_type == "lease_acquire":
+            lease = await websocket_manager.acquire_lease(
+                assignment_id, submission_id, criterion_id, connection.user_id, message.get("ttl"),
+                connection_id=connection.connection_id
+            )
+            status, details = "lease_granted", lease.to_dict()
+        elif message_type == "lease_renew":
+            lease = await websocket_manager.renew_lease(
+                submission_id, criterion_id, connection.user_id,
+                message.get("token"), message.get("ttl"),
+                connection_id=connection.connection_id
+            )
+            status, details = "lease_renewed", lease.to_dict()
+        else:
+            lease = await websocket_manager.release_lease(
+                submission_id, criterion_id, connection.user_id, message.get("token")
+            )
+            status, details = "lease_released", {
+                "submission_id": submission_id,
+                "criterion_id": criterion_id,
+                "released": lease is not None
+            }
+    except LeaseConflictError as e:
+        status, details = "lease_denied", e.lease.to_dict()
+    except (LeaseError, TypeError, ValueError) as e:
+        status, details = "error", {"error": f"租约操作失败: {str(e)}"}
+    
+    await connection.send(
+        CollaborationMessage.session_status_update(session_id, status, details)
+    )
 
 
 async def handle_request_current_grader(
-    websocket: WebSocket, 
+    connection: UserConnection, 
     session_id: str
 ):
-    """处理请求当前评分者消息"""
+    """处理请求当前评分者消息（返回作业下的全部租约）"""
     try:
         session = await websocket_manager.get_session_info(session_id)
         if session:
-            await websocket.send_text(json.dumps(
+            await connection.send(
                 CollaborationMessage.session_status_update(
                     session_id,
                     "current_grader_info",
                     {
-                        "current_grader": session.current_grader,
-                        "active_users": session.active_users
+                        "leases": await websocket_manager.get_leases(session.assignment_id),
+                        "active_users": list(session.active_users)
                     }
                 )
-            ))
+            )
     except Exception as e:
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 session_id,
                 "error",
                 {"error": f"获取当前评分者失败: {str(e)}"}
             )
-        ))
+        )
 
 
 async def handle_release_grader_lock(
-    websocket: WebSocket, 
-    session_id: str, 
+    connection: UserConnection, 
+    assignment_id: str, 
     user_id: str
 ):
-    """处理释放评分者锁消息"""
+    """处理释放评分者锁消息（释放该用户在本作业下的全部租约）"""
+    session_id = f"collab_{assignment_id}"
     try:
-        await websocket_manager.set_current_grader(session_id, "")
+        released = await websocket_manager.release_user_leases(user_id, assignment_id)
         
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 session_id,
                 "grader_lock_released",
-                {"released_by": user_id}
+                {"released_by": user_id, "released": len(released)}
             )
-        ))
+        )
     except Exception as e:
-        await websocket.send_text(json.dumps(
+        await connection.send(
             CollaborationMessage.session_status_update(
                 session_id,
                 "error",
                 {"error": f"释放评分者锁失败: {str(e)}"}
             )
-        ))
+        )
+
+
+@router.get("/collaboration/metrics")
+async def get_collaboration_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取WebSocket运行指标（连接数、心跳驱逐和会话过期计数等）
+    只有管理员可以查看
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="没有权限查看运行指标")
+    
+    return websocket_manager.get_metrics()
 
 
 @router.get("/collaboration/{assignment_id}/status")
@@ -340,7 +480,7 @@ async def get_collaboration_status(
             "assignment_id": assignment_id,
             "status": "inactive",
             "active_users": [],
-            "current_grader": None
+            "leases": []
         }
     
     active_users = await websocket_manager.get_active_users_in_session(session_id)
@@ -350,49 +490,87 @@ async def get_collaboration_status(
         "assignment_id": session.assignment_id,
         "status": "active",
         "active_users": active_users,
-        "current_grader": session.current_grader,
-        "last_activity": session.last_activity.isoformat()
+        "leases": await websocket_manager.get_leases(assignment_id),
+        "last_activity": monotonic_to_iso(session.last_activity)
+    }
+
+
+@router.get("/collaboration/{assignment_id}/leases/{submission_id}")
+async def get_submission_lease(
+    assignment_id: str,
+    submission_id: str,
+    criterion_id: Optional[str] = Query(None, description="评分标准ID，为空表示整个提交"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    查询提交（或评分标准）的当前租约
+    """
+    lease = await websocket_manager.get_lease(submission_id, criterion_id)
+    return {
+        "submission_id": submission_id,
+        "criterion_id": criterion_id,
+        "lease": lease.to_dict() if lease else None
     }
 
 
 @router.post("/collaboration/{assignment_id}/lock")
 async def request_grader_lock(
     assignment_id: str,
+    submission_id: str = Query(..., description="作业提交ID"),
+    criterion_id: Optional[str] = Query(None, description="评分标准ID，为空表示整个提交"),
+    ttl: Optional[int] = Query(None, ge=10, le=3600, description="租约有效期（秒）"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    请求评分者锁
-    确保同一时间只有一个用户可以修改评分
+    请求评分租约
+    租约只锁定单个提交（或评分标准），多个助教可以同时评分同一作业的不同提交
     """
-    if current_user.role not in ["professor", "ta"]:
+    if current_user.role not in GRADER_ROLES:
         raise HTTPException(status_code=403, detail="没有权限请求评分者锁")
     
-    session_id = f"collab_{assignment_id}"
-    await websocket_manager.set_current_grader(session_id, current_user.id)
+    try:
+        lease = await websocket_manager.acquire_lease(
+            assignment_id, submission_id, criterion_id, str(current_user.id), ttl
+        )
+    except LeaseConflictError as e:
+        raise HTTPException(status_code=409, detail={
+            "message": str(e),
+            "lease": e.lease.to_dict()
+        })
     
     return {
         "success": True,
         "message": "已获得评分者锁",
-        "grader_id": current_user.id,
-        "session_id": session_id
+        "grader_id": str(current_user.id),
+        "session_id": f"collab_{assignment_id}",
+        "lease": lease.to_dict()
     }
 
 
 @router.post("/collaboration/{assignment_id}/unlock")
 async def release_grader_lock(
     assignment_id: str,
+    submission_id: Optional[str] = Query(None, description="作业提交ID，为空时释放本作业下的全部租约"),
+    criterion_id: Optional[str] = Query(None, description="评分标准ID"),
+    token: Optional[int] = Query(None, description="租约令牌"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    释放评分者锁
+    释放评分租约
     """
-    session_id = f"collab_{assignment_id}"
-    await websocket_manager.set_current_grader(session_id, "")
+    if submission_id is None:
+        released = len(await websocket_manager.release_user_leases(str(current_user.id), assignment_id))
+    else:
+        lease = await websocket_manager.release_lease(
+            submission_id, criterion_id, str(current_user.id), token
+        )
+        released = 1 if lease else 0
     
     return {
         "success": True,
         "message": "已释放评分者锁",
-        "session_id": session_id
+        "session_id": f"collab_{assignment_id}",
+        "released": released
     }
\ No newline at end of file
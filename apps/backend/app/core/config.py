@@ -43,8 +43,93 @@ class Settings(BaseSettings):
     SMTP_FROM_EMAIL: str = ""
     
     # File Storage
+    STORAGE_TYPE: str = "local"  # local | s3
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # bytes read/written/hashed per step while streaming
+    UPLOAD_HASH_ALGORITHM: str = "sha256"  # sha256 | blake2b
+    DOWNLOAD_CHUNK_SIZE: int = 256 * 1024  # bytes per read when the server cannot sendfile
+    PREVIEW_ENABLED: bool = True  # thumbnails/previews for images and PDFs (needs Pillow, pypdfium2 for PDFs)
+    PREVIEW_WORKERS: int = 2  # processes rendering previews
+    PREVIEW_THUMBNAIL_SIZE: int = 256  # longest edge in pixels
+    PREVIEW_IMAGE_SIZE: int = 1280
+    PREVIEW_QUALITY: int = 80
+    PREVIEW_PDF_MAX_PAGES: int = 10
+    PREVIEW_MAX_SOURCE_SIZE: int = 50 * 1024 * 1024  # larger files get no preview
+    STORAGE_COMPRESSION_ENABLED: bool = True  # compress text-like blobs at rest (zstd if installed, else gzip)
+    STORAGE_COMPRESSION_MIN_SIZE: int = 1024  # smaller files are stored raw
+    STORAGE_COMPRESSION_LEVEL: Optional[int] = None  # None = codec default (zstd 3, gzip 6)
+    IMAGE_NORMALIZE_ENABLED: bool = False  # re-encode large photos at upload, original kept in cold storage
+    IMAGE_NORMALIZE_MIN_SIZE: int = 1024 * 1024  # smaller images are stored as uploaded
+    IMAGE_NORMALIZE_MAX_DIMENSION: int = 2560  # longest edge in pixels after downsampling
+    IMAGE_NORMALIZE_QUALITY: int = 85  # JPEG quality of the normalized image
+    IMAGE_NORMALIZE_WORKERS: int = 2  # processes re-encoding images
+    TIERING_ENABLED: bool = False  # periodically pack blobs of closed courses into cold-tier segments
+    TIERING_INTERVAL: int = 6 * 3600  # seconds between tiering runs
+    TIERING_SEGMENT_SIZE: int = 256 * 1024 * 1024  # target bytes per packed segment
+    TIERING_SEGMENT_MAX_BLOBS: int = 10000  # blobs per packed segment
+    TIERING_COMPACT_THRESHOLD: float = 0.5  # repack segments whose live bytes fall below this fraction
+    GC_ENABLED: bool = False  # periodically quarantine and delete stored files no database row refers to
+    GC_INTERVAL: int = 24 * 3600  # seconds between garbage collection runs
+    GC_FILES_PER_RUN: int = 100000  # stored files (and blob rows) examined per run; the cursor resumes from there
+    GC_SCAN_BATCH_SIZE: int = 1000  # files listed per directory walk step
+    GC_DB_CHUNK_SIZE: int = 500  # paths per IN (...) lookup
+    GC_MIN_AGE: int = 3600  # younger files may belong to an upload whose row is not committed yet
+    GC_QUARANTINE_PERIOD: int = 7 * 24 * 3600  # seconds quarantined files are kept before deletion
+    COURSE_STORAGE_QUOTA: int = 0  # bytes of submission files per course, 0 = unlimited; overridable per course
+    USER_STORAGE_QUOTA: int = 0  # bytes of submission files per student, 0 = unlimited; overridable per student
+    USAGE_RECONCILE_ENABLED: bool = True  # periodically recount per-course/per-user usage from submission_files
+    USAGE_RECONCILE_INTERVAL: int = 24 * 3600  # seconds between usage reconciliation runs
+    USAGE_RECONCILE_BATCH_SIZE: int = 500  # courses or users recounted per transaction
+    RESUMABLE_UPLOAD_EXPIRES: int = 24 * 3600  # seconds an unfinished resumable upload is kept on disk
+    BULK_IMPORT_MAX_ARCHIVE_SIZE: int = 2 * 1024 * 1024 * 1024  # 2GB per uploaded archive
+    BULK_IMPORT_WORKERS: int = 4  # entries extracted, hashed and stored in parallel
+    BULK_IMPORT_BATCH_SIZE: int = 100  # SubmissionFile rows per transaction
+    ALLOWED_FILE_TYPES: list = [
+        "application/pdf",
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "application/vnd.ms-powerpoint",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "image/jpeg", "image/png", "image/gif", "image/bmp", "image/webp",
+        "video/mp4", "video/avi", "video/mov", "video/wmv", "video/flv",
+        "audio/mp3", "audio/wav", "audio/m4a", "audio/flac",
+        "application/zip", "application/x-rar-compressed", "application/x-7z-compressed",
+        "text/plain", "text/csv", "text/html", "text/css",
+        "application/json", "application/xml",
+    ]
+    
+    # S3 storage (STORAGE_TYPE=s3)
+    S3_BUCKET_NAME: str = ""
+    AWS_REGION: str = "us-east-1"
+    AWS_ACCESS_KEY_ID: Optional[str] = None
+    AWS_SECRET_ACCESS_KEY: Optional[str] = None
+    S3_ENDPOINT_URL: Optional[str] = None  # MinIO or another S3-compatible endpoint
+    S3_MAX_POOL_CONNECTIONS: int = 32  # shared by API calls and transfer threads
+    S3_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024  # larger uploads use multipart
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024  # part size
+    S3_TRANSFER_CONCURRENCY: int = 8  # parts uploaded in parallel per file
+    S3_COLD_STORAGE_CLASS: str = "STANDARD_IA"  # storage class for originals kept after normalization
+    S3_PRESIGNED_URL_EXPIRES: int = 900  # seconds a presigned PUT stays valid
+    
+    # Realtime collaboration
+    WEBSOCKET_BACKPLANE: str = "memory"  # memory | redis
+    REDIS_URL: str = "redis://localhost:6379/0"
+    WEBSOCKET_COALESCE_INTERVAL_MS: int = 50  # 0 disables coalescing
+    WEBSOCKET_REPLAY_BUFFER_SIZE: int = 512  # sequenced messages kept per session
+    WEBSOCKET_HEARTBEAT_INTERVAL: int = 30  # seconds between pings
+    WEBSOCKET_MISSED_HEARTBEATS: int = 2  # evict after this many silent intervals
+    WEBSOCKET_SESSION_IDLE_TIMEOUT: int = 3600  # seconds
+    WEBSOCKET_JANITOR_BATCH_SIZE: int = 500  # sessions expired per batch
+    WEBSOCKET_MEMBER_TTL: int = 90  # seconds; backplane session membership expires unless refreshed by the heartbeat
+    WEBSOCKET_COMPRESSION_THRESHOLD: int = 1024  # bytes; smaller binary frames are not deflated
+    GRADING_LEASE_TTL: int = 120  # seconds; renewed over the websocket while grading
+    GRADING_DRAFT_PERSISTENCE: bool = True  # write collaborative drafts behind to score_drafts
+    GRADING_DRAFT_FLUSH_INTERVAL: int = 5  # seconds between batched draft flushes
+    GRADING_DRAFT_FLUSH_BATCH_SIZE: int = 500  # drafts per INSERT statement
+    GRADING_DRAFT_JOURNAL_DIR: Optional[str] = None  # append-only journal for unflushed drafts; None = <UPLOAD_DIR>/.grading-journal
     
     # AI Features
     OPENAI_API_KEY: Optional[str] = None
@@ -3,14 +3,15 @@
 提供数据库会话、当前用户等依赖
 """
 
-from typing import Generator
-from fastapi import Depends, HTTPException, status
+from typing import Generator, Optional
+from fastapi import Depends, HTTPException, Query, WebSocket, WebSocketException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
-from app.core.database import SessionLocal
-from app.core.security import verify_token
+from app.core.constants import UserRole
+from app.db.session import SessionLocal
+from app.core.security import decode_access_token
 from app.models.user import User
 
 security = HTTPBearer()
@@ -32,7 +33,7 @@ def get_current_user(
     """获取当前用户"""
     try:
         token = credentials.credentials
-        payload = verify_token(token)
+        payload = decode_access_token(token)
         user_id = payload.get("sub")
         
         if user_id is None:
@@ -59,6 +60,31 @@ def get_current_user(
         )
 
 
+def get_websocket_user(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None, description="访问令牌（浏览器无法为 WebSocket 设置请求头）"),
+    db: Session = Depends(get_db)
+) -> User:
+    """获取 WebSocket 连接的当前用户，令牌取自 token 查询参数或 Authorization 请求头"""
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    
+    user = None
+    if token:
+        try:
+            user_id = decode_access_token(token).get("sub")
+            if user_id is not None:
+                user = db.query(User).filter(User.id == user_id).first()
+        except Exception:
+            user = None
+    
+    if user is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="认证失败")
+    return user
+
+
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """获取当前活跃用户"""
     if not current_user.is_active:
@@ -68,34 +94,34 @@ def get_current_active_user(current_user: User = Depends(get_current_user)) -> U
 
 def get_current_professor(current_user: User = Depends(get_current_user)) -> User:
     """获取当前教授用户"""
-    if not current_user.is_professor():
+    if not current_user.is_professor:
         raise HTTPException(status_code=403, detail="权限不足，需要教授权限")
     return current_user
 
 
 def get_current_ta(current_user: User = Depends(get_current_user)) -> User:
     """获取当前TA用户"""
-    if not current_user.is_ta():
+    if not current_user.is_ta:
         raise HTTPException(status_code=403, detail="权限不足，需要TA权限")
     return current_user
 
 
 def get_current_student(current_user: User = Depends(get_current_user)) -> User:
     """获取当前学生用户"""
-    if not current_user.is_student():
+    if not current_user.is_student:
         raise HTTPException(status_code=403, detail="权限不足，需要学生权限")
     return current_user
 
 
 def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
     """获取当前管理员用户"""
-    if not current_user.is_admin():
+    if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="权限不足，需要管理员权限")
     return current_user
 
 
 def get_current_staff(current_user: User = Depends(get_current_user)) -> User:
     """获取当前教职工用户（教授或TA）"""
-    if not (current_user.is_professor() or current_user.is_ta()):
+    if not (current_user.is_professor or current_user.is_ta):
         raise HTTPException(status_code=403, detail="权限不足，需要教职工权限")
     return current_user
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+评分租约 (lease)
+以提交或评分标准为粒度的评分锁，带过期时间和防护令牌 (fencing token)
+多个助教可以同时评分同一作业的不同提交
+
+租约键为 (submission_id, criterion_id)，criterion_id 为 "*" 表示整个提交:
+    - 整个提交的租约与该提交上其他人持有的任何租约冲突
+    - 评分标准租约只与同一标准或整个提交上其他人持有的租约冲突
+
+LeaseManager 既用作所有 worker 共享的租约表（由广播总线提供，进程内或 Redis）上的操作，
+也用作每个 worker 的本地缓存：记录经本 worker 获取或续约的租约，按过期时间通知会话
+"""
+
+import heapq
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+
+WHOLE_SUBMISSION = "*"
+
+LeaseKey = Tuple[str, str]
+
+
+class LeaseError(Exception):
+    """租约操作失败（令牌过期或未持有租约）"""
+
+
+class LeaseConflictError(LeaseError):
+    """租约已被其他用户持有"""
+
+    def __init__(self, lease: "GradingLease"):
+        self.lease = lease
+        super().__init__(f"提交 {lease.submission_id} 正在由用户 {lease.holder} 评分")
+
+
+@dataclass
+class GradingLease:
+    """评分租约"""
+    assignment_id: str
+    submission_id: str
+    criterion_id: str
+    holder: str
+    token: int
+    expires_at: float  # time.monotonic()
+
+    @property
+    def key(self) -> LeaseKey:
+        return (self.submission_id, self.criterion_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "assignment_id": self.assignment_id,
+            "submission_id": self.submission_id,
+            "criterion_id": None if self.criterion_id == WHOLE_SUBMISSION else self.criterion_id,
+            "holder": self.holder,
+            "token": self.token,
+            "expires_in": max(0.0, round(self.expires_at - time.monotonic(), 1)),
+        }
+
+
+def lease_key(submission_id: str, criterion_id: Optional[str] = None) -> LeaseKey:
+    """构造租约键"""
+    return (str(submission_id), str(criterion_id) if criterion_id else WHOLE_SUBMISSION)
+
+
+class LeaseManager:
+    """租约表，所有查询按键直接索引 (O(1))"""
+
+    def __init__(self, default_ttl: int = settings.GRADING_LEASE_TTL, first_token: int = 1):
+        self.default_ttl = default_ttl
+        self.leases: Dict[LeaseKey, GradingLease] = {}
+        self.by_submission: Dict[str, Set[LeaseKey]] = {}
+        self.by_holder: Dict[str, Set[LeaseKey]] = {}
+        self.by_assignment: Dict[str, Set[LeaseKey]] = {}
+        # 过期最小堆: (expires_at, key, token)，续约后旧条目按 token 忽略
+        self.expiry_heap: List[Tuple[float, LeaseKey, int]] = []
+        self._next_token = first_token - 1
+
+    def get(self, submission_id: str, criterion_id: Optional[str] = None) -> Optional[GradingLease]:
+        """获取有效租约"""
+        return self._live(lease_key(submission_id, criterion_id))
+
+    def get_for_submission(self, submission_id: str) -> List[GradingLease]:
+        """获取提交上所有有效租约"""
+        leases = []
+        for key in list(self.by_submission.get(str(submission_id), ())):
+            lease = self._live(key)
+            if lease is not None:
+                leases.append(lease)
+        return leases
+
+    def get_for_assignment(self, assignment_id: str) -> List[GradingLease]:
+        """获取作业下所有有效租约"""
+        leases = []
+        for key in list(self.by_assignment.get(assignment_id, ())):
+            lease = self._live(key)
+            if lease is not None:
+                leases.append(lease)
+        return leases
+
+    def acquire(
+        self,
+        assignment_id: str,
+        submission_id: str,
+        criterion_id: Optional[str],
+        holder: str,
+        ttl: Optional[int] = None
+    ) -> GradingLease:
+        """获取租约，已持有时续约；与他人租约冲突时抛出 LeaseConflictError"""
+        key = lease_key(submission_id, criterion_id)
+        holder = str(holder)
+
+        for other_key in self._conflicting_keys(key):
+            other = self._live(other_key)
+            if other is not None and other.holder != holder:
+                raise LeaseConflictError(other)
+
+        current = self._live(key)
+        if current is not None:
+            return self._extend(current, ttl)
+
+        self._next_token += 1
+        lease = GradingLease(
+            assignment_id=str(assignment_id),
+            submission_id=key[0],
+            criterion_id=key[1],
+            holder=holder,
+            token=self._next_token,
+            expires_at=time.monotonic() + (ttl or self.default_ttl)
+        )
+        self._add(lease)
+        return lease
+
+    def renew(
+        self,
+        submission_id: str,
+        criterion_id: Optional[str],
+        holder: str,
+        token: int,
+        ttl: Optional[int] = None
+    ) -> GradingLease:
+        """续约，令牌必须与当前租约一致"""
+        lease = self._require(submission_id, criterion_id, holder, token)
+        return self._extend(lease, ttl)
+
+    def release(
+        self,
+        submission_id: str,
+        criterion_id: Optional[str],
+        holder: str,
+        token: Optional[int] = None
+    ) -> Optional[GradingLease]:
+        """释放租约，未持有时返回 None"""
+        lease = self._live(lease_key(submission_id, criterion_id))
+        if lease is None or lease.holder != str(holder):
+            return None
+        if token is not None and lease.token != int(token):
+            return None
+        self._remove(lease)
+        return lease
+
+    def release_all(self, holder: str, assignment_id: Optional[str] = None) -> List[GradingLease]:
+        """释放用户持有的全部租约（断开连接时调用）"""
+        released = []
+        for key in list(self.by_holder.get(str(holder), ())):
+            lease = self.leases.get(key)
+            if lease is None:
+                continue
+            if assignment_id is not None and lease.assignment_id != str(assignment_id):
+                continue
+            self._remove(lease)
+            released.append(lease)
+        return released
+
+    def check_write(
+        self,
+        submission_id: str,
+        criterion_ids: Iterable[Optional[str]],
+        holder: str,
+        token: Optional[int]
+    ):
+        """
+        校验写入的防护令牌
+        写入范围被他人的租约覆盖，或携带的令牌不是当前租约令牌时抛出 LeaseError
+        """
+        holder = str(holder)
+        for criterion_id in criterion_ids:
+            key = lease_key(submission_id, criterion_id)
+            covering = {key, (key[0], WHOLE_SUBMISSION)}
+            for cover_key in covering:
+                lease = self._live(cover_key)
+                if lease is None:
+                    continue
+                if lease.holder != holder:
+                    raise LeaseConflictError(lease)
+                if token is None or int(token) != lease.token:
+                    raise LeaseError(f"提交 {submission_id} 的租约令牌已失效")
+
+    def expire(self, limit: Optional[int] = None) -> List[GradingLease]:
+        """从过期堆中弹出已到期的租约并移除"""
+        now = time.monotonic()
+        expired = []
+        while self.expiry_heap and (limit is None or len(expired) < limit):
+            expires_at, key, token = self.expiry_heap[0]
+            if expires_at > now:
+                break
+            heapq.heappop(self.expiry_heap)
+            lease = self.leases.get(key)
+            if lease is None or lease.token != token or lease.expires_at > now:
+                continue
+            self._remove(lease)
+            expired.append(lease)
+        return expired
+
+    def remove_expired(self, submission_id: str) -> List[GradingLease]:
+        """移除提交上已过期的租约并返回（共享租约表在每次操作之前调用）"""
+        now = time.monotonic()
+        expired = [
+            self.leases[key] for key in list(self.by_submission.get(str(submission_id), ()))
+            if self.leases[key].expires_at <= now
+        ]
+        for lease in expired:
+            self._remove(lease)
+        return expired
+
+    def track(self, lease: GradingLease) -> GradingLease:
+        """记录在共享租约表中获取或续约的租约（保存副本），替换同一键上的旧记录"""
+        lease = replace(lease)
+        self._add(lease)
+        return lease
+
+    def forget(self, lease: GradingLease):
+        """租约已释放或过期，移除同一令牌的记录"""
+        current = self.leases.get(lease.key)
+        if current is not None and current.token == lease.token:
+            self._remove(current)
+
+    def _conflicting_keys(self, key: LeaseKey) -> Iterable[LeaseKey]:
+        """可能与 key 冲突的租约键"""
+        submission_id, criterion_id = key
+        if criterion_id == WHOLE_SUBMISSION:
+            return list(self.by_submission.get(submission_id, ()))
+        return [key, (submission_id, WHOLE_SUBMISSION)]
+
+    def _require(
+        self,
+        submission_id: str,
+        criterion_id: Optional[str],
+        holder: str,
+        token: int
+    ) -> GradingLease:
+        lease = self._live(lease_key(submission_id, criterion_id))
+        if lease is None or lease.holder != str(holder) or lease.token != int(token):
+            raise LeaseError(f"提交 {submission_id} 的租约不存在或已失效")
+        return lease
+
+    def _extend(self, lease: GradingLease, ttl: Optional[int]) -> GradingLease:
+        lease.expires_at = time.monotonic() + (ttl or self.default_ttl)
+        heapq.heappush(self.expiry_heap, (lease.expires_at, lease.key, lease.token))
+        return lease
+
+    def _live(self, key: LeaseKey) -> Optional[GradingLease]:
+        """
+        返回未过期的租约；过期的租约留给 expire() / remove_expired() 移除，
+        调用方据此解除连接归属并通知会话
+        """
+        lease = self.leases.get(key)
+        if lease is not None and lease.expires_at <= time.monotonic():
+            return None
+        return lease
+
+    def _add(self, lease: GradingLease):
+        """登记租约，替换同一键上的旧记录（已过期的应先经 expire() / remove_expired() 移除并通知）"""
+        key = lease.key
+        current = self.leases.get(key)
+        if current is not None:
+            self._remove(current)
+        self.leases[key] = lease
+        self.by_submission.setdefault(key[0], set()).add(key)
+        self.by_holder.setdefault(lease.holder, set()).add(key)
+        self.by_assignment.setdefault(lease.assignment_id, set()).add(key)
+        heapq.heappush(self.expiry_heap, (lease.expires_at, key, lease.token))
+
+    def _remove(self, lease: GradingLease):
+        key = lease.key
+        self.leases.pop(key, None)
+        for index, index_key in (
+            (self.by_submission, lease.submission_id),
+            (self.by_holder, lease.holder),
+            (self.by_assignment, lease.assignment_id),
+        ):
+            keys = index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[index_key]
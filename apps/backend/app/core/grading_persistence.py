@@ -0,0 +1,381 @@
+"""
+协作评分草稿的后写 (write-behind) 持久化
+已确认（已广播）的草稿先追加到本地日志 (journal) 并 fsync，再按间隔、租约释放或关闭时
+批量写入 score_drafts 表；进程崩溃后启动时从日志恢复尚未写入数据库的草稿
+
+日志格式: 每行一条 JSON，内容是应用增量后的完整草稿快照
+    {"assignment_id": "...", "submission_id": "...", "criteria_scores": {...}, ..., "seq": 12}
+快照可以重复写入（幂等），按 seq 保留最新的一条，因此恢复和重复刷新都不会重复应用增量
+
+每个进程写自己的日志段文件并持有文件锁，恢复时跳过其他存活进程正在写入的日志段
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不加文件锁，只支持单进程
+    fcntl = None
+
+
+SEGMENT_SUFFIX = ".journal"
+
+DraftSnapshot = Dict[str, Any]
+
+
+def _try_lock(handle) -> bool:
+    """对日志段加排他锁，已被其他进程持有时返回 False"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class DraftJournal:
+    """只追加的草稿日志，按段 (segment) 轮转，刷新成功后删除旧段"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.path: Optional[Path] = None
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """创建新的日志段"""
+        with self._lock:
+            self._open_segment()
+
+    def append(self, records: List[DraftSnapshot]):
+        """追加记录并 fsync，返回时记录已落盘"""
+        payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock:
+            if self._handle is None:
+                self._open_segment()
+            self._handle.write(payload.encode("utf-8"))
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+
+    def rotate(self) -> Optional[Path]:
+        """切换到新日志段，返回旧段路径（没有写入过记录时返回 None 并直接删除）"""
+        with self._lock:
+            old_path = self._close_segment()
+            self._open_segment()
+        return old_path
+
+    def close(self) -> Optional[Path]:
+        """关闭当前日志段，返回仍需保留的段路径"""
+        with self._lock:
+            return self._close_segment()
+
+    def discard(self, paths: Iterable[Path]):
+        """删除已写入数据库的日志段"""
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def recoverable_segments(self) -> List[Tuple[Path, List[DraftSnapshot]]]:
+        """
+        读取其他进程（已退出）遗留的日志段
+        被存活进程锁定的段会跳过；末尾写了一半的记录会被忽略
+        """
+        if not self.directory.exists():
+            return []
+
+        segments = []
+        for path in sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}")):
+            if path == self.path:
+                continue
+            with open(path, "rb") as handle:
+                if not _try_lock(handle):
+                    continue
+                records = []
+                for line in handle:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # 崩溃时未写完的最后一行，对应的增量从未被确认
+                        break
+            segments.append((path, records))
+        return segments
+
+    def _open_segment(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+        self.path = self.directory / name
+        self._handle = open(self.path, "ab")
+        _try_lock(self._handle)
+
+    def _close_segment(self) -> Optional[Path]:
+        if self._handle is None:
+            return None
+        path = self.path
+        empty = self._handle.tell() == 0
+        self._handle.close()
+        self._handle = None
+        self.path = None
+        if empty:
+            path.unlink(missing_ok=True)
+            return None
+        return path
+
+
+def latest_snapshots(records: Iterable[DraftSnapshot]) -> Dict[str, DraftSnapshot]:
+    """每个提交只保留 seq 最大的快照（seq 相同取后写入的）"""
+    latest: Dict[str, DraftSnapshot] = {}
+    for record in records:
+        submission_id = str(record["submission_id"])
+        current = latest.get(submission_id)
+        if current is None or int(record.get("seq", 0)) >= int(current.get("seq", 0)):
+            latest[submission_id] = record
+    return latest
+
+
+def _default_session_factory() -> Session:
+    # 延迟导入，只有真正写数据库时才创建数据库引擎
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+class DraftWriteBehind:
+    """
+    草稿后写缓冲
+    record() 写日志后把草稿标记为脏；flush() 在一个事务中批量 upsert 全部（或指定）脏草稿
+    """
+
+    def __init__(
+        self,
+        journal_dir: Optional[str] = None,
+        flush_interval: float = settings.GRADING_DRAFT_FLUSH_INTERVAL,
+        batch_size: int = settings.GRADING_DRAFT_FLUSH_BATCH_SIZE,
+        session_factory: Callable[[], Session] = _default_session_factory
+    ):
+        # 默认放在上传目录下（隐藏目录，不会被孤儿文件回收扫描）
+        self.journal = DraftJournal(
+            journal_dir
+            or settings.GRADING_DRAFT_JOURNAL_DIR
+            or os.path.join(settings.UPLOAD_DIR, ".grading-journal")
+        )
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+        # submission_id -> 最新快照（尚未写入数据库）
+        self.dirty: Dict[str, DraftSnapshot] = {}
+        # 已轮转但尚未确认写入数据库的日志段
+        self._pending_segments: List[Path] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.flush_count = 0
+
+    async def start(self):
+        """恢复遗留日志，打开新日志段并启动定时刷新"""
+        await self.recover()
+        self.journal.open()
+        if self._task is None and self.flush_interval > 0:
+            self._task = asyncio.create_task(self._run())
+        logger.info("评分草稿后写持久化已启动")
+
+    async def stop(self):
+        """停止定时刷新并写入全部剩余草稿"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        finally:
+            segment = self.journal.close()
+            if segment is not None and self.dirty:
+                # 最终刷新失败，保留日志段供下次启动恢复
+                logger.error(f"关闭时仍有 {len(self.dirty)} 份评分草稿未写入数据库，已保留日志")
+            elif segment is not None:
+                self.journal.discard([segment])
+
+    async def record(self, assignment_id: str, snapshot: DraftSnapshot):
+        """记录一次已应用的草稿修改，返回时已写入日志（可以向客户端确认）"""
+        snapshot = {**snapshot, "assignment_id": str(assignment_id)}
+        submission_id = str(snapshot["submission_id"])
+        current = self.dirty.get(submission_id)
+        if current is None or snapshot.get("seq", 0) >= current.get("seq", 0):
+            self.dirty[submission_id] = snapshot
+        await asyncio.to_thread(self.journal.append, [snapshot])
+
+    async def flush(self, submission_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        批量写入脏草稿，submission_ids 为 None 时写入全部并清理日志
+        返回写入的草稿数
+        """
+        async with self._flush_lock:
+            if submission_ids is None:
+                segment = self.journal.rotate() if self.journal.path else None
+                if segment is not None:
+                    self._pending_segments.append(segment)
+                batch = dict(self.dirty)
+            else:
+                batch = {
+                    str(submission_id): self.dirty[str(submission_id)]
+                    for submission_id in submission_ids
+                    if str(submission_id) in self.dirty
+                }
+
+            if batch:
+                await asyncio.to_thread(self._write_batch, list(batch.values()))
+                for submission_id, snapshot in batch.items():
+                    # 刷新期间又被修改的草稿保持为脏
+                    if self.dirty.get(submission_id) is snapshot:
+                        del self.dirty[submission_id]
+                self.flushed += len(batch)
+                self.flush_count += 1
+
+            if submission_ids is None and self._pending_segments:
+                self.journal.discard(self._pending_segments)
+                self._pending_segments = []
+
+            return len(batch)
+
+    async def load(self, assignment_id: str) -> List[DraftSnapshot]:
+        """读取作业下已持久化的草稿（会话重建时调用），本进程尚未刷新的版本优先"""
+        rows = await asyncio.to_thread(self._read_assignment, str(assignment_id))
+        latest = latest_snapshots(rows)
+        for submission_id, snapshot in self.dirty.items():
+            if snapshot["assignment_id"] == str(assignment_id):
+                latest[submission_id] = snapshot
+        return list(latest.values())
+
+    async def recover(self) -> int:
+        """把已退出进程遗留日志中的草稿写入数据库，然后删除这些日志段"""
+        segments = await asyncio.to_thread(self.journal.recoverable_segments)
+        if not segments:
+            return 0
+
+        latest = latest_snapshots(
+            record for _, records in segments for record in records
+        )
+        if latest:
+            await asyncio.to_thread(self._write_batch, list(latest.values()))
+        self.journal.discard(path for path, _ in segments)
+        logger.info(f"从 {len(segments)} 个日志段恢复了 {len(latest)} 份评分草稿")
+        return len(latest)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "dirty_drafts": len(self.dirty),
+            "flushed_drafts": self.flushed,
+            "flushes": self.flush_count,
+            "pending_segments": len(self._pending_segments),
+        }
+
+    async def _run(self):
+        """按间隔刷新"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"评分草稿刷新失败: {e}")
+
+    def _write_batch(self, snapshots: List[DraftSnapshot]):
+        """在一个事务中 upsert 一批草稿；数据库中 seq 更大的行不会被旧快照覆盖"""
+        from app.models.orm.score_draft import ScoreDraft
+
+        db = self.session_factory()
+        try:
+            dialect = db.get_bind().dialect.name
+            for start in range(0, len(snapshots), self.batch_size):
+                rows = [self._to_row(snapshot) for snapshot in snapshots[start:start + self.batch_size]]
+                if dialect in ("postgresql", "sqlite"):
+                    if dialect == "postgresql":
+                        from sqlalchemy.dialects.postgresql import insert
+                    else:
+                        from sqlalchemy.dialects.sqlite import insert
+                    statement = insert(ScoreDraft).values(rows)
+                    statement = statement.on_conflict_do_update(
+                        index_elements=[ScoreDraft.submission_id],
+                        set_={
+                            name: statement.excluded[name]
+                            for name in rows[0]
+                            if name != "submission_id"
+                        },
+                        where=ScoreDraft.seq <= statement.excluded.seq
+                    )
+                    db.execute(statement)
+                else:
+                    for row in rows:
+                        existing = db.get(ScoreDraft, row["submission_id"])
+                        if existing is None:
+                            db.add(ScoreDraft(**row))
+                        elif existing.seq <= row["seq"]:
+                            for name, value in row.items():
+                                setattr(existing, name, value)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _read_assignment(self, assignment_id: str) -> List[DraftSnapshot]:
+        from app.models.orm.score_draft import ScoreDraft
+
+        db = self.session_factory()
+        try:
+            rows = db.query(ScoreDraft).filter(ScoreDraft.assignment_id == assignment_id).all()
+            return [
+                {
+                    "assignment_id": row.assignment_id,
+                    "submission_id": row.submission_id,
+                    "criteria_scores": row.criteria_scores or {},
+                    "criteria_comments": row.criteria_comments or {},
+                    "total_score": row.total_score,
+                    "feedback": row.feedback or "",
+                    "seq": row.seq,
+                    "updated_by": row.updated_by,
+                }
+                for row in rows
+            ]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _to_row(snapshot: DraftSnapshot) -> Dict[str, Any]:
+        updated_by = snapshot.get("updated_by")
+        return {
+            "submission_id": str(snapshot["submission_id"]),
+            "assignment_id": str(snapshot["assignment_id"]),
+            "criteria_scores": snapshot.get("criteria_scores") or {},
+            "criteria_comments": snapshot.get("criteria_comments") or {},
+            "total_score": snapshot.get("total_score"),
+            "feedback": snapshot.get("feedback") or "",
+            "seq": int(snapshot.get("seq", 0)),
+            "updated_by": None if updated_by is None else str(updated_by),
+            "updated_at": datetime.utcnow(),
+        }
+
+
+def get_draft_store() -> Optional[DraftWriteBehind]:
+    """根据配置创建草稿后写缓冲，关闭持久化时返回 None"""
+    if not settings.GRADING_DRAFT_PERSISTENCE:
+        return None
+    return DraftWriteBehind()
@@ -0,0 +1,180 @@
+"""
+协作评分草稿状态
+服务端保存每个提交的权威评分草稿，客户端只收发字段级增量 (delta)
+
+增量格式:
+    {
+        "criteria_scores": {"<criteria_id>": 8, "<criteria_id>": None},   # None 表示删除
+        "criteria_comments": {"<criteria_id>": "..."},
+        "total_score": 42.5,
+        "feedback": "...",                        # 整体替换
+        "feedback_splices": [[offset, delete_count, "insert"], ...]  # 在替换之后依次应用
+    }
+
+增量先由 parse_changes 校验类型，apply 在副本上计算并校验偏移范围，
+全部成功后才替换草稿，非法增量不会留下改了一半的草稿
+"""
+
+from dataclasses import dataclass, field
+from numbers import Real
+from typing import Any, Dict, List, Optional
+
+
+DICT_FIELDS = ("criteria_scores", "criteria_comments")
+SCALAR_FIELDS = ("total_score",)
+
+
+@dataclass
+class GradingDraft:
+    """单个提交的评分草稿"""
+    submission_id: str
+    criteria_scores: Dict[str, Any] = field(default_factory=dict)
+    criteria_comments: Dict[str, str] = field(default_factory=dict)
+    total_score: Optional[float] = None
+    feedback: str = ""
+    seq: int = 0  # 最近一次修改该草稿的序列号
+    updated_by: Optional[str] = None
+
+    def apply(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        应用增量，返回实际生效的增量（去掉与当前状态相同的字段）
+        文本修改超出范围时抛出 ValueError，草稿保持不变
+        """
+        effective: Dict[str, Any] = {}
+        updated: Dict[str, Any] = {}
+
+        for name in DICT_FIELDS:
+            if not changes.get(name):
+                continue
+            values = dict(getattr(self, name))
+            for key, value in changes[name].items():
+                key = str(key)
+                if value is None:
+                    if key in values:
+                        del values[key]
+                        effective.setdefault(name, {})[key] = None
+                elif values.get(key) != value:
+                    values[key] = value
+                    effective.setdefault(name, {})[key] = value
+            updated[name] = values
+
+        for name in SCALAR_FIELDS:
+            if name in changes and getattr(self, name) != changes[name]:
+                updated[name] = effective[name] = changes[name]
+
+        feedback = self.feedback
+        if "feedback" in changes and changes["feedback"] != self.feedback:
+            feedback = effective["feedback"] = changes["feedback"] or ""
+
+        splices = []
+        for splice in changes.get("feedback_splices") or []:
+            offset, delete_count, text = validate_splice(splice)
+            if offset + delete_count > len(feedback):
+                raise ValueError(
+                    f"feedback_splices 超出范围: [{offset}, {delete_count}]，当前长度 {len(feedback)}"
+                )
+            if delete_count == 0 and not text:
+                continue
+            feedback = feedback[:offset] + text + feedback[offset + delete_count:]
+            splices.append([offset, delete_count, text])
+        if splices:
+            effective["feedback_splices"] = splices
+
+        # 全部计算成功后再替换
+        for name, value in updated.items():
+            setattr(self, name, value)
+        self.feedback = feedback
+
+        return effective
+
+    def snapshot(self) -> Dict[str, Any]:
+        """完整草稿（加入会话或重新同步时发送）"""
+        return {
+            "submission_id": self.submission_id,
+            "criteria_scores": dict(self.criteria_scores),
+            "criteria_comments": dict(self.criteria_comments),
+            "total_score": self.total_score,
+            "feedback": self.feedback,
+            "seq": self.seq,
+            "updated_by": self.updated_by,
+        }
+
+
+def merge_changes(previous: Dict[str, Any], latest: Dict[str, Any]) -> Dict[str, Any]:
+    """合并两个增量，合并结果等价于依次应用二者"""
+    merged: Dict[str, Any] = {}
+
+    for name in DICT_FIELDS:
+        if name in previous or name in latest:
+            merged[name] = {**(previous.get(name) or {}), **(latest.get(name) or {})}
+
+    for name in SCALAR_FIELDS:
+        if name in latest:
+            merged[name] = latest[name]
+        elif name in previous:
+            merged[name] = previous[name]
+
+    splices: List[Any] = []
+    if "feedback" in latest:
+        # 整体替换会覆盖之前的所有文本修改
+        merged["feedback"] = latest["feedback"]
+    else:
+        if "feedback" in previous:
+            merged["feedback"] = previous["feedback"]
+        splices.extend(previous.get("feedback_splices") or [])
+    splices.extend(latest.get("feedback_splices") or [])
+    if splices:
+        merged["feedback_splices"] = splices
+
+    return merged
+
+
+def validate_splice(splice: Any) -> List[Any]:
+    """校验单个文本修改 [offset, delete_count, text] 的类型"""
+    if not isinstance(splice, (list, tuple)) or len(splice) != 3:
+        raise ValueError("feedback_splices 的每一项必须是 [offset, delete_count, text]")
+    offset, delete_count, text = splice
+    for name, value in (("offset", offset), ("delete_count", delete_count)):
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"feedback_splices 的 {name} 必须是非负整数")
+    if not isinstance(text, str):
+        raise ValueError("feedback_splices 的 text 必须是字符串")
+    return [offset, delete_count, text]
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, Real) and not isinstance(value, bool)
+
+
+def parse_changes(message: Dict[str, Any]) -> Dict[str, Any]:
+    """从客户端消息中提取增量字段并校验类型，非法时抛出 ValueError"""
+    changes = message.get("changes")
+    if changes is None:
+        # 兼容旧的 grade_update 整体消息，由服务端计算差异
+        changes = {
+            name: message[name]
+            for name in DICT_FIELDS + SCALAR_FIELDS + ("feedback",)
+            if name in message
+        }
+    if not isinstance(changes, dict):
+        raise ValueError("changes 必须是对象")
+    for name in DICT_FIELDS:
+        if name in changes and not isinstance(changes[name], dict):
+            raise ValueError(f"{name} 必须是对象")
+    for key, value in (changes.get("criteria_scores") or {}).items():
+        if value is not None and not _is_number(value):
+            raise ValueError(f"criteria_scores[{key}] 必须是数字或 null")
+    for key, value in (changes.get("criteria_comments") or {}).items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"criteria_comments[{key}] 必须是字符串或 null")
+    for name in SCALAR_FIELDS:
+        if changes.get(name) is not None and not _is_number(changes[name]):
+            raise ValueError(f"{name} 必须是数字或 null")
+    if changes.get("feedback") is not None and not isinstance(changes["feedback"], str):
+        raise ValueError("feedback 必须是字符串或 null")
+    splices = changes.get("feedback_splices")
+    if splices is not None:
+        if not isinstance(splices, list):
+            raise ValueError("feedback_splices 必须是数组")
+        changes["feedback_splices"] = [validate_splice(splice) for splice in splices]
+    return changes
@@ -47,4 +47,7 @@ def get_logger(name: str) -> logging.Logger:
     Returns:
         Configured logger instance
     """
-    return logging.getLogger(name)
\ No newline at end of file
+    return logging.getLogger(name)
+
+# Shared application logger used by the realtime and file services
+logger = get_logger("deeprubric")
@@ -0,0 +1,113 @@
+"""
+高频协作消息合并器
+在固定时间窗口内按 (会话, 发送者, 对象) 合并消息，只广播最新状态
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.core.logging import logger
+
+
+# 窗口结束时调用: (session_id, message)
+FlushCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+# 合并同一窗口内的两条消息: (previous, latest) -> merged
+MergeFunction = Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+
+@dataclass
+class PendingMessage:
+    """窗口内等待发送的消息"""
+    session_id: str
+    message: Dict[str, Any]
+    callback: FlushCallback
+    merge: Optional[MergeFunction] = None
+    task: Optional[asyncio.Task] = None
+
+
+@dataclass
+class CoalescerStats:
+    """合并统计"""
+    received: int = 0
+    flushed: int = 0
+
+    @property
+    def coalesced(self) -> int:
+        """被合并掉的消息数"""
+        return self.received - self.flushed
+
+
+class MessageCoalescer:
+    """按 key 合并消息，窗口内后到的消息覆盖先到的消息（latest-wins）"""
+
+    def __init__(self, flush_callback: FlushCallback, interval: float):
+        self.flush_callback = flush_callback
+        self.interval = interval
+        self.pending: Dict[Hashable, PendingMessage] = {}
+        self.stats = CoalescerStats()
+
+    async def submit(
+        self,
+        key: Hashable,
+        session_id: str,
+        message: Dict[str, Any],
+        merge: Optional[MergeFunction] = None,
+        callback: Optional[FlushCallback] = None
+    ):
+        """
+        提交消息，窗口内同一 key 只保留最新一条
+        提供 merge 时改为合并消息，提供 callback 时窗口结束后调用它而不是默认回调
+        """
+        self.stats.received += 1
+        callback = callback or self.flush_callback
+
+        if self.interval <= 0:
+            self.stats.flushed += 1
+            await callback(session_id, message)
+            return
+
+        pending = self.pending.get(key)
+        if pending is not None:
+            if pending.merge is not None:
+                pending.message = pending.merge(pending.message, message)
+            else:
+                pending.message = message
+            return
+
+        pending = PendingMessage(
+            session_id=session_id,
+            message=message,
+            callback=callback,
+            merge=merge
+        )
+        self.pending[key] = pending
+        pending.task = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: Hashable):
+        """窗口结束后发送该 key 的最新消息"""
+        try:
+            await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            return
+        await self._flush_key(key)
+
+    async def _flush_key(self, key: Hashable):
+        """发送并移除指定 key 的待发送消息"""
+        pending = self.pending.pop(key, None)
+        if pending is None:
+            return
+
+        self.stats.flushed += 1
+        try:
+            await pending.callback(pending.session_id, pending.message)
+        except Exception as e:
+            logger.error(f"发送合并消息失败 ({key}): {e}")
+
+    async def flush_all(self):
+        """立即发送全部待发送消息（关闭时调用，避免丢失最终状态）"""
+        for key in list(self.pending):
+            pending = self.pending.get(key)
+            if pending is not None and pending.task is not None:
+                pending.task.cancel()
+            await self._flush_key(key)
@@ -0,0 +1,458 @@
+"""
+WebSocket 跨进程广播总线 (backplane)
+在多个 uvicorn worker 之间转发会话/课程广播，并共享会话成员关系、序列号和评分租约
+支持 Redis pub/sub 与进程内实现（用于单进程部署和测试）
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.grading_leases import GradingLease, LeaseError, LeaseManager
+from app.core.logging import logger
+
+
+# 收到远端消息时的回调: (scope, target, message)
+BackplaneHandler = Callable[[str, str, Dict[str, Any]], Awaitable[None]]
+
+T = TypeVar("T")
+
+
+class BackplaneEnvelope:
+    """总线消息封装"""
+
+    @staticmethod
+    def build(origin: str, scope: str, target: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """构造带来源标识的总线消息"""
+        return {
+            "id": uuid.uuid4().hex,
+            "origin": origin,
+            "scope": scope,
+            "target": target,
+            "message": message,
+        }
+
+
+class Backplane:
+    """广播总线接口"""
+
+    def __init__(self, worker_id: Optional[str] = None, dedup_window: int = 1024):
+        self.worker_id = worker_id or uuid.uuid4().hex
+        self._handler: Optional[BackplaneHandler] = None
+        self._seen_ids: "OrderedDict[str, None]" = OrderedDict()
+        self._dedup_window = dedup_window
+
+    async def start(self, handler: BackplaneHandler):
+        """启动总线并注册远端消息回调"""
+        raise NotImplementedError
+
+    async def close(self):
+        """关闭总线"""
+        raise NotImplementedError
+
+    async def publish(self, scope: str, target: str, message: Dict[str, Any]):
+        """发布消息到其他 worker"""
+        raise NotImplementedError
+
+    async def add_session_member(self, session_id: str, user_id: str):
+        """登记会话成员"""
+        raise NotImplementedError
+
+    async def remove_session_member(self, session_id: str, user_id: str):
+        """移除会话成员"""
+        raise NotImplementedError
+
+    async def get_session_members(self, session_id: str) -> Set[str]:
+        """获取全部 worker 上的会话成员"""
+        raise NotImplementedError
+
+    async def refresh_session_members(self, members: Dict[str, Iterable[str]]):
+        """续期本 worker 上的会话成员 (session_id -> user_ids)，由心跳定期调用"""
+        raise NotImplementedError
+
+    async def next_sequence(self, session_id: str) -> int:
+        """分配会话内单调递增的序列号（所有 worker 共享）"""
+        raise NotImplementedError
+
+    async def ensure_sequence(self, session_id: str, floor: int):
+        """保证之后分配的序列号大于 floor（从数据库恢复会话时调用）"""
+        raise NotImplementedError
+
+    async def update_leases(
+        self,
+        submission_id: str,
+        operation: Callable[[LeaseManager], T]
+    ) -> Tuple[T, List[GradingLease]]:
+        """
+        在所有 worker 共享的租约表上原子地执行 operation（获取、续约、释放、写入检查）
+        操作之前先移除已过期的租约，返回 (operation 的结果, 被移除的过期租约)，
+        由调用方通知会话；operation 抛出异常时不做任何修改
+        """
+        raise NotImplementedError
+
+    async def get_assignment_leases(self, assignment_id: str) -> List[GradingLease]:
+        """获取作业下的全部有效租约"""
+        raise NotImplementedError
+
+    async def _dispatch(self, envelope: Dict[str, Any]):
+        """按来源和消息ID去重后交给本地回调"""
+        if envelope.get("origin") == self.worker_id:
+            # 本 worker 发布的消息已在本地投递过
+            return
+
+        envelope_id = envelope.get("id")
+        if envelope_id in self._seen_ids:
+            return
+        self._seen_ids[envelope_id] = None
+        if len(self._seen_ids) > self._dedup_window:
+            self._seen_ids.popitem(last=False)
+
+        if self._handler is None:
+            return
+        try:
+            await self._handler(envelope["scope"], envelope["target"], envelope["message"])
+        except Exception as e:
+            logger.error(f"处理总线消息失败: {e}")
+
+
+class InMemoryBroker:
+    """进程内消息代理，模拟多个 worker 共享的 Redis"""
+
+    def __init__(self):
+        self.subscribers: Set["InMemoryBackplane"] = set()
+        self.session_members: Dict[str, Set[str]] = {}
+        self.sequences: Dict[str, int] = {}
+        self.leases = LeaseManager()
+
+
+class InMemoryBackplane(Backplane):
+    """进程内总线实现，多个实例共享同一个 broker 即可模拟多 worker"""
+
+    def __init__(self, broker: Optional[InMemoryBroker] = None, worker_id: Optional[str] = None):
+        super().__init__(worker_id)
+        self.broker = broker or InMemoryBroker()
+
+    async def start(self, handler: BackplaneHandler):
+        self._handler = handler
+        self.broker.subscribers.add(self)
+
+    async def close(self):
+        self.broker.subscribers.discard(self)
+        self._handler = None
+
+    async def publish(self, scope: str, target: str, message: Dict[str, Any]):
+        envelope = BackplaneEnvelope.build(self.worker_id, scope, target, message)
+        # 与 Redis 一致，经过序列化后再投递，避免共享可变对象
+        payload = json.dumps(envelope)
+        for subscriber in list(self.broker.subscribers):
+            if subscriber is not self:
+                await subscriber._dispatch(json.loads(payload))
+
+    async def add_session_member(self, session_id: str, user_id: str):
+        self.broker.session_members.setdefault(session_id, set()).add(user_id)
+
+    async def remove_session_member(self, session_id: str, user_id: str):
+        members = self.broker.session_members.get(session_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.broker.session_members[session_id]
+
+    async def get_session_members(self, session_id: str) -> Set[str]:
+        return set(self.broker.session_members.get(session_id, ()))
+
+    async def refresh_session_members(self, members: Dict[str, Iterable[str]]):
+        # 进程内成员随 worker 一起消失，无需续期
+        pass
+
+    async def next_sequence(self, session_id: str) -> int:
+        seq = self.broker.sequences.get(session_id, 0) + 1
+        self.broker.sequences[session_id] = seq
+        return seq
+
+    async def ensure_sequence(self, session_id: str, floor: int):
+        if self.broker.sequences.get(session_id, 0) < floor:
+            self.broker.sequences[session_id] = floor
+
+    async def update_leases(
+        self,
+        submission_id: str,
+        operation: Callable[[LeaseManager], T]
+    ) -> Tuple[T, List[GradingLease]]:
+        leases = self.broker.leases
+        expired = leases.expire()
+        try:
+            return operation(leases), expired
+        except LeaseError:
+            # 与 Redis 实现一致：操作失败时不做修改，过期租约留给下一次操作移除
+            for lease in expired:
+                leases.track(lease)
+            raise
+
+    async def get_assignment_leases(self, assignment_id: str) -> List[GradingLease]:
+        return self.broker.leases.get_for_assignment(assignment_id)
+
+
+class RedisBackplane(Backplane):
+    """
+    Redis pub/sub 总线实现
+    会话成员保存在有序集合中，成员为 "worker_id:user_id"，分数为最近一次心跳时间；
+    worker 崩溃后它登记的成员不再续期，超过 WEBSOCKET_MEMBER_TTL 后被忽略并清除
+    评分租约按提交保存在哈希中（字段为评分标准ID），过期时间使用 Redis 服务器时间；
+    修改用 WATCH/MULTI 乐观事务，防护令牌由全局计数器分配
+    """
+
+    CHANNEL = "deeprubric:ws:broadcast"
+    MEMBERS_KEY = "deeprubric:ws:members:{session_id}"
+    SEQUENCE_KEY = "deeprubric:ws:seq:{session_id}"
+    LEASES_KEY = "deeprubric:ws:leases:{submission_id}"
+    LEASE_INDEX_KEY = "deeprubric:ws:lease-index:{assignment_id}"
+    LEASE_TOKEN_KEY = "deeprubric:ws:lease-token"
+    RECONNECT_MIN_DELAY = 0.5  # seconds; doubled after each failed reconnect
+    RECONNECT_MAX_DELAY = 30.0
+
+    def __init__(self, redis_url: str, worker_id: Optional[str] = None, member_ttl: Optional[int] = None):
+        super().__init__(worker_id)
+        # 这里需要安装 redis: pip install redis
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            logger.error("redis未安装，无法使用Redis广播总线")
+            raise RuntimeError("Redis广播总线配置错误")
+
+        self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        self.member_ttl = member_ttl or settings.WEBSOCKET_MEMBER_TTL
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: BackplaneHandler):
+        self._handler = handler
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"Redis广播总线已启动 (worker {self.worker_id})")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(self.CHANNEL)
+            except Exception as e:
+                logger.warning(f"取消订阅Redis广播总线失败: {e}")
+            await self._reset_pubsub()
+        await self.redis.close()
+
+    async def _subscribe(self):
+        """创建订阅连接"""
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.CHANNEL)
+
+    async def _reset_pubsub(self):
+        """关闭（可能已失效的）订阅连接"""
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is None:
+            return
+        try:
+            await pubsub.close()
+        except Exception:
+            # 连接已断开时关闭失败是预期情况
+            pass
+
+    async def _listen(self):
+        """
+        持续读取订阅消息
+        连接中断时按指数退避重新订阅；中断期间其他 worker 的消息会丢失，
+        客户端通过序列号缺口发现并请求补发或快照
+        """
+        delay = self.RECONNECT_MIN_DELAY
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    logger.info(f"Redis广播总线已重新订阅 (worker {self.worker_id})")
+                async for raw in self._pubsub.listen():
+                    delay = self.RECONNECT_MIN_DELAY
+                    try:
+                        envelope = json.loads(raw["data"])
+                    except (TypeError, ValueError) as e:
+                        logger.error(f"无法解析总线消息: {e}")
+                        continue
+                    await self._dispatch(envelope)
+                raise ConnectionError("订阅连接已关闭")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis广播总线连接中断，{delay:.1f}秒后重连: {e}")
+                await self._reset_pubsub()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+    async def publish(self, scope: str, target: str, message: Dict[str, Any]):
+        envelope = BackplaneEnvelope.build(self.worker_id, scope, target, message)
+        await self.redis.publish(self.CHANNEL, json.dumps(envelope))
+
+    def _member(self, user_id: str) -> str:
+        return f"{self.worker_id}:{user_id}"
+
+    async def add_session_member(self, session_id: str, user_id: str):
+        key = self.MEMBERS_KEY.format(session_id=session_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {self._member(user_id): time.time()})
+            pipe.expire(key, self.member_ttl)
+            await pipe.execute()
+
+    async def remove_session_member(self, session_id: str, user_id: str):
+        await self.redis.zrem(self.MEMBERS_KEY.format(session_id=session_id), self._member(user_id))
+
+    async def get_session_members(self, session_id: str) -> Set[str]:
+        key = self.MEMBERS_KEY.format(session_id=session_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # 先清除未续期（所在 worker 已退出）的成员
+            pipe.zremrangebyscore(key, "-inf", time.time() - self.member_ttl)
+            pipe.zrange(key, 0, -1)
+            _, members = await pipe.execute()
+        return {member.split(":", 1)[1] for member in members}
+
+    async def refresh_session_members(self, members: Dict[str, Iterable[str]]):
+        if not members:
+            return
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id, user_ids in members.items():
+                key = self.MEMBERS_KEY.format(session_id=session_id)
+                mapping = {self._member(user_id): now for user_id in user_ids}
+                if not mapping:
+                    continue
+                pipe.zadd(key, mapping)
+                pipe.expire(key, self.member_ttl)
+            await pipe.execute()
+
+    async def next_sequence(self, session_id: str) -> int:
+        return int(await self.redis.incr(self.SEQUENCE_KEY.format(session_id=session_id)))
+
+    async def ensure_sequence(self, session_id: str, floor: int):
+        await self.redis.eval(
+            "if tonumber(redis.call('get', KEYS[1]) or '0') < tonumber(ARGV[1]) then "
+            "redis.call('set', KEYS[1], ARGV[1]) end",
+            1,
+            self.SEQUENCE_KEY.format(session_id=session_id),
+            floor
+        )
+
+    async def update_leases(
+        self,
+        submission_id: str,
+        operation: Callable[[LeaseManager], T]
+    ) -> Tuple[T, List[GradingLease]]:
+        from redis.exceptions import WatchError
+
+        key = self.LEASES_KEY.format(submission_id=submission_id)
+        # 预先分配令牌；操作没有创建新租约时令牌作废，令牌仍全局唯一且递增
+        token = int(await self.redis.incr(self.LEASE_TOKEN_KEY))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    now_ms = self._server_ms(await pipe.time())
+                    leases = LeaseManager(first_token=token)
+                    for value in (await pipe.hgetall(key)).values():
+                        leases.track(self._load_lease(value, now_ms))
+                    expired = leases.remove_expired(submission_id)
+                    result = operation(leases)
+                    live = leases.get_for_submission(submission_id)
+
+                    pipe.multi()
+                    pipe.delete(key)
+                    if live:
+                        pipe.hset(key, mapping={
+                            lease.criterion_id: self._dump_lease(lease, now_ms) for lease in live
+                        })
+                        # 过期的租约要留到下一次操作或持有者所在 worker 确认时移除并通知会话，
+                        # 键的 TTL 只用于清理 worker 崩溃后遗留的租约
+                        pipe.pexpire(key, max(self._remaining_ms(lease) for lease in live) + self.member_ttl * 1000)
+                        for assignment_id in {lease.assignment_id for lease in live}:
+                            pipe.sadd(self.LEASE_INDEX_KEY.format(assignment_id=assignment_id), submission_id)
+                    await pipe.execute()
+                    return result, expired
+                except WatchError:
+                    # 其他 worker 同时修改了这个提交的租约，重新读取后再试
+                    continue
+
+    async def get_assignment_leases(self, assignment_id: str) -> List[GradingLease]:
+        index = self.LEASE_INDEX_KEY.format(assignment_id=assignment_id)
+        submission_ids = sorted(await self.redis.smembers(index))
+        if not submission_ids:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.time()
+            for submission_id in submission_ids:
+                pipe.hgetall(self.LEASES_KEY.format(submission_id=submission_id))
+            server_time, *stored = await pipe.execute()
+
+        now_ms = self._server_ms(server_time)
+        leases = []
+        stale = []
+        for submission_id, values in zip(submission_ids, stored):
+            found = [
+                lease for lease in (self._load_lease(value, now_ms) for value in values.values())
+                if lease.assignment_id == str(assignment_id) and lease.expires_at > time.monotonic()
+            ]
+            leases.extend(found)
+            if not found:
+                stale.append(submission_id)
+        if stale:
+            # 租约已全部释放或过期的提交不再留在索引中
+            await self.redis.srem(index, *stale)
+        return leases
+
+    @staticmethod
+    def _server_ms(server_time: Tuple[int, int]) -> int:
+        seconds, microseconds = server_time
+        return int(seconds) * 1000 + int(microseconds) // 1000
+
+    @staticmethod
+    def _remaining_ms(lease: GradingLease) -> int:
+        return max(1, int((lease.expires_at - time.monotonic()) * 1000))
+
+    @classmethod
+    def _dump_lease(cls, lease: GradingLease, now_ms: int) -> str:
+        """保存为服务器时间的过期时间戳，各 worker 的 monotonic 时钟互不相关"""
+        return json.dumps({
+            "assignment_id": lease.assignment_id,
+            "submission_id": lease.submission_id,
+            "criterion_id": lease.criterion_id,
+            "holder": lease.holder,
+            "token": lease.token,
+            "expires_at_ms": now_ms + cls._remaining_ms(lease),
+        })
+
+    @staticmethod
+    def _load_lease(value: str, now_ms: int) -> GradingLease:
+        data = json.loads(value)
+        return GradingLease(
+            assignment_id=data["assignment_id"],
+            submission_id=data["submission_id"],
+            criterion_id=data["criterion_id"],
+            holder=data["holder"],
+            token=data["token"],
+            expires_at=time.monotonic() + (data["expires_at_ms"] - now_ms) / 1000
+        )
+
+
+def get_backplane() -> Backplane:
+    """根据配置创建广播总线实例"""
+    backplane_type = settings.WEBSOCKET_BACKPLANE.lower()
+
+    if backplane_type == "redis":
+        return RedisBackplane(settings.REDIS_URL)
+    # memory: 单 worker 部署或测试
+    return InMemoryBackplane()
@@ -0,0 +1,141 @@
+"""
+WebSocket 消息编解码层
+协作和通知端点共用，连接时通过子协议协商 JSON 文本帧或 MessagePack 二进制帧
+
+子协议 (Sec-WebSocket-Protocol，按客户端给出的顺序选择第一个可用的):
+    deeprubric.msgpack+deflate  MessagePack，超过阈值的消息使用 deflate 压缩
+    deeprubric.msgpack          MessagePack，不压缩
+    deeprubric.json             JSON 文本帧（默认）
+也可以通过查询参数 ?protocol=<子协议> 指定（无法设置子协议头的客户端）
+
+二进制帧首字节为标志位: 0x00 未压缩，0x01 deflate（raw，无 zlib 头）
+"""
+
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+from app.core.logging import logger
+
+try:
+    import msgpack
+except ImportError:  # 未安装 msgpack 时只提供 JSON 协议
+    msgpack = None
+
+
+Frame = Union[str, bytes]
+
+FLAG_RAW = b"\x00"
+FLAG_DEFLATE = b"\x01"
+
+
+class MessageCodec:
+    """消息编解码接口"""
+
+    name: str = ""
+    binary: bool = False
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        """编码消息为 WebSocket 帧"""
+        raise NotImplementedError
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        """解码 WebSocket 帧为消息"""
+        raise NotImplementedError
+
+
+class JsonCodec(MessageCodec):
+    """JSON 文本帧"""
+
+    name = "deeprubric.json"
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        return json.dumps(message)
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        return json.loads(frame)
+
+
+class MsgpackCodec(MessageCodec):
+    """MessagePack 二进制帧，可选对大消息进行 deflate 压缩"""
+
+    binary = True
+
+    def __init__(self, compress_threshold: Optional[int] = None, level: int = 6):
+        if msgpack is None:
+            raise RuntimeError("msgpack未安装，无法使用二进制协议")
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self.name = "deeprubric.msgpack+deflate" if compress_threshold is not None else "deeprubric.msgpack"
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        payload = msgpack.packb(message, use_bin_type=True, default=str)
+        if self.compress_threshold is not None and len(payload) > self.compress_threshold:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            compressed = compressor.compress(payload) + compressor.flush()
+            # 压缩无收益时仍发送原始数据
+            if len(compressed) < len(payload):
+                return FLAG_DEFLATE + compressed
+        return FLAG_RAW + payload
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        if isinstance(frame, str):
+            # 允许客户端在二进制协议下发送 JSON 文本帧
+            return json.loads(frame)
+        flag, payload = frame[:1], frame[1:]
+        if flag == FLAG_DEFLATE:
+            payload = zlib.decompress(payload, -15)
+        elif flag != FLAG_RAW:
+            raise ValueError("未知的帧标志位")
+        return msgpack.unpackb(payload, raw=False)
+
+
+JSON_CODEC = JsonCodec()
+
+
+def available_codecs() -> Dict[str, MessageCodec]:
+    """当前环境支持的全部编解码器，按子协议名索引"""
+    codecs: Dict[str, MessageCodec] = {JSON_CODEC.name: JSON_CODEC}
+    if msgpack is not None:
+        for codec in (
+            MsgpackCodec(compress_threshold=settings.WEBSOCKET_COMPRESSION_THRESHOLD),
+            MsgpackCodec(),
+        ):
+            codecs[codec.name] = codec
+    return codecs
+
+
+SUPPORTED_CODECS = available_codecs()
+
+
+def negotiate_codec(websocket: WebSocket) -> Tuple[Optional[str], MessageCodec]:
+    """
+    根据客户端提供的子协议或查询参数选择编解码器
+    返回 (需要在握手中确认的子协议, 编解码器)
+    """
+    offered: List[str] = list(websocket.scope.get("subprotocols") or [])
+    for name in offered:
+        codec = SUPPORTED_CODECS.get(name)
+        if codec is not None:
+            return name, codec
+
+    requested = websocket.query_params.get("protocol")
+    if requested:
+        codec = SUPPORTED_CODECS.get(requested)
+        if codec is not None:
+            return None, codec
+        logger.warning(f"不支持的WebSocket协议 {requested}，使用JSON")
+
+    return None, JSON_CODEC
+
+
+async def send_frame(websocket: WebSocket, frame: Frame):
+    """按帧类型发送文本或二进制帧"""
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
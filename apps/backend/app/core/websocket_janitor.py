@@ -0,0 +1,80 @@
+"""
+WebSocket 后台清理任务
+定期发送心跳、断开半开连接，并分批清理空闲的协作会话
+"""
+
+import asyncio
+from typing import Optional
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.websocket_manager import WebSocketManager, websocket_manager
+
+
+class WebSocketJanitor:
+    """随应用生命周期启动和停止的后台清理任务"""
+
+    def __init__(
+        self,
+        manager: WebSocketManager,
+        heartbeat_interval: float = settings.WEBSOCKET_HEARTBEAT_INTERVAL,
+        missed_heartbeats: int = settings.WEBSOCKET_MISSED_HEARTBEATS,
+        session_idle_timeout: int = settings.WEBSOCKET_SESSION_IDLE_TIMEOUT,
+        batch_size: int = settings.WEBSOCKET_JANITOR_BATCH_SIZE
+    ):
+        self.manager = manager
+        self.heartbeat_interval = heartbeat_interval
+        self.missed_heartbeats = missed_heartbeats
+        self.session_idle_timeout = session_idle_timeout
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动后台任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("WebSocket清理任务已启动")
+
+    async def stop(self):
+        """停止后台任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("WebSocket清理任务已停止")
+
+    async def run_once(self):
+        """执行一轮清理: 断开超时连接、发送心跳、续期总线上的会话成员、释放过期租约、分批过期空闲会话"""
+        await self.manager.evict_stale_connections(
+            self.heartbeat_interval * self.missed_heartbeats
+        )
+        await self.manager.ping_connections()
+        await self.manager.refresh_session_members()
+        await self.manager.expire_leases()
+
+        while True:
+            removed = await self.manager.cleanup_inactive_sessions(
+                self.session_idle_timeout,
+                batch_size=self.batch_size
+            )
+            if removed < self.batch_size:
+                break
+            # 每批之间让出事件循环，避免长时间持有锁
+            await asyncio.sleep(0)
+
+    async def _run(self):
+        """按心跳间隔循环执行清理"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"WebSocket清理任务执行失败: {e}")
+
+
+# 全局清理任务实例
+websocket_janitor = WebSocketJanitor(websocket_manager)
@@ -3,209 +3,875 @@ WebSocket 管理器
 提供实时协作功能，支持多人同时评分和实时通知
 """
 
-from typing import Dict, List, Set, Optional, Any
-from dataclasses import dataclass, asdict
-from datetime import datetime
-import json
+from typing import Callable, Deque, Dict, Iterable, List, Set, Optional, Any, Hashable
+from collections import deque
+import heapq
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timedelta
+import itertools
+import sys
+import time
 import asyncio
 from fastapi import WebSocket, WebSocketDisconnect
+from app.core.config import settings
 from app.core.logging import logger
+from app.core.grading_state import GradingDraft, merge_changes, DICT_FIELDS, SCALAR_FIELDS
+from app.core.grading_leases import GradingLease, LeaseKey, LeaseManager
+from app.core.grading_persistence import DraftWriteBehind, get_draft_store
+from app.core.message_coalescer import MessageCoalescer
+from app.core.websocket_backplane import Backplane, InMemoryBackplane, get_backplane
+from app.core.websocket_codec import JSON_CODEC, Frame, MessageCodec, negotiate_codec, send_frame
 
 
-@dataclass
+def intern_id(value: Any) -> Any:
+    """驻留重复出现的字符串ID，大量连接/会话共享同一个字符串对象"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def monotonic_to_iso(timestamp: float) -> str:
+    """把 time.monotonic() 时间戳转换为 UTC ISO 时间（仅用于对外输出）"""
+    return (datetime.utcnow() - timedelta(seconds=time.monotonic() - timestamp)).isoformat()
+
+
+_connection_ids = itertools.count(1)
+
+
+@dataclass(slots=True)
 class UserConnection:
-    """用户连接信息"""
+    """
+    用户连接信息
+    使用 __slots__ 和 monotonic 浮点时间戳，数万空闲连接时内存占用更小
+    同一用户可以同时有多个连接（通知和协作、多个标签页），按 connection_id 区分
+    """
     user_id: str
     websocket: WebSocket
     role: str
+    connection_id: int = field(default_factory=lambda: next(_connection_ids))
     course_id: Optional[str] = None
     assignment_id: Optional[str] = None
-    joined_at: datetime = None
+    joined_at: float = field(default_factory=time.monotonic)
+    last_seen: float = 0.0  # 最近一次收到客户端消息（含 pong）的时间
+    codec: MessageCodec = JSON_CODEC  # 连接时协商的帧格式
     
     def __post_init__(self):
-        if self.joined_at is None:
-            self.joined_at = datetime.utcnow()
+        # 角色和课程/作业ID在大量连接间重复，驻留后共享同一对象；用户ID本身唯一，不驻留
+        self.role = intern_id(self.role)
+        self.course_id = intern_id(self.course_id)
+        self.assignment_id = intern_id(self.assignment_id)
+        if not self.last_seen:
+            self.last_seen = self.joined_at
+    
+    async def send(self, message: Dict[str, Any]):
+        """按协商的协议编码并发送消息"""
+        await send_frame(self.websocket, self.codec.encode(message))
+    
+    async def receive(self) -> Dict[str, Any]:
+        """接收并解码一条消息（文本帧或二进制帧）"""
+        event = await self.websocket.receive()
+        if event["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(event.get("code", 1000))
+        frame = event.get("bytes")
+        if frame is None:
+            frame = event.get("text")
+        return self.codec.decode(frame)
 
 
-@dataclass
+@dataclass(slots=True)
 class CollaborationSession:
     """协作会话信息"""
     session_id: str
     assignment_id: str
-    active_users: List[str]
-    current_grader: Optional[str] = None
-    last_activity: datetime = None
+    active_users: Set[str] = field(default_factory=set)  # 成员检查和移除为 O(1)
+    connections: Set[int] = field(default_factory=set)  # 本 worker 上加入会话的连接ID
+    last_activity: float = field(default_factory=time.monotonic)
+    # 每个提交的权威评分草稿: submission_id -> GradingDraft，首次评分时才创建
+    drafts: Optional[Dict[str, GradingDraft]] = None
+    seq: int = 0  # 最近一次广播的增量序列号
+    # 最近的带序列号消息，用于断线重连后补发，首次广播时才创建
+    replay: Optional[Deque[Dict[str, Any]]] = None
+    generation: int = 0  # 区分同ID重建的会话，过期堆中的旧条目据此忽略
+    # 评分增量的应用、序列号分配和记录在同一临界区内完成，首次评分时才创建
+    commit_lock: Optional[asyncio.Lock] = None
     
-    def __post_init__(self):
-        if self.last_activity is None:
-            self.last_activity = datetime.utcnow()
+    def get_draft(self, submission_id: str) -> GradingDraft:
+        """获取提交的评分草稿，不存在时创建"""
+        if self.drafts is None:
+            self.drafts = {}
+        draft = self.drafts.get(submission_id)
+        if draft is None:
+            draft = self.drafts[submission_id] = GradingDraft(submission_id=submission_id)
+        return draft
+    
+    def record(self, message: Dict[str, Any]):
+        """记录带序列号的消息到重放缓冲区"""
+        if self.replay is None:
+            self.replay = deque(maxlen=settings.WEBSOCKET_REPLAY_BUFFER_SIZE)
+        self.seq = max(self.seq, int(message["seq"]))
+        self.replay.append(message)
+
+
+@dataclass
+class WebSocketMetrics:
+    """WebSocket 运行指标"""
+    heartbeats_sent: int = 0
+    evicted_connections: int = 0
+    expired_sessions: int = 0
+    expired_leases: int = 0
 
 
 class WebSocketManager:
     """WebSocket 连接管理器"""
     
-    def __init__(self):
-        self.active_connections: Dict[str, UserConnection] = {}
+    def __init__(self, backplane: Optional[Backplane] = None, draft_store: Optional[DraftWriteBehind] = None):
+        self.active_connections: Dict[int, UserConnection] = {}  # connection_id -> 连接
+        self.user_connections: Dict[str, Set[int]] = {}  # user_id -> connection_ids
         self.collaboration_sessions: Dict[str, CollaborationSession] = {}
-        self.user_sessions: Dict[str, Set[str]] = {}  # user_id -> session_ids
+        self.connection_sessions: Dict[int, Set[str]] = {}  # connection_id -> session_ids
         self.lock = asyncio.Lock()
+        # 会话过期最小堆: (登记时的 last_activity, session_id, generation)
+        self.session_expiry_heap: List[tuple] = []
+        self._session_generation = 0
+        self.metrics = WebSocketMetrics()
+        # 提交/评分标准粒度的评分租约：以广播总线上的共享租约表为准，
+        # 这里只缓存经本 worker 获取或续约的租约，用于按过期时间通知会话
+        self.leases = LeaseManager()
+        # 通过 WebSocket 获取的租约归属的连接，连接断开时只释放它自己的租约
+        self.connection_leases: Dict[int, Set[LeaseKey]] = {}
+        self.lease_connections: Dict[LeaseKey, int] = {}
+        # 跨 worker 广播总线，默认进程内实现（单 worker 行为不变）
+        self.backplane = backplane or InMemoryBackplane()
+        # 评分草稿后写到数据库（None 时只保存在内存中）
+        self.draft_store = draft_store
+        # 高频消息（评分、标注）按窗口合并后再广播
+        self.coalescer = MessageCoalescer(
+            self.broadcast_to_session,
+            settings.WEBSOCKET_COALESCE_INTERVAL_MS / 1000
+        )
+    
+    async def start(self):
+        """启动广播总线，接收其他 worker 的消息；恢复并启动草稿持久化"""
+        if self.draft_store is not None:
+            await self.draft_store.start()
+        await self.backplane.start(self._handle_backplane_message)
+    
+    async def stop(self):
+        """发送剩余的合并消息，写入剩余草稿并关闭广播总线"""
+        await self.coalescer.flush_all()
+        if self.draft_store is not None:
+            try:
+                await self.draft_store.stop()
+            except Exception as e:
+                logger.error(f"关闭时写入评分草稿失败: {e}")
+        await self.backplane.close()
     
     async def connect(self, websocket: WebSocket, user_id: str, role: str) -> UserConnection:
-        """建立WebSocket连接"""
-        await websocket.accept()
+        """建立WebSocket连接，并协商消息帧格式"""
+        subprotocol, codec = negotiate_codec(websocket)
+        await websocket.accept(subprotocol=subprotocol)
         
+        # 用户ID统一为字符串（与总线上的ID一致），角色枚举转为普通字符串
+        user_id = str(user_id)
+        role = getattr(role, "value", role)
         connection = UserConnection(
             user_id=user_id,
             websocket=websocket,
-            role=role
+            role=role,
+            codec=codec
         )
         
         async with self.lock:
-            self.active_connections[user_id] = connection
-            if user_id not in self.user_sessions:
-                self.user_sessions[user_id] = set()
+            self.active_connections[connection.connection_id] = connection
+            self.user_connections.setdefault(user_id, set()).add(connection.connection_id)
+            self.connection_sessions[connection.connection_id] = set()
         
-        logger.info(f"用户 {user_id} ({role}) 已连接")
+        logger.info(f"用户 {user_id} ({role}) 已连接 (连接 {connection.connection_id})")
         return connection
     
-    async def disconnect(self, user_id: str):
-        """断开WebSocket连接"""
+    async def disconnect(self, connection: UserConnection):
+        """
+        断开WebSocket连接，只清理这个连接自己的会话成员关系和租约
+        已经断开的连接（例如发送失败时已被清理）再次调用时直接忽略
+        """
+        connection_id = connection.connection_id
         async with self.lock:
-            if user_id in self.active_connections:
-                connection = self.active_connections.pop(user_id)
-                
-                # 清理用户会话
-                if user_id in self.user_sessions:
-                    for session_id in self.user_sessions[user_id]:
-                        await self.leave_collaboration_session(user_id, session_id)
-                    del self.user_sessions[user_id]
+            if self.active_connections.get(connection_id) is not connection:
+                return
+            del self.active_connections[connection_id]
+            user_connection_ids = self.user_connections.get(connection.user_id)
+            if user_connection_ids is not None:
+                user_connection_ids.discard(connection_id)
+                if not user_connection_ids:
+                    del self.user_connections[connection.user_id]
+            session_ids = self.connection_sessions.pop(connection_id, set())
+        
+        # 清理连接加入的会话（在锁外执行，leave_collaboration_session 会自行加锁）
+        for session_id in list(session_ids):
+            await self.leave_collaboration_session(connection, session_id)
+        
+        async with self.lock:
+            # 断开连接时释放这个连接获取的租约（已转给同一用户新连接的不受影响）
+            keys = self._pop_connection_leases(connection)
+        
+        released = await self._release_leases(keys, connection.user_id)
+        await self._broadcast_lease_changes("lease_released", released)
         
-        logger.info(f"用户 {user_id} 已断开连接")
+        logger.info(f"用户 {connection.user_id} 已断开连接 (连接 {connection_id})")
     
-    async def join_collaboration_session(self, user_id: str, assignment_id: str) -> CollaborationSession:
+    async def join_collaboration_session(
+        self,
+        connection: UserConnection,
+        assignment_id: str
+    ) -> CollaborationSession:
         """加入协作会话"""
         session_id = f"collab_{assignment_id}"
+        user_id = connection.user_id
         
         async with self.lock:
+            created = session_id not in self.collaboration_sessions
             # 创建或获取协作会话
-            if session_id not in self.collaboration_sessions:
-                self.collaboration_sessions[session_id] = CollaborationSession(
-                    session_id=session_id,
-                    assignment_id=assignment_id,
-                    active_users=[]
-                )
+            session = self._get_or_create_session(session_id, assignment_id)
             
-            session = self.collaboration_sessions[session_id]
+            # 同一用户在本会话中的旧连接（如重连前尚未超时的半开连接）持有的租约转给新连接，
+            # 旧连接随后断开时不会释放新连接正在使用的租约
+            for previous_id in self.user_connections.get(user_id, set()) & session.connections:
+                self._transfer_connection_leases(previous_id, connection.connection_id, session.assignment_id)
             
-            # 添加用户到会话
+            # 添加连接和用户到会话
+            session.connections.add(connection.connection_id)
             if user_id not in session.active_users:
-                session.active_users.append(user_id)
-                session.last_activity = datetime.utcnow()
+                session.active_users.add(user_id)
+                session.last_activity = time.monotonic()
+            
+            # 添加会话到连接
+            if connection.connection_id in self.connection_sessions:
+                self.connection_sessions[connection.connection_id].add(session_id)
             
-            # 添加会话到用户
-            if user_id in self.user_sessions:
-                self.user_sessions[user_id].add(session_id)
+            role = connection.role
+        
+        if created:
+            await self._load_persisted_drafts(session_id, assignment_id)
+        
+        # 会话成员在所有 worker 间共享
+        await self.backplane.add_session_member(session_id, str(user_id))
+        
+        # 通知其他用户
+        await self.broadcast_to_session(
+            session_id,
+            {
+                "type": "user_joined",
+                "user_id": user_id,
+                "role": role,
+                "timestamp": monotonic_to_iso(session.last_activity)
+            }
+        )
+        
+        logger.info(f"用户 {user_id} 加入协作会话 {session_id}")
+        return session
+    
+    async def leave_collaboration_session(self, connection: UserConnection, session_id: str):
+        """连接离开协作会话，用户在本会话中没有其他连接时才移除成员"""
+        user_id = connection.user_id
+        session = None
+        async with self.lock:
+            # 从连接的会话中移除
+            session_ids = self.connection_sessions.get(connection.connection_id)
+            if session_ids is not None:
+                session_ids.discard(session_id)
             
-            # 通知其他用户
+            current = self.collaboration_sessions.get(session_id)
+            if current is not None and connection.connection_id in current.connections:
+                session = current
+                session.connections.discard(connection.connection_id)
+                if not self.user_connections.get(user_id, set()) & session.connections:
+                    session.active_users.discard(user_id)
+                else:
+                    # 用户的其他连接仍在会话中
+                    session = None
+                current.last_activity = time.monotonic()
+                
+                # 如果本 worker 上会话为空且没有评分草稿，删除本地会话
+                # 有草稿或重放记录的会话保留到空闲过期，重新连接时仍可恢复
+                if not current.active_users and not current.drafts and not current.replay:
+                    del self.collaboration_sessions[session_id]
+        
+        if session is None:
+            return
+        
+        await self.backplane.remove_session_member(session_id, str(user_id))
+        
+        # 其他 worker 上仍有成员时也需要通知
+        if await self.backplane.get_session_members(session_id):
             await self.broadcast_to_session(
                 session_id,
                 {
-                    "type": "user_joined",
+                    "type": "user_left",
                     "user_id": user_id,
-                    "role": getattr(self.active_connections.get(user_id), 'role', 'unknown'),
-                    "timestamp": session.last_activity.isoformat()
+                    "timestamp": monotonic_to_iso(session.last_activity)
                 }
             )
+    
+    async def acquire_lease(
+        self,
+        assignment_id: str,
+        submission_id: str,
+        criterion_id: Optional[str],
+        user_id: str,
+        ttl: Optional[int] = None,
+        connection_id: Optional[int] = None
+    ) -> GradingLease:
+        """
+        获取评分租约并通知会话，冲突时抛出 LeaseConflictError
+        通过 WebSocket 获取时记录所属连接，该连接断开时自动释放
+        """
+        existing, lease = await self._update_leases(
+            submission_id,
+            lambda leases: (
+                leases.get(submission_id, criterion_id),
+                leases.acquire(assignment_id, submission_id, criterion_id, user_id, ttl)
+            )
+        )
+        async with self.lock:
+            self.leases.track(lease)
+            self._bind_lease(lease, connection_id)
         
-        logger.info(f"用户 {user_id} 加入协作会话 {session_id}")
-        return session
+        if existing is None:
+            await self._broadcast_lease_changes("lease_acquired", [lease])
+        return lease
     
-    async def leave_collaboration_session(self, user_id: str, session_id: str):
-        """离开协作会话"""
+    async def renew_lease(
+        self,
+        submission_id: str,
+        criterion_id: Optional[str],
+        user_id: str,
+        token: int,
+        ttl: Optional[int] = None,
+        connection_id: Optional[int] = None
+    ) -> GradingLease:
+        """续约，令牌失效时抛出 LeaseError；租约归属转到续约的连接"""
+        lease = await self._update_leases(
+            submission_id,
+            lambda leases: leases.renew(submission_id, criterion_id, user_id, token, ttl)
+        )
         async with self.lock:
-            if session_id in self.collaboration_sessions:
-                session = self.collaboration_sessions[session_id]
-                
-                # 从会话中移除用户
-                if user_id in session.active_users:
-                    session.active_users.remove(user_id)
-                    session.last_activity = datetime.utcnow()
-                
-                # 如果会话为空，删除会话
-                if not session.active_users:
-                    del self.collaboration_sessions[session_id]
-                else:
-                    # 通知其他用户
-                    await self.broadcast_to_session(
-                        session_id,
-                        {
-                            "type": "user_left",
-                            "user_id": user_id,
-                            "timestamp": session.last_activity.isoformat()
-                        }
-                    )
-            
-            # 从用户会话中移除
-            if user_id in self.user_sessions and session_id in self.user_sessions[user_id]:
-                self.user_sessions[user_id].remove(session_id)
+            self.leases.track(lease)
+            self._bind_lease(lease, connection_id)
+        return lease
     
-    async def set_current_grader(self, session_id: str, user_id: str):
-        """设置当前评分者"""
+    async def release_lease(
+        self,
+        submission_id: str,
+        criterion_id: Optional[str],
+        user_id: str,
+        token: Optional[int] = None
+    ) -> Optional[GradingLease]:
+        """释放租约并通知会话"""
+        lease = await self._update_leases(
+            submission_id,
+            lambda leases: leases.release(submission_id, criterion_id, user_id, token)
+        )
+        if lease is None:
+            return None
+        
         async with self.lock:
-            if session_id in self.collaboration_sessions:
-                session = self.collaboration_sessions[session_id]
-                session.current_grader = user_id
-                session.last_activity = datetime.utcnow()
-                
-                # 通知所有用户
-                await self.broadcast_to_session(
-                    session_id,
-                    {
-                        "type": "current_grader_changed",
-                        "current_grader": user_id,
-                        "timestamp": session.last_activity.isoformat()
-                    }
+            self.leases.forget(lease)
+            self._unbind_leases([lease])
+        await self._broadcast_lease_changes("lease_released", [lease])
+        return lease
+    
+    async def release_user_leases(self, user_id: str, assignment_id: str) -> List[GradingLease]:
+        """释放用户在某作业下的全部租约（包括经其他 worker 获取的）"""
+        held = [
+            lease.key for lease in await self.backplane.get_assignment_leases(assignment_id)
+            if lease.holder == str(user_id)
+        ]
+        released = await self._release_leases(held, user_id)
+        await self._broadcast_lease_changes("lease_released", released)
+        return released
+    
+    async def expire_leases(self) -> int:
+        """
+        本地缓存中到期的租约到共享租约表确认：已在其他 worker 续约的重新缓存，
+        确实过期的从表中移除并通知会话
+        """
+        async with self.lock:
+            due = self.leases.expire()
+        if not due:
+            return 0
+        
+        expired_before = self.metrics.expired_leases
+        for submission_id in {lease.submission_id for lease in due}:
+            tokens = {lease.key: lease.token for lease in due if lease.submission_id == submission_id}
+            live = await self._update_leases(
+                submission_id,
+                lambda leases, tokens=tokens: [
+                    lease for key, token in tokens.items()
+                    if (lease := leases.get(*key)) is not None and lease.token == token
+                ]
+            )
+            renewed = {lease.key for lease in live}
+            async with self.lock:
+                for lease in live:
+                    self.leases.track(lease)
+                # 已被其他 worker 移除（并通知）或释放的租约只需解除归属
+                self._unbind_leases([
+                    lease for lease in due
+                    if lease.submission_id == submission_id and lease.key not in renewed
+                ])
+        return self.metrics.expired_leases - expired_before
+    
+    async def get_lease(self, submission_id: str, criterion_id: Optional[str] = None) -> Optional[GradingLease]:
+        """获取某个提交或评分标准上的有效租约"""
+        return await self._update_leases(submission_id, lambda leases: leases.get(submission_id, criterion_id))
+    
+    async def check_lease_write(
+        self,
+        submission_id: str,
+        criterion_ids: Iterable[Optional[str]],
+        user_id: str,
+        token: Optional[int]
+    ):
+        """检查修改范围上的租约，未持有或令牌失效时抛出 LeaseError"""
+        await self._update_leases(
+            submission_id,
+            lambda leases: leases.check_write(submission_id, criterion_ids, user_id, token)
+        )
+    
+    async def _update_leases(self, submission_id: str, operation: Callable[[LeaseManager], Any]) -> Any:
+        """在共享租约表上执行租约操作；顺带移除的过期租约从本地缓存和连接归属中清除并通知会话"""
+        result, expired = await self.backplane.update_leases(submission_id, operation)
+        if expired:
+            async with self.lock:
+                for lease in expired:
+                    self.leases.forget(lease)
+                self._unbind_leases(expired)
+            await self._broadcast_lease_changes("lease_expired", expired)
+            self.metrics.expired_leases += len(expired)
+        return result
+    
+    async def _release_leases(self, keys: Iterable[LeaseKey], user_id: str) -> List[GradingLease]:
+        """在共享租约表中释放用户持有的租约，并清除本地缓存和连接归属"""
+        released = []
+        for submission_id, criterion_id in keys:
+            lease = await self._update_leases(
+                submission_id,
+                lambda leases, submission_id=submission_id, criterion_id=criterion_id: leases.release(
+                    submission_id, criterion_id, user_id
                 )
+            )
+            if lease is not None:
+                released.append(lease)
+        
+        async with self.lock:
+            for lease in released:
+                self.leases.forget(lease)
+            self._unbind_leases(released)
+        return released
+    
+    def _bind_lease(self, lease: GradingLease, connection_id: Optional[int]):
+        """记录租约归属的连接（同一用户在新连接上获取或续约时转移），调用方需持有锁"""
+        if connection_id is None:
+            return
+        previous_id = self.lease_connections.get(lease.key)
+        if previous_id == connection_id:
+            return
+        if previous_id is not None:
+            self._discard_connection_lease(previous_id, lease.key)
+        self.lease_connections[lease.key] = connection_id
+        self.connection_leases.setdefault(connection_id, set()).add(lease.key)
+    
+    def _transfer_connection_leases(self, from_id: int, to_id: int, assignment_id: str):
+        """把旧连接在某作业下的租约转给新连接，调用方需持有锁"""
+        for key in list(self.connection_leases.get(from_id, ())):
+            lease = self.leases.leases.get(key)
+            if lease is not None and lease.assignment_id == assignment_id:
+                self._bind_lease(lease, to_id)
+    
+    def _unbind_leases(self, leases: List[GradingLease]):
+        """租约已释放或过期，移除归属记录，调用方需持有锁"""
+        for lease in leases:
+            connection_id = self.lease_connections.pop(lease.key, None)
+            if connection_id is not None:
+                self._discard_connection_lease(connection_id, lease.key)
+    
+    def _discard_connection_lease(self, connection_id: int, key: LeaseKey):
+        keys = self.connection_leases.get(connection_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.connection_leases[connection_id]
+    
+    def _pop_connection_leases(self, connection: UserConnection) -> List[LeaseKey]:
+        """取出连接仍持有的租约键并解除归属，调用方需持有锁"""
+        keys = list(self.connection_leases.pop(connection.connection_id, ()))
+        for key in keys:
+            self.lease_connections.pop(key, None)
+        return keys
+    
+    async def get_leases(self, assignment_id: str) -> List[Dict[str, Any]]:
+        """获取作业下的全部有效租约（所有 worker 共享）"""
+        return [lease.to_dict() for lease in await self.backplane.get_assignment_leases(assignment_id)]
+    
+    async def _broadcast_lease_changes(self, event: str, leases: List[GradingLease]):
+        """把租约变化作为带序列号的消息广播到对应会话；释放或过期时先写入对应草稿"""
+        if leases and event != "lease_acquired" and self.draft_store is not None:
+            try:
+                await self.draft_store.flush({lease.submission_id for lease in leases})
+            except Exception as e:
+                # 草稿仍在日志和内存中，等下次定时刷新
+                logger.error(f"租约释放时写入评分草稿失败: {e}")
+        for lease in leases:
+            await self.broadcast_sequenced(
+                f"collab_{lease.assignment_id}",
+                CollaborationMessage.lease_update(event, lease.to_dict())
+            )
     
     async def broadcast_to_session(self, session_id: str, message: Dict[str, Any]):
-        """向协作会话中的所有用户广播消息"""
+        """向协作会话中的所有用户广播消息（包括其他 worker 上的用户）"""
+        await self._deliver_to_session(session_id, message)
+        await self.backplane.publish("session", session_id, message)
+    
+    async def broadcast_coalesced(
+        self,
+        session_id: str,
+        key: Hashable,
+        message: Dict[str, Any],
+        sequenced: bool = False
+    ):
+        """合并窗口内同一 key 的消息，窗口结束时只广播最新一条"""
+        await self.coalescer.submit(
+            (session_id,) + tuple(key),
+            session_id,
+            message,
+            callback=self.broadcast_sequenced if sequenced else None
+        )
+    
+    async def broadcast_sequenced(
+        self,
+        session_id: str,
+        message: Dict[str, Any],
+        seq: Optional[int] = None
+    ):
+        """分配序列号并记录到会话重放缓冲区，然后广播"""
+        if seq is None:
+            seq = await self.backplane.next_sequence(session_id)
+        message = {**message, "seq": seq}
+        
         async with self.lock:
-            if session_id in self.collaboration_sessions:
-                session = self.collaboration_sessions[session_id]
-                
-                for user_id in session.active_users:
-                    if user_id in self.active_connections:
-                        try:
-                            await self.active_connections[user_id].websocket.send_text(
-                                json.dumps(message)
-                            )
-                        except Exception as e:
-                            logger.error(f"发送消息给用户 {user_id} 失败: {e}")
-                            # 移除断开连接的用户
-                            await self.disconnect(user_id)
+            session = self.collaboration_sessions.get(session_id)
+            if session is not None:
+                session.record(message)
+                session.last_activity = time.monotonic()
+        
+        await self.broadcast_to_session(session_id, message)
+    
+    async def get_replay(self, session_id: str, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        获取 last_seq 之后错过的消息
+        缺口中任一消息已被挤出缓冲区时返回 None，调用方应改发完整快照
+        """
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return None if last_seq > 0 else []
+            current_seq = session.seq
+            if last_seq >= current_seq:
+                return []
+            missed = sorted(
+                (message for message in session.replay or () if message["seq"] > last_seq),
+                key=lambda message: message["seq"]
+            )
+        
+        if len(missed) != current_seq - last_seq:
+            return None
+        return missed
+    
+    async def submit_grade_delta(
+        self,
+        session_id: str,
+        submission_id: str,
+        user_id: str,
+        changes: Dict[str, Any],
+        fencing_token: Optional[int] = None,
+        connection_id: Optional[int] = None
+    ):
+        """
+        提交评分增量，窗口内同一评分者对同一提交的增量合并后再应用和广播
+        修改范围被租约覆盖时必须携带该租约的防护令牌，否则抛出 LeaseError
+        增量无法应用时向提交它的连接（connection_id）发送错误消息
+        """
+        criterion_ids = {
+            criterion_id
+            for name in DICT_FIELDS
+            for criterion_id in (changes.get(name) or {})
+        }
+        if set(changes) - set(DICT_FIELDS):
+            # 总分和总评属于整个提交
+            criterion_ids.add(None)
+        await self.check_lease_write(submission_id, criterion_ids, user_id, fencing_token)
+        
+        await self.coalescer.submit(
+            (session_id, user_id, "grade_delta", submission_id),
+            session_id,
+            {
+                "submission_id": submission_id,
+                "user_id": user_id,
+                "connection_id": connection_id,
+                "changes": changes
+            },
+            merge=lambda previous, latest: {
+                **latest,
+                "changes": merge_changes(previous["changes"], latest["changes"])
+            },
+            callback=self._commit_grade_delta
+        )
+    
+    async def _commit_grade_delta(self, session_id: str, pending: Dict[str, Any]):
+        """
+        应用增量到会话草稿，分配序列号并广播实际生效的字段
+        同一会话的提交在会话的提交锁内串行执行：先应用的增量一定得到更小的序列号，
+        客户端按序列号重放后与服务端草稿一致
+        """
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return
+            if session.commit_lock is None:
+                session.commit_lock = asyncio.Lock()
+            commit_lock = session.commit_lock
+        
+        async with commit_lock:
+            await self._commit_grade_delta_locked(session_id, pending)
+    
+    async def _commit_grade_delta_locked(self, session_id: str, pending: Dict[str, Any]):
+        submission_id = pending["submission_id"]
+        user_id = pending["user_id"]
+        
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return
+            draft = session.get_draft(submission_id)
+            try:
+                effective = draft.apply(pending["changes"])
+                error = None
+            except (TypeError, ValueError) as e:
+                # 草稿未被修改，不写日志也不广播
+                effective, error = None, e
+                snapshot = draft.snapshot()
+            if not effective and error is None:
+                return
+            assignment_id = session.assignment_id
+        
+        if error is not None:
+            await self._reject_grade_delta(session_id, pending, error, snapshot)
+            return
+        
+        seq = await self.backplane.next_sequence(session_id)
+        
+        async with self.lock:
+            draft.updated_by = user_id
+            draft.seq = max(draft.seq, seq)
+            snapshot = draft.snapshot()
+        
+        # 先写日志再广播，已确认的修改在进程崩溃后也能恢复
+        if self.draft_store is not None:
+            await self.draft_store.record(assignment_id, snapshot)
+        
+        await self.broadcast_sequenced(
+            session_id,
+            CollaborationMessage.grade_delta(assignment_id, submission_id, user_id, seq, effective),
+            seq
+        )
+    
+    async def _reject_grade_delta(
+        self,
+        session_id: str,
+        pending: Dict[str, Any],
+        error: Exception,
+        snapshot: Dict[str, Any]
+    ):
+        """把增量被拒绝的原因和当前草稿发给提交它的连接，客户端据此回滚本地修改"""
+        logger.warning(f"拒绝提交 {pending['submission_id']} 的评分增量: {error}")
+        connection = self.active_connections.get(pending.get("connection_id"))
+        if connection is None:
+            return
+        await self._send_to_connections([connection], CollaborationMessage.session_status_update(
+            session_id,
+            "error",
+            {
+                "error": f"评分更新失败: {error}",
+                "submission_id": pending["submission_id"],
+                "draft": snapshot
+            }
+        ))
+    
+    async def get_grading_snapshot(self, session_id: str) -> Dict[str, Any]:
+        """获取会话内全部评分草稿的快照"""
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return {"seq": 0, "drafts": {}}
+            return {
+                "seq": session.seq,
+                "drafts": {
+                    submission_id: draft.snapshot()
+                    for submission_id, draft in (session.drafts or {}).items()
+                }
+            }
+    
+    async def _apply_remote_grade_delta(self, session_id: str, message: Dict[str, Any]):
+        """同步其他 worker 广播的评分增量，保持本地快照完整"""
+        assignment_id = message.get("assignment_id", "")
+        submission_id = str(message.get("submission_id", ""))
+        seq = int(message.get("seq", 0))
+        
+        async with self.lock:
+            session = self._get_or_create_session(session_id, assignment_id)
+            draft = session.get_draft(submission_id)
+            draft.apply(message.get("changes") or {})
+            draft.updated_by = message.get("user_id")
+            draft.seq = max(draft.seq, seq)
+    
+    async def _record_remote_sequenced(self, session_id: str, message: Dict[str, Any]):
+        """记录其他 worker 广播的带序列号消息，使本 worker 也能补发"""
+        async with self.lock:
+            session = self._get_or_create_session(session_id, message.get("assignment_id", ""))
+            session.record(message)
+            session.last_activity = time.monotonic()
+    
+    async def _load_persisted_drafts(self, session_id: str, assignment_id: str):
+        """会话在本 worker 上重建时载入已持久化的草稿，并让序列号从已持久化的位置继续"""
+        if self.draft_store is None:
+            return
+        try:
+            snapshots = await self.draft_store.load(assignment_id)
+        except Exception as e:
+            logger.error(f"载入作业 {assignment_id} 的评分草稿失败: {e}")
+            return
+        if not snapshots:
+            return
+        
+        max_seq = max(int(snapshot.get("seq", 0)) for snapshot in snapshots)
+        await self.backplane.ensure_sequence(session_id, max_seq)
+        
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return
+            for snapshot in snapshots:
+                submission_id = str(snapshot["submission_id"])
+                if session.drafts is not None and submission_id in session.drafts:
+                    # 内存中的版本更新（载入期间已有新的修改）
+                    continue
+                draft = session.get_draft(submission_id)
+                draft.apply({
+                    name: snapshot.get(name)
+                    for name in (*DICT_FIELDS, *SCALAR_FIELDS, "feedback")
+                })
+                draft.seq = int(snapshot.get("seq", 0))
+                draft.updated_by = snapshot.get("updated_by")
+            session.seq = max(session.seq, max_seq)
+    
+    def _get_or_create_session(self, session_id: str, assignment_id: str) -> CollaborationSession:
+        """获取或创建本地会话，调用方需持有锁"""
+        session = self.collaboration_sessions.get(session_id)
+        if session is None:
+            self._session_generation += 1
+            session_id = intern_id(session_id)
+            session = self.collaboration_sessions[session_id] = CollaborationSession(
+                session_id=session_id,
+                assignment_id=intern_id(assignment_id),
+                generation=self._session_generation
+            )
+            heapq.heappush(
+                self.session_expiry_heap,
+                (session.last_activity, session_id, session.generation)
+            )
+        return session
     
     async def send_personal_message(self, message: Dict[str, Any], user_id: str):
-        """发送私有消息给指定用户"""
+        """发送私有消息给指定用户（用户可能连接在其他 worker 上）"""
+        user_id = str(user_id)
+        if not await self._deliver_to_user(user_id, message):
+            await self.backplane.publish("user", user_id, message)
+    
+    async def _deliver_to_user(self, user_id: str, message: Dict[str, Any]) -> bool:
+        """向本 worker 上该用户的全部连接投递消息，用户不在本 worker 时返回 False"""
         async with self.lock:
-            if user_id in self.active_connections:
-                try:
-                    await self.active_connections[user_id].websocket.send_text(
-                        json.dumps(message)
-                    )
-                except Exception as e:
-                    logger.error(f"发送私有消息给用户 {user_id} 失败: {e}")
-                    await self.disconnect(user_id)
+            connections = [
+                self.active_connections[connection_id]
+                for connection_id in self.user_connections.get(user_id, ())
+            ]
+        
+        if not connections:
+            return False
+        await self._send_to_connections(connections, message)
+        return True
     
     async def broadcast_to_course(self, course_id: str, message: Dict[str, Any]):
-        """向课程中的所有用户广播消息"""
+        """向课程中的所有用户广播消息（包括其他 worker 上的用户）"""
+        await self._deliver_to_course(course_id, message)
+        await self.backplane.publish("course", course_id, message)
+    
+    async def _deliver_to_session(self, session_id: str, message: Dict[str, Any]):
+        """向本 worker 上的会话成员投递消息"""
+        async with self.lock:
+            session = self.collaboration_sessions.get(session_id)
+            if session is None:
+                return
+            connections = [
+                self.active_connections[connection_id]
+                for connection_id in session.connections
+                if connection_id in self.active_connections
+            ]
+        
+        await self._send_to_connections(connections, message)
+    
+    async def _deliver_to_course(self, course_id: str, message: Dict[str, Any]):
+        """向本 worker 上订阅该课程的用户投递消息"""
         async with self.lock:
-            for connection in self.active_connections.values():
-                if connection.course_id == course_id:
-                    try:
-                        await connection.websocket.send_text(json.dumps(message))
-                    except Exception as e:
-                        logger.error(f"发送消息给用户 {connection.user_id} 失败: {e}")
-                        await self.disconnect(connection.user_id)
+            connections = [
+                connection for connection in self.active_connections.values()
+                if connection.course_id == course_id
+            ]
+        
+        await self._send_to_connections(connections, message)
+    
+    async def _send_to_connections(self, connections: List[UserConnection], message: Dict[str, Any]):
+        """发送消息，在锁外进行网络IO，失败的连接随后断开"""
+        if not connections:
+            return
+        
+        # 每种协议只编码一次
+        frames: Dict[str, Frame] = {}
+        failed = []
+        for connection in connections:
+            codec = connection.codec
+            frame = frames.get(codec.name)
+            if frame is None:
+                frame = frames[codec.name] = codec.encode(message)
+            try:
+                await send_frame(connection.websocket, frame)
+            except Exception as e:
+                logger.error(f"发送消息给用户 {connection.user_id} 失败: {e}")
+                failed.append(connection)
+        
+        # 移除断开的连接
+        for connection in failed:
+            await self.disconnect(connection)
+    
+    async def _handle_backplane_message(self, scope: str, target: str, message: Dict[str, Any]):
+        """处理其他 worker 转发的广播，仅做本地投递"""
+        if scope == "session":
+            if message.get("type") == "grade_delta":
+                await self._apply_remote_grade_delta(target, message)
+            if "seq" in message:
+                await self._record_remote_sequenced(target, message)
+            await self._deliver_to_session(target, message)
+        elif scope == "course":
+            await self._deliver_to_course(target, message)
+        elif scope == "user":
+            await self._deliver_to_user(target, message)
     
     async def get_session_info(self, session_id: str) -> Optional[CollaborationSession]:
         """获取会话信息"""
@@ -213,41 +879,144 @@ class WebSocketManager:
             return self.collaboration_sessions.get(session_id)
     
     async def get_active_users_in_session(self, session_id: str) -> List[Dict[str, Any]]:
-        """获取会话中的活跃用户列表"""
+        """获取会话中的活跃用户列表（包括其他 worker 上的用户）"""
+        users_info = []
+        local_user_ids = set()
+        
         async with self.lock:
-            if session_id in self.collaboration_sessions:
-                session = self.collaboration_sessions[session_id]
-                users_info = []
-                
-                for user_id in session.active_users:
-                    if user_id in self.active_connections:
-                        connection = self.active_connections[user_id]
-                        users_info.append({
-                            "user_id": user_id,
-                            "role": connection.role,
-                            "joined_at": connection.joined_at.isoformat()
-                        })
-                
-                return users_info
-            return []
+            session = self.collaboration_sessions.get(session_id)
+            if session is not None:
+                # 同一用户的多个连接只列出一次（取最早加入的连接）
+                connections = sorted(
+                    (
+                        self.active_connections[connection_id]
+                        for connection_id in session.connections
+                        if connection_id in self.active_connections
+                    ),
+                    key=lambda connection: connection.joined_at
+                )
+                for connection in connections:
+                    if connection.user_id in local_user_ids:
+                        continue
+                    local_user_ids.add(connection.user_id)
+                    users_info.append({
+                        "user_id": connection.user_id,
+                        "role": connection.role,
+                        "joined_at": monotonic_to_iso(connection.joined_at)
+                    })
+        
+        # 其他 worker 上的成员只有用户ID
+        for user_id in await self.backplane.get_session_members(session_id):
+            if user_id not in local_user_ids:
+                users_info.append({"user_id": user_id, "role": None, "joined_at": None})
+        
+        return users_info
+    
+    async def touch(self, connection: UserConnection):
+        """记录客户端活动（任何消息或 pong），用于心跳检测"""
+        connection.last_seen = time.monotonic()
     
-    async def cleanup_inactive_sessions(self, max_idle_time: int = 3600):
-        """清理非活跃会话"""
+    async def ping_connections(self):
+        """向所有连接发送心跳，发送失败的连接会被断开"""
         async with self.lock:
-            current_time = datetime.utcnow()
-            sessions_to_remove = []
-            
-            for session_id, session in self.collaboration_sessions.items():
-                if (current_time - session.last_activity).total_seconds() > max_idle_time:
-                    sessions_to_remove.append(session_id)
-            
-            for session_id in sessions_to_remove:
+            connections = list(self.active_connections.values())
+        
+        self.metrics.heartbeats_sent += len(connections)
+        await self._send_to_connections(
+            connections,
+            {"type": "ping", "timestamp": datetime.utcnow().isoformat()}
+        )
+    
+    async def refresh_session_members(self):
+        """续期本 worker 上的会话成员，崩溃 worker 登记的成员因不再续期而过期"""
+        async with self.lock:
+            members = {
+                session_id: [str(user_id) for user_id in session.active_users]
+                for session_id, session in self.collaboration_sessions.items()
+                if session.active_users
+            }
+        
+        await self.backplane.refresh_session_members(members)
+    
+    async def evict_stale_connections(self, timeout: float) -> int:
+        """断开超过 timeout 秒没有任何响应的半开连接"""
+        current_time = time.monotonic()
+        async with self.lock:
+            stale = [
+                connection for connection in self.active_connections.values()
+                if current_time - connection.last_seen > timeout
+            ]
+        
+        for connection in stale:
+            try:
+                await connection.websocket.close(code=1001)
+            except Exception:
+                # 半开连接关闭失败是预期情况
+                pass
+            await self.disconnect(connection)
+            logger.info(f"心跳超时，断开用户 {connection.user_id} (连接 {connection.connection_id})")
+        
+        self.metrics.evicted_connections += len(stale)
+        return len(stale)
+    
+    async def cleanup_inactive_sessions(
+        self,
+        max_idle_time: int = 3600,
+        batch_size: Optional[int] = None
+    ) -> int:
+        """
+        清理非活跃会话
+        按最近活动时间从过期堆中批量弹出，只检查可能过期的会话而不是全部扫描
+        """
+        current_time = time.monotonic()
+        removed = 0
+        
+        async with self.lock:
+            heap = self.session_expiry_heap
+            while heap and (batch_size is None or removed < batch_size):
+                last_activity, session_id, generation = heap[0]
+                if current_time - last_activity <= max_idle_time:
+                    break
+                heapq.heappop(heap)
+                
+                session = self.collaboration_sessions.get(session_id)
+                if session is None or session.generation != generation:
+                    continue
+                
+                if session.active_users or \
+                        current_time - session.last_activity <= max_idle_time:
+                    # 期间有活动或仍有在线用户，按最新活动时间重新登记
+                    reference = session.last_activity if not session.active_users else current_time
+                    heapq.heappush(heap, (reference, session_id, generation))
+                    continue
+                
                 del self.collaboration_sessions[session_id]
+                removed += 1
                 logger.info(f"清理非活跃会话: {session_id}")
+        
+        self.metrics.expired_sessions += removed
+        return removed
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取运行指标"""
+        return {
+            "active_connections": len(self.active_connections),
+            "connected_users": len(self.user_connections),
+            "collaboration_sessions": len(self.collaboration_sessions),
+            "pending_session_expiries": len(self.session_expiry_heap),
+            **asdict(self.metrics),
+            "coalescer": {
+                "received": self.coalescer.stats.received,
+                "flushed": self.coalescer.stats.flushed,
+                "coalesced": self.coalescer.stats.coalesced,
+                "pending": len(self.coalescer.pending)
+            },
+            "draft_store": self.draft_store.get_metrics() if self.draft_store is not None else None
+        }
 
 
 # 全局WebSocket管理器实例
-websocket_manager = WebSocketManager()
+websocket_manager = WebSocketManager(get_backplane(), get_draft_store())
 
 
 class CollaborationMessage:
@@ -267,6 +1036,53 @@ class CollaborationMessage:
             "timestamp": datetime.utcnow().isoformat()
         }
     
+    @staticmethod
+    def grade_delta(assignment_id: str, submission_id: str, user_id: str,
+                    seq: int, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """评分增量消息，只包含实际变化的字段"""
+        return {
+            "type": "grade_delta",
+            "assignment_id": assignment_id,
+            "submission_id": submission_id,
+            "user_id": user_id,
+            "seq": seq,
+            "changes": changes,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
+    @staticmethod
+    def grading_snapshot(session_id: str, seq: int,
+                         drafts: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """评分草稿完整快照消息"""
+        return {
+            "type": "grading_snapshot",
+            "session_id": session_id,
+            "seq": seq,
+            "drafts": drafts,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
+    @staticmethod
+    def replay(session_id: str, last_seq: int,
+               messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """断线重连补发消息，messages 按序列号升序排列"""
+        return {
+            "type": "replay",
+            "session_id": session_id,
+            "last_seq": last_seq,
+            "messages": messages,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
+    @staticmethod
+    def lease_update(event: str, lease: Dict[str, Any]) -> Dict[str, Any]:
+        """租约变化消息 (lease_acquired / lease_released / lease_expired)"""
+        return {
+            "type": event,
+            "lease": lease,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
     @staticmethod
     def criteria_comment_update(assignment_id: str, user_id: str, 
                                criteria_id: str, comment: str) -> Dict[str, Any]:
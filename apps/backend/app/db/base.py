@@ -4,7 +4,9 @@ from app.models.user import User
 from app.models.course import Course
 from app.models.enrollment import Enrollment
 from app.models.assignment import Assignment  # ✅ IS THIS MISSING?
-from app.models.submission import Submission
+from app.models.submission import (
+    Submission, SubmissionFile, FileBlob, StorageSegment, StorageTierUsage, StorageUsage
+)
 from app.models.grade import Grade
 from app.models.rubric import Rubric, RubricCriteria
 
@@ -10,8 +10,11 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
 from app.core.logging import setup_logging
-from app.api.v1.routers import health, auth
+from app.api.v1.routers import health, auth, notifications, files, websocket
 from app.api.v1.dependencies import create_tables
+from app.core.websocket_manager import websocket_manager
+from app.core.websocket_janitor import websocket_janitor
+from app.services.file_service import start_file_service, stop_file_service
 from app.db import base
 
 # Setup logging
@@ -46,6 +49,9 @@ app.add_middleware(
 # Include routers
 app.include_router(health.router, prefix=settings.API_V1_PREFIX)
 app.include_router(auth.router, prefix=settings.API_V1_PREFIX)
+app.include_router(notifications.router, prefix=settings.API_V1_PREFIX)
+app.include_router(files.router, prefix=f"{settings.API_V1_PREFIX}/files", tags=["files"])
+app.include_router(websocket.router, prefix=f"{settings.API_V1_PREFIX}/ws", tags=["websocket"])
 
 
 @app.on_event("startup")
@@ -60,6 +66,42 @@ def startup_event() -> None:
         create_tables()
 
 
+@app.on_event("startup")
+async def start_websocket_backplane() -> None:
+    """
+    Connect the websocket manager to the cross-worker backplane
+    and start the heartbeat/idle-session janitor.
+    """
+    await websocket_manager.start()
+    await websocket_janitor.start()
+
+
+@app.on_event("shutdown")
+async def stop_websocket_backplane() -> None:
+    """
+    Disconnect the websocket manager from the backplane.
+    """
+    await websocket_janitor.stop()
+    await websocket_manager.stop()
+
+
+@app.on_event("startup")
+async def start_file_storage() -> None:
+    """
+    Create the storage backend once and warm it up
+    (directories for local storage, bucket connection for S3).
+    """
+    await start_file_service()
+
+
+@app.on_event("shutdown")
+async def stop_file_storage() -> None:
+    """
+    Close the storage backend's connections.
+    """
+    await stop_file_service()
+
+
 @app.get("/")
 def root() -> dict[str, str]:
     """
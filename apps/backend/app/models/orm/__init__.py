@@ -12,7 +12,7 @@ Base = declarative_base()
 
 # Import all models to register them with Base.metadata
 # Order matters: models with foreign keys should come after their referenced models
-from . import user, course, enrollment, rubric, rubric_criteria, score  # noqa: F401
+from . import user, course, enrollment, rubric, rubric_criteria, score, notification, score_draft  # noqa: F401
 
 # Export Base for use in other modules
 __all__ = ["Base"]
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+Notification ORM models.
+Represents the persistent per-user notification inbox.
+
+Every query is scoped to a single user, so rows are laid out by
+(user_id, created_at, id): the composite index serves cursor pagination
+and unread filtering without touching other users' rows.
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index, JSON
+
+from .base import Base
+
+
+class Notification(Base):
+    """
+    Notification model for the user inbox.
+
+    Rows are written for every notification, whether or not the user
+    was online when it was pushed over the websocket.
+    """
+
+    __tablename__ = "notifications"
+
+    # Primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Owner
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # Content
+    type = Column(String(50), nullable=False)
+    title = Column(String(255), nullable=False)
+    body = Column(Text)
+    data = Column(JSON)
+
+    # Read state
+    is_read = Column(Boolean, nullable=False, default=False)
+    read_at = Column(DateTime)
+
+    # Audit trail
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Inbox pages: WHERE user_id = ? AND (created_at, id) < cursor ORDER BY created_at DESC, id DESC
+        Index("ix_notifications_user_id_created_at", "user_id", "created_at", "id"),
+        # Unread-only pages and bulk mark-read only scan the user's unread rows
+        Index(
+            "ix_notifications_user_id_unread",
+            "user_id", "created_at",
+            postgresql_where=(is_read.is_(False))
+        ),
+    )
+
+    def __repr__(self) -> str:
+        return f"<Notification(id={self.id}, user_id={self.user_id}, type={self.type}, read={self.is_read})>"
+
+
+class NotificationCounter(Base):
+    """
+    Per-user unread counter.
+
+    Maintained in the same transaction as every insert and mark-read,
+    so the unread badge is a primary-key lookup instead of a COUNT(*).
+    """
+
+    __tablename__ = "notification_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<NotificationCounter(user_id={self.user_id}, unread={self.unread_count})>"
@@ -0,0 +1,41 @@
+"""
+Score draft ORM model.
+Represents in-progress collaborative grading state in the database.
+
+Drafts are written behind the websocket session in batches; final
+scores are still recorded in the scores table.
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, JSON
+
+from .base import Base
+
+
+class ScoreDraft(Base):
+    """
+    Score draft model, one row per submission.
+
+    Holds the latest criterion scores, comments and feedback edited in a
+    collaboration session. seq is the session sequence number of the last
+    applied delta and guards against a stale worker overwriting newer state.
+    """
+
+    __tablename__ = "score_drafts"
+
+    # Primary key (submission IDs as used by the collaboration session)
+    submission_id = Column(String(64), primary_key=True)
+    assignment_id = Column(String(64), nullable=False, index=True)
+
+    # Draft content
+    criteria_scores = Column(JSON, nullable=False, default=dict)
+    criteria_comments = Column(JSON, nullable=False, default=dict)
+    total_score = Column(Float)
+    feedback = Column(Text, nullable=False, default="")
+
+    # Ordering and audit trail
+    seq = Column(Integer, nullable=False, default=0)
+    updated_by = Column(String(64))
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<ScoreDraft(submission={self.submission_id}, assignment={self.assignment_id}, seq={self.seq})>"
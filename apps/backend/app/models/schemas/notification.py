@@ -0,0 +1,31 @@
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+class NotificationResponse(BaseModel):
+    id: int
+    type: str
+    title: str
+    body: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+    is_read: bool
+    read_at: Optional[datetime] = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class NotificationPage(BaseModel):
+    items: List[NotificationResponse]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= to fetch the next (older) page
+    unread_count: int
+
+class UnreadCountResponse(BaseModel):
+    unread_count: int
+
+class MarkReadRequest(BaseModel):
+    ids: List[int] = Field(default_factory=list, max_length=1000)
+    all: bool = False # Mark every unread notification, ignoring ids
+
+class MarkReadResponse(BaseModel):
+    updated: int
+    unread_count: int
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text
+import uuid
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, BigInteger, DateTime
 from sqlalchemy.orm import relationship
-from ..db.base import Base
+from ..db.base_class import Base
 
 class Submission(Base):
     __tablename__ = "submissions"
@@ -22,4 +23,85 @@ class Submission(Base):
         back_populates="submissions", 
         foreign_keys=[student_id]
     )
-    grader = relationship("User", foreign_keys=[graded_by])
\ No newline at end of file
+    grader = relationship("User", foreign_keys=[graded_by])
+    files = relationship("SubmissionFile", back_populates="submission", cascade="all, delete-orphan")
+
+
+class SubmissionFile(Base):
+    __tablename__ = "submission_files"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    submission_id = Column(Integer, ForeignKey("submissions.id"), nullable=False, index=True)
+    file_name = Column(String(255))
+    file_path = Column(String(1024), nullable=False)
+    file_url = Column(String(1024))
+    file_size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(255))
+    # 内容哈希 "<算法>:<十六进制>"，上传时流式计算；相同内容的文件共享同一个 blob
+    file_hash = Column(String(160), ForeignKey("file_blobs.file_hash"), index=True)
+    # 上传时被规范化（缩小、重新编码）的图片保留原始内容的 blob，存放在冷存储中
+    original_hash = Column(String(160), ForeignKey("file_blobs.file_hash"), index=True)
+    uploaded_at = Column(DateTime, nullable=False)
+
+    submission = relationship("Submission", back_populates="files")
+    blob = relationship("FileBlob", foreign_keys=[file_hash])
+    original_blob = relationship("FileBlob", foreign_keys=[original_hash])
+
+
+class FileBlob(Base):
+    """按内容哈希寻址的文件内容，ref_count 为引用它的 SubmissionFile 数量"""
+    __tablename__ = "file_blobs"
+
+    file_hash = Column(String(160), primary_key=True)
+    storage_path = Column(String(1024), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # 内容的 CRC-32，ZIP 导出时预先确定归档布局；直传的内容在首次导出时补算
+    crc32 = Column(BigInteger)
+    # 存储时的压缩编码（zstd / gzip，None 为原样存储）和压缩后的大小；size 始终是原始内容的大小
+    encoding = Column(String(16))
+    stored_size = Column(BigInteger)
+    ref_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, nullable=False)
+    # 存储层级：hot 为单独的 blob 文件，cold 为冷存储（打包进 segment_id 的分段，或单独存放的原始图片）
+    tier = Column(String(8), nullable=False, default="hot")
+    segment_id = Column(String(32), ForeignKey("storage_segments.id"), index=True)
+    # 预览图状态：None 不需要预览，pending 等待生成，ready 已生成 preview_pages 页，failed 生成失败
+    preview_status = Column(String(16), index=True)
+    preview_pages = Column(Integer)
+
+
+class StorageSegment(Base):
+    """冷存储的打包分段：多个 blob 顺序写入一个文件，blob 的存储路径记录其在分段中的偏移量和长度"""
+    __tablename__ = "storage_segments"
+
+    id = Column(String(32), primary_key=True)
+    storage_path = Column(String(1024), nullable=False)
+    # 写入时分段中 blob 内容的总字节数（不包括末尾的索引）
+    size = Column(BigInteger, nullable=False)
+    # 仍被 file_blobs 引用的 blob 数量和字节数，blob 删除时随之减少；降为 0 后删除分段文件
+    blob_count = Column(Integer, nullable=False)
+    live_bytes = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+class StorageTierUsage(Base):
+    """各存储层级的 blob 数量和存储字节数，随 blob 的写入、删除和迁移增量更新"""
+    __tablename__ = "storage_tier_usage"
+
+    tier = Column(String(8), primary_key=True)
+    blob_count = Column(BigInteger, nullable=False, default=0)
+    stored_bytes = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class StorageUsage(Base):
+    """课程（scope="course"）或学生（scope="user"）的提交文件数和字节数，随文件记录的写入和删除增量更新"""
+    __tablename__ = "storage_usage"
+
+    scope = Column(String(8), primary_key=True)
+    scope_id = Column(Integer, primary_key=True)
+    file_count = Column(BigInteger, nullable=False, default=0)
+    used_bytes = Column(BigInteger, nullable=False, default=0)
+    # 单独设置的配额（字节），None 使用配置中的默认配额
+    quota_bytes = Column(BigInteger)
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,195 @@
+"""
+Notification repository for database operations.
+Keeps the unread counter in step with the inbox rows.
+"""
+
+from datetime import datetime
+from typing import Any, Iterable
+
+from sqlalchemy import tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.orm.notification import Notification, NotificationCounter
+
+
+class NotificationRepository:
+    """
+    Repository for notification inbox operations.
+    Every write that changes read state also adjusts notification_counters
+    before the transaction commits.
+    """
+
+    @staticmethod
+    def create(
+        db: Session,
+        user_id: int,
+        type: str,
+        title: str,
+        body: str | None = None,
+        data: dict[str, Any] | None = None
+    ) -> Notification:
+        """
+        Store a notification and increment the user's unread counter.
+
+        Args:
+            db: Database session
+            user_id: Recipient user ID
+            type: Notification type (e.g. "grade_released")
+            title: Short title shown in the bell dropdown
+            body: Optional longer text
+            data: Optional JSON payload for the frontend (links, IDs)
+
+        Returns:
+            Created notification
+        """
+        notification = Notification(
+            user_id=user_id,
+            type=type,
+            title=title,
+            body=body,
+            data=data,
+            is_read=False,
+            created_at=datetime.utcnow()
+        )
+
+        db.add(notification)
+        NotificationRepository._adjust_unread(db, user_id, 1)
+        db.commit()
+        db.refresh(notification)
+
+        return notification
+
+    @staticmethod
+    def get_page(
+        db: Session,
+        user_id: int,
+        limit: int,
+        before: tuple[datetime, int] | None = None,
+        unread_only: bool = False
+    ) -> list[Notification]:
+        """
+        Get one page of the inbox, newest first.
+
+        Args:
+            db: Database session
+            user_id: Inbox owner
+            limit: Maximum rows to return
+            before: (created_at, id) of the last row of the previous page
+            unread_only: Only return unread notifications
+
+        Returns:
+            Notifications ordered by (created_at, id) descending
+        """
+        query = db.query(Notification).filter(Notification.user_id == user_id)
+        if unread_only:
+            query = query.filter(Notification.is_read.is_(False))
+        if before is not None:
+            # Keyset pagination: an index range scan, no OFFSET
+            query = query.filter(tuple_(Notification.created_at, Notification.id) < before)
+
+        return (
+            query.order_by(Notification.created_at.desc(), Notification.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    @staticmethod
+    def get_unread_count(db: Session, user_id: int) -> int:
+        """
+        Get the user's unread count from the counter row (primary-key lookup).
+
+        Args:
+            db: Database session
+            user_id: Inbox owner
+
+        Returns:
+            Number of unread notifications
+        """
+        count = (
+            db.query(NotificationCounter.unread_count)
+            .filter(NotificationCounter.user_id == user_id)
+            .scalar()
+        )
+        return count or 0
+
+    @staticmethod
+    def mark_read(db: Session, user_id: int, ids: Iterable[int] | None = None) -> int:
+        """
+        Mark notifications as read in one UPDATE and decrement the counter
+        by the number of rows that actually changed.
+
+        Args:
+            db: Database session
+            user_id: Inbox owner
+            ids: Notification IDs to mark; None marks every unread notification
+
+        Returns:
+            Number of notifications that changed from unread to read
+        """
+        statement = (
+            update(Notification)
+            .where(Notification.user_id == user_id, Notification.is_read.is_(False))
+            .values(is_read=True, read_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return 0
+            statement = statement.where(Notification.id.in_(ids))
+
+        updated = db.execute(statement).rowcount
+        if updated:
+            NotificationRepository._adjust_unread(db, user_id, -updated)
+        db.commit()
+
+        return updated
+
+    @staticmethod
+    def reconcile_unread(db: Session, user_id: int) -> int:
+        """
+        Recompute the counter from the inbox rows (repair after manual edits).
+
+        Args:
+            db: Database session
+            user_id: Inbox owner
+
+        Returns:
+            Corrected unread count
+        """
+        count = (
+            db.query(Notification)
+            .filter(Notification.user_id == user_id, Notification.is_read.is_(False))
+            .count()
+        )
+        counter = db.get(NotificationCounter, user_id)
+        if counter is None:
+            db.add(NotificationCounter(user_id=user_id, unread_count=count))
+        else:
+            counter.unread_count = count
+        db.commit()
+
+        return count
+
+    @staticmethod
+    def _adjust_unread(db: Session, user_id: int, delta: int) -> None:
+        """
+        Atomically add delta to the user's counter, creating the row on first use.
+        Runs inside the caller's transaction; the caller commits.
+        """
+        statement = (
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id == user_id)
+            .values(unread_count=NotificationCounter.unread_count + delta)
+            .execution_options(synchronize_session=False)
+        )
+        if db.execute(statement).rowcount:
+            return
+
+        try:
+            # Savepoint so a concurrent first insert does not abort the outer transaction
+            with db.begin_nested():
+                db.add(NotificationCounter(user_id=user_id, unread_count=max(delta, 0)))
+        except IntegrityError:
+            db.execute(statement)
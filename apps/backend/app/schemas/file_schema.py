@@ -4,7 +4,7 @@
 """
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 from pydantic import BaseModel, Field
 
 
@@ -77,4 +77,22 @@ class FileValidationResponse(BaseModel):
     is_valid: bool
     error_message: Optional[str] = None
     allowed_types: List[str]
-    max_file_size: int
\ No newline at end of file
+    max_file_size: int
+
+
+class DirectUploadRequest(BaseModel):
+    """客户端直传请求（申请上传 URL 和确认上传完成使用相同的字段）"""
+    submission_id: str = Field(..., description="作业提交ID")
+    file_name: str
+    content_type: str
+    file_size: int = Field(..., ge=0)
+    file_hash: str = Field(..., description="客户端计算的内容哈希，格式 sha256:<十六进制>")
+
+
+class DirectUploadResponse(BaseModel):
+    """客户端直传响应，内容已存在时无需上传，直接返回文件记录"""
+    upload_required: bool
+    upload_url: Optional[str] = None
+    upload_headers: Dict[str, str] = Field(default_factory=dict)
+    expires_in: Optional[int] = None
+    file: Optional[FileUploadResponse] = None
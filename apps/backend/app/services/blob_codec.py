@@ -0,0 +1,156 @@
+"""
+blob 内容的透明压缩
+文本类内容（CSV、JSON、HTML、源代码、纯文本）写入存储前压缩：安装了 zstandard 时使用 zstd，否则使用标准库的 gzip
+读取时按块流式解压；客户端接受该编码时直接发送压缩后的字节（Content-Encoding）
+"""
+
+import asyncio
+import os
+import zlib
+from typing import AsyncIterator, Optional, Tuple
+
+from app.core.config import settings
+from app.services.upload_stream import SpooledUpload
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时使用 gzip
+    zstandard = None
+
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+
+# 压缩后的 blob 存储路径加上对应的后缀，与未压缩的同一内容不会写到同一个位置
+ENCODING_SUFFIXES = {ENCODING_ZSTD: ".zst", ENCODING_GZIP: ".gz"}
+
+COMPRESSIBLE_PREFIXES = ("text/",)
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-python",
+    "application/x-sh",
+    "image/svg+xml",
+}
+
+# 压缩后至少节省这么多才保存压缩版本
+MIN_SAVING_RATIO = 0.1
+
+
+def is_compressible(mime_type: Optional[str]) -> bool:
+    if not mime_type:
+        return False
+    mime_type = mime_type.split(";")[0].strip().lower()
+    return mime_type.startswith(COMPRESSIBLE_PREFIXES) or mime_type in COMPRESSIBLE_TYPES
+
+
+def default_encoding() -> str:
+    return ENCODING_ZSTD if zstandard is not None else ENCODING_GZIP
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Accept-Encoding 中包含该编码且 q 不为 0"""
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _compressor(encoding: str):
+    if encoding == ENCODING_ZSTD:
+        level = settings.STORAGE_COMPRESSION_LEVEL or 3
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    level = settings.STORAGE_COMPRESSION_LEVEL or 6
+    # wbits=31 生成带 gzip 头的数据，可以直接作为 Content-Encoding: gzip 发送
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _decompressor(encoding: str):
+    if encoding == ENCODING_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard未安装，无法读取zstd压缩的内容")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def compress_file(source_path: str, target_path: str, encoding: str) -> int:
+    """按块压缩文件，返回压缩后的大小；在工作线程中调用"""
+    compressor = _compressor(encoding)
+    size = 0
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        while True:
+            chunk = source.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = compressor.compress(chunk)
+            if data:
+                target.write(data)
+                size += len(data)
+        data = compressor.flush()
+        target.write(data)
+        size += len(data)
+    return size
+
+
+def compress_spooled(spooled: SpooledUpload, content_type: Optional[str]) -> Optional[Tuple[str, str, int]]:
+    """
+    压缩值得压缩的上传内容，返回 (压缩后的临时文件, 编码, 压缩后大小)；在工作线程中调用
+    类型不适合、内容太小或压缩效果不明显时返回 None，按原样保存
+    """
+    if (
+        not settings.STORAGE_COMPRESSION_ENABLED
+        or spooled.size < settings.STORAGE_COMPRESSION_MIN_SIZE
+        or not is_compressible(content_type)
+    ):
+        return None
+
+    encoding = default_encoding()
+    target_path = spooled.path + ENCODING_SUFFIXES[encoding]
+    try:
+        stored_size = compress_file(spooled.path, target_path, encoding)
+    except BaseException:
+        _unlink(target_path)
+        raise
+    if stored_size > spooled.size * (1 - MIN_SAVING_RATIO):
+        _unlink(target_path)
+        return None
+    return target_path, encoding, stored_size
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def decode_stream(
+    chunks: AsyncIterator[bytes],
+    encoding: str,
+    start: int = 0,
+    end: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """流式解压，产生原始内容的字节区间 [start, end]；区间之前的部分解压后丢弃"""
+    decompressor = _decompressor(encoding)
+    position = 0
+    async for chunk in chunks:
+        data = await asyncio.to_thread(decompressor.decompress, chunk)
+        if not data:
+            continue
+        chunk_start, position = position, position + len(data)
+        if position <= start:
+            continue
+        first = max(start - chunk_start, 0)
+        last = len(data) if end is None else min(end + 1 - chunk_start, len(data))
+        if first < last:
+            yield data[first:last]
+        if end is not None and position > end:
+            return
@@ -0,0 +1,195 @@
+"""
+内容寻址的文件存储
+文件内容按强哈希存为 blob（目录按哈希前缀两级分散），相同内容只保存一份
+file_blobs 表记录每个 blob 的引用计数，最后一个引用删除时才删除 blob
+文本类内容压缩后存储，file_blobs.encoding 记录编码，读取方按编码解压
+各存储层级的用量计数随引用计数一起在调用方的事务中更新
+"""
+
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.models.submission import FileBlob, StorageSegment
+from app.services.blob_codec import ENCODING_SUFFIXES, compress_spooled
+from app.services.storage_usage import TIER_COLD, TIER_HOT, adjust_tier_usage, stored_bytes
+from app.services.upload_stream import SpooledUpload
+
+
+def blob_key(file_hash: str) -> str:
+    """
+    "sha256:abcdef.." -> "sha256/ab/cd/abcdef.."
+    两级前缀目录让每个目录下的文件数保持在较小范围
+    """
+    algorithm, _, digest = file_hash.partition(":")
+    if not digest:
+        raise ValueError(f"无效的内容哈希: {file_hash}")
+    return f"{algorithm}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class BlobStore:
+    """在存储后端之上维护 blob 引用计数，引用计数的变更由调用方随业务记录一起提交"""
+
+    def __init__(self, storage_backend):
+        self.storage_backend = storage_backend
+
+    async def acquire(
+        self,
+        spooled: SpooledUpload,
+        content_type: Optional[str],
+        db: Session,
+        cold: bool = False
+    ) -> Tuple[str, bool]:
+        """
+        为上传内容增加一个引用，返回 (blob 存储路径, 是否新写入了 blob)
+        blob 已存在时只增加引用计数并丢弃临时文件，不再写入存储
+        cold 为 True 时新内容写入冷存储（已存在的 blob 保持原位置）
+        """
+        for _ in range(2):
+            storage_path = self._increment(spooled.file_hash, db)
+            if storage_path:
+                spooled.discard()
+                return storage_path, False
+
+            # 新内容：先（压缩后）写入存储，再插入引用计数为 1 的记录
+            storage_path, encoding, stored_size = await self.store(spooled, content_type, cold)
+            if self._insert(
+                spooled.file_hash, storage_path, spooled.size, db, spooled.crc32, encoding, stored_size,
+                tier=TIER_COLD if cold else TIER_HOT
+            ):
+                return storage_path, True
+
+        raise RuntimeError(f"无法获取 blob 引用: {spooled.file_hash}")
+
+    async def store(
+        self,
+        spooled: SpooledUpload,
+        content_type: Optional[str],
+        cold: bool = False
+    ) -> Tuple[str, Optional[str], int]:
+        """
+        把内容写入 blob 位置，返回 (存储路径, 编码, 存储大小)，不修改 file_blobs
+        压缩后的内容路径带编码后缀，同一内容的压缩和未压缩版本不会互相覆盖
+        """
+        if cold:
+            storage_path = self.storage_backend.get_cold_blob_path(spooled.file_hash)
+        else:
+            storage_path = self.storage_backend.get_blob_path(spooled.file_hash)
+
+        encoded = None if cold else await asyncio.to_thread(compress_spooled, spooled, content_type)
+        if encoded is None:
+            await self.storage_backend.store_file(spooled.path, storage_path, content_type, cold=cold)
+            return storage_path, None, spooled.size
+
+        encoded_path, encoding, stored_size = encoded
+        storage_path += ENCODING_SUFFIXES[encoding]
+        try:
+            await self.storage_backend.store_file(encoded_path, storage_path, content_type)
+        finally:
+            # 本地后端重命名、S3 后端上传后删除，这里只清理写入失败时留下的临时文件
+            await asyncio.to_thread(Path(encoded_path).unlink, True)
+        return storage_path, encoding, stored_size
+
+    def reference(self, file_hash: str, db: Session) -> Optional[str]:
+        """内容已存在时增加一个引用并返回存储路径，否则返回 None（不写入存储）"""
+        return self._increment(file_hash, db)
+
+    def acquire_stored(self, file_hash: str, size: int, db: Session) -> Tuple[str, bool]:
+        """为已经写入存储的内容（客户端直传）增加引用，返回 (存储路径, 是否新建了 blob 记录)"""
+        for _ in range(2):
+            existing_path = self._increment(file_hash, db)
+            if existing_path:
+                return existing_path, False
+            storage_path = self.storage_backend.get_blob_path(file_hash)
+            if self._insert(file_hash, storage_path, size, db):
+                return storage_path, True
+
+        raise RuntimeError(f"无法获取 blob 引用: {file_hash}")
+
+    def release(self, file_hash: str, db: Session) -> Optional[str]:
+        """
+        减少一个引用；引用归零时删除 blob 记录并返回存储路径，由调用方删除内容后提交
+        blob 记录不存在（旧版按路径存储的文件）时返回 None
+        """
+        updated = db.query(FileBlob).filter(FileBlob.file_hash == file_hash).update(
+            {FileBlob.ref_count: FileBlob.ref_count - 1},
+            synchronize_session=False
+        )
+        if not updated:
+            return None
+
+        # 上面的 UPDATE 不同步会话中已加载的对象，重新读取最新的引用计数
+        blob = db.query(FileBlob).populate_existing().filter(FileBlob.file_hash == file_hash).first()
+        if blob.ref_count > 0:
+            return None
+
+        storage_path = blob.storage_path
+        adjust_tier_usage(blob.tier or TIER_HOT, -1, -stored_bytes(blob), db)
+        if blob.segment_id:
+            # 打包在分段中的内容不能单独删除，只减少分段的存活计数，分段整体由分层任务删除或重新打包
+            db.query(StorageSegment).filter(StorageSegment.id == blob.segment_id).update({
+                StorageSegment.blob_count: StorageSegment.blob_count - 1,
+                StorageSegment.live_bytes: StorageSegment.live_bytes - stored_bytes(blob)
+            }, synchronize_session=False)
+        db.delete(blob)
+        db.flush()
+        return storage_path
+
+    async def discard_if_unreferenced(self, file_hash: str, storage_path: str, db: Session):
+        """新写入的 blob 最终没有提交引用时删除其内容（事务回滚之后调用）"""
+        exists = db.query(FileBlob.file_hash).filter(FileBlob.file_hash == file_hash).first()
+        if not exists:
+            await self.storage_backend.delete_file(storage_path)
+            logger.info(f"删除未被引用的 blob: {file_hash}")
+
+    @staticmethod
+    def _insert(
+        file_hash: str,
+        storage_path: str,
+        size: int,
+        db: Session,
+        crc32: Optional[int] = None,
+        encoding: Optional[str] = None,
+        stored_size: Optional[int] = None,
+        tier: str = TIER_HOT
+    ) -> bool:
+        stored_size = stored_size if stored_size is not None else size
+        try:
+            with db.begin_nested():
+                db.add(FileBlob(
+                    file_hash=file_hash,
+                    storage_path=storage_path,
+                    size=size,
+                    crc32=crc32,
+                    encoding=encoding,
+                    stored_size=stored_size,
+                    ref_count=1,
+                    created_at=datetime.utcnow(),
+                    tier=tier
+                ))
+                db.flush()
+                adjust_tier_usage(tier, 1, stored_size, db)
+            return True
+        except IntegrityError:
+            # 并发上传了相同内容并先插入了记录，两边写入的内容相同，改为增加引用
+            return False
+
+    @staticmethod
+    def _increment(file_hash: str, db: Session) -> Optional[str]:
+        """增加一个引用并返回 blob 的存储路径（可能是压缩版本或冷存储），blob 不存在时返回 None"""
+        # 只对仍有引用的 blob 加引用：引用已归零的 blob 正在被删除，需要重新写入
+        updated = db.query(FileBlob).filter(
+            FileBlob.file_hash == file_hash,
+            FileBlob.ref_count > 0
+        ).update(
+            {FileBlob.ref_count: FileBlob.ref_count + 1},
+            synchronize_session=False
+        )
+        if not updated:
+            return None
+        return db.query(FileBlob.storage_path).filter(FileBlob.file_hash == file_hash).scalar()
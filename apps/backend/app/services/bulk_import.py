@@ -0,0 +1,441 @@
+"""
+批量导入线下收集的作业
+上传一个 ZIP，按清单文件或命名约定把条目对应到学生的提交
+多个工作线程并行解压、计算哈希并写入存储，文件记录按批在一个事务中插入，处理进度逐步返回
+"""
+
+import asyncio
+import csv
+import io
+import json
+import mimetypes
+import os
+import re
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.submission import FileBlob, Submission, SubmissionFile
+from app.models.user import User
+from app.services.storage_quota import check_quota, record_usage
+from app.services.storage_usage import TIER_HOT, adjust_tier_usage
+from app.services.upload_stream import SpooledUpload, spool_fileobj
+
+MANIFEST_NAME = "manifest.csv"
+
+# 命名约定：顶层目录为学生 ID（student_12/… 或 12/…，与导出的归档结构一致），
+# 或顶层文件名以学生 ID 开头（student_12_report.pdf、12-report.pdf）
+STUDENT_DIR_PATTERN = re.compile(r"^(?:student_)?(\d+)$")
+STUDENT_FILE_PATTERN = re.compile(r"^(?:student_)?(\d+)[_\-\s.]")
+
+
+@dataclass
+class ImportItem:
+    """归档中要导入的一个条目"""
+    entry_name: str
+    file_name: str
+    student_id: int
+    content_type: str
+    size: int = 0  # 归档中记录的解压后大小，用于导入前检查配额
+    submission_id: Optional[int] = None
+
+
+@dataclass
+class ImportReport:
+    """导入进度和结果"""
+    total: int = 0
+    processed: int = 0
+    stored: int = 0
+    deduplicated: int = 0
+    skipped: List[Dict[str, str]] = field(default_factory=list)
+
+    def snapshot(self, event: str) -> Dict[str, Any]:
+        return {
+            "type": event,
+            "total": self.total,
+            "processed": self.processed,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "skipped": len(self.skipped)
+        }
+
+
+def _is_ignored(entry_name: str) -> bool:
+    parts = PurePosixPath(entry_name).parts
+    return not parts or parts[0] == "__MACOSX" or any(part.startswith(".") for part in parts)
+
+
+def _read_manifest(archive: zipfile.ZipFile) -> Optional[Dict[str, str]]:
+    """
+    读取根目录的 manifest.csv：file 列为归档内路径，student_id 或 student_email 列指定学生
+    返回 {归档内路径: 学生 ID 或邮箱}，没有清单时返回 None
+    """
+    try:
+        raw = archive.read(MANIFEST_NAME)
+    except KeyError:
+        return None
+
+    reader = csv.DictReader(io.StringIO(raw.decode("utf-8-sig")))
+    if not reader.fieldnames or "file" not in reader.fieldnames:
+        raise HTTPException(status_code=400, detail="manifest.csv 缺少 file 列")
+    key = "student_id" if "student_id" in reader.fieldnames else "student_email"
+    if key not in reader.fieldnames:
+        raise HTTPException(status_code=400, detail="manifest.csv 需要 student_id 或 student_email 列")
+    return {row["file"].strip(): (row[key] or "").strip() for row in reader if row.get("file")}
+
+
+def _match_convention(entry_name: str) -> Optional[int]:
+    parts = PurePosixPath(entry_name).parts
+    if len(parts) > 1:
+        match = STUDENT_DIR_PATTERN.match(parts[0])
+    else:
+        match = STUDENT_FILE_PATTERN.match(parts[0])
+    return int(match.group(1)) if match else None
+
+
+class BulkImporter:
+    """一次批量导入；归档已经完整写入本地临时文件"""
+
+    def __init__(self, file_service, archive_path: str, assignment_id: int):
+        self.file_service = file_service
+        self.storage_backend = file_service.storage_backend
+        self.archive_path = archive_path
+        self.assignment_id = assignment_id
+        self.workers = max(1, settings.BULK_IMPORT_WORKERS)
+        self.batch_size = max(1, settings.BULK_IMPORT_BATCH_SIZE)
+        self.course_id: Optional[int] = None
+        self.report = ImportReport()
+
+    def plan(self, db: Session) -> List[ImportItem]:
+        """确定每个条目属于哪个学生，无法对应或类型不允许的条目记入 skipped"""
+        with zipfile.ZipFile(self.archive_path) as archive:
+            manifest = _read_manifest(archive)
+            infos = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not _is_ignored(info.filename) and info.filename != MANIFEST_NAME
+            ]
+
+        emails = {}
+        if manifest and any("@" in value for value in manifest.values()):
+            wanted = {value.lower() for value in manifest.values() if "@" in value}
+            emails = {
+                email.lower(): user_id
+                for user_id, email in db.query(User.id, User.email).filter(User.email.in_(wanted))
+            }
+
+        items = []
+        for info in infos:
+            if manifest is not None:
+                value = manifest.get(info.filename)
+                if value is None:
+                    self._skip(info.filename, "不在清单中")
+                    continue
+                student_id = emails.get(value.lower()) if "@" in value else (int(value) if value.isdigit() else None)
+            else:
+                student_id = _match_convention(info.filename)
+            if student_id is None:
+                self._skip(info.filename, "无法对应到学生")
+                continue
+
+            file_name = PurePosixPath(info.filename).name
+            content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+            if not self.file_service._is_allowed_type(content_type):
+                self._skip(info.filename, "不支持的文件类型")
+                continue
+            if info.file_size > settings.MAX_FILE_SIZE:
+                self._skip(info.filename, "文件大小超过限制")
+                continue
+            items.append(ImportItem(info.filename, file_name, student_id, content_type, info.file_size))
+
+        # 只导入存在的学生
+        known = {
+            user_id for (user_id,) in
+            db.query(User.id).filter(User.id.in_({item.student_id for item in items}))
+        }
+        for item in items:
+            if item.student_id not in known:
+                self._skip(item.entry_name, f"学生 {item.student_id} 不存在")
+        items = [item for item in items if item.student_id in known]
+
+        items = self._check_quota(items, db)
+        self._assign_submissions(items, db)
+        self.report.total = len(items)
+        return items
+
+    def _check_quota(self, items: List[ImportItem], db: Session) -> List[ImportItem]:
+        """
+        导入之前按条目记录的大小检查配额：超出学生配额的学生跳过其全部条目，
+        其余条目合计超出课程配额时拒绝整个归档（413）
+        """
+        # assignment 模型导入 app.db.base（其中导入全部模型），在使用时导入避免循环导入
+        from app.models.assignment import Assignment
+        self.course_id = db.query(Assignment.course_id).filter(Assignment.id == self.assignment_id).scalar()
+
+        sizes: Counter = Counter()
+        for item in items:
+            sizes[item.student_id] += item.size
+        rejected = {}
+        for student_id, size in sizes.items():
+            try:
+                check_quota(None, student_id, size, db)
+            except HTTPException as e:
+                rejected[student_id] = e.detail
+        for item in items:
+            if item.student_id in rejected:
+                self._skip(item.entry_name, rejected[item.student_id])
+        items = [item for item in items if item.student_id not in rejected]
+
+        check_quota(self.course_id, None, sum(item.size for item in items), db)
+        return items
+
+    def _assign_submissions(self, items: List[ImportItem], db: Session):
+        """每个学生使用其在该作业下已有的提交，没有时一次性创建"""
+        student_ids = {item.student_id for item in items}
+        submissions = {}
+        for submission_id, student_id in db.query(Submission.id, Submission.student_id).filter(
+            Submission.assignment_id == self.assignment_id,
+            Submission.student_id.in_(student_ids)
+        ).order_by(Submission.id):
+            submissions.setdefault(student_id, submission_id)
+
+        missing = [Submission(assignment_id=self.assignment_id, student_id=student_id)
+                   for student_id in sorted(student_ids - submissions.keys())]
+        if missing:
+            db.add_all(missing)
+            db.commit()
+            for submission in missing:
+                submissions[submission.student_id] = submission.id
+
+        for item in items:
+            item.submission_id = submissions[item.student_id]
+
+    async def run(self, items: List[ImportItem], db: Session) -> AsyncIterator[Dict[str, Any]]:
+        """并行解压条目，按批写入存储和数据库，每批完成后产生一次进度"""
+        yield self.report.snapshot("started")
+
+        pending = list(reversed(items))
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.batch_size)
+        archives: asyncio.Queue = asyncio.Queue()
+        # 每个工作线程使用独立的 ZipFile 句柄，ZipFile 不支持多线程同时读取
+        for _ in range(self.workers):
+            archives.put_nowait(await asyncio.to_thread(zipfile.ZipFile, self.archive_path))
+
+        async def worker():
+            while pending:
+                item = pending.pop()
+                archive = await archives.get()
+                try:
+                    spooled = await asyncio.to_thread(self._extract, archive, item)
+                    await results.put((item, spooled, None))
+                except Exception as e:
+                    await results.put((item, None, e))
+                finally:
+                    archives.put_nowait(archive)
+            await results.put(None)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        batch: List[Tuple[ImportItem, SpooledUpload]] = []
+        finished = 0
+        try:
+            while finished < len(tasks):
+                result = await results.get()
+                if result is None:
+                    finished += 1
+                    continue
+                item, spooled, error = result
+                if error is not None:
+                    detail = error.detail if isinstance(error, HTTPException) else str(error)
+                    self._skip(item.entry_name, detail)
+                    self.report.processed += 1
+                    continue
+                batch.append((item, spooled))
+                if len(batch) >= self.batch_size:
+                    await self._commit_batch(batch, db)
+                    batch = []
+                    yield self.report.snapshot("progress")
+            if batch:
+                await self._commit_batch(batch, db)
+                batch = []
+        finally:
+            for task in tasks:
+                task.cancel()
+            for _, spooled in batch:
+                spooled.discard()
+            while not results.empty():
+                result = results.get_nowait()
+                if result and result[1] is not None:
+                    result[1].discard()
+            while not archives.empty():
+                archives.get_nowait().close()
+
+        final = self.report.snapshot("complete")
+        final["skipped_entries"] = self.report.skipped
+        yield final
+
+    def _extract(self, archive: zipfile.ZipFile, item: ImportItem) -> SpooledUpload:
+        """在工作线程中解压一个条目到临时文件，同一遍计算哈希和 CRC"""
+        with archive.open(item.entry_name) as source:
+            return spool_fileobj(source, self.storage_backend.spool_dir, max_size=settings.MAX_FILE_SIZE)
+
+    async def _commit_batch(self, batch: List[Tuple[ImportItem, SpooledUpload]], db: Session):
+        """
+        一批条目：已存在的内容只增加引用，新内容并行写入存储，
+        然后在一个事务中更新 blob 引用计数、用量计数并插入全部文件记录
+        配额已在导入之前按整个归档检查，这里只累加用量，不因并发上传使导入中途失败
+        """
+        counts = Counter(spooled.file_hash for _, spooled in batch)
+        paths = dict(db.query(FileBlob.file_hash, FileBlob.storage_path).filter(
+            FileBlob.file_hash.in_(counts.keys()),
+            FileBlob.ref_count > 0
+        ))
+        new_blobs: Dict[str, Tuple[ImportItem, SpooledUpload]] = {}
+        for item, spooled in batch:
+            if spooled.file_hash not in paths:
+                new_blobs.setdefault(spooled.file_hash, (item, spooled))
+
+        semaphore = asyncio.Semaphore(self.workers)
+        stored: Dict[str, Tuple[str, Optional[str], int]] = {}
+
+        async def store(item: ImportItem, spooled: SpooledUpload):
+            async with semaphore:
+                stored[spooled.file_hash] = await self.file_service.blob_store.store(spooled, item.content_type)
+
+        try:
+            await asyncio.gather(*(store(item, spooled) for item, spooled in new_blobs.values()))
+
+            for file_hash, count in counts.items():
+                spooled = new_blobs.get(file_hash, (None, None))[1]
+                paths[file_hash] = self._add_references(
+                    file_hash, count, spooled, stored.get(file_hash), db
+                )
+
+            file_urls = {}
+            for file_hash in counts:
+                file_urls[file_hash] = await self.storage_backend.get_file_url(paths[file_hash])
+
+            now = datetime.utcnow()
+            db.add_all([
+                SubmissionFile(
+                    submission_id=item.submission_id,
+                    file_name=item.file_name,
+                    file_path=paths[spooled.file_hash],
+                    file_url=file_urls[spooled.file_hash],
+                    file_size=spooled.size,
+                    mime_type=item.content_type,
+                    file_hash=spooled.file_hash,
+                    uploaded_at=now
+                )
+                for item, spooled in batch
+            ])
+            student_usage: Dict[int, Tuple[int, int]] = {}
+            for item, spooled in batch:
+                files, size = student_usage.get(item.student_id, (0, 0))
+                student_usage[item.student_id] = (files + 1, size + spooled.size)
+            record_usage(self.course_id, None, len(batch), sum(spooled.size for _, spooled in batch), db)
+            for student_id in sorted(student_usage):
+                record_usage(None, student_id, *student_usage[student_id], db)
+            previews = {
+                spooled.file_hash: item.content_type
+                for item, spooled in batch
+                if self.file_service.previews.wants_preview(item.content_type, spooled.size)
+            }
+            for file_hash in previews:
+                self.file_service.previews.mark_pending(file_hash, db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            for file_hash, (storage_path, _, _) in stored.items():
+                await self.file_service.blob_store.discard_if_unreferenced(file_hash, storage_path, db)
+            raise
+        finally:
+            for _, spooled in batch:
+                spooled.discard()
+
+        for file_hash, content_type in previews.items():
+            self.file_service.previews.enqueue(file_hash, content_type)
+        self.report.processed += len(batch)
+        self.report.stored += len(new_blobs)
+        self.report.deduplicated += len(batch) - len(new_blobs)
+
+    def _add_references(
+        self,
+        file_hash: str,
+        count: int,
+        spooled: Optional[SpooledUpload],
+        stored: Optional[Tuple[str, Optional[str], int]],
+        db: Session
+    ) -> str:
+        """
+        为一个内容增加 count 个引用，返回 blob 的存储路径
+        新内容插入 blob 记录，并发插入冲突时改为累加
+        """
+        if spooled is not None:
+            storage_path, encoding, stored_size = stored
+            try:
+                with db.begin_nested():
+                    db.add(FileBlob(
+                        file_hash=file_hash,
+                        storage_path=storage_path,
+                        size=spooled.size,
+                        crc32=spooled.crc32,
+                        encoding=encoding,
+                        stored_size=stored_size,
+                        ref_count=count,
+                        created_at=datetime.utcnow(),
+                        tier=TIER_HOT
+                    ))
+                    db.flush()
+                    adjust_tier_usage(TIER_HOT, 1, stored_size, db)
+                return storage_path
+            except IntegrityError:
+                pass
+
+        updated = db.query(FileBlob).filter(
+            FileBlob.file_hash == file_hash,
+            FileBlob.ref_count > 0
+        ).update(
+            {FileBlob.ref_count: FileBlob.ref_count + count},
+            synchronize_session=False
+        )
+        if not updated:
+            # 查询之后该内容的最后一个引用被删除，存储内容已不存在
+            raise RuntimeError(f"内容 {file_hash} 已被删除，请重新导入")
+        return db.query(FileBlob.storage_path).filter(FileBlob.file_hash == file_hash).scalar()
+
+    def _skip(self, entry_name: str, reason: str):
+        logger.info(f"批量导入跳过 {entry_name}: {reason}")
+        self.report.skipped.append({"entry": entry_name, "reason": reason})
+
+
+def _open_session() -> Session:
+    # 导入在响应流中进行，请求的数据库会话此时已经关闭，使用独立的会话
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+async def stream_import(importer: BulkImporter, items: List[ImportItem]) -> AsyncIterator[bytes]:
+    """以 NDJSON 逐行产生导入进度，结束后删除临时归档"""
+    db = _open_session()
+    try:
+        async for event in importer.run(items, db):
+            yield (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    except Exception as e:
+        logger.error(f"批量导入失败: {str(e)}")
+        event = importer.report.snapshot("error")
+        event["detail"] = str(e)
+        yield (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    finally:
+        db.close()
+        try:
+            os.unlink(importer.archive_path)
+        except FileNotFoundError:
+            pass
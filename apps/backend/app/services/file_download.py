@@ -0,0 +1,243 @@
+"""
+流式文件下载
+支持 Range / 206 部分内容（视频拖动、PDF 按页加载）和基于内容哈希的 ETag 条件请求（304）
+本地文件优先交给服务器零拷贝发送（ASGI zerocopysend / pathsend 扩展），
+否则按固定大小的块读取发送；内存占用与文件大小无关
+"""
+
+import os
+from typing import Iterable, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+
+
+def make_etag(file_hash: str) -> str:
+    """由内容哈希生成强 ETag（"sha256:ab.." -> "sha256-ab.."）"""
+    return '"' + file_hash.replace(":", "-") + '"'
+
+
+def _split_etags(header: str) -> Iterable[str]:
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag:
+            yield tag
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 弱比较：忽略 W/ 前缀，支持 * 和多个值"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in _split_etags(header)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节范围，返回闭区间 (start, end)
+    没有 Range、格式无法识别或请求多个范围时返回 None（按规范可以返回完整内容）
+    范围完全超出文件时返回 416
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+
+    start_text, sep, end_text = spec.partition("-")
+    if not sep:
+        return None
+    start_text, end_text = start_text.strip(), end_text.strip()
+    try:
+        if start_text:
+            start = int(start_text)
+            if start >= size:
+                raise _not_satisfiable(size)
+            end = int(end_text) if end_text else size - 1
+            if start > end:
+                return None
+        elif end_text:
+            # 后缀范围：最后 N 个字节
+            suffix = int(end_text)
+            if suffix == 0:
+                raise _not_satisfiable(size)
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    return start, min(end, size - 1)
+
+
+def _not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=416,
+        detail="请求的范围无效",
+        headers={"Content-Range": f"bytes */{size}"}
+    )
+
+
+def content_disposition(file_name: Optional[str], inline: bool = False) -> str:
+    """
+    文件名为空时使用 "download"；需要编码的文件名同时给出 RFC 5987 的 filename*
+    和只含可打印 ASCII 的 filename 回退（不支持 filename* 的客户端使用）
+    """
+    disposition = "inline" if inline else "attachment"
+    file_name = file_name or "download"
+    quoted = quote(file_name)
+    if quoted == file_name:
+        return f'{disposition}; filename="{file_name}"'
+    fallback = "".join(char if " " <= char <= "~" and char not in '"\\' else "_" for char in file_name)
+    return f"{disposition}; filename=\"{fallback}\"; filename*=utf-8''{quoted}"
+
+
+class RangeFileResponse(Response):
+    """
+    发送本地文件的一个字节区间
+    服务器支持 http.response.zerocopysend 时用 sendfile 发送；
+    发送完整文件且支持 http.response.pathsend 时交给服务器按路径发送；
+    否则在线程中按块 pread，客户端断开后立即停止读取
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        end: int,
+        file_size: int,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+        chunk_size: Optional[int] = None
+    ):
+        self.path = path
+        self.start = start
+        self.length = max(end - start + 1, 0)
+        self.file_size = file_size
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers
+            })
+            if scope["method"].upper() == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fd,
+                    "offset": self.start,
+                    "count": self.length
+                })
+            elif "http.response.pathsend" in extensions and self.length == self.file_size:
+                await send({"type": "http.response.pathsend", "path": self.path})
+            else:
+                async with anyio.create_task_group() as task_group:
+                    async def stream_and_cancel():
+                        await self._stream_chunks(fd, send)
+                        task_group.cancel_scope.cancel()
+
+                    task_group.start_soon(stream_and_cancel)
+                    await self._wait_for_disconnect(receive)
+                    task_group.cancel_scope.cancel()
+        finally:
+            os.close(fd)
+
+        if self.background is not None:
+            await self.background()
+
+    async def _stream_chunks(self, fd: int, send: Send):
+        offset = self.start
+        remaining = self.length
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, remaining), offset)
+            if not chunk:
+                # 文件在发送过程中被截断，已声明的长度无法满足，直接结束
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+
+
+class DownloadPlan:
+    """条件请求和范围请求的处理结果"""
+
+    def __init__(self, file_size: int, headers: dict, byte_range: Optional[Tuple[int, int]]):
+        self.file_size = file_size
+        self.headers = headers
+        self.start, self.end = byte_range if byte_range else (0, file_size - 1)
+        self.status_code = 206 if byte_range else 200
+        if byte_range:
+            self.headers["Content-Range"] = f"bytes {self.start}-{self.end}/{file_size}"
+
+
+def plan_download(
+    request: Request,
+    file_size: int,
+    file_name: str,
+    file_hash: Optional[str],
+    inline: bool = False
+):
+    """
+    根据请求头决定如何响应下载请求，在读取任何文件内容之前调用
+    If-None-Match 命中时直接返回 304 响应；否则返回 DownloadPlan：
+    Range 有效（且 If-Range 与当前 ETag 一致）时为 206，其余情况为完整内容
+    """
+    headers = {
+        "Accept-Ranges": "bytes",
+        # 文件需要鉴权，只允许浏览器私有缓存，并在使用前用 ETag 重新验证
+        "Cache-Control": "private, no-cache"
+    }
+    etag = make_etag(file_hash) if file_hash else None
+    if etag:
+        headers["ETag"] = etag
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or (etag and if_range.strip() == etag):
+        byte_range = parse_range(request.headers.get("range"), file_size)
+
+    headers["Content-Disposition"] = content_disposition(file_name, inline)
+    return DownloadPlan(file_size, headers, byte_range)
+
+
+def local_file_response(path: str, plan: DownloadPlan, media_type: Optional[str]) -> RangeFileResponse:
+    return RangeFileResponse(
+        path,
+        plan.start,
+        plan.end,
+        plan.file_size,
+        status_code=plan.status_code,
+        headers=plan.headers,
+        media_type=media_type
+    )
@@ -6,32 +6,124 @@
 
 import os
 import uuid
+import base64
 import hashlib
+import asyncio
+import tempfile
+import zipfile
+import zlib
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from pathlib import Path
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from pathlib import Path, PurePosixPath
 from urllib.parse import quote
 
 from fastapi import UploadFile, HTTPException
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.logging import logger
-from app.models.submission import SubmissionFile
-from app.schemas.file_schema import FileUploadResponse, FileMetadata
+from app.models.submission import FileBlob, Submission, SubmissionFile
+from app.schemas.file_schema import (
+    DirectUploadRequest,
+    DirectUploadResponse,
+    FileMetadata,
+    FileUploadResponse
+)
+from app.services.blob_codec import decode_stream, default_encoding
+from app.services.blob_store import BlobStore, blob_key
+from app.services.bulk_import import BulkImporter, stream_import
+from app.services.image_normalize import NORMALIZED_MEDIA_TYPE, ImageNormalizer
+from app.services.orphan_gc import OrphanCollector
+from app.services.preview import PREVIEW_READY, PreviewPipeline
+from app.services.preview_render import preview_name
+from app.services.resumable_upload import ResumableUploadStore, UploadState
+from app.services.storage_quota import (
+    UsageReconciler,
+    check_quota,
+    get_usage,
+    get_usage_summary,
+    record_usage,
+    set_quota,
+    submission_owner
+)
+from app.services.storage_tiering import StorageTiering, packed_range, parse_packed_path
+from app.services.storage_usage import get_tier_usage
+from app.services.upload_stream import SpooledUpload, spool_stream, spool_upload_file
+from app.services.zip_stream import ZipEntry, ZipStream, is_precompressed
 
 
 class FileStorageBackend:
     """文件存储后端接口"""
     
+    # 是否支持客户端通过预签名 URL 直接上传到存储
+    supports_direct_upload = False
+    
+    async def start(self):
+        """应用启动时预热（创建目录、建立连接），后端实例在整个进程内复用"""
+    
+    async def close(self):
+        """应用关闭时释放连接"""
+    
+    async def health_check(self) -> bool:
+        """检查存储是否可用"""
+        return True
+    
     async def upload_file(self, file: UploadFile, file_path: str) -> str:
         """上传文件"""
         raise NotImplementedError
     
+    async def store_file(
+        self,
+        source_path: str,
+        file_path: str,
+        content_type: Optional[str] = None,
+        cold: bool = False
+    ) -> str:
+        """
+        把已写入本地临时文件的内容存入后端，成功后临时文件被移动或删除
+        cold 为 True 时存为很少读取的内容（S3 使用低频访问存储类型）
+        """
+        raise NotImplementedError
+    
+    @property
+    def spool_dir(self) -> str:
+        """流式上传时临时文件所在目录"""
+        return os.path.join(settings.UPLOAD_DIR, ".incoming")
+    
     async def download_file(self, file_path: str) -> bytes:
         """下载文件"""
         raise NotImplementedError
     
+    def get_local_path(self, file_path: str) -> Optional[str]:
+        """文件在本机磁盘上的路径，可以直接流式发送；远程存储返回 None"""
+        return None
+    
+    async def iter_file(
+        self,
+        file_path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """按块读取文件的一个字节区间（闭区间）"""
+        content = await self.download_file(file_path)
+        yield content[start:None if end is None else end + 1]
+    
+    async def get_upload_url(
+        self,
+        file_path: str,
+        content_type: str,
+        checksum_sha256: str,
+        expires_in: int
+    ) -> Tuple[str, Dict[str, str]]:
+        """生成客户端直传的预签名 URL，返回 (url, 必须携带的请求头)"""
+        raise NotImplementedError
+    
+    async def stat_object(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """获取已存储对象的大小和校验和"""
+        raise NotImplementedError
+    
     async def delete_file(self, file_path: str) -> bool:
         """删除文件"""
         raise NotImplementedError
@@ -43,6 +135,60 @@ class FileStorageBackend:
     def get_file_path(self, original_filename: str, submission_id: str) -> str:
         """生成文件存储路径"""
         raise NotImplementedError
+    
+    def get_blob_path(self, file_hash: str) -> str:
+        """按内容哈希生成 blob 存储路径，相同内容得到相同路径"""
+        raise NotImplementedError
+    
+    def get_preview_path(self, file_hash: str, name: str) -> str:
+        """内容的预览图存储路径"""
+        raise NotImplementedError
+    
+    def get_cold_blob_path(self, file_hash: str) -> str:
+        """很少读取的 blob（如规范化之前的原始图片）的存储路径"""
+        raise NotImplementedError
+    
+    def get_segment_path(self, segment_id: str) -> str:
+        """冷存储打包分段的存储路径"""
+        raise NotImplementedError
+    
+    def storage_key(self, file_path: str) -> str:
+        """存储路径相对于存储根目录的部分（"blobs/sha256/ab/cd/.."），用于识别文件的类别"""
+        raise NotImplementedError
+    
+    async def list_files(
+        self,
+        after: Optional[str],
+        limit: int,
+        quarantined: bool = False
+    ) -> List[Tuple[str, float]]:
+        """
+        按存储路径的字典序列出 after 之后的至多 limit 个文件，返回 [(存储路径, 修改时间)]
+        不包括临时目录；quarantined 为 True 时只列出隔离区中的文件
+        """
+        raise NotImplementedError
+    
+    async def file_exists(self, file_path: str) -> bool:
+        raise NotImplementedError
+    
+    def get_quarantine_path(self, file_path: str) -> str:
+        """文件在隔离区中的位置"""
+        raise NotImplementedError
+    
+    def get_quarantine_source(self, quarantine_path: str) -> str:
+        """隔离区中的文件原来的位置"""
+        raise NotImplementedError
+    
+    async def quarantine_file(self, file_path: str) -> bool:
+        """把文件移入隔离区，修改时间记为移入的时间"""
+        raise NotImplementedError
+    
+    async def restore_file(self, file_path: str) -> bool:
+        """
+        把隔离区中的文件移回原位置；原位置已经重新写入了内容时只删除隔离的副本
+        隔离区中没有该文件时返回 False
+        """
+        raise NotImplementedError
 
 
 class LocalFileStorage(FileStorageBackend):
@@ -52,6 +198,13 @@ class LocalFileStorage(FileStorageBackend):
         self.base_path = Path(base_path)
         self.base_path.mkdir(parents=True, exist_ok=True)
     
+    async def start(self):
+        await asyncio.to_thread(Path(self.spool_dir).mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread((self.base_path / "blobs").mkdir, exist_ok=True)
+    
+    async def health_check(self) -> bool:
+        return await asyncio.to_thread(os.access, self.base_path, os.W_OK)
+    
     def get_file_path(self, original_filename: str, submission_id: str) -> str:
         """生成本地文件存储路径"""
         # 使用UUID和时间戳确保文件名唯一
@@ -60,24 +213,51 @@ class LocalFileStorage(FileStorageBackend):
         unique_filename = f"{submission_id}_{timestamp}_{uuid.uuid4().hex}{file_extension}"
         return str(self.base_path / "submissions" / submission_id / unique_filename)
     
+    def get_blob_path(self, file_hash: str) -> str:
+        return str(self.base_path / "blobs" / blob_key(file_hash))
+    
+    def get_preview_path(self, file_hash: str, name: str) -> str:
+        return str(self.base_path / "previews" / blob_key(file_hash) / name)
+    
+    def get_cold_blob_path(self, file_hash: str) -> str:
+        return str(self.base_path / "cold" / blob_key(file_hash))
+    
+    def get_segment_path(self, segment_id: str) -> str:
+        return str(self.base_path / "segments" / segment_id[:2] / f"{segment_id}.seg")
+    
+    @property
+    def spool_dir(self) -> str:
+        # 与最终位置在同一文件系统上，存储时只需原子重命名
+        return str(self.base_path / ".incoming")
+    
     async def upload_file(self, file: UploadFile, file_path: str) -> str:
-        """上传文件到本地存储"""
+        """上传文件到本地存储（按块写入，不整体读入内存）"""
+        spooled = await spool_upload_file(file, self.spool_dir)
         try:
-            # 确保目录存在
-            Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-            
-            # 保存文件
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
+            return await self.store_file(spooled.path, file_path, file.content_type)
+        finally:
+            spooled.discard()
+    
+    async def store_file(
+        self,
+        source_path: str,
+        file_path: str,
+        content_type: Optional[str] = None,
+        cold: bool = False
+    ) -> str:
+        """把临时文件原子重命名到最终位置"""
+        try:
+            await asyncio.to_thread(Path(file_path).parent.mkdir, parents=True, exist_ok=True)
+            await asyncio.to_thread(os.replace, source_path, file_path)
             return file_path
         except Exception as e:
             logger.error(f"本地文件上传失败: {e}")
             raise HTTPException(status_code=500, detail="文件上传失败")
     
     async def download_file(self, file_path: str) -> bytes:
-        """从本地存储下载文件"""
+        """从本地存储下载文件（打包在分段中的 blob 只读取其区间）"""
+        if parse_packed_path(file_path):
+            return b"".join([chunk async for chunk in self.iter_file(file_path)])
         try:
             with open(file_path, "rb") as file:
                 return file.read()
@@ -87,8 +267,44 @@ class LocalFileStorage(FileStorageBackend):
             logger.error(f"本地文件下载失败: {e}")
             raise HTTPException(status_code=500, detail="文件下载失败")
     
+    def get_local_path(self, file_path: str) -> Optional[str]:
+        # 打包在分段中的 blob 没有单独的文件，按区间读取
+        return None if parse_packed_path(file_path) else file_path
+    
+    async def iter_file(
+        self,
+        file_path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """在线程中按块 pread 文件的一个字节区间（闭区间）"""
+        chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+        packed = parse_packed_path(file_path)
+        if packed:
+            file_path, offset, length = packed
+            start, end = packed_range(length, offset, start, end)
+        try:
+            fd = await asyncio.to_thread(os.open, file_path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        try:
+            offset = start
+            while end is None or offset <= end:
+                length = chunk_size if end is None else min(chunk_size, end - offset + 1)
+                chunk = await asyncio.to_thread(os.pread, fd, length, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+    
     async def delete_file(self, file_path: str) -> bool:
         """删除本地文件"""
+        if parse_packed_path(file_path):
+            # 分段中的内容不能单独删除，分段由分层任务回收
+            return True
         try:
             Path(file_path).unlink(missing_ok=True)
             return True
@@ -100,26 +316,171 @@ class LocalFileStorage(FileStorageBackend):
         """获取本地文件访问URL"""
         # 本地存储直接返回文件路径
         return f"/api/v1/files/download?path={quote(file_path)}"
+    
+    @property
+    def quarantine_dir(self) -> Path:
+        return self.base_path / ".quarantine"
+    
+    def storage_key(self, file_path: str) -> str:
+        return Path(file_path).relative_to(self.base_path).as_posix()
+    
+    async def list_files(
+        self,
+        after: Optional[str],
+        limit: int,
+        quarantined: bool = False
+    ) -> List[Tuple[str, float]]:
+        root = self.quarantine_dir if quarantined else self.base_path
+        after_parts = Path(after).relative_to(root).parts if after else ()
+        return await asyncio.to_thread(self._scan, root, after_parts, limit, not quarantined)
+    
+    @staticmethod
+    def _scan(root: Path, after_parts: Tuple[str, ...], limit: int, skip_hidden: bool) -> List[Tuple[str, float]]:
+        """
+        按路径各级名称的字典序深度优先遍历，只读取 after 所在分支及其之后的目录
+        哈希分散的目录每层只有少量条目，排序每个目录的条目即可得到确定的遍历顺序，游标可以跨进程续传
+        """
+        result = []
+        
+        def walk(directory: str, parts: Tuple[str, ...]) -> bool:
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except FileNotFoundError:
+                return True
+            for entry in entries:
+                # 根目录下以 . 开头的是临时文件、续传上传和隔离区
+                if skip_hidden and not parts and entry.name.startswith("."):
+                    continue
+                entry_parts = parts + (entry.name,)
+                if entry.is_dir(follow_symlinks=False):
+                    # 整个目录都在游标之前
+                    if entry_parts < after_parts[:len(entry_parts)]:
+                        continue
+                    if not walk(entry.path, entry_parts):
+                        return False
+                elif entry_parts > after_parts:
+                    try:
+                        mtime = entry.stat(follow_symlinks=False).st_mtime
+                    except FileNotFoundError:
+                        continue
+                    result.append((entry.path, mtime))
+                    if len(result) >= limit:
+                        return False
+            return True
+        
+        walk(str(root), ())
+        return result
+    
+    async def file_exists(self, file_path: str) -> bool:
+        packed = parse_packed_path(file_path)
+        return await asyncio.to_thread(os.path.isfile, packed[0] if packed else file_path)
+    
+    def get_quarantine_path(self, file_path: str) -> str:
+        return str(self.quarantine_dir / self.storage_key(file_path))
+    
+    def get_quarantine_source(self, quarantine_path: str) -> str:
+        return str(self.base_path / Path(quarantine_path).relative_to(self.quarantine_dir))
+    
+    async def quarantine_file(self, file_path: str) -> bool:
+        target = self.get_quarantine_path(file_path)
+        
+        def move() -> bool:
+            Path(target).parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(file_path, target)
+            except FileNotFoundError:
+                return False
+            os.utime(target)
+            return True
+        
+        return await asyncio.to_thread(move)
+    
+    async def restore_file(self, file_path: str) -> bool:
+        source = self.get_quarantine_path(file_path)
+        
+        def move() -> bool:
+            if not os.path.exists(source):
+                return False
+            if os.path.exists(file_path):
+                os.unlink(source)
+            else:
+                Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+                os.replace(source, file_path)
+            return True
+        
+        return await asyncio.to_thread(move)
 
 
 class S3FileStorage(FileStorageBackend):
-    """AWS S3文件存储实现"""
+    """
+    AWS S3文件存储实现
+    boto3 是同步客户端，所有网络调用都放到线程中执行，不阻塞事件循环
+    大文件使用分片上传，多个分片并行传输；下载按块流式读取
+    """
+    
+    supports_direct_upload = True
+    
+    # 垃圾回收隔离的对象移到这个前缀下
+    QUARANTINE_PREFIX = "quarantine/"
     
     def __init__(self, bucket_name: str, region: str = "us-east-1"):
         self.bucket_name = bucket_name
         self.region = region
         # 这里需要安装 boto3: pip install boto3
         try:
-            import boto3
-            self.s3_client = boto3.client(
-                's3',
-                region_name=region,
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-            )
+            from boto3.s3.transfer import TransferConfig
         except ImportError:
             logger.error("boto3未安装，无法使用S3存储")
             raise HTTPException(status_code=500, detail="S3存储配置错误")
+        
+        self.s3_client = self._create_client()
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.S3_TRANSFER_CONCURRENCY,
+            use_threads=True
+        )
+    
+    def _create_client(self):
+        import boto3
+        from botocore.config import Config
+        
+        # 客户端在进程内复用，连接池大小要覆盖并行分片上传的线程数
+        return boto3.client(
+            's3',
+            region_name=self.region,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 3, "mode": "standard"}
+            )
+        )
+    
+    async def start(self):
+        """访问一次存储桶，预先完成 DNS 解析和 TLS 握手，并尽早发现配置错误"""
+        if not await self.health_check():
+            logger.error(f"S3存储桶不可用: {self.bucket_name}")
+    
+    async def close(self):
+        await asyncio.to_thread(self.s3_client.close)
+    
+    async def health_check(self) -> bool:
+        """检查存储桶是否可访问；失败时重建客户端（丢弃可能已失效的连接池）后重试一次"""
+        for attempt in range(2):
+            try:
+                await asyncio.to_thread(self.s3_client.head_bucket, Bucket=self.bucket_name)
+                return True
+            except Exception as e:
+                logger.warning(f"S3健康检查失败: {e}")
+                if attempt == 0:
+                    stale_client = self.s3_client
+                    self.s3_client = await asyncio.to_thread(self._create_client)
+                    await asyncio.to_thread(stale_client.close)
+        return False
     
     def get_file_path(self, original_filename: str, submission_id: str) -> str:
         """生成S3文件存储路径"""
@@ -128,41 +489,123 @@ class S3FileStorage(FileStorageBackend):
         unique_filename = f"{submission_id}_{timestamp}_{uuid.uuid4().hex}{file_extension}"
         return f"submissions/{submission_id}/{unique_filename}"
     
+    def get_blob_path(self, file_hash: str) -> str:
+        return f"blobs/{blob_key(file_hash)}"
+    
+    def get_preview_path(self, file_hash: str, name: str) -> str:
+        return f"previews/{blob_key(file_hash)}/{name}"
+    
+    def get_cold_blob_path(self, file_hash: str) -> str:
+        return f"cold/{blob_key(file_hash)}"
+    
+    def get_segment_path(self, segment_id: str) -> str:
+        return f"segments/{segment_id[:2]}/{segment_id}.seg"
+    
+    @property
+    def spool_dir(self) -> str:
+        return os.path.join(tempfile.gettempdir(), "deeprubric-uploads")
+    
     async def upload_file(self, file: UploadFile, file_path: str) -> str:
-        """上传文件到S3"""
+        """上传文件到S3（先按块写入临时文件，再从文件上传）"""
+        spooled = await spool_upload_file(file, self.spool_dir)
         try:
-            content = await file.read()
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=file_path,
-                Body=content,
-                ContentType=file.content_type or 'application/octet-stream'
+            return await self.store_file(spooled.path, file_path, file.content_type)
+        finally:
+            spooled.discard()
+    
+    async def store_file(
+        self,
+        source_path: str,
+        file_path: str,
+        content_type: Optional[str] = None,
+        cold: bool = False
+    ) -> str:
+        """
+        从临时文件上传到S3
+        超过 S3_MULTIPART_THRESHOLD 时使用分片上传，S3_TRANSFER_CONCURRENCY 个分片并行传输
+        """
+        extra_args = {"ContentType": content_type or 'application/octet-stream'}
+        if cold:
+            extra_args["StorageClass"] = settings.S3_COLD_STORAGE_CLASS
+        try:
+            await asyncio.to_thread(
+                self.s3_client.upload_file,
+                source_path,
+                self.bucket_name,
+                file_path,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
             )
             return file_path
         except Exception as e:
             logger.error(f"S3文件上传失败: {e}")
             raise HTTPException(status_code=500, detail="文件上传失败")
+        finally:
+            Path(source_path).unlink(missing_ok=True)
     
     async def download_file(self, file_path: str) -> bytes:
-        """从S3下载文件"""
+        """从S3下载文件（整体读入内存，大文件请使用 iter_file）"""
+        if parse_packed_path(file_path):
+            return b"".join([chunk async for chunk in self.iter_file(file_path)])
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_path)
-            return response['Body'].read()
+            response = await asyncio.to_thread(
+                self.s3_client.get_object, Bucket=self.bucket_name, Key=file_path
+            )
+            return await asyncio.to_thread(response['Body'].read)
         except Exception as e:
             logger.error(f"S3文件下载失败: {e}")
             raise HTTPException(status_code=404, detail="文件不存在")
     
+    async def iter_file(
+        self,
+        file_path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """按块流式读取对象的一个字节区间（闭区间），只请求需要的范围"""
+        chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+        packed = parse_packed_path(file_path)
+        if packed:
+            file_path, offset, length = packed
+            start, end = packed_range(length, offset, start, end)
+            if end < start:
+                return
+        params = {"Bucket": self.bucket_name, "Key": file_path}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = await asyncio.to_thread(self.s3_client.get_object, **params)
+        except Exception as e:
+            logger.error(f"S3文件下载失败: {e}")
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        body = response['Body']
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+    
     async def delete_file(self, file_path: str) -> bool:
         """删除S3文件"""
+        if parse_packed_path(file_path):
+            # 分段中的内容不能单独删除，分段由分层任务回收
+            return True
         try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=file_path)
+            await asyncio.to_thread(
+                self.s3_client.delete_object, Bucket=self.bucket_name, Key=file_path
+            )
             return True
         except Exception as e:
             logger.error(f"S3文件删除失败: {e}")
             return False
     
     async def get_file_url(self, file_path: str, expires_in: int = 3600) -> str:
-        """获取S3文件预签名URL"""
+        """获取S3文件预签名URL（本地签名，不访问网络）"""
         try:
             url = self.s3_client.generate_presigned_url(
                 'get_object',
@@ -173,6 +616,127 @@ class S3FileStorage(FileStorageBackend):
         except Exception as e:
             logger.error(f"S3文件URL生成失败: {e}")
             raise HTTPException(status_code=500, detail="文件URL生成失败")
+    
+    async def get_upload_url(
+        self,
+        file_path: str,
+        content_type: str,
+        checksum_sha256: str,
+        expires_in: int
+    ) -> Tuple[str, Dict[str, str]]:
+        """
+        生成直传用的预签名 PUT URL
+        签名包含 SHA-256 校验和，内容与声明的哈希不一致时 S3 会拒绝写入
+        返回 (url, 客户端必须携带的请求头)
+        """
+        try:
+            url = self.s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': file_path,
+                    'ContentType': content_type,
+                    'ChecksumSHA256': checksum_sha256
+                },
+                ExpiresIn=expires_in
+            )
+        except Exception as e:
+            logger.error(f"S3上传URL生成失败: {e}")
+            raise HTTPException(status_code=500, detail="上传URL生成失败")
+        
+        return url, {
+            "Content-Type": content_type,
+            "x-amz-checksum-sha256": checksum_sha256
+        }
+    
+    async def stat_object(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """获取对象大小和 SHA-256 校验和，对象不存在时返回 None"""
+        try:
+            response = await asyncio.to_thread(
+                self.s3_client.head_object,
+                Bucket=self.bucket_name,
+                Key=file_path,
+                ChecksumMode="ENABLED"
+            )
+        except Exception as e:
+            logger.info(f"S3对象不存在或无法访问: {file_path} ({e})")
+            return None
+        return {
+            "size": response["ContentLength"],
+            "checksum_sha256": response.get("ChecksumSHA256")
+        }
+    
+    def storage_key(self, file_path: str) -> str:
+        return file_path
+    
+    async def list_files(
+        self,
+        after: Optional[str],
+        limit: int,
+        quarantined: bool = False
+    ) -> List[Tuple[str, float]]:
+        """ListObjectsV2 按键的字典序分页返回，StartAfter 即游标"""
+        params = {"Bucket": self.bucket_name}
+        if quarantined:
+            params["Prefix"] = self.QUARANTINE_PREFIX
+        result = []
+        while len(result) < limit:
+            params["MaxKeys"] = min(limit - len(result), 1000)
+            if after:
+                params["StartAfter"] = after
+            response = await asyncio.to_thread(self.s3_client.list_objects_v2, **params)
+            objects = response.get("Contents", [])
+            for item in objects:
+                if quarantined or not item["Key"].startswith(self.QUARANTINE_PREFIX):
+                    result.append((item["Key"], item["LastModified"].timestamp()))
+            if not objects or not response.get("IsTruncated"):
+                break
+            after = objects[-1]["Key"]
+        return result
+    
+    async def file_exists(self, file_path: str) -> bool:
+        packed = parse_packed_path(file_path)
+        try:
+            await asyncio.to_thread(
+                self.s3_client.head_object,
+                Bucket=self.bucket_name,
+                Key=packed[0] if packed else file_path
+            )
+            return True
+        except Exception:
+            return False
+    
+    def get_quarantine_path(self, file_path: str) -> str:
+        return self.QUARANTINE_PREFIX + file_path
+    
+    def get_quarantine_source(self, quarantine_path: str) -> str:
+        return quarantine_path[len(self.QUARANTINE_PREFIX):]
+    
+    async def _move_object(self, source: str, target: str) -> bool:
+        """复制后删除源对象（S3 没有重命名），复制时对象的修改时间更新为当前时间"""
+        try:
+            await asyncio.to_thread(
+                self.s3_client.copy,
+                {"Bucket": self.bucket_name, "Key": source},
+                self.bucket_name,
+                target,
+                Config=self.transfer_config
+            )
+        except Exception as e:
+            logger.info(f"S3对象不存在或无法复制: {source} ({e})")
+            return False
+        return await self.delete_file(source)
+    
+    async def quarantine_file(self, file_path: str) -> bool:
+        return await self._move_object(file_path, self.get_quarantine_path(file_path))
+    
+    async def restore_file(self, file_path: str) -> bool:
+        source = self.get_quarantine_path(file_path)
+        if not await self.file_exists(source):
+            return False
+        if await self.file_exists(file_path):
+            return await self.delete_file(source)
+        return await self._move_object(source, file_path)
 
 
 class FileService:
@@ -180,9 +744,16 @@ class FileService:
     
     def __init__(self, storage_backend: FileStorageBackend):
         self.storage_backend = storage_backend
+        self.blob_store = BlobStore(storage_backend)
+        self.tiering = StorageTiering(storage_backend)
+        self.garbage_collector = OrphanCollector(storage_backend)
+        self.usage_reconciler = UsageReconciler()
+        self.resumable_uploads = ResumableUploadStore()
+        self.previews = PreviewPipeline(storage_backend)
+        self.normalizer = ImageNormalizer()
     
     async def validate_file(self, file: UploadFile) -> Dict[str, Any]:
-        """验证文件"""
+        """验证文件（只检查声明的大小和类型，实际大小在流式写入时检查）"""
         # 检查文件大小
         if file.size and file.size > settings.MAX_FILE_SIZE:
             raise HTTPException(
@@ -197,14 +768,10 @@ class FileService:
                 detail="不支持的文件类型"
             )
         
-        # 生成文件元数据
-        file_hash = await self._calculate_file_hash(file)
-        
         return {
             "original_filename": file.filename,
             "content_type": file.content_type,
             "size": file.size,
-            "file_hash": file_hash,
             "is_valid": True
         }
     
@@ -219,37 +786,295 @@ class FileService:
         validation_result = await self.validate_file(file)
         if not validation_result["is_valid"]:
             raise HTTPException(status_code=400, detail="文件验证失败")
+        self.check_quota(submission_id, file.size or 0, db)
         
-        # 生成存储路径
-        file_path = self.storage_backend.get_file_path(file.filename or "unknown", submission_id)
-        
-        # 上传文件
-        stored_path = await self.storage_backend.upload_file(file, file_path)
-        
-        # 保存文件记录到数据库
-        file_record = SubmissionFile(
-            submission_id=submission_id,
-            file_name=file.filename,
-            file_path=stored_path,
-            file_url="",  # 稍后生成
-            file_size=validation_result["size"],
-            mime_type=validation_result["content_type"],
-            file_hash=validation_result["file_hash"],
-            uploaded_at=datetime.utcnow()
+        # 按块写入临时文件，同一遍计算哈希并检查大小
+        spooled = await spool_upload_file(
+            file, self.storage_backend.spool_dir, max_size=settings.MAX_FILE_SIZE
+        )
+        return await self._store_submission_file(
+            spooled, file.filename, file.content_type, submission_id, db
         )
+    
+    async def upload_submission_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        file_name: str,
+        content_type: Optional[str],
+        submission_id: str,
+        db: Session,
+        declared_size: int = 0
+    ) -> FileUploadResponse:
+        """
+        上传作业文件（原始请求体）
+        请求体直接写入临时文件，不经过 multipart 解析的中间缓存
+        declared_size 为请求声明的长度（Content-Length），在读取请求体之前按它检查配额
+        """
+        if content_type and not self._is_allowed_type(content_type):
+            raise HTTPException(status_code=415, detail="不支持的文件类型")
+        self.check_quota(submission_id, declared_size, db)
         
-        db.add(file_record)
-        db.commit()
-        db.refresh(file_record)
+        spooled = await spool_stream(
+            chunks, self.storage_backend.spool_dir, max_size=settings.MAX_FILE_SIZE
+        )
+        return await self._store_submission_file(spooled, file_name, content_type, submission_id, db)
+    
+    async def create_resumable_upload(
+        self,
+        user_id: int,
+        submission_id: Optional[str],
+        file_name: Optional[str],
+        content_type: Optional[str],
+        length: int,
+        db: Session
+    ) -> UploadState:
+        """创建可续传的上传，大小、类型和配额在接收任何内容之前检查"""
+        if not submission_id or not file_name:
+            raise HTTPException(status_code=400, detail="Upload-Metadata 需要 submission_id 和 filename")
+        if length > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"文件大小超过限制 ({settings.MAX_FILE_SIZE / 1024 / 1024}MB)"
+            )
+        content_type = content_type or "application/octet-stream"
+        if not self._is_allowed_type(content_type):
+            raise HTTPException(status_code=415, detail="不支持的文件类型")
+        self.check_quota(submission_id, length, db)
+        
+        return await self.resumable_uploads.create(user_id, submission_id, file_name, content_type, length)
+    
+    async def append_resumable_upload(
+        self,
+        state: UploadState,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        checksum: Optional[Tuple[str, bytes]],
+        db: Session
+    ) -> Tuple[UploadState, Optional[FileUploadResponse]]:
+        """写入一个块；收到全部内容时存为普通的提交文件，并返回文件记录"""
+        state = await self.resumable_uploads.append(state, offset, chunks, checksum)
+        if state.offset < state.length:
+            return state, None
+        
+        spooled = await self.resumable_uploads.take(state, self.storage_backend.spool_dir)
+        try:
+            result = await self._store_submission_file(
+                spooled, state.file_name, state.content_type, state.submission_id, db
+            )
+        except Exception:
+            # 内容已随临时文件删除，无法再续传
+            await self.resumable_uploads.remove(state.id)
+            raise
+        await self.resumable_uploads.mark_completed(state, result.id)
+        return state, result
+    
+    async def _store_submission_file(
+        self,
+        spooled: SpooledUpload,
+        file_name: Optional[str],
+        content_type: Optional[str],
+        submission_id: str,
+        db: Session
+    ) -> FileUploadResponse:
+        """
+        把临时文件存为内容寻址的 blob，并在一个事务中写入文件记录和 blob 引用计数
+        相同内容已存在时不再写入存储，只增加引用
+        启用图片规范化时，照片先缩小并重新编码，原始内容存为冷存储 blob
+        """
+        if self.normalizer.wants(content_type, spooled.size):
+            normalized = await self.normalizer.normalize(spooled, self.storage_backend.spool_dir)
+            if normalized is not None:
+                return await self._store_normalized_file(
+                    spooled, normalized, file_name, submission_id, db
+                )
+        
+        try:
+            stored_path, created = await self.blob_store.acquire(spooled, content_type, db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            spooled.discard()
         
-        # 生成访问URL
-        file_url = await self.storage_backend.get_file_url(stored_path)
-        file_record.file_url = file_url
-        db.commit()
+        return await self._add_file_record(
+            stored_path, created, spooled.file_hash, spooled.size,
+            file_name, content_type, submission_id, db
+        )
+    
+    async def _store_normalized_file(
+        self,
+        original: SpooledUpload,
+        normalized: SpooledUpload,
+        file_name: Optional[str],
+        submission_id: str,
+        db: Session
+    ) -> FileUploadResponse:
+        """文件记录指向规范化后的内容，original_hash 引用冷存储中的原始内容，两个引用在同一个事务中提交"""
+        original_created = False
+        try:
+            original_path, original_created = await self.blob_store.acquire(
+                original, NORMALIZED_MEDIA_TYPE, db, cold=True
+            )
+            stored_path, created = await self.blob_store.acquire(normalized, NORMALIZED_MEDIA_TYPE, db)
+        except Exception:
+            db.rollback()
+            if original_created:
+                await self.blob_store.discard_if_unreferenced(original.file_hash, original_path, db)
+            raise
+        finally:
+            original.discard()
+            normalized.discard()
+        
+        return await self._add_file_record(
+            stored_path, created, normalized.file_hash, normalized.size,
+            file_name, NORMALIZED_MEDIA_TYPE, submission_id, db,
+            original=(original.file_hash, original_path, original_created)
+        )
+    
+    async def create_direct_upload(self, request: DirectUploadRequest, db: Session) -> DirectUploadResponse:
+        """
+        申请客户端直传：内容已存在时直接增加引用并创建文件记录，无需上传；
+        否则返回写入 blob 位置的预签名 PUT URL，客户端上传后调用 complete_direct_upload
+        """
+        checksum = self._validate_direct_upload(request)
+        self.check_quota(request.submission_id, request.file_size, db)
+        
+        try:
+            stored_path = self.blob_store.reference(request.file_hash, db)
+        except Exception:
+            db.rollback()
+            raise
+        if stored_path:
+            file = await self._add_file_record(
+                stored_path, False, request.file_hash, request.file_size,
+                request.file_name, request.content_type, request.submission_id, db
+            )
+            return DirectUploadResponse(upload_required=False, file=file)
+        
+        expires_in = settings.S3_PRESIGNED_URL_EXPIRES
+        upload_url, upload_headers = await self.storage_backend.get_upload_url(
+            self.storage_backend.get_blob_path(request.file_hash),
+            request.content_type,
+            checksum,
+            expires_in
+        )
+        return DirectUploadResponse(
+            upload_required=True,
+            upload_url=upload_url,
+            upload_headers=upload_headers,
+            expires_in=expires_in
+        )
+    
+    async def complete_direct_upload(self, request: DirectUploadRequest, db: Session) -> FileUploadResponse:
+        """确认直传完成：核对存储中对象的大小和校验和，然后写入 blob 引用和文件记录"""
+        checksum = self._validate_direct_upload(request)
+        
+        blob_path = self.storage_backend.get_blob_path(request.file_hash)
+        stat = await self.storage_backend.stat_object(blob_path)
+        if not stat:
+            raise HTTPException(status_code=400, detail="文件尚未上传")
+        
+        if stat["size"] != request.file_size:
+            matches = False
+        elif stat["checksum_sha256"] is not None:
+            matches = stat["checksum_sha256"] == checksum
+        else:
+            # 不保存校验和的 S3 兼容存储：读取对象重新计算
+            matches = await self._hash_stored_object(blob_path) == checksum
+        if not matches:
+            await self.blob_store.discard_if_unreferenced(request.file_hash, blob_path, db)
+            raise HTTPException(status_code=400, detail="上传内容与声明的大小或哈希不一致")
+        
+        try:
+            stored_path, created = self.blob_store.acquire_stored(request.file_hash, stat["size"], db)
+        except Exception:
+            db.rollback()
+            raise
+        return await self._add_file_record(
+            stored_path, created, request.file_hash, stat["size"],
+            request.file_name, request.content_type, request.submission_id, db
+        )
+    
+    async def _hash_stored_object(self, file_path: str) -> str:
+        hasher = hashlib.sha256()
+        async for chunk in self.storage_backend.iter_file(file_path, chunk_size=settings.UPLOAD_CHUNK_SIZE):
+            await asyncio.to_thread(hasher.update, chunk)
+        return base64.b64encode(hasher.digest()).decode()
+    
+    def _validate_direct_upload(self, request: DirectUploadRequest) -> str:
+        """检查直传请求，返回 S3 使用的 base64 编码 SHA-256 校验和"""
+        if not self.storage_backend.supports_direct_upload:
+            raise HTTPException(status_code=400, detail="当前存储后端不支持直传")
+        if request.file_size > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"文件大小超过限制 ({settings.MAX_FILE_SIZE / 1024 / 1024}MB)"
+            )
+        if not self._is_allowed_type(request.content_type):
+            raise HTTPException(status_code=415, detail="不支持的文件类型")
+        
+        # 只接受 SHA-256：S3 在写入时校验它，客户端无法把错误的内容写到别的哈希下
+        algorithm, _, digest = request.file_hash.partition(":")
+        try:
+            if algorithm != "sha256" or len(digest) != 64:
+                raise ValueError
+            return base64.b64encode(bytes.fromhex(digest)).decode()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="file_hash 必须为 sha256:<64位十六进制>")
+    
+    async def _add_file_record(
+        self,
+        stored_path: str,
+        created: bool,
+        file_hash: str,
+        file_size: int,
+        file_name: Optional[str],
+        content_type: Optional[str],
+        submission_id: str,
+        db: Session,
+        original: Optional[Tuple[str, str, bool]] = None
+    ) -> FileUploadResponse:
+        """
+        写入文件记录，并与已变更的 blob 引用计数、课程和用户的用量计数一起提交；需要预览的内容提交后进入生成队列
+        提交前在锁定的计数行上再检查一次配额，并发上传合计超出配额时回滚（413）
+        original 为规范化之前的原始内容 (哈希, 存储路径, 是否新写入)
+        """
+        wants_preview = self.previews.wants_preview(content_type, file_size)
+        try:
+            file_url = await self.storage_backend.get_file_url(stored_path)
+            file_record = SubmissionFile(
+                submission_id=submission_id,
+                file_name=file_name,
+                file_path=stored_path,
+                file_url=file_url,
+                file_size=file_size,
+                mime_type=content_type,
+                file_hash=file_hash,
+                original_hash=original[0] if original else None,
+                uploaded_at=datetime.utcnow()
+            )
+            db.add(file_record)
+            course_id, user_id = submission_owner(submission_id, db)
+            record_usage(course_id, user_id, 1, file_size, db, enforce=True)
+            if wants_preview:
+                self.previews.mark_pending(file_hash, db)
+            db.commit()
+            db.refresh(file_record)
+        except Exception:
+            # 记录写入失败时删除本次新写入且没有其他引用的 blob，避免产生孤立文件
+            db.rollback()
+            if created:
+                await self.blob_store.discard_if_unreferenced(file_hash, stored_path, db)
+            if original and original[2]:
+                await self.blob_store.discard_if_unreferenced(original[0], original[1], db)
+            raise
+        
+        if wants_preview:
+            self.previews.enqueue(file_hash, content_type)
         
         return FileUploadResponse(
             id=file_record.id,
-            file_name=file.filename,
+            file_name=file_name,
             file_url=file_url,
             file_size=file_record.file_size,
             mime_type=file_record.mime_type,
@@ -260,17 +1085,98 @@ class FileService:
         """下载文件"""
         return await self.storage_backend.download_file(file_path)
     
+    def get_file_record(self, file_id: str, db: Session) -> Optional[SubmissionFile]:
+        """获取文件记录"""
+        return db.query(SubmissionFile).filter(SubmissionFile.id == file_id).first()
+    
     async def delete_file(self, file_path: str, db: Session, file_id: str) -> bool:
-        """删除文件"""
-        # 从存储后端删除文件
-        success = await self.storage_backend.delete_file(file_path)
+        """
+        删除文件记录并释放其 blob 引用（规范化文件同时释放原件），最后一个引用删除时才处理存储内容
+        先提交再移动内容：提交失败时内容保持不变；提交后内容移入隔离区，隔离期满由垃圾回收删除，
+        移动期间有上传重新引用了相同内容时立即移回
+        """
+        file_record = self.get_file_record(file_id, db)
+        if not file_record:
+            return False
         
-        if success:
-            # 从数据库删除记录
-            db.query(SubmissionFile).filter(SubmissionFile.id == file_id).delete()
+        file_hash = file_record.file_hash
+        preview_pages = file_record.blob.preview_pages if file_record.blob else None
+        try:
+            if file_hash:
+                blob_path = self.blob_store.release(file_hash, db)
+            else:
+                # 没有内容哈希的记录不属于任何 blob，直接删除其文件
+                blob_path = file_record.file_path
+            
+            original_path = None
+            if file_record.original_hash:
+                original_path = self.blob_store.release(file_record.original_hash, db)
+            
+            course_id, user_id = submission_owner(file_record.submission_id, db)
+            record_usage(course_id, user_id, -1, -file_record.file_size, db)
+            db.delete(file_record)
             db.commit()
+        except Exception:
+            db.rollback()
+            raise
         
-        return success
+        # 打包在分段中的内容由分层任务随分段一起删除或重新打包
+        released = [
+            path for path in (blob_path, original_path)
+            if path and parse_packed_path(path) is None
+        ]
+        try:
+            quarantined, _ = await self.garbage_collector.quarantine(released, db)
+        except Exception as e:
+            # 记录已经删除，留在存储中的内容由垃圾回收处理
+            logger.error(f"文件 {file_id} 的存储内容移入隔离区失败: {e}")
+        else:
+            for path in set(released) - set(quarantined):
+                logger.warning(f"文件 {file_id} 的存储内容不存在或无法移动: {path}")
+        
+        if blob_path and file_hash and preview_pages:
+            await self.previews.delete(file_hash, preview_pages)
+        return True
+    
+    def get_preview_path(
+        self,
+        file_record: SubmissionFile,
+        variant: str,
+        page: int
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        文件某一页的预览图，返回 (预览状态, 存储路径)
+        预览未生成完成或该页不存在时路径为 None
+        """
+        blob = file_record.blob
+        if blob is None or blob.preview_status is None:
+            return None, None
+        if blob.preview_status != PREVIEW_READY:
+            return blob.preview_status, None
+        if page > (blob.preview_pages or 0):
+            return blob.preview_status, None
+        return blob.preview_status, self.storage_backend.get_preview_path(
+            blob.file_hash, preview_name(variant, page)
+        )
+    
+    def iter_content(
+        self,
+        storage_path: str,
+        encoding: Optional[str],
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        按块产生 blob 原始内容的闭区间 [start, end]
+        压缩存储的内容从头流式解压，区间之前的部分解压后丢弃
+        """
+        if not encoding:
+            return self.storage_backend.iter_file(storage_path, start, end, chunk_size=chunk_size)
+        return decode_stream(
+            self.storage_backend.iter_file(storage_path, chunk_size=chunk_size or settings.UPLOAD_CHUNK_SIZE),
+            encoding, start, end
+        )
     
     async def get_file_metadata(self, file_id: str, db: Session) -> Optional[FileMetadata]:
         """获取文件元数据"""
@@ -287,6 +1193,120 @@ class FileService:
             file_hash=file_record.file_hash
         )
     
+    async def build_assignment_archive(
+        self,
+        assignment_id: int,
+        db: Session,
+        status: Optional[str] = None,
+        student_ids: Optional[List[int]] = None,
+        compression: str = "auto"
+    ) -> Tuple[ZipStream, str]:
+        """
+        构造作业所有提交文件的流式 ZIP，返回 (ZipStream, 归档内容标识)
+        status 为 graded / ungraded 时按是否已评分过滤；compression 为 store 时全部不压缩，
+        归档大小可以预先确定，支持按范围续传；auto 时只压缩文本类文件
+        内容标识由条目名称和内容哈希计算，文件集合不变时保持不变，用作 ETag
+        """
+        query = db.query(SubmissionFile, Submission.student_id, FileBlob.crc32, FileBlob.encoding).join(
+            Submission, SubmissionFile.submission_id == Submission.id
+        ).outerjoin(
+            FileBlob, SubmissionFile.file_hash == FileBlob.file_hash
+        ).filter(Submission.assignment_id == assignment_id)
+        if status == "graded":
+            query = query.filter(Submission.graded_by.isnot(None))
+        elif status == "ungraded":
+            query = query.filter(Submission.graded_by.is_(None))
+        if student_ids:
+            query = query.filter(Submission.student_id.in_(student_ids))
+        rows = query.order_by(
+            Submission.student_id, Submission.id, SubmissionFile.uploaded_at, SubmissionFile.id
+        ).all()
+        
+        entries = []
+        encodings = {}
+        used_names = set()
+        identity = hashlib.sha256(compression.encode())
+        for file_record, student_id, crc32, encoding in rows:
+            name = self._archive_entry_name(file_record, student_id, used_names)
+            compress = compression != "store" and not is_precompressed(file_record.mime_type)
+            if crc32 is None and not compress:
+                crc32 = await self._ensure_crc32(file_record, encoding, db)
+            if encoding:
+                encodings[file_record.file_path] = encoding
+            entries.append(ZipEntry(
+                name=name,
+                storage_path=file_record.file_path,
+                size=file_record.file_size,
+                modified_at=file_record.uploaded_at,
+                crc32=crc32,
+                compress=compress
+            ))
+            identity.update(f"{name}\0{file_record.file_hash}\n".encode())
+        
+        def read(storage_path: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+            return self.iter_content(storage_path, encodings.get(storage_path), start, end)
+        
+        return ZipStream(entries, read), f"zip:{identity.hexdigest()}"
+    
+    @staticmethod
+    def _archive_entry_name(file_record: SubmissionFile, student_id: Optional[int], used_names: set) -> str:
+        """归档内路径 student_<id>/submission_<id>/<文件名>，去掉文件名中的路径部分并处理重名"""
+        base_name = PurePosixPath((file_record.file_name or file_record.id).replace("\\", "/")).name
+        if base_name in ("", ".", ".."):
+            base_name = file_record.id
+        folder = f"student_{student_id}/submission_{file_record.submission_id}"
+        name = f"{folder}/{base_name}"
+        
+        stem, suffix = PurePosixPath(base_name).stem, PurePosixPath(base_name).suffix
+        counter = 2
+        while name in used_names:
+            name = f"{folder}/{stem} ({counter}){suffix}"
+            counter += 1
+        used_names.add(name)
+        return name
+    
+    async def import_assignment_archive(
+        self,
+        chunks: AsyncIterator[bytes],
+        assignment_id: int,
+        db: Session
+    ) -> AsyncIterator[bytes]:
+        """
+        批量导入线下收集的提交：归档先完整写入临时文件（ZIP 的中央目录在末尾），
+        确定每个条目对应的学生后返回 NDJSON 进度流，条目在读取进度流时逐个解压导入
+        """
+        from app.models.assignment import Assignment
+        if not db.query(Assignment.id).filter(Assignment.id == assignment_id).first():
+            raise HTTPException(status_code=404, detail="作业不存在")
+        
+        spooled = await spool_stream(
+            chunks, self.storage_backend.spool_dir, max_size=settings.BULK_IMPORT_MAX_ARCHIVE_SIZE
+        )
+        try:
+            if not await asyncio.to_thread(zipfile.is_zipfile, spooled.path):
+                raise HTTPException(status_code=400, detail="上传的内容不是 ZIP 归档")
+            importer = BulkImporter(self, spooled.path, assignment_id)
+            items = importer.plan(db)
+        except Exception:
+            spooled.discard()
+            raise
+        return stream_import(importer, items)
+    
+    async def _ensure_crc32(self, file_record: SubmissionFile, encoding: Optional[str], db: Session) -> int:
+        """补算并保存内容的 CRC-32（直传或旧记录没有在上传时计算）"""
+        crc = 0
+        async for chunk in self.iter_content(
+            file_record.file_path, encoding, chunk_size=settings.UPLOAD_CHUNK_SIZE
+        ):
+            crc = await asyncio.to_thread(zlib.crc32, chunk, crc)
+        
+        if file_record.file_hash:
+            db.query(FileBlob).filter(FileBlob.file_hash == file_record.file_hash).update(
+                {FileBlob.crc32: crc}, synchronize_session=False
+            )
+            db.commit()
+        return crc
+    
     async def get_submission_files(self, submission_id: str, db: Session) -> List[FileMetadata]:
         """获取作业的所有文件"""
         file_records = db.query(SubmissionFile).filter(
@@ -305,27 +1325,130 @@ class FileService:
             for file_record in file_records
         ]
     
+    def get_normalization_stats(self, db: Session) -> Dict[str, Any]:
+        """图片规范化：已规范化文件节省的空间（全部记录）和本进程的编码吞吐量"""
+        file_count, original_bytes, normalized_bytes = db.query(
+            func.count(SubmissionFile.id),
+            func.coalesce(func.sum(FileBlob.size), 0),
+            func.coalesce(func.sum(SubmissionFile.file_size), 0)
+        ).join(FileBlob, SubmissionFile.original_hash == FileBlob.file_hash).one()
+        return {
+            "normalized_file_count": file_count,
+            "original_bytes": int(original_bytes),
+            "normalized_bytes": int(normalized_bytes),
+            "hot_bytes_saved": int(original_bytes) - int(normalized_bytes),
+            "process": self.normalizer.stats()
+        }
+    
+    def get_compression_stats(self, db: Session) -> Dict[str, Any]:
+        """透明压缩：按文件类型统计压缩存储的 blob 的原始大小、存储大小和压缩率"""
+        # 同一 blob 被多个文件引用时只计一次
+        blobs = db.query(
+            FileBlob.file_hash,
+            func.coalesce(SubmissionFile.mime_type, "application/octet-stream").label("mime_type"),
+            FileBlob.size,
+            FileBlob.stored_size
+        ).join(
+            SubmissionFile, SubmissionFile.file_hash == FileBlob.file_hash
+        ).filter(FileBlob.encoding.isnot(None)).distinct().subquery()
+        rows = db.query(
+            blobs.c.mime_type,
+            func.count(blobs.c.file_hash),
+            func.coalesce(func.sum(blobs.c.size), 0),
+            func.coalesce(func.sum(blobs.c.stored_size), 0)
+        ).group_by(blobs.c.mime_type).all()
+        
+        by_type = {}
+        for mime_type, type_blob_count, type_raw_bytes, type_stored_bytes in rows:
+            by_type[mime_type] = {
+                "blob_count": type_blob_count,
+                "raw_bytes": int(type_raw_bytes),
+                "stored_bytes": int(type_stored_bytes),
+                "ratio": round(int(type_raw_bytes) / int(type_stored_bytes), 2) if type_stored_bytes else None
+            }
+        
+        blob_count, raw_bytes, stored_bytes = db.query(
+            func.count(FileBlob.file_hash),
+            func.coalesce(func.sum(FileBlob.size), 0),
+            func.coalesce(func.sum(FileBlob.stored_size), 0)
+        ).filter(FileBlob.encoding.isnot(None)).one()
+        return {
+            "enabled": settings.STORAGE_COMPRESSION_ENABLED,
+            "encoding": default_encoding(),
+            "compressed_blob_count": blob_count,
+            "raw_bytes": int(raw_bytes),
+            "stored_bytes": int(stored_bytes),
+            "saved_bytes": int(raw_bytes) - int(stored_bytes),
+            "ratio": round(int(raw_bytes) / int(stored_bytes), 2) if stored_bytes else None,
+            "by_type": by_type
+        }
+    
+    def get_tier_usage(self, db: Session) -> Dict[str, Any]:
+        """各存储层级的用量，读取增量维护的计数，不扫描 file_blobs"""
+        return get_tier_usage(db)
+    
+    async def run_tiering(self) -> Dict[str, Any]:
+        """立即把已结束课程的文件打包进冷存储（与定时任务互斥）"""
+        return await self.tiering.run()
+    
+    async def collect_garbage(self, max_files: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """立即从游标处继续回收没有记录引用的存储文件（与定时任务互斥）"""
+        return await self.garbage_collector.run(max_files, dry_run)
+    
+    def check_quota(self, submission_id, size: int, db: Session):
+        """向提交再写入 size 字节会超过其课程或学生的存储配额时抛出 413（只按主键读取计数）"""
+        course_id, user_id = submission_owner(submission_id, db)
+        check_quota(course_id, user_id, size, db)
+    
+    def get_storage_usage(self, scope: str, scope_id: int, db: Session) -> Dict[str, Any]:
+        """课程或用户的用量和配额，读取增量维护的计数"""
+        return get_usage(scope, scope_id, db)
+    
+    def set_storage_quota(
+        self,
+        scope: str,
+        scope_id: int,
+        quota_bytes: Optional[int],
+        db: Session
+    ) -> Dict[str, Any]:
+        return set_quota(scope, scope_id, quota_bytes, db)
+    
+    def get_usage_summary(self, db: Session) -> Dict[str, Any]:
+        return get_usage_summary(db)
+    
+    async def reconcile_usage(self) -> Dict[str, Any]:
+        """立即按文件记录校正课程和用户的用量计数（与定时任务互斥）"""
+        return await self.usage_reconciler.run()
+    
+    def get_dedup_stats(self, db: Session) -> Dict[str, Any]:
+        """去重效果：文件记录的总大小与实际存储的 blob 总大小（压缩的 blob 按压缩后的大小计算）"""
+        file_count, logical_bytes = db.query(
+            func.count(SubmissionFile.id), func.coalesce(func.sum(SubmissionFile.file_size), 0)
+        ).one()
+        blob_count, stored_bytes = db.query(
+            func.count(FileBlob.file_hash),
+            func.coalesce(func.sum(func.coalesce(FileBlob.stored_size, FileBlob.size)), 0)
+        ).one()
+        return {
+            "file_count": file_count,
+            "blob_count": blob_count,
+            "logical_bytes": int(logical_bytes),
+            "stored_bytes": int(stored_bytes),
+            "saved_bytes": int(logical_bytes) - int(stored_bytes)
+        }
+    
     def _is_allowed_type(self, content_type: str) -> bool:
         """检查是否为允许的文件类型"""
         allowed_types = settings.ALLOWED_FILE_TYPES
         return content_type in allowed_types
-    
-    async def _calculate_file_hash(self, file: UploadFile) -> str:
-        """计算文件哈希值"""
-        await file.seek(0)
-        content = await file.read()
-        file_hash = hashlib.md5(content).hexdigest()
-        await file.seek(0)  # 重置文件指针
-        return file_hash
 
 
-# 创建文件服务实例
-def get_file_service() -> FileService:
-    """根据配置创建文件服务实例"""
+def create_storage_backend() -> FileStorageBackend:
+    """根据配置创建存储后端"""
     storage_type = settings.STORAGE_TYPE.lower()
     
     if storage_type == "s3":
-        backend = S3FileStorage(
+        return S3FileStorage(
             bucket_name=settings.S3_BUCKET_NAME,
             region=settings.AWS_REGION
         )
@@ -333,6 +1456,40 @@ def get_file_service() -> FileService:
         # 阿里云OSS实现（需要安装 aliyun-python-sdk-oss2）
         raise NotImplementedError("阿里云OSS存储尚未实现")
     else:  # local
-        backend = LocalFileStorage(settings.UPLOAD_DIR)
-    
-    return FileService(backend)
\ No newline at end of file
+        return LocalFileStorage(settings.UPLOAD_DIR)
+
+
+# 进程内唯一的文件服务实例，存储后端（以及 S3 客户端的连接池）在所有请求间复用
+_file_service: Optional[FileService] = None
+
+
+def get_file_service() -> FileService:
+    """获取文件服务实例（FastAPI 依赖），未经启动流程时（脚本）首次调用时创建"""
+    global _file_service
+    if _file_service is None:
+        _file_service = FileService(create_storage_backend())
+    return _file_service
+
+
+async def start_file_service():
+    """应用启动时创建并预热存储后端，清理过期的续传上传，启动预览图生成、分层、垃圾回收和用量校正任务"""
+    file_service = get_file_service()
+    await file_service.storage_backend.start()
+    await file_service.resumable_uploads.purge_expired()
+    await file_service.previews.start()
+    await file_service.tiering.start()
+    await file_service.garbage_collector.start()
+    await file_service.usage_reconciler.start()
+
+
+async def stop_file_service():
+    """应用关闭时停止后台任务并释放存储后端的连接"""
+    global _file_service
+    if _file_service is not None:
+        await _file_service.usage_reconciler.stop()
+        await _file_service.garbage_collector.stop()
+        await _file_service.tiering.stop()
+        await _file_service.previews.stop()
+        _file_service.normalizer.stop()
+        await _file_service.storage_backend.close()
+        _file_service = None
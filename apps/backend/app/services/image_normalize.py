@@ -0,0 +1,105 @@
+"""
+上传图片的规范化
+手机拍摄的作业照片（8–12MB）在保存前按 EXIF 方向旋转、缩小到配置的最大分辨率并重新编码，
+原始内容作为冷存储 blob 保留；编码在进程池中执行，不占用事件循环和 GIL
+"""
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.services.preview_render import can_normalize, normalize_image
+from app.services.upload_stream import SpooledUpload, hash_file
+
+NORMALIZED_MEDIA_TYPE = "image/jpeg"
+
+
+class ImageNormalizer:
+    """规范化上传的照片，并统计本进程的处理量和节省的空间"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = max(1, workers or settings.IMAGE_NORMALIZE_WORKERS)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._files = 0
+        self._skipped = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._seconds = 0.0
+
+    def wants(self, content_type: Optional[str], size: int) -> bool:
+        return (
+            settings.IMAGE_NORMALIZE_ENABLED
+            and size >= settings.IMAGE_NORMALIZE_MIN_SIZE
+            and can_normalize(content_type)
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn 启动的子进程不继承事件循环和数据库连接
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def normalize(self, spooled: SpooledUpload, spool_dir: str) -> Optional[SpooledUpload]:
+        """
+        返回规范化后的临时文件；图片无法解码或结果不比原图小时返回 None，按原样保存
+        原始临时文件不变，由调用方处理
+        """
+        fd, target = await asyncio.to_thread(tempfile.mkstemp, dir=spool_dir, suffix=".part")
+        os.close(fd)
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self._get_executor(),
+                normalize_image,
+                spooled.path,
+                target,
+                settings.IMAGE_NORMALIZE_MAX_DIMENSION,
+                settings.IMAGE_NORMALIZE_QUALITY
+            )
+            size = (await asyncio.to_thread(os.stat, target)).st_size
+            if size >= spooled.size:
+                self._skipped += 1
+                await asyncio.to_thread(Path(target).unlink, True)
+                return None
+            file_hash, crc = await asyncio.to_thread(hash_file, target)
+        except Exception as e:
+            logger.warning(f"图片规范化失败，按原样保存: {e}")
+            self._skipped += 1
+            await asyncio.to_thread(Path(target).unlink, True)
+            return None
+
+        self._files += 1
+        self._bytes_in += spooled.size
+        self._bytes_out += size
+        self._seconds += time.perf_counter() - started
+        return SpooledUpload(path=target, size=size, file_hash=file_hash, crc32=crc)
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程启动以来的处理量和编码吞吐量"""
+        seconds = self._seconds or None
+        return {
+            "enabled": settings.IMAGE_NORMALIZE_ENABLED,
+            "normalized_files": self._files,
+            "skipped_files": self._skipped,
+            "input_bytes": self._bytes_in,
+            "output_bytes": self._bytes_out,
+            "saved_bytes": self._bytes_in - self._bytes_out,
+            "files_per_second": round(self._files / seconds, 2) if seconds else None,
+            "input_mb_per_second": round(self._bytes_in / 1024 / 1024 / seconds, 2) if seconds else None
+        }
@@ -0,0 +1,114 @@
+"""
+通知服务
+通知先写入用户收件箱（同一事务内更新未读计数），用户在线时再通过 WebSocket 实时推送
+"""
+
+import base64
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.logging import logger
+from app.core.websocket_manager import websocket_manager
+from app.models.orm.notification import Notification
+from app.models.schemas.notification import NotificationPage, NotificationResponse
+from app.repositories.notification_repository import NotificationRepository
+
+
+def encode_cursor(notification: Notification) -> str:
+    """把分页位置 (created_at, id) 编码为不透明游标"""
+    raw = f"{notification.created_at.isoformat()}|{notification.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解码游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, notification_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("无效的分页游标") from e
+
+
+class NotificationService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def notify(
+        self,
+        user_id: int,
+        type: str,
+        title: str,
+        body: Optional[str] = None,
+        data: Optional[Dict[str, Any]] = None
+    ) -> Notification:
+        """
+        发送通知
+        始终写入收件箱，离线用户下次打开时可以看到；在线用户（任意 worker）同时收到实时推送
+        """
+        notification = NotificationRepository.create(self.db, user_id, type, title, body, data)
+        unread_count = NotificationRepository.get_unread_count(self.db, user_id)
+
+        try:
+            await websocket_manager.send_personal_message(
+                {
+                    "type": "notification",
+                    "notification": NotificationResponse.model_validate(notification).model_dump(mode="json"),
+                    "unread_count": unread_count,
+                    "timestamp": datetime.utcnow().isoformat()
+                },
+                user_id
+            )
+        except Exception as e:
+            # 推送失败不影响收件箱，客户端重连后按游标拉取
+            logger.error(f"推送通知给用户 {user_id} 失败: {e}")
+
+        return notification
+
+    async def get_inbox(
+        self,
+        user_id: int,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        unread_only: bool = False
+    ) -> NotificationPage:
+        """按游标分页获取收件箱（最新的在前）"""
+        before = decode_cursor(cursor) if cursor else None
+        rows = NotificationRepository.get_page(self.db, user_id, limit + 1, before, unread_only)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return NotificationPage(
+            items=[NotificationResponse.model_validate(row) for row in rows],
+            next_cursor=encode_cursor(rows[-1]) if has_more else None,
+            unread_count=NotificationRepository.get_unread_count(self.db, user_id)
+        )
+
+    async def get_unread_count(self, user_id: int) -> int:
+        """获取未读数（读取计数行，不扫描通知表）"""
+        return NotificationRepository.get_unread_count(self.db, user_id)
+
+    async def mark_read(self, user_id: int, ids: Optional[Iterable[int]] = None) -> Tuple[int, int]:
+        """
+        批量标记已读，ids 为 None 时标记全部
+        返回 (实际更新条数, 最新未读数)，并把最新未读数同步给用户的其他在线客户端
+        """
+        updated = NotificationRepository.mark_read(self.db, user_id, ids)
+        unread_count = NotificationRepository.get_unread_count(self.db, user_id)
+
+        if updated:
+            try:
+                await websocket_manager.send_personal_message(
+                    {
+                        "type": "notification_unread_count",
+                        "unread_count": unread_count,
+                        "timestamp": datetime.utcnow().isoformat()
+                    },
+                    user_id
+                )
+            except Exception as e:
+                logger.error(f"同步未读数给用户 {user_id} 失败: {e}")
+
+        return updated, unread_count
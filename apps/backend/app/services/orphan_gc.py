@@ -0,0 +1,300 @@
+"""
+存储的垃圾回收
+上传在写入存储之后、提交记录之前失败，或删除时进程中途退出，会在存储中留下没有任何记录引用的文件；
+回收任务按存储路径的字典序分批遍历存储，每批按块与数据库做差集，找出的孤立文件先移入隔离区，
+隔离期满且仍未被引用时才删除；遍历位置保存在游标中，每次运行处理一部分，下次从该处继续
+反方向（blob 记录存在而存储内容丢失）只检查并报告：隔离区中有副本时自动恢复，否则记入日志
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.submission import FileBlob, StorageSegment, SubmissionFile
+from app.services.blob_codec import ENCODING_SUFFIXES
+from app.services.storage_tiering import parse_packed_path
+
+# 报告中最多列出的存储内容丢失的 blob 数量
+MISSING_SAMPLE_SIZE = 20
+
+
+@dataclass
+class CollectorState:
+    """跨运行保存的遍历位置"""
+    scan_cursor: Optional[str] = None  # 上次检查到的存储路径，None 表示从头开始
+    row_cursor: Optional[str] = None  # 上次检查到的 blob 哈希
+    completed_passes: int = 0  # 完整遍历存储的次数
+    updated_at: Optional[float] = None
+
+
+@dataclass
+class CollectorReport:
+    scanned_files: int = 0
+    orphaned_files: int = 0
+    quarantined_files: int = 0
+    restored_files: int = 0
+    purged_files: int = 0
+    checked_blobs: int = 0
+    missing_blobs: List[str] = field(default_factory=list)
+    completed_pass: bool = False
+    dry_run: bool = False
+
+
+def _open_session() -> Session:
+    # 后台任务不属于任何请求，使用独立的会话
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def _strip_encoding_suffix(name: str) -> str:
+    for suffix in ENCODING_SUFFIXES.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class OrphanCollector:
+    """随应用生命周期启动和停止的回收任务，每 GC_INTERVAL 秒运行一次，也可以手动触发"""
+
+    def __init__(self, storage_backend, state_path: Optional[str] = None):
+        self.storage_backend = storage_backend
+        self.state_path = Path(state_path or os.path.join(settings.UPLOAD_DIR, ".gc-state.json"))
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        if self._task is None and settings.GC_ENABLED:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(settings.GC_INTERVAL)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"存储垃圾回收出错: {e}")
+
+    def _load(self) -> CollectorState:
+        try:
+            return CollectorState(**json.loads(self.state_path.read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return CollectorState()
+
+    def _save(self, state: CollectorState):
+        # 先写临时文件再重命名，进程中途退出时不会留下半个状态文件
+        state.updated_at = time.time()
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.state_path.with_suffix(".json.tmp")
+        temp_path.write_text(json.dumps(asdict(state)))
+        os.replace(temp_path, self.state_path)
+
+    async def run(self, max_files: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        从游标处继续检查至多 max_files 个存储文件和同样数量的 blob 记录，并删除隔离期满的文件
+        dry_run 时只统计孤立文件，不移动文件也不推进游标
+        """
+        limit = max_files or settings.GC_FILES_PER_RUN
+        report = CollectorReport(dry_run=dry_run)
+        async with self._lock:
+            state = await asyncio.to_thread(self._load)
+            db = _open_session()
+            try:
+                await self._scan_storage(state, limit, report, db, dry_run)
+                await self._check_blobs(state, limit, report, db, dry_run)
+                if not dry_run:
+                    await self._purge_quarantine(report, db)
+            finally:
+                db.close()
+
+        result = asdict(report)
+        result["state"] = asdict(state)
+        if report.quarantined_files or report.purged_files or report.missing_blobs:
+            logger.info(
+                f"存储垃圾回收: 检查 {report.scanned_files} 个文件，隔离 {report.quarantined_files} 个，"
+                f"删除 {report.purged_files} 个，内容丢失的 blob {len(report.missing_blobs)} 个"
+            )
+        return result
+
+    async def _scan_storage(
+        self,
+        state: CollectorState,
+        limit: int,
+        report: CollectorReport,
+        db: Session,
+        dry_run: bool
+    ):
+        """按游标分批遍历存储，孤立文件移入隔离区"""
+        cursor = state.scan_cursor
+        while report.scanned_files < limit:
+            batch = await self.storage_backend.list_files(
+                cursor, min(settings.GC_SCAN_BATCH_SIZE, limit - report.scanned_files)
+            )
+            if not batch:
+                cursor = None
+                report.completed_pass = True
+                break
+            report.scanned_files += len(batch)
+            cursor = batch[-1][0]
+
+            # 新写入的文件可能属于尚未提交记录的上传
+            now = time.time()
+            candidates = [path for path, mtime in batch if now - mtime >= settings.GC_MIN_AGE]
+            referenced = self._referenced(candidates, db)
+            orphans = [path for path in candidates if path not in referenced]
+            report.orphaned_files += len(orphans)
+            if dry_run:
+                continue
+
+            quarantined, restored = await self.quarantine(orphans, db)
+            report.quarantined_files += len(quarantined) - len(restored)
+            report.restored_files += len(restored)
+
+            state.scan_cursor = cursor
+            await asyncio.to_thread(self._save, state)
+
+        if not dry_run:
+            if report.completed_pass:
+                state.scan_cursor = None
+                state.completed_passes += 1
+            await asyncio.to_thread(self._save, state)
+
+    async def quarantine(self, paths: List[str], db: Session) -> Tuple[List[str], List[str]]:
+        """
+        把不再被引用的文件移入隔离区，隔离期满后由回收任务删除；返回 (移入的路径, 又移回的路径)
+        检查与移动之间可能有上传重新引用了相同内容，移动之后再检查一次，被引用的立即移回
+        """
+        quarantined = [path for path in paths if await self.storage_backend.quarantine_file(path)]
+        restored = [
+            path for path in self._referenced(quarantined, db)
+            if await self.storage_backend.restore_file(path)
+        ]
+        return quarantined, restored
+
+    def _referenced(self, paths: List[str], db: Session) -> Set[str]:
+        """
+        paths 中被数据库记录引用的存储路径；每个查询只带 GC_DB_CHUNK_SIZE 个参数，单独提交，不长时间占用事务
+        blob、预览图和分段按路径中的哈希或 ID 走主键查询，其余（旧版按路径存储的文件）按 file_path 查询
+        """
+        blobs: Dict[str, List[str]] = {}
+        previews: Dict[str, List[str]] = {}
+        segments: Dict[str, List[str]] = {}
+        legacy: List[str] = []
+        for path in paths:
+            parts = self.storage_backend.storage_key(path).split("/")
+            if parts[0] in ("blobs", "cold") and len(parts) == 5:
+                blobs.setdefault(f"{parts[1]}:{_strip_encoding_suffix(parts[4])}", []).append(path)
+            elif parts[0] == "previews" and len(parts) == 6:
+                previews.setdefault(f"{parts[1]}:{parts[4]}", []).append(path)
+            elif parts[0] == "segments" and len(parts) == 3 and parts[2].endswith(".seg"):
+                segments.setdefault(parts[2][:-len(".seg")], []).append(path)
+            else:
+                legacy.append(path)
+
+        referenced = set()
+        try:
+            for chunk in _chunks(list(blobs), settings.GC_DB_CHUNK_SIZE):
+                for (storage_path,) in db.query(FileBlob.storage_path).filter(FileBlob.file_hash.in_(chunk)):
+                    referenced.add(storage_path)
+                db.commit()
+            for chunk in _chunks(list(previews), settings.GC_DB_CHUNK_SIZE):
+                for (file_hash,) in db.query(FileBlob.file_hash).filter(FileBlob.file_hash.in_(chunk)):
+                    referenced.update(previews[file_hash])
+                db.commit()
+            for chunk in _chunks(list(segments), settings.GC_DB_CHUNK_SIZE):
+                for (storage_path,) in db.query(StorageSegment.storage_path).filter(StorageSegment.id.in_(chunk)):
+                    referenced.add(storage_path)
+                db.commit()
+            for chunk in _chunks(legacy, settings.GC_DB_CHUNK_SIZE):
+                for (file_path,) in db.query(SubmissionFile.file_path).filter(SubmissionFile.file_path.in_(chunk)):
+                    referenced.add(file_path)
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return referenced
+
+    async def _check_blobs(
+        self,
+        state: CollectorState,
+        limit: int,
+        report: CollectorReport,
+        db: Session,
+        dry_run: bool
+    ):
+        """按哈希顺序分批检查 blob 记录的存储内容是否存在，隔离区中有副本时移回"""
+        cursor = state.row_cursor
+        while report.checked_blobs < limit:
+            query = db.query(FileBlob.file_hash, FileBlob.storage_path).order_by(FileBlob.file_hash)
+            if cursor:
+                query = query.filter(FileBlob.file_hash > cursor)
+            rows = query.limit(min(settings.GC_SCAN_BATCH_SIZE, limit - report.checked_blobs)).all()
+            db.commit()
+            if not rows:
+                cursor = None
+                break
+            report.checked_blobs += len(rows)
+            cursor = rows[-1][0]
+
+            for file_hash, storage_path in rows:
+                if await self.storage_backend.file_exists(storage_path):
+                    continue
+                # 打包在分段中的 blob 恢复整个分段
+                packed = parse_packed_path(storage_path)
+                restore_path = packed[0] if packed else storage_path
+                if not dry_run and await self.storage_backend.restore_file(restore_path):
+                    report.restored_files += 1
+                    continue
+                logger.warning(f"blob 的存储内容不存在: {file_hash} ({storage_path})")
+                if len(report.missing_blobs) < MISSING_SAMPLE_SIZE:
+                    report.missing_blobs.append(file_hash)
+
+        if not dry_run:
+            state.row_cursor = cursor
+            await asyncio.to_thread(self._save, state)
+
+    async def _purge_quarantine(self, report: CollectorReport, db: Session):
+        """删除隔离期满的文件；期间重新被引用的文件移回原位置"""
+        cursor = None
+        while True:
+            batch = await self.storage_backend.list_files(cursor, settings.GC_SCAN_BATCH_SIZE, quarantined=True)
+            if not batch:
+                break
+            cursor = batch[-1][0]
+
+            now = time.time()
+            expired = {
+                self.storage_backend.get_quarantine_source(path): path
+                for path, mtime in batch
+                if now - mtime >= settings.GC_QUARANTINE_PERIOD
+            }
+            referenced = self._referenced(list(expired), db)
+            for source, path in expired.items():
+                if source in referenced:
+                    if await self.storage_backend.restore_file(source):
+                        report.restored_files += 1
+                elif await self.storage_backend.delete_file(path):
+                    report.purged_files += 1
@@ -0,0 +1,214 @@
+"""
+后台预览图生成
+上传提交后把内容哈希放入队列，后台任务在进程池中为图片和 PDF 生成缩略图和低分辨率预览，
+按内容哈希存储（相同内容只生成一次），上传请求不等待生成
+状态记录在 file_blobs.preview_status：启动时重新排队 pending 的内容，已 ready 的内容不会重复生成
+"""
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.submission import FileBlob, SubmissionFile
+from app.services.preview_render import (
+    PREVIEW_MEDIA_TYPE,
+    can_render,
+    preview_name,
+    render_previews
+)
+
+PREVIEW_PENDING = "pending"
+PREVIEW_READY = "ready"
+PREVIEW_FAILED = "failed"
+
+
+def preview_variants() -> List[Tuple[str, int]]:
+    return [
+        ("thumb", settings.PREVIEW_THUMBNAIL_SIZE),
+        ("preview", settings.PREVIEW_IMAGE_SIZE)
+    ]
+
+
+def _open_session() -> Session:
+    # 后台任务不属于任何请求，使用独立的会话
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+class PreviewPipeline:
+    """随应用生命周期启动和停止的预览图生成队列"""
+
+    def __init__(self, storage_backend, workers: Optional[int] = None):
+        self.storage_backend = storage_backend
+        self.workers = max(1, workers or settings.PREVIEW_WORKERS)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def wants_preview(self, mime_type: Optional[str], size: int) -> bool:
+        return (
+            settings.PREVIEW_ENABLED
+            and size <= settings.PREVIEW_MAX_SOURCE_SIZE
+            and can_render(mime_type)
+        )
+
+    async def start(self):
+        """启动进程池和后台任务，重新排队上次未完成的内容"""
+        if self.running or not settings.PREVIEW_ENABLED:
+            return
+        if not can_render("image/png"):
+            logger.warning("Pillow未安装，不生成预览图")
+            return
+
+        # spawn 启动的子进程不继承事件循环和数据库连接
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+        db = _open_session()
+        try:
+            pending = db.query(FileBlob.file_hash, SubmissionFile.mime_type).join(
+                SubmissionFile, SubmissionFile.file_hash == FileBlob.file_hash
+            ).filter(FileBlob.preview_status == PREVIEW_PENDING).distinct().all()
+        finally:
+            db.close()
+        for file_hash, mime_type in pending:
+            self.enqueue(file_hash, mime_type)
+        logger.info(f"预览图生成任务已启动，待生成 {len(self._queued)} 个")
+
+    async def stop(self):
+        """停止后台任务；未完成的内容保持 pending，下次启动时继续"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._queued.clear()
+        self._queue = asyncio.Queue()
+
+    def mark_pending(self, file_hash: str, db: Session):
+        """在记录上传的同一个事务中标记需要生成预览（已有状态的内容不变）"""
+        db.query(FileBlob).filter(
+            FileBlob.file_hash == file_hash,
+            FileBlob.preview_status.is_(None)
+        ).update({FileBlob.preview_status: PREVIEW_PENDING}, synchronize_session=False)
+
+    def enqueue(self, file_hash: str, mime_type: Optional[str]):
+        """提交之后调用，不等待生成；同一内容在队列中只出现一次"""
+        if not self.running or file_hash in self._queued or not can_render(mime_type):
+            return
+        self._queued.add(file_hash)
+        self._queue.put_nowait((file_hash, mime_type))
+
+    async def _run(self):
+        while True:
+            file_hash, mime_type = await self._queue.get()
+            try:
+                await self.generate(file_hash, mime_type)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"预览图生成任务出错 {file_hash}: {e}")
+            finally:
+                self._queued.discard(file_hash)
+
+    async def generate(self, file_hash: str, mime_type: str):
+        """生成一个内容的全部预览图；已生成或内容已删除时直接返回"""
+        db = _open_session()
+        try:
+            blob = db.query(FileBlob).filter(FileBlob.file_hash == file_hash).first()
+            if blob is None or blob.preview_status != PREVIEW_PENDING:
+                return
+
+            work_dir = await asyncio.to_thread(
+                self._make_work_dir, self.storage_backend.spool_dir
+            )
+            try:
+                source_path = self.storage_backend.get_local_path(blob.storage_path)
+                if source_path is None:
+                    source_path = os.path.join(work_dir, "source")
+                    await self._download(blob.storage_path, source_path)
+
+                output_dir = os.path.join(work_dir, "out")
+                await asyncio.to_thread(os.mkdir, output_dir)
+                loop = asyncio.get_running_loop()
+                pages = await loop.run_in_executor(
+                    self._executor,
+                    render_previews,
+                    source_path,
+                    mime_type,
+                    output_dir,
+                    preview_variants(),
+                    settings.PREVIEW_QUALITY,
+                    settings.PREVIEW_PDF_MAX_PAGES
+                )
+                for name in await asyncio.to_thread(os.listdir, output_dir):
+                    await self.storage_backend.store_file(
+                        os.path.join(output_dir, name),
+                        self.storage_backend.get_preview_path(file_hash, name),
+                        PREVIEW_MEDIA_TYPE
+                    )
+            except Exception as e:
+                logger.warning(f"预览图生成失败 {file_hash}: {e}")
+                self._set_status(file_hash, PREVIEW_FAILED, None, db)
+                return
+            finally:
+                await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+            if not self._set_status(file_hash, PREVIEW_READY, pages, db):
+                # 生成期间最后一个引用被删除
+                await self.delete(file_hash, pages)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _make_work_dir(spool_dir: str) -> str:
+        os.makedirs(spool_dir, exist_ok=True)
+        return tempfile.mkdtemp(dir=spool_dir, prefix="preview-")
+
+    async def _download(self, storage_path: str, target: str):
+        """远程存储的内容先按块下载到本地临时文件"""
+        handle = await asyncio.to_thread(open, target, "wb")
+        try:
+            async for chunk in self.storage_backend.iter_file(storage_path):
+                await asyncio.to_thread(handle.write, chunk)
+        finally:
+            await asyncio.to_thread(handle.close)
+
+    @staticmethod
+    def _set_status(file_hash: str, status: str, pages: Optional[int], db: Session) -> bool:
+        updated = db.query(FileBlob).filter(FileBlob.file_hash == file_hash).update(
+            {FileBlob.preview_status: status, FileBlob.preview_pages: pages},
+            synchronize_session=False
+        )
+        db.commit()
+        return bool(updated)
+
+    async def delete(self, file_hash: str, pages: Optional[int]):
+        """删除内容的全部预览图（blob 被删除之后调用）"""
+        for page in range(1, (pages or 0) + 1):
+            for variant, _ in preview_variants():
+                await self.storage_backend.delete_file(
+                    self.storage_backend.get_preview_path(file_hash, preview_name(variant, page))
+                )
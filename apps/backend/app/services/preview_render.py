@@ -0,0 +1,120 @@
+"""
+图片处理：预览图渲染和上传图片的规范化（在进程池的子进程中执行）
+只依赖标准库和可选的 Pillow / pypdfium2，子进程启动时不需要导入应用的其他模块
+"""
+
+import os
+from typing import List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 未安装 Pillow 时不生成预览
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # 未安装 pypdfium2 时不生成 PDF 预览
+    pdfium = None
+
+PREVIEW_FORMAT = "webp"
+PREVIEW_MEDIA_TYPE = "image/webp"
+PDF_MEDIA_TYPE = "application/pdf"
+
+# 变体名称 -> 长边像素，由调用方传入
+Variants = List[Tuple[str, int]]
+
+
+def can_render(mime_type: str) -> bool:
+    """当前环境能否为该类型生成预览"""
+    if Image is None or not mime_type:
+        return False
+    if mime_type == PDF_MEDIA_TYPE:
+        return pdfium is not None
+    return mime_type.startswith("image/")
+
+
+def preview_name(variant: str, page: int) -> str:
+    return f"{variant}-{page}.{PREVIEW_FORMAT}"
+
+
+def _save_variants(image, output_dir: str, page: int, variants: Variants, quality: int) -> List[str]:
+    """按从大到小的顺序原地缩小同一张图，每个变体从上一个变体缩小而来"""
+    names = []
+    for variant, size in sorted(variants, key=lambda item: item[1], reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        name = preview_name(variant, page)
+        image.save(os.path.join(output_dir, name), PREVIEW_FORMAT.upper(), quality=quality, method=4)
+        names.append(name)
+    return names
+
+
+def _render_image(source_path: str, output_dir: str, variants: Variants, quality: int) -> int:
+    largest = max(size for _, size in variants)
+    with Image.open(source_path) as image:
+        # draft 让 JPEG 在解码时直接按比例缩小，大照片不需要完整解码
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        _save_variants(image, output_dir, 1, variants, quality)
+    return 1
+
+
+def _render_pdf(source_path: str, output_dir: str, variants: Variants, quality: int, max_pages: int) -> int:
+    largest = max(size for _, size in variants)
+    document = pdfium.PdfDocument(source_path)
+    try:
+        pages = min(len(document), max_pages)
+        for index in range(pages):
+            page = document[index]
+            try:
+                width, height = page.get_size()
+                # 按最大变体的长边渲染，页面尺寸单位为 1/72 英寸
+                bitmap = page.render(scale=largest / max(width, height, 1))
+                _save_variants(bitmap.to_pil(), output_dir, index + 1, variants, quality)
+            finally:
+                page.close()
+        return pages
+    finally:
+        document.close()
+
+
+def render_previews(
+    source_path: str,
+    mime_type: str,
+    output_dir: str,
+    variants: Variants,
+    quality: int,
+    max_pages: int
+) -> int:
+    """
+    为 source_path 生成各变体的预览图，写入 output_dir，文件名为 "<变体>-<页码>.webp"
+    返回生成的页数（图片为 1）
+    """
+    if mime_type == PDF_MEDIA_TYPE:
+        return _render_pdf(source_path, output_dir, variants, quality, max_pages)
+    return _render_image(source_path, output_dir, variants, quality)
+
+
+# 只规范化照片（JPEG）；PNG 截图等按原样保存，重新编码为 JPEG 会让文字边缘模糊
+NORMALIZE_TYPES = {"image/jpeg"}
+
+
+def can_normalize(mime_type: Optional[str]) -> bool:
+    return Image is not None and mime_type in NORMALIZE_TYPES
+
+
+def normalize_image(source_path: str, target_path: str, max_dimension: int, quality: int) -> Tuple[int, int]:
+    """
+    按 EXIF 方向旋转、把长边缩小到 max_dimension 以内，并重新编码为渐进式 JPEG 写入 target_path
+    EXIF（包括位置信息）不写入结果，返回结果图片的 (宽, 高)
+    """
+    with Image.open(source_path) as image:
+        # JPEG 在解码时按 1/2、1/4、1/8 缩小，手机照片不需要完整解码
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        image.save(target_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        return image.size
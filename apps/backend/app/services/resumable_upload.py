@@ -0,0 +1,303 @@
+"""
+可续传的分块上传（tus 协议 1.0.0 的 creation / checksum / expiration / termination 扩展）
+客户端先创建上传，再按偏移量 PATCH 连续的块；连接中断后用 HEAD 查询服务器已确认的偏移量，从该处继续
+未完成的上传保存在本地磁盘（内容 .part + 状态 .json），过期后清理；全部接收后进入普通的文件记录流程
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.services.upload_stream import SpooledUpload, format_hash, hash_file, new_hasher
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,checksum,expiration,termination"
+CHECKSUM_ALGORITHMS = ("sha1", "sha256", "md5")
+
+# tus checksum 扩展规定的状态码：块的校验和不一致
+CHECKSUM_MISMATCH = 460
+
+
+@dataclass
+class UploadState:
+    """一个上传的持久状态；offset 只在块写入并校验通过后推进"""
+    id: str
+    user_id: int
+    submission_id: str
+    file_name: str
+    content_type: str
+    length: int
+    offset: int
+    expires_at: float
+    file_id: Optional[str] = None  # 完成后的文件记录，客户端丢失最后一个响应时通过 HEAD 取回
+
+    @property
+    def completed(self) -> bool:
+        return self.file_id is not None
+
+
+class _RunningDigest:
+    """随块推进的整体哈希和 CRC，使完成时不必重新读取文件；只在本进程内有效"""
+
+    __slots__ = ("offset", "hasher", "crc")
+
+    def __init__(self):
+        self.offset = 0
+        self.hasher = new_hasher()
+        self.crc = 0
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Upload-Metadata: "key base64value,key2 base64value2" """
+    metadata = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value.strip(), validate=True).decode("utf-8") if value else ""
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Upload-Metadata 中 {key} 的值不是有效的 base64")
+    return metadata
+
+
+def parse_checksum(header: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """Upload-Checksum: "<算法> <base64 摘要>"，返回 (算法, 摘要)"""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise HTTPException(status_code=400, detail=f"不支持的校验算法: {algorithm}")
+    try:
+        return algorithm, base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Checksum 不是有效的 base64")
+
+
+class ResumableUploadStore:
+    """磁盘上的未完成上传；同一上传的块在本进程内串行写入"""
+
+    def __init__(self, directory: Optional[str] = None, expires_in: Optional[int] = None):
+        self.directory = Path(directory or os.path.join(settings.UPLOAD_DIR, ".resumable"))
+        self.expires_in = expires_in or settings.RESUMABLE_UPLOAD_EXPIRES
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._digests: Dict[str, _RunningDigest] = {}
+        self._last_purge = 0.0
+
+    def _state_path(self, upload_id: str) -> Path:
+        return self.directory / f"{upload_id}.json"
+
+    def _data_path(self, upload_id: str) -> Path:
+        return self.directory / f"{upload_id}.part"
+
+    def _save(self, state: UploadState):
+        # 先写临时文件再重命名，进程中途退出时不会留下半个状态文件
+        temp_path = self._state_path(state.id).with_suffix(".json.tmp")
+        temp_path.write_text(json.dumps(asdict(state)))
+        os.replace(temp_path, self._state_path(state.id))
+
+    def _load(self, upload_id: str) -> Optional[UploadState]:
+        try:
+            return UploadState(**json.loads(self._state_path(upload_id).read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    async def create(
+        self,
+        user_id: int,
+        submission_id: str,
+        file_name: str,
+        content_type: str,
+        length: int
+    ) -> UploadState:
+        # 长时间运行的进程中，创建新上传时顺带清理过期的上传（最多每小时一次）
+        if time.time() - self._last_purge > 3600:
+            await self.purge_expired()
+
+        state = UploadState(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            submission_id=submission_id,
+            file_name=file_name,
+            content_type=content_type,
+            length=length,
+            offset=0,
+            expires_at=time.time() + self.expires_in
+        )
+
+        def create_files():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._data_path(state.id).touch()
+            self._save(state)
+
+        await asyncio.to_thread(create_files)
+        self._digests[state.id] = _RunningDigest()
+        return state
+
+    async def get(self, upload_id: str, user_id: int) -> UploadState:
+        """读取上传状态；不存在、已过期或不属于当前用户时返回 404"""
+        if not upload_id.isalnum():
+            raise HTTPException(status_code=404, detail="上传不存在")
+        state = await asyncio.to_thread(self._load, upload_id)
+        if state is None or state.user_id != user_id:
+            raise HTTPException(status_code=404, detail="上传不存在")
+        if state.expires_at < time.time():
+            await self.remove(upload_id)
+            raise HTTPException(status_code=410, detail="上传已过期")
+        return state
+
+    async def append(
+        self,
+        state: UploadState,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        checksum: Optional[Tuple[str, bytes]] = None
+    ) -> UploadState:
+        """
+        从 offset 处写入一个块，返回更新后的状态
+        offset 必须等于服务器已确认的偏移量（否则 409）；带校验和时整块校验通过才推进偏移量，
+        不带校验和时连接中断前收到的字节也会保留，客户端只需重传之后的部分
+        """
+        lock = self._locks.setdefault(state.id, asyncio.Lock())
+        if lock.locked():
+            raise HTTPException(status_code=409, detail="该上传正在写入其他块")
+
+        async with lock:
+            # 持有锁之后重新读取，状态可能已被上一个块推进
+            state = await self.get(state.id, state.user_id)
+            if state.completed:
+                raise HTTPException(status_code=409, detail="上传已完成")
+            if offset != state.offset:
+                raise HTTPException(status_code=409, detail=f"偏移量不一致，服务器当前为 {state.offset}")
+
+            digest = self._digests.get(state.id)
+            if digest is not None and digest.offset != state.offset:
+                digest = None
+            chunk_hasher = hashlib.new(checksum[0]) if checksum else None
+            received = 0
+            disconnected = False
+
+            fd = await asyncio.to_thread(os.open, self._data_path(state.id), os.O_WRONLY)
+            try:
+                # 丢弃上一次未确认的字节（校验失败或进程在写入途中退出）
+                await asyncio.to_thread(os.ftruncate, fd, state.offset)
+                try:
+                    async for chunk in chunks:
+                        if state.offset + received + len(chunk) > state.length:
+                            raise HTTPException(status_code=413, detail="写入的数据超过声明的 Upload-Length")
+                        await asyncio.to_thread(
+                            self._write, fd, chunk, state.offset + received, chunk_hasher, digest
+                        )
+                        received += len(chunk)
+                except ClientDisconnect:
+                    disconnected = True
+
+                if checksum is not None:
+                    if disconnected:
+                        raise HTTPException(status_code=400, detail="连接中断，块不完整")
+                    if chunk_hasher.digest() != checksum[1]:
+                        raise HTTPException(status_code=CHECKSUM_MISMATCH, detail="块的校验和不一致")
+                await asyncio.to_thread(os.fsync, fd)
+            except BaseException:
+                # 未确认的块作废，整体哈希无法回退，完成时重新计算
+                self._digests.pop(state.id, None)
+                raise
+            finally:
+                os.close(fd)
+
+            state.offset += received
+            if digest is not None:
+                digest.offset = state.offset
+            await asyncio.to_thread(self._save, state)
+            return state
+
+    @staticmethod
+    def _write(fd: int, chunk: bytes, position: int, chunk_hasher, digest: Optional[_RunningDigest]):
+        view = memoryview(chunk)
+        while view:
+            written = os.pwrite(fd, view, position)
+            view = view[written:]
+            position += written
+        if chunk_hasher is not None:
+            chunk_hasher.update(chunk)
+        if digest is not None:
+            digest.hasher.update(chunk)
+            digest.crc = zlib.crc32(chunk, digest.crc)
+
+    async def take(self, state: UploadState, spool_dir: str) -> SpooledUpload:
+        """
+        已接收全部内容的上传移动到 spool_dir，作为普通的流式上传交给后续流程
+        块都在本进程接收时直接使用随块计算的哈希，否则重新读取一遍文件计算
+        """
+        digest = self._digests.pop(state.id, None)
+        if digest is None or digest.offset != state.length:
+            file_hash, crc = await asyncio.to_thread(hash_file, self._data_path(state.id))
+        else:
+            file_hash, crc = format_hash(digest.hasher), digest.crc
+
+        def move() -> str:
+            Path(spool_dir).mkdir(parents=True, exist_ok=True)
+            target = os.path.join(spool_dir, f"{state.id}.part")
+            os.replace(self._data_path(state.id), target)
+            return target
+
+        path = await asyncio.to_thread(move)
+        return SpooledUpload(path=path, size=state.length, file_hash=file_hash, crc32=crc)
+
+    async def mark_completed(self, state: UploadState, file_id: str):
+        """记录完成后的文件 ID；状态保留到过期，供重试的客户端查询"""
+        state.file_id = file_id
+        await asyncio.to_thread(self._save, state)
+
+    async def remove(self, upload_id: str):
+        self._digests.pop(upload_id, None)
+        self._locks.pop(upload_id, None)
+
+        def unlink():
+            for path in (self._data_path(upload_id), self._state_path(upload_id)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+        await asyncio.to_thread(unlink)
+
+    async def purge_expired(self) -> int:
+        """删除过期的上传，返回删除的数量"""
+        def expired_ids():
+            if not self.directory.is_dir():
+                return []
+            now = time.time()
+            result = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    upload_id = entry.name[:-len(".json")]
+                    state = self._load(upload_id)
+                    if state is None or state.expires_at < now:
+                        result.append(upload_id)
+            return result
+
+        self._last_purge = time.time()
+        upload_ids = await asyncio.to_thread(expired_ids)
+        for upload_id in upload_ids:
+            await self.remove(upload_id)
+        if upload_ids:
+            logger.info(f"清理过期的续传上传 {len(upload_ids)} 个")
+        return len(upload_ids)
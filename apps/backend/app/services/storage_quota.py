@@ -0,0 +1,342 @@
+"""
+课程和用户的存储配额
+每个课程、每个学生的提交文件数和字节数保存在计数表 storage_usage 中，
+随文件记录的写入和删除在同一个事务中增量更新；配额检查只按主键读取计数行，不扫描 submission_files
+上传在接收内容之前按声明的大小检查一次，提交时在已锁定的计数行上再检查一次，并发上传不会越过配额
+计数与文件记录不一致（绕过文件服务的删除、进程中途退出等）时，由校正任务按 submission_files 重新计算
+"""
+
+import asyncio
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.submission import StorageUsage, Submission, SubmissionFile
+from app.models.user import User
+
+SCOPE_COURSE = "course"
+SCOPE_USER = "user"
+SCOPE_NAMES = {SCOPE_COURSE: "课程", SCOPE_USER: "用户"}
+
+# 校正报告中最多列出的不一致计数行数量
+DRIFT_SAMPLE_SIZE = 20
+
+
+def _open_session() -> Session:
+    # 后台任务不属于任何请求，使用独立的会话
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+def submission_owner(submission_id, db: Session) -> Tuple[Optional[int], Optional[int]]:
+    """提交所属的 (课程 ID, 学生 ID)，按主键查询；提交不存在时为 (None, None)"""
+    # assignment 模型导入 app.db.base（其中导入全部模型），在使用时导入避免循环导入
+    from app.models.assignment import Assignment
+    row = db.query(Assignment.course_id, Submission.student_id).join(
+        Assignment, Assignment.id == Submission.assignment_id
+    ).filter(Submission.id == submission_id).first()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def _scopes(course_id: Optional[int], user_id: Optional[int]) -> List[Tuple[str, int]]:
+    # 固定先课程后用户的顺序锁定计数行，并发事务不会互相等待形成死锁
+    return [
+        (scope, scope_id)
+        for scope, scope_id in ((SCOPE_COURSE, course_id), (SCOPE_USER, user_id))
+        if scope_id is not None
+    ]
+
+
+def default_quota(scope: str) -> Optional[int]:
+    """配置中的默认配额，0 表示不限制"""
+    quota = settings.COURSE_STORAGE_QUOTA if scope == SCOPE_COURSE else settings.USER_STORAGE_QUOTA
+    return quota or None
+
+
+def _usage(scope: str, scope_id: int, db: Session) -> Tuple[int, int, Optional[int]]:
+    """(文件数, 已用字节数, 配额)；没有计数行时用量为 0，配额为默认值"""
+    row = db.query(StorageUsage.file_count, StorageUsage.used_bytes, StorageUsage.quota_bytes).filter(
+        StorageUsage.scope == scope,
+        StorageUsage.scope_id == scope_id
+    ).first()
+    if row is None:
+        return 0, 0, default_quota(scope)
+    quota = row.quota_bytes if row.quota_bytes is not None else default_quota(scope)
+    return int(row.file_count), int(row.used_bytes), quota
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.2f}MB"
+
+
+def _quota_error(scope: str, used: int, size: int, quota: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=(
+            f"{SCOPE_NAMES[scope]}存储空间不足"
+            f"（已用 {_megabytes(used)}，本次 {_megabytes(size)}，配额 {_megabytes(quota)}）"
+        )
+    )
+
+
+def check_quota(course_id: Optional[int], user_id: Optional[int], size: int, db: Session):
+    """再写入 size 字节会超过课程或用户的配额时抛出 413"""
+    for scope, scope_id in _scopes(course_id, user_id):
+        _, used, quota = _usage(scope, scope_id, db)
+        if quota is not None and used + size > quota:
+            raise _quota_error(scope, used, size, quota)
+
+
+def _adjust(scope: str, scope_id: int, files: int, size: int, db: Session):
+    values = {
+        StorageUsage.file_count: StorageUsage.file_count + files,
+        StorageUsage.used_bytes: StorageUsage.used_bytes + size,
+        StorageUsage.updated_at: datetime.utcnow()
+    }
+    query = db.query(StorageUsage).filter(StorageUsage.scope == scope, StorageUsage.scope_id == scope_id)
+    if query.update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(StorageUsage(
+                scope=scope, scope_id=scope_id, file_count=files, used_bytes=size, updated_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        # 并发插入了同一范围的计数行
+        query.update(values, synchronize_session=False)
+
+
+def record_usage(
+    course_id: Optional[int],
+    user_id: Optional[int],
+    files: int,
+    size: int,
+    db: Session,
+    enforce: bool = False
+):
+    """
+    在调用方的事务中增减课程和用户的计数，由调用方提交
+    enforce 时在更新（并锁定）计数行之后检查配额，超出时抛出 413，由调用方回滚
+    """
+    for scope, scope_id in _scopes(course_id, user_id):
+        _adjust(scope, scope_id, files, size, db)
+        if enforce and size > 0:
+            _, used, quota = _usage(scope, scope_id, db)
+            if quota is not None and used > quota:
+                raise _quota_error(scope, used - size, size, quota)
+
+
+def get_usage(scope: str, scope_id: int, db: Session) -> Dict[str, Any]:
+    file_count, used, quota = _usage(scope, scope_id, db)
+    return {
+        "scope": scope,
+        "scope_id": scope_id,
+        "file_count": file_count,
+        "used_bytes": used,
+        "quota_bytes": quota,
+        "remaining_bytes": max(quota - used, 0) if quota is not None else None
+    }
+
+
+def set_quota(scope: str, scope_id: int, quota_bytes: Optional[int], db: Session) -> Dict[str, Any]:
+    """设置单个课程或用户的配额，None 恢复为默认配额"""
+    values = {StorageUsage.quota_bytes: quota_bytes, StorageUsage.updated_at: datetime.utcnow()}
+    query = db.query(StorageUsage).filter(StorageUsage.scope == scope, StorageUsage.scope_id == scope_id)
+    try:
+        if not query.update(values, synchronize_session=False):
+            try:
+                with db.begin_nested():
+                    db.add(StorageUsage(
+                        scope=scope, scope_id=scope_id, file_count=0, used_bytes=0,
+                        quota_bytes=quota_bytes, updated_at=datetime.utcnow()
+                    ))
+            except IntegrityError:
+                query.update(values, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    # 新建的计数行用量为 0，下一次校正时按文件记录补齐
+    return get_usage(scope, scope_id, db)
+
+
+def get_usage_summary(db: Session, limit: int = 10) -> Dict[str, Any]:
+    """默认配额和用量最大的课程、用户（读取计数表）"""
+    summary = {}
+    for scope in (SCOPE_COURSE, SCOPE_USER):
+        rows = db.query(StorageUsage).filter(StorageUsage.scope == scope).order_by(
+            StorageUsage.used_bytes.desc()
+        ).limit(limit).all()
+        summary[scope] = {
+            "default_quota_bytes": default_quota(scope),
+            "largest": [
+                {
+                    "scope_id": row.scope_id,
+                    "file_count": int(row.file_count),
+                    "used_bytes": int(row.used_bytes),
+                    "quota_bytes": row.quota_bytes if row.quota_bytes is not None else default_quota(scope)
+                }
+                for row in rows
+            ]
+        }
+    return summary
+
+
+@dataclass
+class ReconcileReport:
+    checked: int = 0
+    corrected: int = 0
+    drift: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _chunks(items: List[int], size: int) -> Iterable[List[int]]:
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+class UsageReconciler:
+    """随应用生命周期启动和停止的计数校正任务，每 USAGE_RECONCILE_INTERVAL 秒运行一次，也可以手动触发"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        """首次部署时（计数表为空而已有文件记录）校正一次，启用校正时启动定时任务"""
+        db = _open_session()
+        try:
+            missing = (
+                db.query(StorageUsage.scope).first() is None
+                and db.query(SubmissionFile.id).first() is not None
+            )
+            db.commit()
+        except Exception as e:
+            logger.warning(f"存储用量计数检查失败: {e}")
+            missing = False
+        finally:
+            db.close()
+        if missing:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.warning(f"存储用量计数初始化失败: {e}")
+        if self._task is None and settings.USAGE_RECONCILE_ENABLED:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(settings.USAGE_RECONCILE_INTERVAL)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"存储用量校正出错: {e}")
+
+    async def run(self) -> Dict[str, Any]:
+        """按 submission_files 重新计算全部课程和用户的计数，返回校正的计数行"""
+        async with self._lock:
+            report = await asyncio.to_thread(self._reconcile)
+        if report.corrected:
+            logger.info(f"存储用量校正: 检查 {report.checked} 个计数，校正 {report.corrected} 个")
+        return asdict(report)
+
+    def _reconcile(self) -> ReconcileReport:
+        # assignment / course 模型导入 app.db.base（其中导入全部模型），在使用时导入避免循环导入
+        from app.models.assignment import Assignment
+        from app.models.course import Course
+        report = ReconcileReport()
+        db = _open_session()
+        try:
+            files = db.query(SubmissionFile).join(
+                Submission, Submission.id == SubmissionFile.submission_id
+            )
+            course_ids = [course_id for (course_id,) in db.query(Course.id).order_by(Course.id)]
+            user_ids = [user_id for (user_id,) in db.query(User.id).order_by(User.id)]
+            db.commit()
+
+            for chunk in _chunks(course_ids, max(1, settings.USAGE_RECONCILE_BATCH_SIZE)):
+                actual = files.join(Assignment, Assignment.id == Submission.assignment_id).filter(
+                    Assignment.course_id.in_(chunk)
+                ).group_by(Assignment.course_id).with_entities(
+                    Assignment.course_id, func.count(SubmissionFile.id), func.sum(SubmissionFile.file_size)
+                )
+                self._correct(SCOPE_COURSE, chunk, actual, report, db)
+            for chunk in _chunks(user_ids, max(1, settings.USAGE_RECONCILE_BATCH_SIZE)):
+                actual = files.filter(Submission.student_id.in_(chunk)).group_by(
+                    Submission.student_id
+                ).with_entities(
+                    Submission.student_id, func.count(SubmissionFile.id), func.sum(SubmissionFile.file_size)
+                )
+                self._correct(SCOPE_USER, chunk, actual, report, db)
+        finally:
+            db.close()
+        return report
+
+    @staticmethod
+    def _correct(scope: str, scope_ids: List[int], actual, report: ReconcileReport, db: Session):
+        """
+        校正一批计数行并提交
+        先锁定计数行再统计文件：锁定之前已提交的上传计入统计，之后的上传等待锁释放后在校正值上继续累加
+        """
+        try:
+            counters = {
+                usage.scope_id: usage
+                for usage in db.query(StorageUsage).filter(
+                    StorageUsage.scope == scope,
+                    StorageUsage.scope_id.in_(scope_ids)
+                ).with_for_update()
+            }
+            totals = {scope_id: (int(count), int(size or 0)) for scope_id, count, size in actual}
+            now = datetime.utcnow()
+            for scope_id in scope_ids:
+                file_count, used = totals.get(scope_id, (0, 0))
+                usage = counters.get(scope_id)
+                report.checked += 1
+                if usage is None:
+                    if not file_count:
+                        continue
+                    db.add(StorageUsage(
+                        scope=scope, scope_id=scope_id, file_count=file_count, used_bytes=used, updated_at=now
+                    ))
+                    counted = (0, 0)
+                elif (usage.file_count, usage.used_bytes) != (file_count, used):
+                    counted = (int(usage.file_count), int(usage.used_bytes))
+                    usage.file_count = file_count
+                    usage.used_bytes = used
+                    usage.updated_at = now
+                else:
+                    continue
+                report.corrected += 1
+                if len(report.drift) < DRIFT_SAMPLE_SIZE:
+                    report.drift.append({
+                        "scope": scope,
+                        "scope_id": scope_id,
+                        "counted_files": counted[0],
+                        "counted_bytes": counted[1],
+                        "file_count": file_count,
+                        "used_bytes": used
+                    })
+            db.commit()
+        except IntegrityError:
+            # 统计期间有上传插入了同一范围的计数行，本批留到下一次校正
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
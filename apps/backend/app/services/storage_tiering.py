@@ -0,0 +1,303 @@
+"""
+冷热分层存储
+所有引用都属于已结束课程（courses.is_active 为 False）的 blob 由后台任务打包进冷存储分段：
+多个 blob 的存储内容（保持原有的压缩编码）顺序写入一个分段文件，末尾附带索引，大幅减少文件（inode）数量
+打包后 blob 的存储路径为 "<分段路径>#<偏移量>+<长度>"，存储后端按该区间读取，对读取方透明
+blob 删除后分段中留下的空间在存活比例低于 TIERING_COMPACT_THRESHOLD 时重新打包回收
+"""
+
+import asyncio
+import json
+import os
+import re
+import struct
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.submission import FileBlob, StorageSegment, Submission, SubmissionFile
+from app.services.storage_usage import (
+    TIER_COLD,
+    TIER_HOT,
+    adjust_tier_usage,
+    ensure_tier_usage,
+    stored_bytes
+)
+
+# 分段文件末尾：JSON 索引，随后是索引长度（8 字节小端）和魔数；数据库丢失时可以据此恢复 blob 位置
+SEGMENT_MAGIC = b"DRSEG001"
+SEGMENT_MEDIA_TYPE = "application/octet-stream"
+
+_PACKED_PATH = re.compile(r"^(?P<segment>.+)#(?P<offset>\d+)\+(?P<length>\d+)$")
+
+
+def packed_path(segment_path: str, offset: int, length: int) -> str:
+    return f"{segment_path}#{offset}+{length}"
+
+
+def parse_packed_path(path: str) -> Optional[Tuple[str, int, int]]:
+    """打包在分段中的 blob 路径返回 (分段路径, 偏移量, 长度)，普通路径返回 None"""
+    match = _PACKED_PATH.match(path)
+    if match is None:
+        return None
+    return match.group("segment"), int(match.group("offset")), int(match.group("length"))
+
+
+def packed_range(length: int, offset: int, start: int, end: Optional[int]) -> Tuple[int, Optional[int]]:
+    """blob 内的闭区间 [start, end] 换算为分段文件中的区间；区间为空时 end 小于 start"""
+    last = length - 1 if end is None else min(end, length - 1)
+    return offset + start, offset + last
+
+
+def _open_session() -> Session:
+    # 后台任务不属于任何请求，使用独立的会话
+    from app.db.session import SessionLocal
+    return SessionLocal()
+
+
+class StorageTiering:
+    """随应用生命周期启动和停止的分层任务，每 TIERING_INTERVAL 秒运行一次，也可以手动触发"""
+
+    def __init__(self, storage_backend):
+        self.storage_backend = storage_backend
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        """首次部署时按现有 blob 建立层级计数，启用分层时启动定时任务"""
+        db = _open_session()
+        try:
+            await asyncio.to_thread(ensure_tier_usage, db)
+        except Exception as e:
+            logger.warning(f"存储层级计数初始化失败: {e}")
+        finally:
+            db.close()
+        if self._task is None and settings.TIERING_ENABLED:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(settings.TIERING_INTERVAL)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"分层任务出错: {e}")
+
+    async def run(self) -> Dict[str, Any]:
+        """打包全部候选 blob 并删除已清空的分段，返回本次运行的统计"""
+        report = {"segments": 0, "packed_blobs": 0, "packed_bytes": 0, "removed_segments": 0}
+        async with self._lock:
+            db = _open_session()
+            try:
+                while True:
+                    batch = self._next_batch(db)
+                    if not batch:
+                        break
+                    packed, packed_bytes = await self._pack(batch, db)
+                    if not packed:
+                        break
+                    report["segments"] += 1
+                    report["packed_blobs"] += packed
+                    report["packed_bytes"] += packed_bytes
+                report["removed_segments"] = await self._remove_empty_segments(db)
+            finally:
+                db.close()
+        if report["packed_blobs"] or report["removed_segments"]:
+            logger.info(f"分层任务完成: {report}")
+        return report
+
+    def _next_batch(self, db: Session) -> List[FileBlob]:
+        """
+        下一个分段的 blob：尚未打包且所有引用都属于已结束课程的 blob，
+        以及存活比例过低的分段中的 blob（重新打包以回收空间）
+        """
+        # assignment / course 模型导入 app.db.base（其中导入全部模型），在使用时导入避免循环导入
+        from app.models.assignment import Assignment
+        from app.models.course import Course
+        references = or_(
+            SubmissionFile.file_hash == FileBlob.file_hash,
+            SubmissionFile.original_hash == FileBlob.file_hash
+        )
+        closed_courses = db.query(Course.id).filter(Course.is_active.is_(False))
+        active_reference = exists().where(
+            references,
+            SubmissionFile.submission_id == Submission.id,
+            Submission.assignment_id == Assignment.id,
+            or_(Assignment.course_id.is_(None), Assignment.course_id.notin_(closed_courses))
+        )
+        sparse_segments = db.query(StorageSegment.id).filter(
+            StorageSegment.live_bytes < StorageSegment.size * settings.TIERING_COMPACT_THRESHOLD
+        )
+        blobs = db.query(FileBlob).filter(
+            FileBlob.ref_count > 0,
+            or_(
+                (FileBlob.segment_id.is_(None)) & exists().where(references) & ~active_reference,
+                FileBlob.segment_id.in_(sparse_segments)
+            )
+        ).order_by(FileBlob.file_hash).limit(settings.TIERING_SEGMENT_MAX_BLOBS).all()
+
+        batch, size = [], 0
+        for blob in blobs:
+            if batch and size + stored_bytes(blob) > settings.TIERING_SEGMENT_SIZE:
+                break
+            batch.append(blob)
+            size += stored_bytes(blob)
+        return batch
+
+    async def _pack(self, blobs: List[FileBlob], db: Session) -> Tuple[int, int]:
+        """把一批 blob 写入新的分段，提交后删除原来的文件；返回 (打包的 blob 数, 字节数)"""
+        segment_id = uuid.uuid4().hex
+        work_path, entries = await self._write_segment(blobs)
+        if not entries:
+            await asyncio.to_thread(_unlink, work_path)
+            return 0, 0
+
+        segment_path = self.storage_backend.get_segment_path(segment_id)
+        await self.storage_backend.store_file(work_path, segment_path, SEGMENT_MEDIA_TYPE, cold=True)
+
+        moved = []
+        try:
+            db.add(StorageSegment(
+                id=segment_id,
+                storage_path=segment_path,
+                size=sum(length for _, _, length in entries),
+                blob_count=0,
+                live_bytes=0,
+                created_at=datetime.utcnow()
+            ))
+            db.flush()
+            for blob, offset, length in entries:
+                if self._move(blob, packed_path(segment_path, offset, length), segment_id, length, db):
+                    moved.append((blob.storage_path, length))
+            db.query(StorageSegment).filter(StorageSegment.id == segment_id).update({
+                StorageSegment.blob_count: len(moved),
+                StorageSegment.live_bytes: sum(length for _, length in moved)
+            }, synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            await self.storage_backend.delete_file(segment_path)
+            raise
+        finally:
+            # 下一批重新查询，不使用本批已过期的对象
+            db.expire_all()
+
+        for old_path, _ in moved:
+            if parse_packed_path(old_path) is None:
+                await self.storage_backend.delete_file(old_path)
+        return len(moved), sum(length for _, length in moved)
+
+    @staticmethod
+    def _move(blob: FileBlob, new_path: str, segment_id: str, length: int, db: Session) -> bool:
+        """
+        把 blob 和引用它的文件记录指向分段中的位置，并更新层级计数
+        先锁定 blob 记录：并发上传相同内容时，对方要么在此之前提交（其文件记录随后被更新），
+        要么在此之后增加引用并读到新的路径
+        """
+        updated = db.query(FileBlob).filter(
+            FileBlob.file_hash == blob.file_hash,
+            FileBlob.storage_path == blob.storage_path,
+            FileBlob.ref_count > 0
+        ).update({
+            FileBlob.storage_path: new_path,
+            FileBlob.segment_id: segment_id,
+            FileBlob.tier: TIER_COLD,
+            FileBlob.stored_size: length
+        }, synchronize_session=False)
+        if not updated:
+            # 读取之后 blob 被删除或已被其他进程迁移，分段中的这部分内容不计入存活
+            return False
+
+        db.query(SubmissionFile).filter(
+            SubmissionFile.file_hash == blob.file_hash,
+            SubmissionFile.file_path == blob.storage_path
+        ).update({SubmissionFile.file_path: new_path}, synchronize_session=False)
+
+        adjust_tier_usage(blob.tier or TIER_HOT, -1, -stored_bytes(blob), db)
+        adjust_tier_usage(TIER_COLD, 1, length, db)
+        if blob.segment_id:
+            db.query(StorageSegment).filter(StorageSegment.id == blob.segment_id).update({
+                StorageSegment.blob_count: StorageSegment.blob_count - 1,
+                StorageSegment.live_bytes: StorageSegment.live_bytes - stored_bytes(blob)
+            }, synchronize_session=False)
+        return True
+
+    async def _write_segment(self, blobs: List[FileBlob]) -> Tuple[str, List[Tuple[FileBlob, int, int]]]:
+        """
+        把 blob 的存储内容按原样顺序写入临时分段文件，末尾写入索引
+        返回 (临时文件, [(blob, 偏移量, 长度)])；读取失败的 blob 跳过
+        """
+        spool_dir = self.storage_backend.spool_dir
+        await asyncio.to_thread(os.makedirs, spool_dir, exist_ok=True)
+        fd, work_path = await asyncio.to_thread(tempfile.mkstemp, dir=spool_dir, prefix="segment-")
+        handle = os.fdopen(fd, "wb")
+        entries = []
+        position = 0
+        try:
+            for blob in blobs:
+                offset = position
+                try:
+                    async for chunk in self.storage_backend.iter_file(
+                        blob.storage_path, chunk_size=settings.UPLOAD_CHUNK_SIZE
+                    ):
+                        await asyncio.to_thread(handle.write, chunk)
+                        position += len(chunk)
+                except Exception as e:
+                    logger.warning(f"分层任务读取 blob 失败，跳过 {blob.file_hash}: {e}")
+                    await asyncio.to_thread(handle.seek, offset)
+                    await asyncio.to_thread(handle.truncate)
+                    position = offset
+                    continue
+                entries.append((blob, offset, position - offset))
+
+            index = json.dumps({
+                "blobs": [
+                    {"hash": blob.file_hash, "offset": offset, "length": length, "encoding": blob.encoding}
+                    for blob, offset, length in entries
+                ]
+            }).encode()
+            await asyncio.to_thread(handle.write, index + struct.pack("<Q", len(index)) + SEGMENT_MAGIC)
+            await asyncio.to_thread(handle.flush)
+            await asyncio.to_thread(os.fsync, handle.fileno())
+        except BaseException:
+            handle.close()
+            await asyncio.to_thread(_unlink, work_path)
+            raise
+        handle.close()
+        return work_path, entries
+
+    async def _remove_empty_segments(self, db: Session) -> int:
+        """删除所有 blob 都已删除或已重新打包的分段"""
+        segments = db.query(StorageSegment).filter(StorageSegment.blob_count <= 0).all()
+        removed = 0
+        for segment in segments:
+            # 先删除记录，删除文件失败时只留下未被引用的文件，不会留下指向不存在文件的记录
+            db.delete(segment)
+            db.commit()
+            if await self.storage_backend.delete_file(segment.storage_path):
+                removed += 1
+        return removed
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,100 @@
+"""
+存储用量计数
+各存储层级的 blob 数量和字节数保存在计数表中，随 blob 的写入、删除和迁移在同一个事务中增量更新，
+查询用量时不需要扫描 file_blobs；计数表为空时（首次部署）按 file_blobs 重建一次
+"""
+
+from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.submission import FileBlob, StorageSegment, StorageTierUsage
+
+TIER_HOT = "hot"
+TIER_COLD = "cold"
+
+
+def stored_bytes(blob: FileBlob) -> int:
+    """blob 在存储中实际占用的字节数（压缩后的大小）"""
+    return blob.stored_size if blob.stored_size is not None else blob.size
+
+
+def adjust_tier_usage(tier: str, blobs: int, size: int, db: Session):
+    """在调用方的事务中增减一个层级的计数，由调用方提交"""
+    values = {
+        StorageTierUsage.blob_count: StorageTierUsage.blob_count + blobs,
+        StorageTierUsage.stored_bytes: StorageTierUsage.stored_bytes + size,
+        StorageTierUsage.updated_at: datetime.utcnow()
+    }
+    if db.query(StorageTierUsage).filter(StorageTierUsage.tier == tier).update(
+        values, synchronize_session=False
+    ):
+        return
+    try:
+        with db.begin_nested():
+            db.add(StorageTierUsage(
+                tier=tier, blob_count=blobs, stored_bytes=size, updated_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        # 并发插入了同一层级的计数行
+        db.query(StorageTierUsage).filter(StorageTierUsage.tier == tier).update(
+            values, synchronize_session=False
+        )
+
+
+def rebuild_tier_usage(db: Session):
+    """按 file_blobs 重新计算各层级的计数并提交（首次部署或手动校正时调用，会扫描 file_blobs）"""
+    rows = db.query(
+        func.coalesce(FileBlob.tier, TIER_HOT),
+        func.count(FileBlob.file_hash),
+        func.coalesce(func.sum(func.coalesce(FileBlob.stored_size, FileBlob.size)), 0)
+    ).group_by(func.coalesce(FileBlob.tier, TIER_HOT)).all()
+
+    db.query(StorageTierUsage).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    for tier, blob_count, size in rows:
+        db.add(StorageTierUsage(tier=tier, blob_count=blob_count, stored_bytes=int(size), updated_at=now))
+    db.commit()
+
+
+def ensure_tier_usage(db: Session):
+    """计数表为空而 file_blobs 有记录时重建计数"""
+    if db.query(StorageTierUsage.tier).first() is not None:
+        return
+    if db.query(FileBlob.file_hash).first() is None:
+        return
+    rebuild_tier_usage(db)
+
+
+def get_tier_usage(db: Session) -> Dict[str, Any]:
+    """各层级的用量（读取计数表）和冷存储分段的空间利用情况（分段表很小）"""
+    tiers = {
+        tier: {"blob_count": 0, "stored_bytes": 0}
+        for tier in (TIER_HOT, TIER_COLD)
+    }
+    for usage in db.query(StorageTierUsage).all():
+        tiers[usage.tier] = {
+            "blob_count": int(usage.blob_count),
+            "stored_bytes": int(usage.stored_bytes),
+            "updated_at": usage.updated_at
+        }
+
+    segment_count, segment_bytes, live_bytes, packed_blobs = db.query(
+        func.count(StorageSegment.id),
+        func.coalesce(func.sum(StorageSegment.size), 0),
+        func.coalesce(func.sum(StorageSegment.live_bytes), 0),
+        func.coalesce(func.sum(StorageSegment.blob_count), 0)
+    ).one()
+    return {
+        "tiers": tiers,
+        "segments": {
+            "segment_count": segment_count,
+            "packed_blob_count": int(packed_blobs),
+            "segment_bytes": int(segment_bytes),
+            "live_bytes": int(live_bytes),
+            "dead_bytes": int(segment_bytes) - int(live_bytes)
+        }
+    }
@@ -0,0 +1,185 @@
+"""
+流式上传
+按固定大小的块把上传内容写入临时文件，同一遍计算内容哈希并检查大小限制
+磁盘写入和哈希计算在线程池中执行，不阻塞事件循环；内存占用与块大小相关，与文件大小无关
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+
+
+@dataclass
+class SpooledUpload:
+    """已写入临时文件的上传内容"""
+    path: str
+    size: int
+    file_hash: str  # "<算法>:<十六进制摘要>"
+    crc32: Optional[int] = None  # ZIP 导出使用，与哈希同一遍计算
+
+    def discard(self):
+        """删除临时文件（上传失败或已被移动时调用）"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def new_hasher(algorithm: Optional[str] = None):
+    """创建哈希对象，支持 sha256 / blake2b 等 hashlib 算法"""
+    algorithm = (algorithm or settings.UPLOAD_HASH_ALGORITHM).lower()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError(f"不支持的哈希算法: {algorithm}")
+
+
+def format_hash(hasher) -> str:
+    return f"{hasher.name}:{hasher.hexdigest()}"
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    """按块读取 UploadFile"""
+    await file.seek(0)
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _write_chunk(handle, hasher, chunk: bytes, crc: int) -> int:
+    handle.write(chunk)
+    hasher.update(chunk)
+    return zlib.crc32(chunk, crc)
+
+
+async def spool_stream(
+    chunks: AsyncIterator[bytes],
+    directory: str,
+    max_size: Optional[int] = None,
+    algorithm: Optional[str] = None
+) -> SpooledUpload:
+    """
+    把字节流写入 directory 下的临时文件，边写边计算哈希
+    临时文件与最终位置在同一文件系统上，之后可以原子重命名
+    超过 max_size 时立即停止读取、删除临时文件并返回 413
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    hasher = new_hasher(algorithm)
+    size = 0
+    crc = 0
+
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"文件大小超过限制 ({max_size / 1024 / 1024}MB)"
+                    )
+                crc = await asyncio.to_thread(_write_chunk, handle, hasher, chunk, crc)
+            await asyncio.to_thread(handle.flush)
+            await asyncio.to_thread(os.fsync, handle.fileno())
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return SpooledUpload(path=temp_path, size=size, file_hash=format_hash(hasher), crc32=crc)
+
+
+async def spool_upload_file(
+    file: UploadFile,
+    directory: str,
+    max_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    algorithm: Optional[str] = None
+) -> SpooledUpload:
+    """把 UploadFile 按块写入临时文件"""
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    return await spool_stream(iter_upload_file(file, chunk_size), directory, max_size, algorithm)
+
+
+def spool_fileobj(
+    source: BinaryIO,
+    directory: str,
+    max_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    algorithm: Optional[str] = None
+) -> SpooledUpload:
+    """
+    spool_stream 的同步版本，在工作线程中使用（例如从归档中解压条目）
+    读取、写入和哈希都在调用线程中完成
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    hasher = new_hasher(algorithm)
+    size = 0
+    crc = 0
+
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"文件大小超过限制 ({max_size / 1024 / 1024}MB)"
+                    )
+                crc = _write_chunk(handle, hasher, chunk, crc)
+            handle.flush()
+            os.fsync(handle.fileno())
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return SpooledUpload(path=temp_path, size=size, file_hash=format_hash(hasher), crc32=crc)
+
+
+def hash_file(path: str, algorithm: Optional[str] = None) -> Tuple[str, int]:
+    """按块读取已在磁盘上的文件，返回 (内容哈希, CRC-32)；在工作线程中调用"""
+    hasher = new_hasher(algorithm)
+    crc = 0
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return format_hash(hasher), crc
+
+
+def rechunk(stream: AsyncIterator[bytes], chunk_size: int) -> AsyncIterator[bytes]:
+    """把请求体的任意大小分片整理为固定大小的块，减少线程切换次数"""
+    async def chunks():
+        buffer = bytearray()
+        async for piece in stream:
+            buffer += piece
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if buffer:
+            yield bytes(buffer)
+    return chunks()
@@ -0,0 +1,313 @@
+"""
+流式 ZIP 打包
+边读取存储中的文件边生成 ZIP，内存占用与归档大小无关
+已压缩的媒体文件使用存储模式（不压缩），其余文件用 deflate 压缩
+全部条目都是存储模式时，归档的每个字节在开始前就已确定（大小和 CRC 来自数据库），
+可以给出 Content-Length 并按任意字节范围续传
+"""
+
+import asyncio
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+# 超过这些值的字段需要 ZIP64 扩展，原字段写入占位值
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+METHOD_STORE = 0
+METHOD_DEFLATE = 8
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+# 高字节 3 表示 Unix，外部属性中的权限位才会被解压工具采用
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64
+EXTERNAL_ATTR = (0o100644 << 16)
+
+# 本身已经压缩过的类型，再次 deflate 只会浪费 CPU
+PRECOMPRESSED_PREFIXES = ("image/", "video/", "audio/")
+PRECOMPRESSED_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/x-rar-compressed",
+    "application/x-7z-compressed",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+# read(storage_path, start, end) -> 按块产生文件内容的闭区间 [start, end]
+ReadRange = Callable[[str, int, Optional[int]], AsyncIterator[bytes]]
+
+
+def is_precompressed(mime_type: Optional[str]) -> bool:
+    if not mime_type:
+        return False
+    return mime_type.startswith(PRECOMPRESSED_PREFIXES) or mime_type in PRECOMPRESSED_TYPES
+
+
+@dataclass
+class ZipEntry:
+    """归档中的一个文件"""
+    name: str
+    storage_path: str
+    size: int
+    modified_at: datetime
+    crc32: Optional[int] = None
+    compress: bool = False
+
+
+def _dos_datetime(value: datetime) -> Tuple[int, int]:
+    if value.year < 1980:
+        value = datetime(1980, 1, 1)
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return dos_time, dos_date
+
+
+class _EntryRecord:
+    """写出本地头时确定的条目信息，用于生成中央目录"""
+
+    __slots__ = ("name", "flags", "method", "dos_time", "dos_date", "crc32", "compressed_size", "size", "offset")
+
+    def __init__(self, entry: ZipEntry, flags: int, method: int, offset: int):
+        self.name = entry.name.encode("utf-8")
+        self.flags = flags
+        self.method = method
+        self.dos_time, self.dos_date = _dos_datetime(entry.modified_at)
+        self.crc32 = entry.crc32 or 0
+        self.compressed_size = entry.size if method == METHOD_STORE else 0
+        self.size = entry.size
+        self.offset = offset
+
+
+def _local_header(record: _EntryRecord, zip64: bool) -> bytes:
+    # 使用数据描述符时 CRC 和大小写在数据之后，本地头中为 0
+    deferred = record.flags & FLAG_DATA_DESCRIPTOR
+    crc32 = 0 if deferred else record.crc32
+    compressed_size, size = (0, 0) if deferred else (record.compressed_size, record.size)
+    if zip64:
+        extra = struct.pack("<HHQQ", 0x0001, 16, size, compressed_size)
+        sizes = (ZIP64_MARKER, ZIP64_MARKER)
+    else:
+        extra = b""
+        sizes = (compressed_size, size)
+    return struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50,
+        VERSION_ZIP64 if zip64 else VERSION_DEFAULT,
+        record.flags,
+        record.method,
+        record.dos_time,
+        record.dos_date,
+        crc32,
+        sizes[0],
+        sizes[1],
+        len(record.name),
+        len(extra)
+    ) + record.name + extra
+
+
+def _data_descriptor(record: _EntryRecord, zip64: bool) -> bytes:
+    if zip64:
+        return struct.pack("<IIQQ", 0x08074B50, record.crc32, record.compressed_size, record.size)
+    return struct.pack("<IIII", 0x08074B50, record.crc32, record.compressed_size, record.size)
+
+
+def _central_header(record: _EntryRecord) -> bytes:
+    # ZIP64 扩展中只出现超限的字段，顺序固定为 原始大小、压缩后大小、偏移
+    extra_fields = []
+    size, compressed_size, offset = record.size, record.compressed_size, record.offset
+    if size >= ZIP64_LIMIT:
+        extra_fields.append(size)
+        size = ZIP64_MARKER
+    if compressed_size >= ZIP64_LIMIT:
+        extra_fields.append(compressed_size)
+        compressed_size = ZIP64_MARKER
+    if offset >= ZIP64_LIMIT:
+        extra_fields.append(offset)
+        offset = ZIP64_MARKER
+    extra = b""
+    if extra_fields:
+        extra = struct.pack(f"<HH{len(extra_fields)}Q", 0x0001, 8 * len(extra_fields), *extra_fields)
+
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50,
+        VERSION_MADE_BY,
+        VERSION_ZIP64 if extra_fields else VERSION_DEFAULT,
+        record.flags,
+        record.method,
+        record.dos_time,
+        record.dos_date,
+        record.crc32,
+        compressed_size,
+        size,
+        len(record.name),
+        len(extra),
+        0,
+        0,
+        0,
+        EXTERNAL_ATTR,
+        offset
+    ) + record.name + extra
+
+
+def _central_directory(records: List[_EntryRecord], offset: int) -> bytes:
+    """中央目录和结束记录（需要时包含 ZIP64 结束记录和定位器）"""
+    directory = b"".join(_central_header(record) for record in records)
+    count = len(records)
+    size = len(directory)
+
+    tail = b""
+    if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+        zip64_end_offset = offset + size
+        tail += struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064B50, 44, VERSION_MADE_BY, VERSION_ZIP64, 0, 0, count, count, size, offset
+        )
+        tail += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+
+    tail += struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        ZIP64_COUNT_MARKER if count >= ZIP64_COUNT_LIMIT else count,
+        ZIP64_COUNT_MARKER if count >= ZIP64_COUNT_LIMIT else count,
+        ZIP64_MARKER if size >= ZIP64_LIMIT else size,
+        ZIP64_MARKER if offset >= ZIP64_LIMIT else offset,
+        0
+    )
+    return directory + tail
+
+
+class ZipStream:
+    """
+    按顺序读取各条目生成 ZIP
+    存储模式的条目需要预先知道 CRC-32；deflate 条目的 CRC 和压缩后大小在压缩时计算，写在数据描述符中
+    """
+
+    def __init__(self, entries: List[ZipEntry], read: ReadRange):
+        self.entries = entries
+        self.read = read
+        self._layout = None if any(entry.compress for entry in entries) else self._plan_layout()
+
+    @property
+    def size(self) -> Optional[int]:
+        """归档总大小，只有全部条目为存储模式时可以预先确定"""
+        if self._layout is None:
+            return None
+        return sum(length for _, length, _ in self._layout)
+
+    @property
+    def seekable(self) -> bool:
+        return self._layout is not None
+
+    def _plan_layout(self) -> List[Tuple[str, int, object]]:
+        """
+        全部为存储模式时的归档布局：依次为 (类型, 长度, 内容)
+        类型 "bytes" 的内容是头部字节，"file" 的内容是 ZipEntry
+        """
+        layout = []
+        records = []
+        offset = 0
+        for entry in self.entries:
+            record = _EntryRecord(entry, FLAG_UTF8, METHOD_STORE, offset)
+            header = _local_header(record, entry.size >= ZIP64_LIMIT)
+            layout.append(("bytes", len(header), header))
+            layout.append(("file", entry.size, entry))
+            records.append(record)
+            offset += len(header) + entry.size
+        directory = _central_directory(records, offset)
+        layout.append(("bytes", len(directory), directory))
+        return layout
+
+    async def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        产生归档的字节区间 [start, end]
+        只有可定位（全部存储模式）的归档支持 start > 0
+        """
+        if self._layout is None:
+            if start or end is not None:
+                raise ValueError("包含压缩条目的归档不支持按范围读取")
+            async for chunk in self._iter_sequential():
+                yield chunk
+            return
+
+        end = self.size - 1 if end is None else end
+        position = 0
+        for kind, length, content in self._layout:
+            segment_start, segment_end = position, position + length - 1
+            position += length
+            if segment_end < start or length == 0:
+                continue
+            if segment_start > end:
+                break
+            first = max(start, segment_start) - segment_start
+            last = min(end, segment_end) - segment_start
+            if kind == "bytes":
+                yield content[first:last + 1]
+            else:
+                async for chunk in self.read(content.storage_path, first, last):
+                    yield chunk
+
+    async def _iter_sequential(self) -> AsyncIterator[bytes]:
+        records = []
+        offset = 0
+        for entry in self.entries:
+            if entry.compress:
+                record = _EntryRecord(entry, FLAG_UTF8 | FLAG_DATA_DESCRIPTOR, METHOD_DEFLATE, offset)
+                # 压缩后可能略大于原始大小，留出余量决定是否使用 ZIP64
+                zip64 = entry.size * 1.05 + 1024 >= ZIP64_LIMIT
+            else:
+                record = _EntryRecord(entry, FLAG_UTF8, METHOD_STORE, offset)
+                zip64 = entry.size >= ZIP64_LIMIT
+            header = _local_header(record, zip64)
+            yield header
+            offset += len(header)
+
+            if entry.compress:
+                async for chunk in self._deflate(entry, record):
+                    offset += len(chunk)
+                    yield chunk
+                descriptor = _data_descriptor(record, zip64)
+                offset += len(descriptor)
+                yield descriptor
+            else:
+                async for chunk in self.read(entry.storage_path, 0, None):
+                    offset += len(chunk)
+                    yield chunk
+            records.append(record)
+
+        yield _central_directory(records, offset)
+
+    async def _deflate(self, entry: ZipEntry, record: _EntryRecord) -> AsyncIterator[bytes]:
+        """压缩条目内容，同时计算 CRC 和大小并写回 record"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc = 0
+        size = 0
+        compressed_size = 0
+
+        def compress(chunk: bytes, crc: int) -> Tuple[bytes, int]:
+            return compressor.compress(chunk), zlib.crc32(chunk, crc)
+
+        async for chunk in self.read(entry.storage_path, 0, None):
+            size += len(chunk)
+            data, crc = await asyncio.to_thread(compress, chunk, crc)
+            if data:
+                compressed_size += len(data)
+                yield data
+        data = compressor.flush()
+        compressed_size += len(data)
+        if data:
+            yield data
+
+        record.crc32 = crc
+        record.size = size
+        record.compressed_size = compressed_size
@@ -0,0 +1,122 @@
+"""
+文件上传基准测试
+对比旧的上传路径（整体读入内存计算 md5，再整体读入写盘）与流式上传
+（按块写入临时文件、同一遍计算哈希、原子重命名）的吞吐量和峰值 RSS
+每种方式在独立子进程中运行，峰值 RSS 互不影响
+
+Usage:
+    cd apps/backend
+    python scripts/bench_upload.py [--size-mb 100] [--repeat 3]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def legacy_upload(source: str, target_dir: str):
+    """旧实现: validate_file 读入全部内容计算 md5，upload_file 再读一遍并同步写盘"""
+    from fastapi import UploadFile
+
+    with open(source, "rb") as handle:
+        file = UploadFile(file=handle, filename="video.mp4")
+        await file.seek(0)
+        content = await file.read()
+        hashlib.md5(content).hexdigest()
+        await file.seek(0)
+
+        target = os.path.join(target_dir, "legacy.bin")
+        with open(target, "wb") as buffer:
+            content = await file.read()
+            buffer.write(content)
+
+
+async def streaming_upload(source: str, target_dir: str):
+    """新实现: 按块写入临时文件并计算 sha256，然后原子重命名"""
+    from fastapi import UploadFile
+    from app.services.upload_stream import spool_upload_file
+
+    with open(source, "rb") as handle:
+        file = UploadFile(file=handle, filename="video.mp4")
+        spooled = await spool_upload_file(file, os.path.join(target_dir, ".incoming"))
+        os.replace(spooled.path, os.path.join(target_dir, "streaming.bin"))
+
+
+async def measure_loop_stall(upload) -> float:
+    """上传期间事件循环的最大停顿（毫秒），反映是否阻塞其他请求"""
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await upload
+    done = True
+    await task
+    return stall * 1000
+
+
+def run_child(mode: str, source: str, repeat: int):
+    upload = legacy_upload if mode == "legacy" else streaming_upload
+    size = os.path.getsize(source)
+    with tempfile.TemporaryDirectory() as target_dir:
+        timings = []
+        stalls = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stalls.append(asyncio.run(measure_loop_stall(upload(source, target_dir))))
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{mode:<10}{size / best / 1024 / 1024:>12.0f}{peak_rss_mb():>16.1f}{max(stalls):>18.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.source, args.repeat)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as handle:
+        for _ in range(args.size_mb):
+            handle.write(os.urandom(1024 * 1024))
+        source = handle.name
+
+    try:
+        print(f"{args.size_mb} MB upload, best of {args.repeat}")
+        print(f"{'mode':<10}{'MB/s':>12}{'peak RSS MB':>16}{'loop stall ms':>18}")
+        for mode in ("legacy", "streaming"):
+            subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--source", source, "--repeat", str(args.repeat)],
+                check=True
+            )
+    finally:
+        os.unlink(source)
+
+
+if __name__ == "__main__":
+    main()
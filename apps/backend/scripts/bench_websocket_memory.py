@@ -0,0 +1,159 @@
+"""
+WebSocket 连接内存基准测试
+模拟大量空闲连接和协作会话，对比旧版数据结构（普通 dataclass、datetime、list 成员）
+与当前紧凑结构（slots、monotonic 时间戳、驻留重复ID、按需创建的会话缓冲、set 成员）的内存占用和成员检查耗时
+
+Usage:
+    cd apps/backend
+    python scripts/bench_websocket_memory.py [--connections 50000] [--session-size 50]
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.core.websocket_manager import CollaborationSession, UserConnection
+
+
+@dataclass
+class LegacyUserConnection:
+    """旧版连接结构"""
+    user_id: str
+    websocket: object
+    role: str
+    course_id: Optional[str] = None
+    assignment_id: Optional[str] = None
+    joined_at: datetime = None
+
+    def __post_init__(self):
+        if self.joined_at is None:
+            self.joined_at = datetime.utcnow()
+
+
+@dataclass
+class LegacyCollaborationSession:
+    """旧版会话结构"""
+    session_id: str
+    assignment_id: str
+    active_users: List[str]
+    current_grader: Optional[str] = None
+    last_activity: datetime = None
+
+    def __post_init__(self):
+        if self.last_activity is None:
+            self.last_activity = datetime.utcnow()
+
+
+class IdleSocket:
+    """空闲连接占位，不计入比较"""
+    __slots__ = ()
+
+
+def build_legacy(connections: int, session_size: int):
+    socket = IdleSocket()
+    conns = {}
+    sessions = {}
+    for i in range(connections):
+        # 旧代码中的ID来自每次请求解析出的新字符串
+        user_id = "".join(["user-", str(i)])
+        conns[user_id] = LegacyUserConnection(user_id=user_id, websocket=socket, role="".join(["t", "a"]))
+        session_id = f"collab_{i // session_size}"
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = LegacyCollaborationSession(
+                session_id=session_id, assignment_id=str(i // session_size), active_users=[]
+            )
+        if user_id not in session.active_users:
+            session.active_users.append(user_id)
+    return conns, sessions
+
+
+def build_compact(connections: int, session_size: int):
+    socket = IdleSocket()
+    conns = {}
+    sessions = {}
+    for i in range(connections):
+        user_id = "".join(["user-", str(i)])
+        connection = UserConnection(user_id=user_id, websocket=socket, role="".join(["t", "a"]))
+        conns[connection.user_id] = connection
+        session_id = sys.intern(f"collab_{i // session_size}")
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = CollaborationSession(
+                session_id=session_id, assignment_id=str(i // session_size)
+            )
+        session.active_users.add(connection.user_id)
+    return conns, sessions
+
+
+def measure(builder, connections: int, session_size: int):
+    """返回 (结构对象, 占用字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    result = builder(connections, session_size)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def object_cost(factory, count: int) -> float:
+    """只计算连接对象本身（ID字符串预先创建，不计入），每个对象的字节数"""
+    socket = IdleSocket()
+    user_ids = [f"user-{i}" for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    objects = [factory(user_id=user_id, websocket=socket, role="ta") for user_id in user_ids]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current / count
+
+
+def membership_cost(sessions, probes: int) -> float:
+    """join/leave 中的成员检查耗时（每次微秒）"""
+    session = next(iter(sessions.values()))
+    members = list(session.active_users)
+    missing = "user-absent"
+    start = time.perf_counter()
+    for i in range(probes):
+        _ = members[i % len(members)] in session.active_users
+        _ = missing in session.active_users
+    return (time.perf_counter() - start) / (probes * 2) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--session-size", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = []
+    for name, builder, factory in (
+        ("legacy", build_legacy, LegacyUserConnection),
+        ("compact", build_compact, UserConnection),
+    ):
+        (conns, sessions), size = measure(builder, args.connections, args.session_size)
+        member_us = membership_cost(sessions, 20000)
+        del conns, sessions
+        rows.append((name, size, object_cost(factory, args.connections), member_us))
+
+    print(f"{args.connections} connections, {args.session_size} users per session")
+    print(f"{'layout':<10}{'total MB':>12}{'bytes/conn':>14}{'conn object B':>16}{'member check us':>18}")
+    for name, size, object_bytes, member_us in rows:
+        print(f"{name:<10}{size / 1024 / 1024:>12.1f}{size / args.connections:>14.0f}"
+              f"{object_bytes:>16.0f}{member_us:>18.3f}")
+    legacy, compact = rows[0][1], rows[1][1]
+    print(f"saved: {(legacy - compact) / args.connections:.0f} bytes/connection "
+          f"({(1 - compact / legacy) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+WebSocket 进程内压测工具
+用假的 WebSocket 传输层驱动协作和通知两个 WebSocket 路由（以及 websocket_manager），
+模拟数千个客户端，可配置慢客户端和发送失败的客户端，
+报告广播延迟 p50/p99、每秒投递消息数、锁等待时间和内存占用
+不需要浏览器、网络或数据库服务
+
+Usage:
+    cd apps/backend
+    python scripts/loadtest_websocket.py [--clients 2000] [--session-size 50]
+        [--notification-clients 500] [--duration 5] [--rate 200]
+        [--slow-fraction 0.02] [--slow-delay-ms 20]
+        [--fail-fraction 0.01] [--fail-after 5]
+        [--protocol deeprubric.json]
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+# 使用内存 SQLite 代替数据库服务（通知端点连接时读取收件箱未读数）
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+# 压测不发送评分增量，不启用草稿持久化（避免创建日志目录）
+os.environ.setdefault("GRADING_DRAFT_PERSISTENCE", "false")
+
+from app.api.v1.dependencies import SessionLocal, create_tables
+from app.api.v1.routers.websocket import collaboration_websocket, notification_websocket
+from app.core.constants import UserRole
+from app.core.websocket_codec import SUPPORTED_CODECS
+from app.core.websocket_manager import websocket_manager
+
+
+PING_TYPE = "loadtest_ping"
+
+
+class ClientDisconnected(Exception):
+    """模拟客户端断开导致的发送失败"""
+
+
+@dataclass
+class LoadTestUser:
+    """路由依赖 get_current_user 返回的用户（只用到 id 和 role）"""
+    id: str
+    role: str
+
+
+class InstrumentedLock(asyncio.Lock):
+    """记录每次获取锁等待时间的 asyncio.Lock"""
+
+    def __init__(self):
+        super().__init__()
+        self.waits: List[float] = []
+
+    async def acquire(self):
+        start = time.perf_counter()
+        result = await super().acquire()
+        self.waits.append(time.perf_counter() - start)
+        return result
+
+
+class FakeWebSocket:
+    """
+    内存中的 WebSocket 传输层
+    服务端发送的帧直接解码并记录，客户端消息通过队列送入 receive()
+    """
+
+    def __init__(
+        self,
+        stats: "LoadTestStats",
+        protocol: Optional[str] = None,
+        send_delay: float = 0.0,
+        fail_after: Optional[int] = None
+    ):
+        self.stats = stats
+        self.scope: Dict[str, Any] = {"subprotocols": [protocol] if protocol else []}
+        self.query_params: Dict[str, str] = {}
+        self.codec = SUPPORTED_CODECS.get(protocol or "", SUPPORTED_CODECS["deeprubric.json"])
+        self.send_delay = send_delay
+        self.fail_after = fail_after
+        self.sent = 0
+        self.closed = False
+        self.inbox: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.accepted = asyncio.Event()
+
+    async def accept(self, subprotocol: Optional[str] = None):
+        self.accepted.set()
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        self.closed = True
+        self.accepted.set()
+
+    async def receive(self) -> Dict[str, Any]:
+        return await self.inbox.get()
+
+    async def send_text(self, frame: str):
+        await self._deliver(frame)
+
+    async def send_bytes(self, frame: bytes):
+        await self._deliver(frame)
+
+    async def _deliver(self, frame):
+        if self.closed:
+            raise ClientDisconnected("连接已关闭")
+        self.sent += 1
+        if self.fail_after is not None and self.sent > self.fail_after:
+            self.closed = True
+            raise ClientDisconnected("模拟客户端断开")
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+
+        self.stats.frames += 1
+        self.stats.bytes += len(frame)
+        message = self.codec.decode(frame)
+        if message.get("type") == PING_TYPE:
+            self.stats.latencies.append(time.perf_counter() - message["sent_at"])
+
+    def push(self, message: Dict[str, Any]):
+        """模拟客户端发送一条消息"""
+        frame = self.codec.encode(message)
+        key = "bytes" if isinstance(frame, bytes) else "text"
+        self.inbox.put_nowait({"type": "websocket.receive", key: frame})
+
+    def hang_up(self):
+        """模拟客户端关闭连接"""
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+
+@dataclass
+class LoadTestStats:
+    """压测统计"""
+    frames: int = 0
+    bytes: int = 0
+    latencies: List[float] = field(default_factory=list)
+    pings_sent: int = 0
+
+
+@dataclass
+class SimulatedClient:
+    """一个模拟客户端及其路由任务"""
+    user: LoadTestUser
+    websocket: FakeWebSocket
+    task: Optional[asyncio.Task] = None
+    assignment_id: Optional[str] = None
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def open_clients(args, stats: LoadTestStats, db) -> List[SimulatedClient]:
+    """按配置建立协作和通知客户端，等待全部握手完成"""
+    rng = random.Random(args.seed)
+    clients = []
+
+    def make_socket() -> FakeWebSocket:
+        roll = rng.random()
+        if roll < args.fail_fraction:
+            return FakeWebSocket(stats, args.protocol, fail_after=args.fail_after)
+        if roll < args.fail_fraction + args.slow_fraction:
+            return FakeWebSocket(stats, args.protocol, send_delay=args.slow_delay_ms / 1000)
+        return FakeWebSocket(stats, args.protocol)
+
+    for i in range(args.clients):
+        client = SimulatedClient(
+            user=LoadTestUser(id=f"grader-{i}", role=UserRole.TA.value),
+            websocket=make_socket(),
+            assignment_id=str(i // args.session_size)
+        )
+        client.task = asyncio.create_task(collaboration_websocket(
+            client.websocket, client.assignment_id,
+            last_seq=None, db=db, current_user=client.user
+        ))
+        clients.append(client)
+
+    for i in range(args.notification_clients):
+        client = SimulatedClient(
+            user=LoadTestUser(id=f"student-{i}", role="student"),
+            websocket=make_socket()
+        )
+        client.task = asyncio.create_task(notification_websocket(
+            client.websocket, db=db, current_user=client.user
+        ))
+        client.websocket.push({"type": "subscribe_course", "course_id": "loadtest"})
+        clients.append(client)
+
+    await asyncio.gather(*(client.websocket.accepted.wait() for client in clients))
+    # 让加入会话、快照等初始消息发送完毕
+    await asyncio.sleep(0.5)
+    return clients
+
+
+async def drive_traffic(args, clients: List[SimulatedClient], stats: LoadTestStats):
+    """
+    按固定速率发送消息:
+    协作客户端发送的 ping 经路由转发给会话内所有成员，
+    每 --course-every 条额外向通知客户端做一次课程广播
+    """
+    rng = random.Random(args.seed + 1)
+    graders = [client for client in clients if client.assignment_id is not None]
+    interval = 1 / args.rate
+    deadline = time.perf_counter() + args.duration
+    sent = 0
+
+    while time.perf_counter() < deadline:
+        sent += 1
+        message = {"type": PING_TYPE, "id": sent, "sent_at": time.perf_counter()}
+        if args.notification_clients and sent % args.course_every == 0:
+            await websocket_manager.broadcast_to_course("loadtest", message)
+        elif graders:
+            sender = rng.choice(graders)
+            if not sender.task.done():
+                sender.websocket.push(message)
+        stats.pings_sent += 1
+        await asyncio.sleep(interval)
+
+
+async def close_clients(clients: List[SimulatedClient]):
+    for client in clients:
+        client.websocket.hang_up()
+    await asyncio.gather(*(client.task for client in clients), return_exceptions=True)
+
+
+async def run(args) -> Dict[str, Any]:
+    stats = LoadTestStats()
+    lock = InstrumentedLock()
+    websocket_manager.lock = lock
+    await websocket_manager.start()
+    create_tables()
+    db = SessionLocal()
+
+    gc.collect()
+    tracemalloc.start()
+    connect_start = time.perf_counter()
+    clients = await open_clients(args, stats, db)
+    connect_time = time.perf_counter() - connect_start
+    connected_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lock.waits.clear()
+    frames_before = stats.frames
+    traffic_start = time.perf_counter()
+    await drive_traffic(args, clients, stats)
+    # 等待慢客户端上的排队消息发送完毕
+    while True:
+        frames = stats.frames
+        await asyncio.sleep(0.2)
+        if stats.frames == frames:
+            break
+    traffic_time = time.perf_counter() - traffic_start
+    traffic_frames = stats.frames - frames_before
+
+    metrics = websocket_manager.get_metrics()
+    remaining = len(websocket_manager.active_connections)
+    await close_clients(clients)
+    await websocket_manager.stop()
+    db.close()
+
+    total = len(clients)
+    return {
+        "clients": total,
+        "connect_time": connect_time,
+        "connected_bytes": connected_bytes,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "pings_sent": stats.pings_sent,
+        "frames": traffic_frames,
+        "bytes": stats.bytes,
+        "throughput": traffic_frames / traffic_time if traffic_time else 0.0,
+        "latency_p50": percentile(stats.latencies, 0.50),
+        "latency_p99": percentile(stats.latencies, 0.99),
+        "latency_max": max(stats.latencies, default=0.0),
+        "lock_wait_p99": percentile(lock.waits, 0.99),
+        "lock_wait_max": max(lock.waits, default=0.0),
+        "lock_acquisitions": len(lock.waits),
+        "dropped_clients": total - remaining,
+        "metrics": metrics,
+    }
+
+
+def report(args, result: Dict[str, Any]):
+    ms = 1000
+    print(f"{result['clients']} clients ({args.clients} collaboration in sessions of {args.session_size}, "
+          f"{args.notification_clients} notification), protocol {args.protocol or 'deeprubric.json'}")
+    print(f"slow clients {args.slow_fraction:.0%} (+{args.slow_delay_ms}ms/frame), "
+          f"failing clients {args.fail_fraction:.0%} (after {args.fail_after} frames)")
+    print(f"connect:     {result['connect_time']:.2f}s, "
+          f"{result['connected_bytes'] / result['clients']:.0f} B/client traced, "
+          f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB")
+    print(f"traffic:     {result['pings_sent']} broadcasts -> {result['frames']} frames, "
+          f"{result['throughput']:.0f} msg/s")
+    print(f"latency:     p50 {result['latency_p50'] * ms:.2f}ms, p99 {result['latency_p99'] * ms:.2f}ms, "
+          f"max {result['latency_max'] * ms:.2f}ms")
+    print(f"lock wait:   p99 {result['lock_wait_p99'] * ms:.3f}ms, max {result['lock_wait_max'] * ms:.3f}ms "
+          f"over {result['lock_acquisitions']} acquisitions")
+    print(f"dropped:     {result['dropped_clients']} clients disconnected after send failures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000, help="协作客户端数")
+    parser.add_argument("--session-size", type=int, default=50, help="每个协作会话的客户端数")
+    parser.add_argument("--notification-clients", type=int, default=500, help="通知客户端数")
+    parser.add_argument("--duration", type=float, default=5.0, help="发送消息的秒数")
+    parser.add_argument("--rate", type=float, default=200.0, help="每秒广播次数")
+    parser.add_argument("--course-every", type=int, default=10, help="每 N 次广播做一次课程广播")
+    parser.add_argument("--slow-fraction", type=float, default=0.02, help="慢客户端比例")
+    parser.add_argument("--slow-delay-ms", type=float, default=20.0, help="慢客户端每帧延迟")
+    parser.add_argument("--fail-fraction", type=float, default=0.01, help="发送失败客户端比例")
+    parser.add_argument("--fail-after", type=int, default=5, help="失败客户端在第 N 帧后断开")
+    parser.add_argument("--protocol", default=None, choices=sorted(SUPPORTED_CODECS), help="协商的子协议")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="CRITICAL")
+    args = parser.parse_args()
+
+    logging.getLogger("deeprubric").setLevel(args.log_level.upper())
+    report(args, asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
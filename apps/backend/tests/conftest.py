@@ -0,0 +1,175 @@
+"""
+测试夹具
+整个测试会话使用临时 SQLite 数据库和上传目录（必须在导入 app 之前设置环境变量），
+每个测试前重建数据表；路由测试通过真实的 JWT 认证依赖访问
+"""
+
+import os
+import tempfile
+
+_TEST_ROOT = tempfile.mkdtemp(prefix="deeprubric-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_ROOT, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_TEST_ROOT, "uploads")
+os.environ["ENVIRONMENT"] = "test"
+os.environ["PREVIEW_ENABLED"] = "false"
+# 合并窗口为 0 时评分增量立即应用和广播，路由测试无需等待
+os.environ["WEBSOCKET_COALESCE_INTERVAL_MS"] = "0"
+os.environ["GRADING_DRAFT_PERSISTENCE"] = "false"
+
+import itertools
+import json
+from types import SimpleNamespace
+from typing import Callable, Dict
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.db.base  # noqa: F401  注册全部模型
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.core.security import create_access_token
+from app.core.websocket_backplane import InMemoryBackplane
+from app.core.websocket_manager import websocket_manager
+from app.db.base_class import Base
+from app.db.session import SessionLocal, engine
+from app.main import app as fastapi_app
+from app.models.assignment import Assignment
+from app.models.course import Course
+from app.models.orm.base import Base as OrmBase
+from app.models.submission import Submission
+from app.models.user import User
+
+
+@pytest.fixture(autouse=True)
+def database():
+    """每个测试使用空表"""
+    OrmBase.metadata.drop_all(engine)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    OrmBase.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(monkeypatch, tmp_path):
+    """每个测试使用独立的上传目录（文件服务在应用启动时按当前配置创建）"""
+    directory = tmp_path / "uploads"
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(directory))
+    return directory
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    """带应用启动/关闭事件的测试客户端"""
+    # 全局管理器从空的连接、会话和租约（保存在广播总线上）开始；每个 TestClient 使用新的事件循环，锁也需要重新创建
+    websocket_manager.__init__(InMemoryBackplane(), websocket_manager.draft_store)
+    with TestClient(fastapi_app) as test_client:
+        yield test_client
+
+
+_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def make_user(db) -> Callable[..., User]:
+    """创建数据库用户"""
+    def factory(role: UserRole = UserRole.PROFESSOR, **fields) -> User:
+        number = next(_user_numbers)
+        user = User(
+            email=f"user{number}@example.edu",
+            full_name=f"User {number}",
+            hashed_password="not-used",
+            role=role,
+            **fields
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user
+    return factory
+
+
+@pytest.fixture
+def course(db, make_user) -> SimpleNamespace:
+    """一门课程: 教授、助教、两名学生，一个作业及两名学生各自的提交"""
+    professor = make_user(UserRole.PROFESSOR)
+    assistant = make_user(UserRole.TA)
+    students = [make_user(UserRole.STUDENT), make_user(UserRole.STUDENT)]
+    course = Course(name="Algorithms", code=f"CS-{professor.id}", professor_id=professor.id, is_active=True)
+    db.add(course)
+    db.flush()
+    assignment = Assignment(title="Homework 1", course_id=course.id)
+    db.add(assignment)
+    db.flush()
+    submissions = [Submission(assignment_id=assignment.id, student_id=student.id) for student in students]
+    db.add_all(submissions)
+    db.commit()
+    return SimpleNamespace(
+        id=course.id,
+        professor=professor,
+        assistant=assistant,
+        students=students,
+        assignment_id=assignment.id,
+        submission_ids=[submission.id for submission in submissions],
+    )
+
+
+def _token_for(user: User) -> str:
+    return create_access_token({"sub": str(user.id)})
+
+
+@pytest.fixture
+def access_token() -> Callable[[User], str]:
+    """用户的访问令牌"""
+    return _token_for
+
+
+@pytest.fixture
+def auth_headers() -> Callable[[User], Dict[str, str]]:
+    """用户的 Authorization 请求头"""
+    return lambda user: {"Authorization": f"Bearer {_token_for(user)}"}
+
+
+class FakeWebSocket:
+    """记录已发送消息的 WebSocket 替身，用于直接驱动 WebSocketManager"""
+
+    def __init__(self, subprotocols=(), query_params=None):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.query_params = query_params or {}
+        self.sent = []
+        self.accepted = False
+        self.closed_with = None
+        self.fail_sends = False
+
+    async def accept(self, subprotocol=None):
+        self.accepted = True
+
+    async def send_text(self, frame: str):
+        if self.fail_sends:
+            raise RuntimeError("connection reset")
+        self.sent.append(json.loads(frame))
+
+    async def send_bytes(self, frame: bytes):
+        if self.fail_sends:
+            raise RuntimeError("connection reset")
+        self.sent.append(frame)
+
+    async def close(self, code: int = 1000, reason=None):
+        self.closed_with = code
+
+    def of_type(self, message_type: str):
+        return [message for message in self.sent if message.get("type") == message_type]
+
+
+@pytest.fixture
+def fake_socket() -> Callable[..., FakeWebSocket]:
+    return FakeWebSocket
@@ -0,0 +1,138 @@
+"""
+作业提交打包导出测试
+通过真实路由流式生成 ZIP：过滤条件、存储模式下的 Range 续传和 ETag、HEAD 请求
+"""
+
+import io
+import zipfile
+
+import pytest
+
+from app.models.submission import Submission
+
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40
+TEXT = b"def solve():\n    return 42\n" * 200
+
+
+def upload(client, headers, submission_id, name, data, content_type):
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={submission_id}",
+        files={"file": (name, data, content_type)},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def submitted(client, course, auth_headers):
+    """第一名学生提交 PDF 和文本，第二名学生提交 PDF"""
+    first, second = course.students
+    upload(client, auth_headers(first), course.submission_ids[0], "report.pdf", PDF, "application/pdf")
+    upload(client, auth_headers(first), course.submission_ids[0], "main.txt", TEXT, "text/plain")
+    upload(client, auth_headers(second), course.submission_ids[1], "report.pdf", PDF + b"2", "application/pdf")
+    return course
+
+
+def archive_url(course, **params):
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    return f"/api/v1/files/assignment/{course.assignment_id}/archive" + (f"?{query}" if query else "")
+
+
+def read_archive(content: bytes):
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: (archive.read(info), info.compress_type) for info in archive.infolist()}
+
+
+def test_auto_archive_compresses_text_and_streams_without_ranges(client, submitted, auth_headers):
+    response = client.get(archive_url(submitted), headers=auth_headers(submitted.professor))
+    first, second = submitted.students
+    sub_a, sub_b = submitted.submission_ids
+
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "none"
+    assert "assignment_" in response.headers["content-disposition"]
+    entries = read_archive(response.content)
+    assert entries == {
+        f"student_{first.id}/submission_{sub_a}/report.pdf": (PDF, zipfile.ZIP_STORED),
+        f"student_{first.id}/submission_{sub_a}/main.txt": (TEXT, zipfile.ZIP_DEFLATED),
+        f"student_{second.id}/submission_{sub_b}/report.pdf": (PDF + b"2", zipfile.ZIP_STORED),
+    }
+
+
+def test_store_archive_supports_ranges_and_etag(client, submitted, auth_headers):
+    headers = auth_headers(submitted.assistant)
+    url = archive_url(submitted, compression="store")
+
+    full = client.get(url, headers=headers)
+    resumed = client.get(url, headers={**headers, "Range": "bytes=1000-"})
+    unchanged = client.get(url, headers={**headers, "If-None-Match": full.headers["etag"]})
+
+    assert full.status_code == 200
+    assert full.headers["accept-ranges"] == "bytes"
+    assert int(full.headers["content-length"]) == len(full.content)
+    assert all(compress_type == zipfile.ZIP_STORED for _, compress_type in read_archive(full.content).values())
+    assert resumed.status_code == 206
+    assert resumed.content == full.content[1000:]
+    assert resumed.headers["content-range"] == f"bytes 1000-{len(full.content) - 1}/{len(full.content)}"
+    assert unchanged.status_code == 304
+
+
+def test_store_archive_etag_changes_with_contents(client, submitted, auth_headers):
+    url = archive_url(submitted, compression="store")
+    before = client.get(url, headers=auth_headers(submitted.professor)).headers["etag"]
+    upload(client, auth_headers(submitted.students[1]), submitted.submission_ids[1],
+           "appendix.pdf", PDF + b"appendix", "application/pdf")
+    after = client.get(url, headers=auth_headers(submitted.professor)).headers["etag"]
+
+    assert before != after
+
+
+def test_head_returns_archive_headers_without_body(client, submitted, auth_headers):
+    url = archive_url(submitted, compression="store")
+    full = client.get(url, headers=auth_headers(submitted.professor))
+    head = client.head(url, headers=auth_headers(submitted.professor))
+
+    assert head.status_code == 200
+    assert head.content == b""
+    assert head.headers["content-length"] == full.headers["content-length"]
+    assert head.headers["etag"] == full.headers["etag"]
+
+
+def test_status_filter_selects_graded_submissions(client, submitted, auth_headers, db):
+    graded = db.get(Submission, submitted.submission_ids[0])
+    graded.graded_by = submitted.professor.id
+    db.commit()
+    headers = auth_headers(submitted.professor)
+
+    graded_names = read_archive(client.get(archive_url(submitted, status="graded"), headers=headers).content)
+    ungraded_names = read_archive(client.get(archive_url(submitted, status="ungraded"), headers=headers).content)
+    invalid = client.get(archive_url(submitted, status="late"), headers=headers)
+
+    assert {name.split("/")[0] for name in graded_names} == {f"student_{submitted.students[0].id}"}
+    assert {name.split("/")[0] for name in ungraded_names} == {f"student_{submitted.students[1].id}"}
+    assert invalid.status_code == 422
+
+
+def test_student_filter_and_empty_selection(client, submitted, auth_headers):
+    headers = auth_headers(submitted.professor)
+    second = submitted.students[1]
+
+    selected = read_archive(client.get(archive_url(submitted, student_id=second.id), headers=headers).content)
+    empty = client.get(archive_url(submitted, student_id=999999), headers=headers)
+
+    assert list(selected) == [f"student_{second.id}/submission_{submitted.submission_ids[1]}/report.pdf"]
+    assert empty.status_code == 404
+
+
+def test_duplicate_file_names_are_renamed(client, course, auth_headers):
+    student = course.students[0]
+    for data in (PDF, PDF + b"v2"):
+        upload(client, auth_headers(student), course.submission_ids[0], "report.pdf", data, "application/pdf")
+
+    response = client.get(archive_url(course), headers=auth_headers(course.professor))
+    folder = f"student_{student.id}/submission_{course.submission_ids[0]}"
+
+    assert sorted(read_archive(response.content)) == [f"{folder}/report (2).pdf", f"{folder}/report.pdf"]
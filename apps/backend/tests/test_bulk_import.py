@@ -0,0 +1,198 @@
+"""
+批量导入测试
+通过真实路由上传 ZIP：清单和命名约定对应学生、跳过的条目、去重、分批进度和配额
+"""
+
+import io
+import json
+import zipfile
+
+import pytest
+
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.models.submission import FileBlob, StorageUsage, Submission, SubmissionFile
+
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40
+
+
+def make_archive(entries) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def import_archive(client, course, headers, content):
+    return client.post(
+        f"/api/v1/files/assignment/{course.assignment_id}/import",
+        content=content,
+        headers={**headers, "Content-Type": "application/zip"},
+    )
+
+
+def events_of(response):
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def files_by_student(db, course):
+    db.expire_all()
+    rows = db.query(Submission.student_id, SubmissionFile.file_name).join(
+        Submission, SubmissionFile.submission_id == Submission.id
+    ).filter(Submission.assignment_id == course.assignment_id)
+    result = {}
+    for student_id, file_name in rows:
+        result.setdefault(student_id, []).append(file_name)
+    return {student_id: sorted(names) for student_id, names in result.items()}
+
+
+def test_manifest_maps_entries_by_id_and_email(client, course, auth_headers, make_user, db):
+    first, second = course.students
+    # 没有提交的学生导入时创建提交
+    late = make_user(UserRole.STUDENT)
+    manifest = (
+        "file,student_id\n"
+        f"scans/a.pdf,{first.id}\n"
+        f"scans/b.pdf,{second.id}\n"
+        f"scans/c.pdf,{late.id}\n"
+    )
+    content = make_archive({
+        "manifest.csv": manifest,
+        "scans/a.pdf": PDF + b"a",
+        "scans/b.pdf": PDF + b"b",
+        "scans/c.pdf": PDF + b"c",
+        "scans/unlisted.pdf": PDF + b"x",
+    })
+
+    events = events_of(import_archive(client, course, auth_headers(course.professor), content))
+
+    assert events[0] == {**events[0], "type": "started", "total": 3}
+    assert events[-1]["type"] == "complete"
+    assert events[-1]["stored"] == 3
+    assert events[-1]["skipped_entries"] == [{"entry": "scans/unlisted.pdf", "reason": "不在清单中"}]
+    assert files_by_student(db, course) == {first.id: ["a.pdf"], second.id: ["b.pdf"], late.id: ["c.pdf"]}
+
+
+def test_manifest_with_student_email(client, course, auth_headers, db):
+    first = course.students[0]
+    content = make_archive({
+        "manifest.csv": f"file,student_email\nessay.pdf,{first.email.upper()}\nother.pdf,nobody@example.edu\n",
+        "essay.pdf": PDF,
+        "other.pdf": PDF + b"other",
+    })
+
+    events = events_of(import_archive(client, course, auth_headers(course.assistant), content))
+
+    assert files_by_student(db, course) == {first.id: ["essay.pdf"]}
+    assert [entry["entry"] for entry in events[-1]["skipped_entries"]] == ["other.pdf"]
+
+
+def test_manifest_without_student_column_is_rejected(client, course, auth_headers):
+    content = make_archive({"manifest.csv": "file,name\na.pdf,Alice\n", "a.pdf": PDF})
+
+    response = import_archive(client, course, auth_headers(course.professor), content)
+
+    assert response.status_code == 400
+    assert "student_id" in response.json()["detail"]
+
+
+def test_naming_convention_and_skipped_entries(client, course, auth_headers, db):
+    first, second = course.students
+    content = make_archive({
+        f"student_{first.id}/report.pdf": PDF + b"1",
+        f"{second.id}_report.pdf": PDF + b"2",
+        "__MACOSX/._report.pdf": b"resource fork",
+        f"student_{first.id}/.DS_Store": b"finder",
+        "readme.pdf": PDF + b"readme",
+        f"student_{first.id}/setup.exe": b"MZ",
+        "999999/report.pdf": PDF + b"ghost",
+    })
+
+    events = events_of(import_archive(client, course, auth_headers(course.professor), content))
+    skipped = {entry["entry"]: entry["reason"] for entry in events[-1]["skipped_entries"]}
+
+    assert files_by_student(db, course) == {first.id: ["report.pdf"], second.id: [f"{second.id}_report.pdf"]}
+    assert skipped == {
+        "readme.pdf": "无法对应到学生",
+        f"student_{first.id}/setup.exe": "不支持的文件类型",
+        "999999/report.pdf": "学生 999999 不存在",
+    }
+
+
+def test_identical_entries_share_one_blob_across_batches(client, course, auth_headers, monkeypatch, db):
+    monkeypatch.setattr(settings, "BULK_IMPORT_BATCH_SIZE", 1)
+    first, second = course.students
+    content = make_archive({
+        f"student_{first.id}/a.pdf": PDF,
+        f"student_{second.id}/a.pdf": PDF,
+        f"student_{second.id}/b.pdf": PDF + b"b",
+    })
+
+    events = events_of(import_archive(client, course, auth_headers(course.professor), content))
+    db.expire_all()
+
+    assert [event["type"] for event in events] == ["started", "progress", "progress", "progress", "complete"]
+    assert events[-1] == {**events[-1], "processed": 3, "stored": 2, "deduplicated": 1, "skipped": 0}
+    assert sorted(blob.ref_count for blob in db.query(FileBlob)) == [1, 2]
+    usage = {(row.scope, row.scope_id): (row.file_count, row.used_bytes) for row in db.query(StorageUsage)}
+    assert usage[("course", course.id)] == (3, 3 * len(PDF) + 1)
+    assert usage[("user", second.id)] == (2, 2 * len(PDF) + 1)
+
+
+def test_import_removes_spooled_archive(client, course, auth_headers, upload_dir):
+    content = make_archive({f"student_{course.students[0].id}/a.pdf": PDF})
+
+    events_of(import_archive(client, course, auth_headers(course.professor), content))
+
+    assert list((upload_dir / ".incoming").iterdir()) == []
+
+
+def test_student_over_quota_is_skipped(client, course, auth_headers, monkeypatch, db):
+    monkeypatch.setattr(settings, "USER_STORAGE_QUOTA", len(PDF) + 100)
+    first, second = course.students
+    content = make_archive({
+        f"student_{first.id}/a.pdf": PDF,
+        f"student_{first.id}/b.pdf": PDF + b"b",
+        f"student_{second.id}/a.pdf": PDF,
+    })
+
+    events = events_of(import_archive(client, course, auth_headers(course.professor), content))
+
+    assert files_by_student(db, course) == {second.id: ["a.pdf"]}
+    assert sorted(entry["entry"] for entry in events[-1]["skipped_entries"]) == [
+        f"student_{first.id}/a.pdf", f"student_{first.id}/b.pdf"]
+
+
+def test_course_over_quota_rejects_whole_archive(client, course, auth_headers, monkeypatch, db):
+    monkeypatch.setattr(settings, "COURSE_STORAGE_QUOTA", len(PDF) + 100)
+    content = make_archive({f"student_{student.id}/a.pdf": PDF + bytes([student.id % 256])
+                            for student in course.students})
+
+    response = import_archive(client, course, auth_headers(course.professor), content)
+
+    assert response.status_code == 413
+    assert files_by_student(db, course) == {}
+
+
+@pytest.mark.parametrize("assignment_id, content, status", [
+    (None, b"not a zip archive", 400),
+    (999999, make_archive({"1/a.pdf": PDF}), 404),
+])
+def test_invalid_imports_are_rejected(client, course, auth_headers, assignment_id, content, status):
+    response = client.post(
+        f"/api/v1/files/assignment/{assignment_id or course.assignment_id}/import",
+        content=content,
+        headers={**auth_headers(course.professor), "Content-Type": "application/zip"},
+    )
+    assert response.status_code == status
+
+
+def test_oversized_archive_is_rejected_by_content_length(client, course, auth_headers, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_IMPORT_MAX_ARCHIVE_SIZE", 100)
+
+    response = import_archive(client, course, auth_headers(course.professor), make_archive({"1/a.pdf": PDF}))
+
+    assert response.status_code == 413
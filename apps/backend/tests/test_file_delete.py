@@ -0,0 +1,147 @@
+"""
+删除文件测试
+记录先提交，之后存储内容才移入隔离区；规范化文件的原件同样处理
+"""
+
+import asyncio
+import io
+import os
+import random
+
+import pytest
+
+from app.core.config import settings
+from app.models.submission import FileBlob, StorageUsage, SubmissionFile
+from app.services.file_service import get_file_service
+
+DATA = b"%PDF-1.4\n" + os.urandom(50_000)
+
+
+def upload(client, headers, submission_id, data=DATA, name="report.pdf", content_type="application/pdf"):
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={submission_id}&file_name={name}",
+        content=data, headers={**headers, "Content-Type": content_type},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def blob_paths(db):
+    db.expire_all()
+    return {blob.file_hash: blob.storage_path for blob in db.query(FileBlob)}
+
+
+def usage(db):
+    db.expire_all()
+    return {(row.scope, row.scope_id): (row.file_count, row.used_bytes) for row in db.query(StorageUsage)}
+
+
+def test_delete_quarantines_content_after_commit(client, course, auth_headers, db):
+    student, staff = auth_headers(course.students[0]), auth_headers(course.professor)
+    file_id = upload(client, student, course.submission_ids[0])
+    (path,) = blob_paths(db).values()
+
+    response = client.delete(f"/api/v1/files/{file_id}", headers=staff)
+    quarantine_path = get_file_service().storage_backend.get_quarantine_path(path)
+
+    assert response.status_code == 200
+    assert blob_paths(db) == {}
+    assert not os.path.exists(path)
+    with open(quarantine_path, "rb") as quarantined:
+        assert quarantined.read() == DATA
+    assert usage(db)[("user", course.students[0].id)] == (0, 0)
+
+
+def test_shared_content_stays_until_last_reference(client, course, auth_headers, db):
+    first = upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    second = upload(client, auth_headers(course.students[1]), course.submission_ids[1])
+    (path,) = blob_paths(db).values()
+    staff = auth_headers(course.assistant)
+
+    client.delete(f"/api/v1/files/{first}", headers=staff)
+    assert os.path.exists(path)
+    assert client.get(f"/api/v1/files/{second}/download", headers=staff).content == DATA
+
+    client.delete(f"/api/v1/files/{second}", headers=staff)
+    assert not os.path.exists(path)
+
+
+def test_failed_commit_keeps_record_and_content(client, course, auth_headers, db, monkeypatch):
+    file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    (path,) = blob_paths(db).values()
+    before = usage(db)
+
+    def fail_commit():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(db, "commit", fail_commit)
+    with pytest.raises(RuntimeError):
+        asyncio.run(get_file_service().delete_file(None, db, file_id))
+    monkeypatch.undo()
+
+    assert db.query(SubmissionFile).filter(SubmissionFile.id == file_id).count() == 1
+    assert list(blob_paths(db).values()) == [path]
+    with open(path, "rb") as stored:
+        assert stored.read() == DATA
+    assert usage(db) == before
+
+
+def test_content_reused_during_delete_is_restored(client, course, auth_headers, db, monkeypatch):
+    file_service = get_file_service()
+    file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    (path,) = blob_paths(db).values()
+    quarantine_file = file_service.storage_backend.quarantine_file
+
+    async def upload_then_quarantine(file_path):
+        # 提交删除之后、移动内容之前，另一个上传重新写入了相同内容
+        upload(client, auth_headers(course.students[1]), course.submission_ids[1])
+        return await quarantine_file(file_path)
+
+    monkeypatch.setattr(file_service.storage_backend, "quarantine_file", upload_then_quarantine)
+    assert asyncio.run(file_service.delete_file(None, db, file_id))
+
+    assert list(blob_paths(db).values()) == [path]
+    with open(path, "rb") as stored:
+        assert stored.read() == DATA
+    assert not os.path.exists(file_service.storage_backend.get_quarantine_path(path))
+
+
+def test_garbage_collection_purges_deleted_content(client, course, auth_headers, monkeypatch):
+    file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    staff = auth_headers(course.professor)
+    client.delete(f"/api/v1/files/{file_id}", headers=staff)
+    monkeypatch.setattr(settings, "GC_QUARANTINE_PERIOD", 0)
+
+    report = asyncio.run(get_file_service().garbage_collector.run())
+
+    assert report["purged_files"] == 1
+
+
+def test_normalized_image_releases_original_too(course, auth_headers, db, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    from fastapi.testclient import TestClient
+    from app.main import app as fastapi_app
+
+    monkeypatch.setattr(settings, "IMAGE_NORMALIZE_ENABLED", True)
+    monkeypatch.setattr(settings, "IMAGE_NORMALIZE_MIN_SIZE", 10_000)
+    monkeypatch.setattr(settings, "IMAGE_NORMALIZE_MAX_DIMENSION", 200)
+    noise = Image.frombytes("RGB", (100, 75), random.Random(0).randbytes(100 * 75 * 3)).resize((800, 600))
+    buffer = io.BytesIO()
+    noise.save(buffer, "JPEG", quality=95)
+    photo = buffer.getvalue()
+
+    with TestClient(fastapi_app) as client:
+        file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0],
+                         data=photo, name="photo.jpg", content_type="image/jpeg")
+        record = db.query(SubmissionFile).filter(SubmissionFile.id == file_id).one()
+        assert record.original_hash and record.original_hash != record.file_hash
+        paths = list(blob_paths(db).values())
+        quarantine_paths = [get_file_service().storage_backend.get_quarantine_path(path) for path in paths]
+
+        response = client.delete(f"/api/v1/files/{file_id}", headers=auth_headers(course.professor))
+
+    assert response.status_code == 200
+    assert blob_paths(db) == {}
+    assert len(paths) == 2
+    assert not any(os.path.exists(path) for path in paths)
+    assert all(os.path.exists(path) for path in quarantine_paths)
@@ -0,0 +1,125 @@
+"""
+下载测试：Range / 206、ETag 条件请求和 Content-Disposition
+"""
+
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.submission import SubmissionFile
+from app.services.file_download import content_disposition, etag_matches, make_etag, parse_range
+
+DATA = b"%PDF-1.4\n" + os.urandom(100_000)
+
+
+@pytest.fixture
+def uploaded(client, course, auth_headers):
+    headers = auth_headers(course.students[0])
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=lecture notes.pdf",
+        content=DATA, headers={**headers, "Content-Type": "application/pdf"},
+    )
+    assert response.status_code == 200, response.text
+    return f"/api/v1/files/{response.json()['id']}/download", headers
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=95-500", (95, 99)),
+    ("bytes=0-1,5-6", None),
+    ("bytes=9-3", None),
+    ("items=0-1", None),
+    ("bytes=abc-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as exc_info:
+        parse_range(header, 100)
+    assert exc_info.value.status_code == 416
+    assert exc_info.value.headers["Content-Range"] == "bytes */100"
+
+
+def test_etag_helpers():
+    etag = make_etag("sha256:abc")
+    assert etag == '"sha256-abc"'
+    assert etag_matches(f'W/{etag}, "other"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert content_disposition("report.pdf") == 'attachment; filename="report.pdf"'
+    assert content_disposition("报告.pdf", inline=True) == (
+        "inline; filename=\"__.pdf\"; filename*=utf-8''%E6%8A%A5%E5%91%8A.pdf")
+    assert content_disposition('a"b.pdf') == "attachment; filename=\"a_b.pdf\"; filename*=utf-8''a%22b.pdf"
+    assert content_disposition(None) == 'attachment; filename="download"'
+    assert content_disposition("") == 'attachment; filename="download"'
+
+
+def test_full_download_has_validators(client, uploaded):
+    url, headers = uploaded
+    response = client.get(url, headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"].startswith('"sha256-')
+    assert response.headers["content-length"] == str(len(DATA))
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert "filename*=utf-8''lecture%20notes.pdf" in response.headers["content-disposition"]
+
+
+def test_record_without_file_name_downloads_as_its_id(client, uploaded, db):
+    url, headers = uploaded
+    file_id = url.split("/")[-2]
+    db.query(SubmissionFile).filter(SubmissionFile.id == file_id).update({SubmissionFile.file_name: None})
+    db.commit()
+
+    response = client.get(url, headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["content-disposition"] == f'attachment; filename="{file_id}"'
+
+
+def test_range_requests(client, uploaded):
+    url, headers = uploaded
+    middle = client.get(url, headers={**headers, "Range": "bytes=1000-1999"})
+    tail = client.get(url, headers={**headers, "Range": "bytes=-100"})
+    beyond = client.get(url, headers={**headers, "Range": f"bytes={len(DATA)}-"})
+
+    assert middle.status_code == 206
+    assert middle.content == DATA[1000:2000]
+    assert middle.headers["content-range"] == f"bytes 1000-1999/{len(DATA)}"
+    assert tail.content == DATA[-100:]
+    assert beyond.status_code == 416
+    assert beyond.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_conditional_requests(client, uploaded):
+    url, headers = uploaded
+    etag = client.head(url, headers=headers).headers["etag"]
+
+    not_modified = client.get(url, headers={**headers, "If-None-Match": etag})
+    stale_if_range = client.get(url, headers={**headers, "Range": "bytes=0-9", "If-Range": '"old"'})
+    fresh_if_range = client.get(url, headers={**headers, "Range": "bytes=0-9", "If-Range": etag})
+
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert stale_if_range.status_code == 200 and stale_if_range.content == DATA
+    assert fresh_if_range.status_code == 206 and fresh_if_range.content == DATA[:10]
+
+
+def test_head_and_inline(client, uploaded):
+    url, headers = uploaded
+    head = client.head(url, headers={**headers, "Range": "bytes=0-99"})
+    inline = client.get(f"{url}?inline=true", headers=headers)
+
+    assert head.status_code == 206 and head.content == b""
+    assert head.headers["content-length"] == "100"
+    assert inline.headers["content-disposition"].startswith("inline;")
@@ -0,0 +1,115 @@
+"""
+文件路由测试
+全部请求经过真实的 JWT 认证依赖和数据库用户，校验各角色的权限检查
+"""
+
+import io
+import json
+import zipfile
+
+import pytest
+
+from app.core.constants import UserRole
+
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40
+
+
+def upload(client, headers, submission_id, name="report.pdf", data=PDF, content_type="application/pdf"):
+    return client.post(
+        f"/api/v1/files/upload?submission_id={submission_id}",
+        files={"file": (name, data, content_type)},
+        headers=headers,
+    )
+
+
+def test_student_uploads_through_multipart_route(client, course, auth_headers):
+    student = course.students[0]
+    response = upload(client, auth_headers(student), course.submission_ids[0])
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["file_name"] == "report.pdf"
+    assert body["file_size"] == len(PDF)
+
+
+@pytest.mark.parametrize("role", [UserRole.PROFESSOR, UserRole.TA])
+def test_staff_upload_through_stream_route(client, course, make_user, auth_headers, role):
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=notes.txt",
+        content=b"graded notes\n" * 100,
+        headers={**auth_headers(make_user(role)), "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_admin_is_forbidden_not_a_server_error(client, course, make_user, auth_headers):
+    response = upload(client, auth_headers(make_user(UserRole.ADMIN)), course.submission_ids[0])
+    assert response.status_code == 403
+
+
+def test_missing_token_is_rejected(client, course):
+    response = upload(client, {}, course.submission_ids[0])
+    assert response.status_code in (401, 403)
+
+
+def test_uploaded_file_is_listed_and_downloaded(client, course, auth_headers):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0]).json()["id"]
+
+    listed = client.get(f"/api/v1/files/submission/{course.submission_ids[0]}", headers=headers)
+    downloaded = client.get(f"/api/v1/files/{file_id}/download", headers=headers)
+
+    assert [item["id"] for item in listed.json()["files"]] == [file_id]
+    assert downloaded.status_code == 200
+    assert downloaded.content == PDF
+
+
+def test_only_staff_can_delete(client, course, auth_headers):
+    file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0]).json()["id"]
+
+    forbidden = client.delete(f"/api/v1/files/{file_id}", headers=auth_headers(course.students[0]))
+    deleted = client.delete(f"/api/v1/files/{file_id}", headers=auth_headers(course.assistant))
+    missing = client.get(f"/api/v1/files/{file_id}/download", headers=auth_headers(course.assistant))
+
+    assert forbidden.status_code == 403
+    assert deleted.status_code == 200 and deleted.json()["success"]
+    assert missing.status_code == 404
+
+
+def test_assignment_export_route(client, course, auth_headers):
+    for index, submission_id in enumerate(course.submission_ids):
+        upload(client, auth_headers(course.students[index]), submission_id, name=f"hw{index}.pdf",
+               data=PDF + bytes([index]))
+
+    url = f"/api/v1/files/assignment/{course.assignment_id}/archive"
+    forbidden = client.get(url, headers=auth_headers(course.students[0]))
+    response = client.get(url, headers=auth_headers(course.professor))
+
+    assert forbidden.status_code == 403
+    assert response.status_code == 200, response.text
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        contents = sorted(archive.read(name) for name in archive.namelist() if not name.endswith("/"))
+    assert contents == [PDF + b"\x00", PDF + b"\x01"]
+
+
+def test_assignment_import_route(client, course, auth_headers):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for student in course.students:
+            archive.writestr(f"student_{student.id}/essay.pdf", PDF + str(student.id).encode())
+    url = f"/api/v1/files/assignment/{course.assignment_id}/import"
+    headers = {"Content-Type": "application/zip"}
+
+    forbidden = client.post(url, content=buffer.getvalue(),
+                            headers={**headers, **auth_headers(course.students[0])})
+    response = client.post(url, content=buffer.getvalue(),
+                           headers={**headers, **auth_headers(course.assistant)})
+
+    assert forbidden.status_code == 403
+    assert response.status_code == 200, response.text
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[-1]["type"] == "complete"
+    for submission_id in course.submission_ids:
+        listed = client.get(f"/api/v1/files/submission/{submission_id}", headers=auth_headers(course.assistant))
+        assert [item["file_name"] for item in listed.json()["files"]] == ["essay.pdf"]
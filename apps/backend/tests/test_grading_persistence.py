@@ -0,0 +1,92 @@
+"""
+评分草稿后写持久化测试
+"""
+
+import asyncio
+import os
+
+from app.core.config import settings
+from app.core.grading_persistence import DraftWriteBehind
+from app.core.websocket_manager import WebSocketManager
+
+
+def snapshot(submission_id: str, seq: int, **fields):
+    return {
+        "assignment_id": "a1",
+        "submission_id": submission_id,
+        "criteria_scores": {},
+        "criteria_comments": {},
+        "total_score": None,
+        "feedback": "",
+        "seq": seq,
+        "updated_by": "1",
+        **fields,
+    }
+
+
+def test_journal_defaults_to_upload_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "GRADING_DRAFT_JOURNAL_DIR", None)
+    store = DraftWriteBehind()
+    assert store.journal.directory == tmp_path / ".grading-journal"
+
+    monkeypatch.setattr(settings, "GRADING_DRAFT_JOURNAL_DIR", str(tmp_path / "journal"))
+    assert DraftWriteBehind().journal.directory == tmp_path / "journal"
+
+
+def test_unflushed_drafts_are_recovered_after_a_crash(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "GRADING_DRAFT_JOURNAL_DIR", None)
+
+    async def crash():
+        store = DraftWriteBehind(flush_interval=3600)
+        await store.start()
+        await store.record("a1", snapshot("s1", 1, total_score=5))
+        await store.record("a1", snapshot("s1", 2, total_score=7))
+        # 进程崩溃: 不调用 stop()，只关闭文件句柄释放文件锁
+        store._task.cancel()
+        store.journal._handle.close()
+
+    async def restart():
+        store = DraftWriteBehind(flush_interval=3600)
+        await store.start()
+        drafts = await store.load("a1")
+        await store.stop()
+        return drafts
+
+    asyncio.run(crash())
+    drafts = asyncio.run(restart())
+
+    assert [(draft["submission_id"], draft["seq"], draft["total_score"]) for draft in drafts] == [("s1", 2, 7)]
+    assert os.listdir(tmp_path / ".grading-journal") == []
+
+
+def test_session_rebuild_continues_from_persisted_drafts(monkeypatch, tmp_path, fake_socket):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "GRADING_DRAFT_JOURNAL_DIR", None)
+
+    async def first_worker():
+        manager = WebSocketManager(draft_store=DraftWriteBehind(flush_interval=3600))
+        await manager.start()
+        connection = await manager.connect(fake_socket(), 1, "grader")
+        await manager.join_collaboration_session(connection, "a1")
+        await manager.submit_grade_delta("collab_a1", "s1", "1", {"feedback": "draft"})
+        await manager.stop()
+
+    async def second_worker():
+        manager = WebSocketManager(draft_store=DraftWriteBehind(flush_interval=3600))
+        await manager.start()
+        connection = await manager.connect(fake_socket(), 2, "grader")
+        await manager.join_collaboration_session(connection, "a1")
+        await manager.submit_grade_delta("collab_a1", "s1", "2", {"total_score": 3})
+        result = await manager.get_grading_snapshot("collab_a1")
+        await manager.stop()
+        return result
+
+    asyncio.run(first_worker())
+    result = asyncio.run(second_worker())
+
+    draft = result["drafts"]["s1"]
+    assert draft["feedback"] == "draft"
+    assert draft["total_score"] == 3
+    assert result["seq"] == 2
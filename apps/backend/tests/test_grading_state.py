@@ -0,0 +1,85 @@
+"""
+评分草稿增量测试
+"""
+
+import pytest
+
+from app.core.grading_state import GradingDraft, merge_changes, parse_changes
+
+
+def test_apply_returns_only_effective_changes():
+    draft = GradingDraft(submission_id="s1", criteria_scores={"c1": 3})
+    effective = draft.apply({
+        "criteria_scores": {"c1": 3, "c2": 5},
+        "total_score": 8,
+        "feedback": "good",
+        "feedback_splices": [[4, 0, " work"]],
+    })
+
+    assert effective == {
+        "criteria_scores": {"c2": 5},
+        "total_score": 8,
+        "feedback": "good",
+        "feedback_splices": [[4, 0, " work"]],
+    }
+    assert draft.feedback == "good work"
+    assert draft.apply({"criteria_scores": {"c2": None}}) == {"criteria_scores": {"c2": None}}
+    assert draft.criteria_scores == {"c1": 3}
+
+
+def test_out_of_range_splice_leaves_draft_unchanged():
+    draft = GradingDraft(submission_id="s1", criteria_scores={"c1": 1}, feedback="abc")
+    before = draft.snapshot()
+
+    with pytest.raises(ValueError):
+        draft.apply({
+            "criteria_scores": {"c1": 9},
+            "total_score": 9,
+            "feedback_splices": [[1, 1, "X"], [2, 5, ""]],
+        })
+
+    assert draft.snapshot() == before
+
+
+def test_splices_are_checked_against_the_replaced_feedback():
+    draft = GradingDraft(submission_id="s1", feedback="a much longer feedback")
+    with pytest.raises(ValueError):
+        draft.apply({"feedback": "short", "feedback_splices": [[10, 0, "x"]]})
+    assert draft.feedback == "a much longer feedback"
+
+
+@pytest.mark.parametrize("changes", [
+    {"feedback_splices": "0,0,x"},
+    {"feedback_splices": [[0, 0]]},
+    {"feedback_splices": [["0", 0, "x"]]},
+    {"feedback_splices": [[-1, 0, "x"]]},
+    {"feedback_splices": [[0, True, "x"]]},
+    {"feedback_splices": [[0, 0, 5]]},
+    {"criteria_scores": ["c1"]},
+    {"criteria_scores": {"c1": "ten"}},
+    {"criteria_comments": {"c1": 3}},
+    {"total_score": "high"},
+    {"feedback": ["a"]},
+])
+def test_parse_changes_rejects_malformed_fields(changes):
+    with pytest.raises(ValueError):
+        parse_changes({"changes": changes})
+
+
+def test_parse_changes_accepts_legacy_grade_update():
+    changes = parse_changes({"type": "grade_update", "criteria_scores": {"c1": 2.5},
+                             "total_score": None, "feedback": "ok", "user_id": "1"})
+    assert changes == {"criteria_scores": {"c1": 2.5}, "total_score": None, "feedback": "ok"}
+
+
+def test_merged_changes_apply_like_sequential_changes():
+    first = {"criteria_scores": {"c1": 1}, "feedback_splices": [[0, 0, "ab"]]}
+    second = {"criteria_scores": {"c2": 2}, "feedback_splices": [[2, 0, "c"]]}
+
+    sequential = GradingDraft(submission_id="s1")
+    sequential.apply(first)
+    sequential.apply(second)
+    merged = GradingDraft(submission_id="s1")
+    merged.apply(merge_changes(first, second))
+
+    assert merged.snapshot() == sequential.snapshot()
@@ -0,0 +1,59 @@
+"""
+WebSocket 压测工具的冒烟测试
+以很小的规模运行 scripts/loadtest_websocket.py，确认它仍能驱动当前的路由和管理器
+"""
+
+import argparse
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from app.core.websocket_manager import websocket_manager
+
+SCRIPT_PATH = Path(__file__).parent.parent / "scripts" / "loadtest_websocket.py"
+
+
+@pytest.fixture
+def loadtest():
+    spec = importlib.util.spec_from_file_location("loadtest_websocket", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    # 压测替换了全局管理器的锁，恢复为全新的管理器状态
+    websocket_manager.__init__(websocket_manager.backplane, websocket_manager.draft_store)
+
+
+def options(**overrides) -> argparse.Namespace:
+    values = dict(
+        clients=40, session_size=10, notification_clients=10, duration=0.3, rate=50,
+        course_every=5, slow_fraction=0.0, slow_delay_ms=0.0, fail_fraction=0.0, fail_after=5,
+        protocol=None, seed=1,
+    )
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def test_harness_delivers_broadcasts_to_every_client(loadtest, capsys):
+    args = options()
+    result = asyncio.run(loadtest.run(args))
+    loadtest.report(args, result)
+
+    assert result["clients"] == 50
+    assert result["pings_sent"] > 0
+    # 每次会话广播送达会话内 10 个客户端，课程广播送达 10 个通知客户端
+    assert result["frames"] >= result["pings_sent"] * 10 * 0.9
+    assert result["dropped_clients"] == 0
+    assert result["latency_p50"] <= result["latency_p99"] <= result["latency_max"]
+    assert "clients disconnected" in capsys.readouterr().out
+
+
+def test_failing_clients_are_dropped(loadtest):
+    pytest.importorskip("msgpack")
+    result = asyncio.run(loadtest.run(options(
+        fail_fraction=0.2, fail_after=3, protocol="deeprubric.msgpack+deflate"
+    )))
+
+    assert result["dropped_clients"] > 0
+    assert result["frames"] > 0
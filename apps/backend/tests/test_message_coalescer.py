@@ -0,0 +1,107 @@
+"""
+高频消息合并测试
+"""
+
+import asyncio
+
+from app.core.config import settings
+from app.core.message_coalescer import MessageCoalescer
+from app.core.websocket_manager import WebSocketManager
+
+
+class Recorder:
+    def __init__(self):
+        self.flushed = []
+
+    async def __call__(self, session_id, message):
+        self.flushed.append((session_id, message))
+
+
+def test_latest_message_wins_within_window():
+    async def scenario():
+        recorder = Recorder()
+        coalescer = MessageCoalescer(recorder, 0.02)
+        for position in range(5):
+            await coalescer.submit(("collab_a1", "u1", "annotation", "n1"), "collab_a1", {"x": position})
+        await coalescer.submit(("collab_a1", "u1", "annotation", "n2"), "collab_a1", {"x": 100})
+        pending = len(coalescer.pending)
+        await asyncio.sleep(0.05)
+        return recorder.flushed, pending, coalescer.stats
+
+    flushed, pending, stats = asyncio.run(scenario())
+    assert pending == 2
+    assert sorted(message["x"] for _, message in flushed) == [4, 100]
+    assert (stats.received, stats.flushed, stats.coalesced) == (6, 2, 4)
+
+
+def test_merge_function_and_custom_callback():
+    async def scenario():
+        default, custom = Recorder(), Recorder()
+        coalescer = MessageCoalescer(default, 0.02)
+        merge = lambda previous, latest: {"scores": {**previous["scores"], **latest["scores"]}}
+        await coalescer.submit("k", "s", {"scores": {"c1": 1}}, merge=merge, callback=custom)
+        await coalescer.submit("k", "s", {"scores": {"c2": 2}})
+        await coalescer.submit("k", "s", {"scores": {"c1": 3}})
+        await asyncio.sleep(0.05)
+        return default.flushed, custom.flushed
+
+    default, custom = asyncio.run(scenario())
+    assert default == []
+    assert custom == [("s", {"scores": {"c1": 3, "c2": 2}})]
+
+
+def test_zero_interval_sends_immediately():
+    async def scenario():
+        recorder = Recorder()
+        coalescer = MessageCoalescer(recorder, 0)
+        await coalescer.submit("k", "s", {"n": 1})
+        await coalescer.submit("k", "s", {"n": 2})
+        return recorder.flushed, coalescer.pending
+
+    flushed, pending = asyncio.run(scenario())
+    assert [message["n"] for _, message in flushed] == [1, 2]
+    assert pending == {}
+
+
+def test_flush_all_sends_pending_state_and_survives_callback_errors():
+    async def scenario():
+        recorder = Recorder()
+
+        async def broken(session_id, message):
+            raise RuntimeError("socket closed")
+
+        coalescer = MessageCoalescer(recorder, 60)
+        await coalescer.submit("a", "s", {"n": 1}, callback=broken)
+        await coalescer.submit("b", "s", {"n": 2})
+        await coalescer.flush_all()
+        return recorder.flushed, coalescer.pending
+
+    flushed, pending = asyncio.run(scenario())
+    assert flushed == [("s", {"n": 2})]
+    assert pending == {}
+
+
+def test_manager_merges_grade_deltas_into_one_broadcast(fake_socket, monkeypatch):
+    monkeypatch.setattr(settings, "WEBSOCKET_COALESCE_INTERVAL_MS", 20)
+
+    async def scenario():
+        manager = WebSocketManager()
+        await manager.start()
+        grader, viewer = fake_socket(), fake_socket()
+        grader_connection = await manager.connect(grader, 1, "professor")
+        viewer_connection = await manager.connect(viewer, 2, "grader")
+        await manager.join_collaboration_session(grader_connection, "a1")
+        await manager.join_collaboration_session(viewer_connection, "a1")
+
+        for score in range(3):
+            await manager.submit_grade_delta("collab_a1", "s1", "1", {"criteria_scores": {"c1": score}})
+        await manager.submit_grade_delta("collab_a1", "s1", "1", {"feedback": "ok"})
+        await asyncio.sleep(0.06)
+        draft = manager.collaboration_sessions["collab_a1"].get_draft("s1")
+        await manager.stop()
+        return viewer.of_type("grade_delta"), draft
+
+    deltas, draft = asyncio.run(scenario())
+    assert len(deltas) == 1
+    assert deltas[0]["changes"] == {"criteria_scores": {"c1": 2}, "feedback": "ok"}
+    assert draft.criteria_scores == {"c1": 2}
@@ -0,0 +1,103 @@
+"""
+通知收件箱测试
+"""
+
+import asyncio
+
+from app.core.constants import UserRole
+from app.db.session import SessionLocal
+from app.models.orm.notification import NotificationCounter
+from app.repositories.notification_repository import NotificationRepository
+from app.services.notification_service import NotificationService
+
+
+def notify(user, count, start=0):
+    async def send():
+        db = SessionLocal()
+        try:
+            service = NotificationService(db)
+            return [
+                (await service.notify(user.id, "grade_released", f"Grade {index}", data={"index": index})).id
+                for index in range(start, start + count)
+            ]
+        finally:
+            db.close()
+    return send
+
+
+def test_inbox_pages_newest_first(client, make_user, auth_headers):
+    user = make_user(UserRole.STUDENT)
+    ids = asyncio.run(notify(user, 5)())
+    headers = auth_headers(user)
+
+    first = client.get("/api/v1/notifications?limit=2", headers=headers).json()
+    second = client.get(f"/api/v1/notifications?limit=2&cursor={first['next_cursor']}", headers=headers).json()
+    third = client.get(f"/api/v1/notifications?limit=2&cursor={second['next_cursor']}", headers=headers).json()
+
+    pages = [first, second, third]
+    assert [item["id"] for page in pages for item in page["items"]] == ids[::-1]
+    assert third["next_cursor"] is None
+    assert all(page["unread_count"] == 5 for page in pages)
+
+
+def test_invalid_cursor_is_rejected(client, make_user, auth_headers):
+    response = client.get("/api/v1/notifications?cursor=not-a-cursor", headers=auth_headers(make_user()))
+    assert response.status_code == 400
+
+
+def test_mark_read_keeps_counter_exact(client, make_user, auth_headers):
+    user, other = make_user(UserRole.STUDENT), make_user(UserRole.STUDENT)
+    ids = asyncio.run(notify(user, 4)())
+    other_ids = asyncio.run(notify(other, 1)())
+    headers = auth_headers(user)
+
+    marked = client.post("/api/v1/notifications/mark-read", json={"ids": ids[:2] + other_ids}, headers=headers).json()
+    again = client.post("/api/v1/notifications/mark-read", json={"ids": ids[:2]}, headers=headers).json()
+    unread = client.get("/api/v1/notifications?unread_only=true", headers=headers).json()
+    everything = client.post("/api/v1/notifications/mark-read", json={"all": True}, headers=headers).json()
+    empty = client.post("/api/v1/notifications/mark-read", json={}, headers=headers)
+
+    assert marked == {"updated": 2, "unread_count": 2}
+    assert again == {"updated": 0, "unread_count": 2}
+    assert [item["id"] for item in unread["items"]] == ids[:1:-1]
+    assert everything == {"updated": 2, "unread_count": 0}
+    assert empty.status_code == 400
+    # 其他用户的通知不受影响
+    other_count = client.get("/api/v1/notifications/unread-count", headers=auth_headers(other)).json()
+    assert other_count == {"unread_count": 1}
+
+
+def test_reconcile_repairs_counter(make_user, db):
+    user = make_user(UserRole.STUDENT)
+    asyncio.run(notify(user, 3)())
+    db.query(NotificationCounter).filter(NotificationCounter.user_id == user.id).update(
+        {NotificationCounter.unread_count: 42}
+    )
+    db.commit()
+
+    assert NotificationRepository.reconcile_unread(db, user.id) == 3
+    assert NotificationRepository.get_unread_count(db, user.id) == 3
+
+
+def test_online_user_receives_push_and_count_updates(client, make_user, access_token, auth_headers):
+    user = make_user(UserRole.STUDENT)
+    asyncio.run(notify(user, 2)())
+    with client.websocket_connect(f"/api/v1/ws/notifications?token={access_token(user)}") as websocket:
+        established = websocket.receive_json()
+        (new_id,) = client.portal.call(notify(user, 1, start=2))
+        pushed = websocket.receive_json()
+
+        client.post("/api/v1/notifications/mark-read", json={"ids": [new_id]}, headers=auth_headers(user))
+        synced = websocket.receive_json()
+
+        websocket.send_json({"type": "mark_read", "all": True})
+        # 同一用户的全部连接（包括本连接）先收到未读数同步，然后是本次请求的结果
+        broadcast = websocket.receive_json()
+        marked = websocket.receive_json()
+
+    assert established["unread_count"] == 2
+    assert pushed["type"] == "notification"
+    assert pushed["notification"]["id"] == new_id and pushed["unread_count"] == 3
+    assert synced == {**synced, "type": "notification_unread_count", "unread_count": 2}
+    assert broadcast == {**broadcast, "type": "notification_unread_count", "unread_count": 0}
+    assert marked == {**marked, "type": "notifications_marked_read", "updated": 2, "unread_count": 0}
@@ -0,0 +1,178 @@
+"""
+存储垃圾回收测试
+在本地存储中放置没有记录引用的文件，通过管理员路由运行回收：隔离、游标续传、试运行、期满删除和恢复
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.models.submission import FileBlob
+from app.services.blob_store import blob_key
+from app.services.file_service import get_file_service
+
+
+DATA = b"%PDF-1.4\n" + os.urandom(10_000)
+OLD = time.time() - 2 * 3600
+
+
+@pytest.fixture
+def admin(make_user, auth_headers):
+    return auth_headers(make_user(UserRole.ADMIN))
+
+
+def upload(client, headers, submission_id, data=DATA, name="report.pdf"):
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={submission_id}&file_name={name}",
+        content=data, headers={**headers, "Content-Type": "application/pdf"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def plant(upload_dir, relative_path, data=b"orphan", mtime=OLD):
+    """在存储中写入一个没有记录引用的文件，默认早于 GC_MIN_AGE"""
+    path = upload_dir / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def orphan_blob(upload_dir, data=b"orphan", mtime=OLD):
+    file_hash = "sha256:" + hashlib.sha256(data).hexdigest()
+    return plant(upload_dir, f"blobs/{blob_key(file_hash)}", data, mtime)
+
+
+def age_storage(upload_dir):
+    """把已上传的文件标记为早于 GC_MIN_AGE"""
+    for path in upload_dir.rglob("*"):
+        if path.is_file():
+            os.utime(path, (OLD, OLD))
+
+
+def collect(client, admin, **params):
+    query = "&".join(f"{key}={str(value).lower()}" for key, value in params.items())
+    response = client.post(f"/api/v1/files/storage/gc?{query}", headers=admin)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def quarantined(upload_dir, path):
+    return upload_dir / ".quarantine" / path.relative_to(upload_dir)
+
+
+def test_orphans_are_quarantined_and_referenced_files_kept(client, course, auth_headers, admin, upload_dir, db):
+    upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    age_storage(upload_dir)
+    stored = [blob.storage_path for blob in db.query(FileBlob)]
+    orphan = orphan_blob(upload_dir)
+    preview = plant(upload_dir, f"previews/{blob_key('sha256:' + 'ab' * 32)}/thumb-1.webp")
+    segment = plant(upload_dir, "segments/ff/" + "f" * 32 + ".seg")
+    legacy = plant(upload_dir, "submissions/1/old_upload.pdf")
+
+    report = collect(client, admin)
+
+    assert report == {**report, "scanned_files": 5, "orphaned_files": 4, "quarantined_files": 4,
+                      "completed_pass": True, "missing_blobs": []}
+    assert all(os.path.exists(path) for path in stored)
+    for path in (orphan, preview, segment, legacy):
+        assert not path.exists()
+        assert quarantined(upload_dir, path).exists()
+    assert report["state"]["completed_passes"] == 1 and report["state"]["scan_cursor"] is None
+
+
+def test_recent_files_are_not_collected(client, admin, upload_dir):
+    orphan = orphan_blob(upload_dir, mtime=time.time())
+
+    report = collect(client, admin)
+
+    assert report["scanned_files"] == 1 and report["orphaned_files"] == 0
+    assert orphan.exists()
+
+
+def test_dry_run_only_counts(client, admin, upload_dir):
+    orphan = orphan_blob(upload_dir)
+
+    report = collect(client, admin, dry_run=True)
+
+    assert report == {**report, "dry_run": True, "orphaned_files": 1, "quarantined_files": 0}
+    assert orphan.exists()
+    assert report["state"]["completed_passes"] == 0
+    assert not (upload_dir / ".gc-state.json").exists()
+
+
+def test_cursor_resumes_across_runs(client, admin, upload_dir):
+    orphans = [orphan_blob(upload_dir, f"orphan {index}".encode()) for index in range(3)]
+    ordered = sorted(orphans, key=lambda path: path.relative_to(upload_dir).parts)
+
+    first = collect(client, admin, max_files=2)
+    saved = json.loads((upload_dir / ".gc-state.json").read_text())
+
+    assert first == {**first, "scanned_files": 2, "quarantined_files": 2, "completed_pass": False}
+    assert saved["scan_cursor"] == str(ordered[1])
+    assert [path.exists() for path in ordered] == [False, False, True]
+
+    second = collect(client, admin, max_files=2)
+
+    assert not ordered[2].exists()
+    assert second == {**second, "scanned_files": 1, "quarantined_files": 1, "completed_pass": True}
+    assert second["state"]["scan_cursor"] is None
+
+
+def test_expired_quarantine_is_purged(client, admin, upload_dir, monkeypatch):
+    orphan = orphan_blob(upload_dir)
+    collect(client, admin)
+    assert quarantined(upload_dir, orphan).exists()
+
+    monkeypatch.setattr(settings, "GC_QUARANTINE_PERIOD", 0)
+    report = collect(client, admin)
+
+    assert report["purged_files"] == 1
+    assert not quarantined(upload_dir, orphan).exists()
+
+
+def test_quarantined_content_referenced_again_is_restored(client, course, auth_headers, admin, upload_dir,
+                                                          monkeypatch):
+    # 内容先成为孤立文件被隔离，随后有上传重新引用了相同的内容
+    orphan = orphan_blob(upload_dir, DATA)
+    collect(client, admin)
+    assert not orphan.exists()
+    file_id = upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+
+    monkeypatch.setattr(settings, "GC_QUARANTINE_PERIOD", 0)
+    collect(client, admin)
+    download = client.get(f"/api/v1/files/{file_id}/download", headers=auth_headers(course.professor))
+
+    assert orphan.exists()
+    assert download.content == DATA
+
+
+def test_missing_blob_content_is_restored_or_reported(client, course, auth_headers, admin, db):
+    upload(client, auth_headers(course.students[0]), course.submission_ids[0])
+    upload(client, auth_headers(course.students[1]), course.submission_ids[1], DATA + b"2")
+    db.expire_all()
+    first, second = db.query(FileBlob).order_by(FileBlob.file_hash).all()
+    backend = get_file_service().storage_backend
+    # 一个内容误被移入隔离区，另一个已经丢失
+    os.makedirs(os.path.dirname(backend.get_quarantine_path(first.storage_path)), exist_ok=True)
+    os.replace(first.storage_path, backend.get_quarantine_path(first.storage_path))
+    os.unlink(second.storage_path)
+
+    report = collect(client, admin)
+
+    assert report["checked_blobs"] == 2
+    assert report["restored_files"] == 1
+    assert report["missing_blobs"] == [second.file_hash]
+    assert os.path.exists(first.storage_path)
+
+
+def test_gc_route_is_admin_only(client, course, auth_headers):
+    response = client.post("/api/v1/files/storage/gc", headers=auth_headers(course.professor))
+
+    assert response.status_code == 403
@@ -0,0 +1,189 @@
+"""
+预览图生成测试
+开启预览后通过真实路由上传图片和 PDF，后台任务在进程池中用 Pillow / pypdfium2 生成 WebP 预览
+"""
+
+import io
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import app as fastapi_app
+from app.models.submission import FileBlob
+from app.services.preview import PREVIEW_FAILED, PREVIEW_READY, PreviewPipeline
+from app.services.preview_render import render_previews
+
+Image = pytest.importorskip("PIL.Image")
+pdfium = pytest.importorskip("pypdfium2")
+
+
+def png_bytes(size=(640, 480), color=(30, 120, 200)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def pdf_bytes(pages: int) -> bytes:
+    document = pdfium.PdfDocument.new()
+    for _ in range(pages):
+        document.new_page(612, 792)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    document.close()
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def previews_enabled(monkeypatch):
+    """开启预览；需要在 client 之前请求，应用启动时才会启动生成任务"""
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", True)
+    monkeypatch.setattr(settings, "PREVIEW_WORKERS", 1)
+
+
+def upload(client, headers, submission_id, name, data, content_type):
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={submission_id}",
+        files={"file": (name, data, content_type)},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def wait_for_preview(client, headers, file_id, variant="thumb", page=1, timeout=30.0):
+    """轮询预览路由，直到不再返回 202"""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(f"/api/v1/files/{file_id}/preview?variant={variant}&page={page}", headers=headers)
+        if response.status_code != 202:
+            return response
+        assert response.headers["retry-after"] == "2"
+        assert time.monotonic() < deadline, "preview not generated"
+        time.sleep(0.05)
+
+
+def blob_of(db, file_hash=None):
+    db.expire_all()
+    query = db.query(FileBlob)
+    return query.filter(FileBlob.file_hash == file_hash).one() if file_hash else query.one()
+
+
+def test_render_previews_scales_variants(tmp_path):
+    source = tmp_path / "photo.png"
+    source.write_bytes(png_bytes((2000, 1000)))
+
+    pages = render_previews(str(source), "image/png", str(tmp_path), [("thumb", 256), ("preview", 1280)], 80, 10)
+
+    assert pages == 1
+    with Image.open(tmp_path / "thumb-1.webp") as thumb, Image.open(tmp_path / "preview-1.webp") as preview:
+        assert thumb.size == (256, 128)
+        assert preview.size == (1280, 640)
+
+
+def test_render_previews_limits_pdf_pages(tmp_path):
+    source = tmp_path / "scan.pdf"
+    source.write_bytes(pdf_bytes(3))
+
+    pages = render_previews(str(source), "application/pdf", str(tmp_path), [("thumb", 128)], 80, 2)
+
+    assert pages == 2
+    assert sorted(path.name for path in tmp_path.glob("*.webp")) == ["thumb-1.webp", "thumb-2.webp"]
+
+
+def test_image_preview_is_generated_in_background(previews_enabled, client, course, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0], "photo.png", png_bytes(), "image/png")
+
+    thumb = wait_for_preview(client, headers, file_id)
+    preview = client.get(f"/api/v1/files/{file_id}/preview?variant=preview", headers=headers)
+    cached = client.get(f"/api/v1/files/{file_id}/preview", headers={**headers, "If-None-Match": thumb.headers["etag"]})
+
+    assert thumb.status_code == 200
+    assert thumb.headers["content-type"] == "image/webp"
+    assert "immutable" in thumb.headers["cache-control"]
+    with Image.open(io.BytesIO(thumb.content)) as image:
+        assert max(image.size) == settings.PREVIEW_THUMBNAIL_SIZE
+    with Image.open(io.BytesIO(preview.content)) as image:
+        assert image.size == (640, 480)
+    assert cached.status_code == 304
+    assert blob_of(db).preview_status == PREVIEW_READY
+
+
+def test_pdf_preview_pages(previews_enabled, client, course, auth_headers):
+    headers = auth_headers(course.professor)
+    file_id = upload(client, headers, course.submission_ids[0], "scan.pdf", pdf_bytes(2), "application/pdf")
+
+    second = wait_for_preview(client, headers, file_id, page=2)
+    beyond = client.get(f"/api/v1/files/{file_id}/preview?page=3", headers=headers)
+
+    assert second.status_code == 200
+    assert beyond.status_code == 404
+
+
+def test_unsupported_types_have_no_preview(previews_enabled, client, course, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0], "notes.txt", b"plain text", "text/plain")
+
+    response = client.get(f"/api/v1/files/{file_id}/preview", headers=headers)
+
+    assert response.status_code == 404
+    assert blob_of(db).preview_status is None
+
+
+def test_undecodable_image_is_marked_failed(previews_enabled, client, course, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0], "broken.png", b"\x89PNG\r\n\x1a\n" + b"\0" * 64,
+                     "image/png")
+
+    response = wait_for_preview(client, headers, file_id)
+
+    assert response.status_code == 404
+    assert blob_of(db).preview_status == PREVIEW_FAILED
+
+
+def test_identical_content_is_rendered_once(previews_enabled, client, course, auth_headers, monkeypatch):
+    rendered = []
+    set_status = PreviewPipeline._set_status
+
+    def recording_set_status(file_hash, status, pages, db):
+        rendered.append((file_hash, status))
+        return set_status(file_hash, status, pages, db)
+
+    monkeypatch.setattr(PreviewPipeline, "_set_status", staticmethod(recording_set_status))
+    data = png_bytes()
+    first = upload(client, auth_headers(course.students[0]), course.submission_ids[0], "a.png", data, "image/png")
+    wait_for_preview(client, auth_headers(course.students[0]), first)
+    second = upload(client, auth_headers(course.students[1]), course.submission_ids[1], "b.png", data, "image/png")
+
+    assert wait_for_preview(client, auth_headers(course.students[1]), second).status_code == 200
+    assert [status for _, status in rendered] == [PREVIEW_READY]
+
+
+def test_deleting_last_reference_removes_previews(previews_enabled, client, course, auth_headers, upload_dir):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0], "photo.png", png_bytes(), "image/png")
+    wait_for_preview(client, headers, file_id)
+    assert len(list((upload_dir / "previews").rglob("*.webp"))) == 2
+
+    deleted = client.delete(f"/api/v1/files/{file_id}", headers=auth_headers(course.professor))
+
+    assert deleted.status_code == 200
+    assert list((upload_dir / "previews").rglob("*.webp")) == []
+
+
+def test_pending_previews_resume_after_restart(previews_enabled, course, auth_headers, monkeypatch, db):
+    headers = auth_headers(course.students[0])
+    # 第一次运行时生成任务未执行就关闭，内容保持 pending
+    with monkeypatch.context() as patched:
+        patched.setattr(PreviewPipeline, "enqueue", lambda self, file_hash, mime_type: None)
+        with TestClient(fastapi_app) as first_run:
+            file_id = upload(first_run, headers, course.submission_ids[0], "photo.png", png_bytes(), "image/png")
+            assert first_run.get(f"/api/v1/files/{file_id}/preview", headers=headers).status_code == 202
+
+    with TestClient(fastapi_app) as second_run:
+        response = wait_for_preview(second_run, headers, file_id)
+
+    assert response.status_code == 200
+    assert blob_of(db).preview_status == PREVIEW_READY
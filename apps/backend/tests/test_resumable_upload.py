@@ -0,0 +1,130 @@
+"""
+可续传上传（tus 协议）路由测试
+"""
+
+import base64
+import hashlib
+import os
+
+from fastapi.testclient import TestClient
+
+from app.main import app as fastapi_app
+
+DATA = os.urandom(200_000)
+TUS = {"Tus-Resumable": "1.0.0"}
+PATCH_TYPE = {"Content-Type": "application/offset+octet-stream"}
+
+
+def _metadata(**fields) -> str:
+    return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in fields.items())
+
+
+def create_upload(client, headers, submission_id, length=len(DATA)):
+    response = client.post("/api/v1/files/uploads", headers={
+        **headers, **TUS,
+        "Upload-Length": str(length),
+        "Upload-Metadata": _metadata(
+            submission_id=str(submission_id), filename="thesis.pdf", filetype="application/pdf"
+        ),
+    })
+    assert response.status_code == 201, response.text
+    return response.headers["Location"]
+
+
+def patch(client, url, headers, offset, body, checksum=None):
+    extra = {"Upload-Offset": str(offset)}
+    if checksum is not None:
+        extra["Upload-Checksum"] = checksum
+    return client.patch(url, content=body, headers={**headers, **TUS, **PATCH_TYPE, **extra})
+
+
+def sha256_header(body: bytes) -> str:
+    return "sha256 " + base64.b64encode(hashlib.sha256(body).digest()).decode()
+
+
+def test_options_advertises_protocol(client):
+    response = client.options("/api/v1/files/uploads")
+    assert response.status_code == 204
+    assert response.headers["Tus-Version"] == "1.0.0"
+    assert "checksum" in response.headers["Tus-Extension"]
+
+
+def test_upload_in_chunks_creates_file(client, course, auth_headers):
+    headers = auth_headers(course.students[0])
+    url = create_upload(client, headers, course.submission_ids[0])
+
+    first = patch(client, url, headers, 0, DATA[:80_000], sha256_header(DATA[:80_000]))
+    head = client.head(url, headers={**headers, **TUS})
+    last = patch(client, url, headers, 80_000, DATA[80_000:])
+
+    assert first.status_code == 204
+    assert first.headers["Upload-Offset"] == "80000"
+    assert head.headers["Upload-Offset"] == "80000"
+    assert head.headers["Upload-Length"] == str(len(DATA))
+    assert last.status_code == 200, last.text
+    file_id = last.json()["id"]
+    assert client.head(url, headers={**headers, **TUS}).headers["Upload-File-Id"] == file_id
+    assert client.get(f"/api/v1/files/{file_id}/download", headers=headers).content == DATA
+
+
+def test_checksum_mismatch_is_not_acknowledged(client, course, auth_headers):
+    headers = auth_headers(course.students[0])
+    url = create_upload(client, headers, course.submission_ids[0])
+    patch(client, url, headers, 0, DATA[:50_000])
+
+    rejected = patch(client, url, headers, 50_000, DATA[50_000:100_000], sha256_header(b"something else"))
+    head = client.head(url, headers={**headers, **TUS})
+    retried = patch(client, url, headers, 50_000, DATA[50_000:100_000], sha256_header(DATA[50_000:100_000]))
+
+    assert rejected.status_code == 460
+    assert rejected.headers["Tus-Resumable"] == "1.0.0"
+    assert head.headers["Upload-Offset"] == "50000"
+    assert retried.status_code == 204
+    assert retried.headers["Upload-Offset"] == "100000"
+
+
+def test_offset_mismatch_returns_conflict(client, course, auth_headers):
+    headers = auth_headers(course.students[0])
+    url = create_upload(client, headers, course.submission_ids[0])
+    patch(client, url, headers, 0, DATA[:10_000])
+
+    stale = patch(client, url, headers, 0, DATA[:10_000])
+    ahead = patch(client, url, headers, 20_000, DATA[20_000:30_000])
+
+    assert stale.status_code == 409
+    assert ahead.status_code == 409
+    assert client.head(url, headers={**headers, **TUS}).headers["Upload-Offset"] == "10000"
+
+
+def test_upload_resumes_after_restart(course, auth_headers):
+    headers = auth_headers(course.students[0])
+    with TestClient(fastapi_app) as client:
+        url = create_upload(client, headers, course.submission_ids[0])
+        patch(client, url, headers, 0, DATA[:120_000])
+
+    # 新的应用实例从磁盘上的状态继续
+    with TestClient(fastapi_app) as restarted:
+        offset = int(restarted.head(url, headers={**headers, **TUS}).headers["Upload-Offset"])
+        finished = patch(restarted, url, headers, offset, DATA[offset:])
+        downloaded = restarted.get(f"/api/v1/files/{finished.json()['id']}/download", headers=headers)
+
+    assert offset == 120_000
+    assert finished.status_code == 200
+    assert downloaded.content == DATA
+
+
+def test_uploads_are_private_and_bounded(client, course, auth_headers):
+    owner = auth_headers(course.students[0])
+    other = auth_headers(course.students[1])
+    url = create_upload(client, owner, course.submission_ids[0], length=10)
+
+    foreign = client.head(url, headers={**other, **TUS})
+    too_long = patch(client, url, owner, 0, b"x" * 11)
+    wrong_type = client.patch(url, content=b"x", headers={**owner, **TUS, "Upload-Offset": "0"})
+    cancelled = client.delete(url, headers={**owner, **TUS})
+
+    assert foreign.status_code == 404
+    assert too_long.status_code == 413
+    assert wrong_type.status_code == 415
+    assert cancelled.status_code == 204
+    assert client.head(url, headers={**owner, **TUS}).status_code == 404
@@ -0,0 +1,211 @@
+"""
+S3 存储后端测试
+使用 moto 的本地 S3 服务：分片上传、线程中执行的 boto3 调用、预签名 PUT 直传
+"""
+
+import asyncio
+import hashlib
+import os
+import socket
+
+import pytest
+
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.services.file_service import S3FileStorage
+
+boto3 = pytest.importorskip("boto3")
+moto_server = pytest.importorskip("moto.server")
+requests = pytest.importorskip("requests")
+
+BUCKET = "submissions"
+PART_SIZE = 5 * 1024 * 1024  # S3 最小分片大小
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    port = _free_port()
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3(s3_endpoint, monkeypatch):
+    """切换到 S3 存储并创建空桶；需要在 client 之前请求，应用启动时才会创建 S3 后端"""
+    for name, value in {
+        "STORAGE_TYPE": "s3",
+        "S3_BUCKET_NAME": BUCKET,
+        "S3_ENDPOINT_URL": s3_endpoint,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "S3_MULTIPART_THRESHOLD": PART_SIZE,
+        "S3_MULTIPART_CHUNK_SIZE": PART_SIZE,
+        "MAX_FILE_SIZE": 4 * PART_SIZE,
+        "STORAGE_COMPRESSION_ENABLED": False,
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+    s3_client = boto3.client(
+        "s3", endpoint_url=s3_endpoint, region_name="us-east-1",
+        aws_access_key_id="testing", aws_secret_access_key="testing"
+    )
+    s3_client.create_bucket(Bucket=BUCKET)
+    yield s3_client
+    for item in s3_client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+        s3_client.delete_object(Bucket=BUCKET, Key=item["Key"])
+    s3_client.delete_bucket(Bucket=BUCKET)
+
+
+def test_backend_runs_multipart_uploads_and_ranged_reads(s3, tmp_path):
+    data = os.urandom(2 * PART_SIZE + 7)
+
+    async def scenario():
+        backend = S3FileStorage(BUCKET)
+        # 多个上传在线程中并发执行
+        keys = []
+        for index in range(3):
+            source = tmp_path / f"part-{index}.bin"
+            source.write_bytes(data)
+            keys.append(backend.store_file(str(source), f"tests/{index}.bin", "application/pdf"))
+        keys = await asyncio.gather(*keys)
+        ranged = b"".join([chunk async for chunk in backend.iter_file(keys[0], PART_SIZE - 3, PART_SIZE + 2, 4)])
+        whole = await backend.download_file(keys[1])
+        deleted = await backend.delete_file(keys[2])
+        missing = await backend.stat_object(keys[2])
+        return keys, ranged, whole, deleted, missing
+
+    keys, ranged, whole, deleted, missing = asyncio.run(scenario())
+    head = s3.head_object(Bucket=BUCKET, Key=keys[0])
+
+    # 分片上传的 ETag 以 -<分片数> 结尾
+    assert head["ETag"].strip('"').endswith("-3")
+    assert head["ContentType"] == "application/pdf"
+    assert ranged == data[PART_SIZE - 3:PART_SIZE + 3]
+    assert whole == data
+    assert deleted and missing is None
+    assert not list(tmp_path.iterdir())  # 上传后删除临时文件
+
+
+def test_stream_upload_route_stores_multipart_object(s3, client, course, auth_headers):
+    data = os.urandom(PART_SIZE + 11)
+    headers = auth_headers(course.students[0])
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=scan.pdf",
+        content=data, headers={**headers, "Content-Type": "application/pdf"},
+    )
+    assert response.status_code == 200, response.text
+    file_id = response.json()["id"]
+
+    keys = [item["Key"] for item in s3.list_objects_v2(Bucket=BUCKET)["Contents"]]
+    downloaded = client.get(f"/api/v1/files/{file_id}/download", headers=headers)
+    ranged = client.get(f"/api/v1/files/{file_id}/download", headers={**headers, "Range": "bytes=100-199"})
+
+    assert len(keys) == 1 and keys[0].startswith("blobs/")
+    assert s3.head_object(Bucket=BUCKET, Key=keys[0])["ETag"].strip('"').endswith("-2")
+    assert downloaded.content == data
+    assert ranged.status_code == 206 and ranged.content == data[100:200]
+
+
+def _direct_request(submission_id, data):
+    return {
+        "submission_id": str(submission_id),
+        "file_name": "essay.pdf",
+        "content_type": "application/pdf",
+        "file_size": len(data),
+        "file_hash": "sha256:" + hashlib.sha256(data).hexdigest(),
+    }
+
+
+def test_presigned_put_is_verified_on_completion(s3, client, course, auth_headers):
+    data = os.urandom(300_000)
+    headers = auth_headers(course.students[0])
+    request = _direct_request(course.submission_ids[0], data)
+
+    presigned = client.post("/api/v1/files/upload/presign", json=request, headers=headers).json()
+    assert presigned["upload_required"]
+
+    not_uploaded = client.post("/api/v1/files/upload/complete", json=request, headers=headers)
+    # 大小与声明不一致的对象在确认时被拒绝并删除
+    requests.put(presigned["upload_url"], data=data[:-1], headers=presigned["upload_headers"])
+    truncated = client.post("/api/v1/files/upload/complete", json=request, headers=headers)
+    leftover = s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    uploaded = requests.put(presigned["upload_url"], data=data, headers=presigned["upload_headers"])
+    completed = client.post("/api/v1/files/upload/complete", json=request, headers=headers)
+
+    assert not_uploaded.status_code == 400
+    assert truncated.status_code == 400
+    assert leftover == []
+    assert uploaded.status_code == 200
+    assert completed.status_code == 200, completed.text
+    file_id = completed.json()["id"]
+    assert client.get(f"/api/v1/files/{file_id}/download", headers=headers).content == data
+
+    # 相同内容再次申请时直接复用已有对象
+    again = client.post(
+        "/api/v1/files/upload/presign",
+        json=_direct_request(course.submission_ids[1], data),
+        headers=auth_headers(course.students[1]),
+    ).json()
+    assert not again["upload_required"]
+    assert again["file"]["file_size"] == len(data)
+    assert len(s3.list_objects_v2(Bucket=BUCKET)["Contents"]) == 1
+
+
+def test_presign_checks_quota_before_issuing_url(s3, client, course, auth_headers, make_user):
+    admin = auth_headers(make_user(UserRole.ADMIN))
+    client.put(f"/api/v1/files/storage/usage/user/{course.students[0].id}/quota?quota_bytes=1000", headers=admin)
+    response = client.post(
+        "/api/v1/files/upload/presign",
+        json=_direct_request(course.submission_ids[0], os.urandom(2000)),
+        headers=auth_headers(course.students[0]),
+    )
+
+    assert response.status_code == 413
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+def test_health_check_rebuilds_client_after_failure(s3):
+    class BrokenClient:
+        closed = False
+
+        def head_bucket(self, **kwargs):
+            raise ConnectionError("connection pool is closed")
+
+        def close(self):
+            self.closed = True
+
+    async def scenario():
+        backend = S3FileStorage(BUCKET)
+        broken = backend.s3_client = BrokenClient()
+        healthy = await backend.health_check()
+        rebuilt = backend.s3_client
+        await backend.close()
+        return broken, rebuilt, healthy
+
+    broken, rebuilt, healthy = asyncio.run(scenario())
+    assert healthy
+    assert broken.closed
+    assert rebuilt is not broken
+
+
+def test_health_check_fails_for_missing_bucket(s3):
+    async def scenario():
+        backend = S3FileStorage("missing-bucket")
+        healthy = await backend.health_check()
+        await backend.close()
+        return healthy
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_storage_health_route_uses_s3_backend(s3, client):
+    response = client.get("/api/v1/health/storage")
+
+    assert response.json() == {**response.json(), "status": "healthy", "storage": "s3"}
@@ -0,0 +1,72 @@
+"""
+透明压缩测试
+文本类内容压缩后存储，下载时按 Accept-Encoding 原样发送或解压；统计按实际存储的字节数计算
+"""
+
+import os
+
+from app.core.constants import UserRole
+from app.models.submission import FileBlob
+
+CSV = "".join(f"{index},student{index},{index * 7 % 100}\n" for index in range(20_000)).encode()
+PDF = b"%PDF-1.4\n" + os.urandom(30_000)
+
+
+def upload(client, headers, submission_id, data, name, content_type):
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={submission_id}&file_name={name}",
+        content=data, headers={**headers, "Content-Type": content_type},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_text_is_stored_compressed_and_served_either_way(client, course, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    file_id = upload(client, headers, course.submission_ids[0], CSV, "grades.csv", "text/csv")
+    blob = db.query(FileBlob).one()
+
+    identity = client.get(f"/api/v1/files/{file_id}/download", headers={**headers, "Accept-Encoding": "identity"})
+    encoded = client.get(f"/api/v1/files/{file_id}/download", headers={**headers, "Accept-Encoding": "gzip"})
+    refused = client.get(f"/api/v1/files/{file_id}/download", headers={**headers, "Accept-Encoding": "gzip;q=0"})
+    ranged = client.get(f"/api/v1/files/{file_id}/download",
+                        headers={**headers, "Accept-Encoding": "identity", "Range": "bytes=1000-1099"})
+
+    assert blob.encoding is not None
+    assert blob.stored_size < blob.size == len(CSV)
+    assert os.path.getsize(blob.storage_path) == blob.stored_size
+    assert identity.content == CSV and "content-encoding" not in identity.headers
+    assert "Accept-Encoding" in identity.headers["vary"]
+    assert refused.content == CSV
+    assert ranged.status_code == 206 and ranged.content == CSV[1000:1100]
+    if blob.encoding == "gzip":
+        # TestClient 会自动解压 gzip，直接比较发送的字节数
+        assert encoded.headers["content-encoding"] == "gzip"
+        assert int(encoded.headers["content-length"]) == blob.stored_size
+        assert encoded.content == CSV
+
+
+def test_small_and_binary_files_are_stored_raw(client, course, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    upload(client, headers, course.submission_ids[0], b"hi", "note.txt", "text/plain")
+    upload(client, headers, course.submission_ids[0], PDF, "paper.pdf", "application/pdf")
+
+    assert [blob.encoding for blob in db.query(FileBlob)] == [None, None]
+
+
+def test_storage_stats_count_compressed_bytes(client, course, auth_headers, make_user):
+    upload(client, auth_headers(course.students[0]), course.submission_ids[0], CSV, "grades.csv", "text/csv")
+    upload(client, auth_headers(course.students[1]), course.submission_ids[1], CSV, "grades.csv", "text/csv")
+    upload(client, auth_headers(course.students[1]), course.submission_ids[1], PDF, "paper.pdf", "application/pdf")
+
+    info = client.get("/api/v1/files/storage-info", headers=auth_headers(make_user(UserRole.ADMIN))).json()
+    dedup, compression = info["deduplication"], info["compression"]
+
+    assert compression["compressed_blob_count"] == 1
+    assert compression["raw_bytes"] == len(CSV)
+    assert compression["stored_bytes"] < len(CSV) // 2
+    assert dedup["file_count"] == 3 and dedup["blob_count"] == 2
+    assert dedup["logical_bytes"] == 2 * len(CSV) + len(PDF)
+    # 去重统计的存储字节数是磁盘上的实际大小：压缩后的 CSV 加原样存储的 PDF
+    assert dedup["stored_bytes"] == compression["stored_bytes"] + len(PDF)
+    assert dedup["saved_bytes"] == dedup["logical_bytes"] - dedup["stored_bytes"]
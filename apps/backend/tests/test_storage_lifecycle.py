@@ -0,0 +1,59 @@
+"""
+存储后端生命周期测试
+进程内共享一个文件服务：启动时预热、健康检查接口、关闭时释放
+"""
+
+from fastapi.testclient import TestClient
+
+from app.main import app as fastapi_app
+from app.services import file_service as file_service_module
+from app.services.file_service import LocalFileStorage, get_file_service
+
+
+def test_startup_creates_one_shared_local_backend(client, upload_dir):
+    service = get_file_service()
+
+    assert isinstance(service.storage_backend, LocalFileStorage)
+    assert service.storage_backend.base_path == upload_dir
+    # 预热时创建暂存和内容寻址目录
+    assert (upload_dir / ".incoming").is_dir()
+    assert (upload_dir / "blobs").is_dir()
+    assert get_file_service() is service
+
+
+def test_requests_reuse_the_startup_backend(client, course, auth_headers):
+    service = get_file_service()
+    headers = auth_headers(course.students[0])
+    url = f"/api/v1/files/upload?submission_id={course.submission_ids[0]}"
+
+    for name in ("a.txt", "b.txt"):
+        response = client.post(url, files={"file": (name, name.encode(), "text/plain")}, headers=headers)
+        assert response.status_code == 200
+
+    assert get_file_service() is service
+
+
+def test_shutdown_releases_the_service(upload_dir):
+    with TestClient(fastapi_app):
+        started = get_file_service()
+    assert file_service_module._file_service is None
+
+    with TestClient(fastapi_app):
+        restarted = get_file_service()
+    assert restarted is not started
+
+
+def test_storage_health_route_reports_healthy(client):
+    response = client.get("/api/v1/health/storage")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+    assert response.json()["storage"] == "local"
+
+
+def test_storage_health_route_reports_unwritable_storage(client, monkeypatch):
+    monkeypatch.setattr(file_service_module.os, "access", lambda path, mode: False)
+
+    response = client.get("/api/v1/health/storage")
+
+    assert response.json()["status"] == "unhealthy"
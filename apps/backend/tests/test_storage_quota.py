@@ -0,0 +1,178 @@
+"""
+存储配额测试
+超出配额的上传在读取请求体之前被拒绝，计数保持不变
+"""
+
+import base64
+import os
+
+import pytest
+from starlette.requests import Request
+
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.models.submission import FileBlob, StorageUsage
+
+QUOTA = 100_000
+
+
+def usage(db):
+    db.expire_all()
+    return {(row.scope, row.scope_id): (row.file_count, row.used_bytes) for row in db.query(StorageUsage)}
+
+
+@pytest.fixture
+def admin(make_user, auth_headers):
+    return auth_headers(make_user(UserRole.ADMIN))
+
+
+@pytest.fixture
+def limited(client, course, admin, auth_headers):
+    """第一名学生已上传一个文件，配额设为 QUOTA"""
+    student = auth_headers(course.students[0])
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=first.pdf",
+        content=b"%PDF" + os.urandom(60_000), headers={**student, "Content-Type": "application/pdf"},
+    )
+    assert response.status_code == 200
+    client.put(f"/api/v1/files/storage/usage/user/{course.students[0].id}/quota?quota_bytes={QUOTA}", headers=admin)
+    return student
+
+
+@pytest.fixture
+def body_never_read(monkeypatch):
+    """被拒绝的上传不应读取请求体"""
+    async def fail_form(self, **kwargs):
+        raise AssertionError("request body was read")
+
+    async def fail_stream(self):
+        raise AssertionError("request body was read")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(Request, "form", fail_form)
+    monkeypatch.setattr(Request, "stream", fail_stream)
+
+
+def test_usage_follows_uploads_and_deletes(client, course, admin, auth_headers, db):
+    headers = auth_headers(course.students[0])
+    data = b"%PDF" + os.urandom(10_000)
+    file_id = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        files={"file": ("a.pdf", data, "application/pdf")}, headers=headers,
+    ).json()["id"]
+
+    after_upload = client.get(f"/api/v1/files/storage/usage/user/{course.students[0].id}", headers=admin).json()
+    client.delete(f"/api/v1/files/{file_id}", headers=auth_headers(course.professor))
+
+    assert after_upload["file_count"] == 1 and after_upload["used_bytes"] == len(data)
+    assert usage(db) == {("course", course.id): (0, 0), ("user", course.students[0].id): (0, 0)}
+
+
+def test_multipart_over_quota_is_rejected_before_parsing(client, course, limited, db, body_never_read):
+    before = usage(db)
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        files={"file": ("big.pdf", b"%PDF" + os.urandom(120_000), "application/pdf")}, headers=limited,
+    )
+
+    assert response.status_code == 413
+    assert "存储空间不足" in response.json()["detail"]
+    assert usage(db) == before
+    assert db.query(FileBlob).count() == 1
+
+
+def test_multipart_over_quota_after_parsing_is_rejected(client, course, limited, db):
+    # 请求长度扣除 multipart 余量后未超出配额，解析后按实际大小拒绝
+    before = usage(db)
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        files={"file": ("big.pdf", b"%PDF" + os.urandom(50_000), "application/pdf")}, headers=limited,
+    )
+
+    assert response.status_code == 413
+    assert usage(db) == before
+    assert db.query(FileBlob).count() == 1
+
+
+def test_multipart_within_quota_is_accepted(client, course, limited, db):
+    data = b"%PDF" + os.urandom(30_000)
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        files={"file": ("small.pdf", data, "application/pdf")}, headers=limited,
+    )
+
+    assert response.status_code == 200, response.text
+    assert usage(db)[("user", course.students[0].id)][0] == 2
+
+
+def test_multipart_oversized_file_is_rejected_before_parsing(client, course, auth_headers, monkeypatch, body_never_read):
+    monkeypatch.setattr(settings, "MAX_FILE_SIZE", 10_000)
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        files={"file": ("big.pdf", os.urandom(200_000), "application/pdf")},
+        headers=auth_headers(course.students[0]),
+    )
+    assert response.status_code == 413
+
+
+def test_multipart_requires_file_field(client, course, auth_headers):
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={course.submission_ids[0]}",
+        data={"other": "x"}, headers=auth_headers(course.students[0]),
+    )
+    assert response.status_code == 422
+
+
+def test_stream_over_quota_is_rejected_before_reading(client, course, limited, db, body_never_read):
+    before = usage(db)
+    response = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=big.pdf",
+        content=os.urandom(60_000), headers={**limited, "Content-Type": "application/pdf"},
+    )
+    assert response.status_code == 413
+    assert usage(db) == before
+
+
+def test_resumable_upload_checks_quota_on_create(client, course, limited):
+    fields = {"submission_id": str(course.submission_ids[0]), "filename": "big.pdf", "filetype": "application/pdf"}
+    metadata = ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in fields.items())
+    response = client.post("/api/v1/files/uploads", headers={
+        **limited, "Tus-Resumable": "1.0.0", "Upload-Length": "60000", "Upload-Metadata": metadata,
+    })
+
+    assert response.status_code == 413
+
+
+def test_course_quota_applies_to_every_student(client, course, auth_headers, monkeypatch, db):
+    monkeypatch.setattr(settings, "COURSE_STORAGE_QUOTA", 50_000)
+    first = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[0]}&file_name=a.pdf",
+        content=os.urandom(30_000), headers={**auth_headers(course.students[0]), "Content-Type": "application/pdf"},
+    )
+    second = client.post(
+        f"/api/v1/files/upload/stream?submission_id={course.submission_ids[1]}&file_name=b.pdf",
+        content=os.urandom(30_000), headers={**auth_headers(course.students[1]), "Content-Type": "application/pdf"},
+    )
+
+    assert first.status_code == 200
+    assert second.status_code == 413
+    assert "课程" in second.json()["detail"]
+    assert usage(db)[("course", course.id)] == (1, 30_000)
+
+
+def test_reconcile_corrects_drifted_counters(client, course, limited, admin, db):
+    db.query(StorageUsage).update({StorageUsage.used_bytes: 1, StorageUsage.file_count: 7})
+    db.commit()
+
+    report = client.post("/api/v1/files/storage/usage/reconcile", headers=admin)
+    corrected = client.get(f"/api/v1/files/storage/usage/user/{course.students[0].id}", headers=admin).json()
+
+    assert report.status_code == 200
+    assert corrected["file_count"] == 1 and corrected["used_bytes"] == 60_004
+    assert corrected["quota_bytes"] == QUOTA
+
+
+def test_usage_routes_are_admin_only(client, course, auth_headers):
+    headers = auth_headers(course.professor)
+    assert client.get(f"/api/v1/files/storage/usage/course/{course.id}", headers=headers).status_code == 403
+    assert client.post("/api/v1/files/storage/usage/reconcile", headers=headers).status_code == 403
@@ -0,0 +1,188 @@
+"""
+冷热分层存储测试
+已结束课程的 blob 通过真实路由打包进本地冷存储分段，读取、删除和重新打包对调用方透明
+"""
+
+import json
+import os
+import struct
+
+import pytest
+
+from app.core.config import settings
+from app.core.constants import UserRole
+from app.models.assignment import Assignment
+from app.models.course import Course
+from app.models.submission import FileBlob, StorageSegment, Submission
+from app.services.storage_tiering import SEGMENT_MAGIC, parse_packed_path
+
+
+PDF = b"%PDF-1.4\n" + os.urandom(20_000)
+CSV = b"student,score\n" + b"".join(f"{index},{index % 100}\n".encode() for index in range(2000))
+
+
+@pytest.fixture
+def admin(make_user, auth_headers):
+    return auth_headers(make_user(UserRole.ADMIN))
+
+
+def upload(client, headers, submission_id, name, data, content_type):
+    response = client.post(
+        f"/api/v1/files/upload?submission_id={submission_id}",
+        files={"file": (name, data, content_type)},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def close_course(db, course_id):
+    db.query(Course).filter(Course.id == course_id).update({Course.is_active: False})
+    db.commit()
+
+
+def run_tiering(client, admin):
+    response = client.post("/api/v1/files/storage/tiering/run", headers=admin)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def blobs(db):
+    db.expire_all()
+    return db.query(FileBlob).order_by(FileBlob.file_hash).all()
+
+
+@pytest.fixture
+def archived(client, course, auth_headers, db):
+    """已结束课程中的一个 PDF 和一个（压缩存储的）CSV"""
+    headers = auth_headers(course.students[0])
+    course.pdf_id = upload(client, headers, course.submission_ids[0], "report.pdf", PDF, "application/pdf")
+    course.csv_id = upload(client, headers, course.submission_ids[0], "scores.csv", CSV, "text/csv")
+    course.hot_paths = [blob.storage_path for blob in blobs(db)]
+    close_course(db, course.id)
+    return course
+
+
+def test_closed_course_blobs_are_packed_into_one_segment(client, archived, admin, db):
+    report = run_tiering(client, admin)
+    packed = blobs(db)
+
+    assert report == {**report, "segments": 1, "packed_blobs": 2, "removed_segments": 0}
+    assert {blob.tier for blob in packed} == {"cold"}
+    assert len({blob.segment_id for blob in packed}) == 1
+    assert all(not os.path.exists(path) for path in archived.hot_paths)
+
+    segment_path, _, _ = parse_packed_path(packed[0].storage_path)
+    with open(segment_path, "rb") as handle:
+        data = handle.read()
+    assert data.endswith(SEGMENT_MAGIC)
+    index_length = struct.unpack("<Q", data[-16:-8])[0]
+    index = json.loads(data[-16 - index_length:-16])
+    assert sorted(entry["hash"] for entry in index["blobs"]) == [blob.file_hash for blob in packed]
+    assert report["packed_bytes"] == sum(entry["length"] for entry in index["blobs"])
+
+
+def test_packed_files_download_unchanged(client, archived, admin, auth_headers):
+    run_tiering(client, admin)
+    headers = auth_headers(archived.professor)
+
+    pdf = client.get(f"/api/v1/files/{archived.pdf_id}/download", headers=headers)
+    ranged = client.get(f"/api/v1/files/{archived.pdf_id}/download",
+                        headers={**headers, "Range": "bytes=100-199"})
+    csv = client.get(f"/api/v1/files/{archived.csv_id}/download", headers=headers)
+    encoded = client.get(f"/api/v1/files/{archived.csv_id}/download",
+                         headers={**headers, "Accept-Encoding": "gzip"})
+
+    assert pdf.content == PDF
+    assert ranged.status_code == 206 and ranged.content == PDF[100:200]
+    assert csv.content == CSV
+    assert encoded.headers.get("content-encoding") == "gzip"
+
+
+def test_active_and_shared_blobs_stay_hot(client, course, auth_headers, admin, db):
+    # 同一学生在另一门进行中的课程也提交了同样的 PDF
+    other = Course(name="Compilers", code=f"CS-{course.id}-2", professor_id=course.professor.id, is_active=True)
+    db.add(other)
+    db.flush()
+    assignment = Assignment(title="Homework 1", course_id=other.id)
+    db.add(assignment)
+    db.flush()
+    submission = Submission(assignment_id=assignment.id, student_id=course.students[0].id)
+    db.add(submission)
+    db.commit()
+    headers = auth_headers(course.students[0])
+    upload(client, headers, course.submission_ids[0], "report.pdf", PDF, "application/pdf")
+    upload(client, headers, submission.id, "report.pdf", PDF, "application/pdf")
+    upload(client, auth_headers(course.students[1]), submission.id, "notes.pdf", PDF + b"notes",
+           "application/pdf")
+    close_course(db, course.id)
+
+    report = run_tiering(client, admin)
+
+    assert report["packed_blobs"] == 0
+    assert {blob.tier for blob in blobs(db)} == {"hot"}
+
+
+def test_segment_size_limits_blobs_per_segment(client, archived, admin, db, monkeypatch):
+    monkeypatch.setattr(settings, "TIERING_SEGMENT_MAX_BLOBS", 1)
+
+    report = run_tiering(client, admin)
+
+    assert report["segments"] == 2
+    assert len({blob.segment_id for blob in blobs(db)}) == 2
+
+
+def test_tier_usage_route_follows_packing(client, archived, admin):
+    before = client.get("/api/v1/files/storage/tiers", headers=admin).json()
+    run_tiering(client, admin)
+    after = client.get("/api/v1/files/storage/tiers", headers=admin).json()
+
+    assert before["tiers"]["hot"]["blob_count"] == 2
+    assert before["segments"]["segment_count"] == 0
+    assert after["tiers"]["hot"]["blob_count"] == 0
+    assert after["tiers"]["cold"]["blob_count"] == 2
+    assert after["tiers"]["cold"]["stored_bytes"] == after["segments"]["live_bytes"]
+    assert after["segments"] == {**after["segments"], "segment_count": 1, "packed_blob_count": 2, "dead_bytes": 0}
+
+
+def test_deleting_packed_files_empties_and_removes_segment(client, archived, admin, auth_headers, db):
+    run_tiering(client, admin)
+    segment_path = parse_packed_path(blobs(db)[0].storage_path)[0]
+    headers = auth_headers(archived.professor)
+
+    assert client.delete(f"/api/v1/files/{archived.pdf_id}", headers=headers).status_code == 200
+    partial = client.get("/api/v1/files/storage/tiers", headers=admin).json()["segments"]
+    assert partial["packed_blob_count"] == 1 and partial["dead_bytes"] > 0
+    assert client.get(f"/api/v1/files/{archived.csv_id}/download", headers=headers).content == CSV
+
+    assert client.delete(f"/api/v1/files/{archived.csv_id}", headers=headers).status_code == 200
+    report = run_tiering(client, admin)
+
+    assert report["removed_segments"] == 1
+    assert not os.path.exists(segment_path)
+    db.expire_all()
+    assert db.query(StorageSegment).count() == 0
+
+
+def test_sparse_segments_are_repacked(client, archived, admin, auth_headers, db, monkeypatch):
+    monkeypatch.setattr(settings, "TIERING_COMPACT_THRESHOLD", 0.99)
+    run_tiering(client, admin)
+    old_segment = blobs(db)[0].segment_id
+    old_path = parse_packed_path(blobs(db)[0].storage_path)[0]
+    client.delete(f"/api/v1/files/{archived.pdf_id}", headers=auth_headers(archived.professor))
+
+    report = run_tiering(client, admin)
+    remaining = blobs(db)
+
+    assert report == {**report, "segments": 1, "packed_blobs": 1, "removed_segments": 1}
+    assert len(remaining) == 1 and remaining[0].segment_id != old_segment
+    assert not os.path.exists(old_path)
+    download = client.get(f"/api/v1/files/{archived.csv_id}/download", headers=auth_headers(archived.professor))
+    assert download.content == CSV
+
+
+def test_tiering_routes_are_admin_only(client, course, auth_headers):
+    headers = auth_headers(course.professor)
+
+    assert client.get("/api/v1/files/storage/tiers", headers=headers).status_code == 403
+    assert client.post("/api/v1/files/storage/tiering/run", headers=headers).status_code == 403
@@ -0,0 +1,279 @@
+"""
+跨 worker 广播总线测试
+Redis 实现使用 fakeredis，多 worker 通过共享同一个 InMemoryBroker 模拟
+"""
+
+import asyncio
+
+import pytest
+
+from app.core import websocket_backplane
+from app.core.grading_leases import LeaseConflictError, LeaseError
+from app.core.websocket_backplane import InMemoryBackplane, InMemoryBroker, RedisBackplane
+from app.core.websocket_manager import WebSocketManager
+
+fakeredis = pytest.importorskip("fakeredis")
+aioredis = pytest.importorskip("redis.asyncio")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """所有 RedisBackplane 实例连接到同一个 fakeredis 服务"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        aioredis, "from_url",
+        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+    )
+    monkeypatch.setattr(RedisBackplane, "RECONNECT_MIN_DELAY", 0.01)
+    return server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(websocket_backplane, "time", clock)
+    return clock
+
+
+def test_redis_members_expire_unless_refreshed(redis_server, clock):
+    async def scenario():
+        alive = RedisBackplane("redis://test", worker_id="alive", member_ttl=90)
+        crashed = RedisBackplane("redis://test", worker_id="crashed", member_ttl=90)
+        await alive.add_session_member("collab_1", "1")
+        await crashed.add_session_member("collab_1", "2")
+        assert await alive.get_session_members("collab_1") == {"1", "2"}
+
+        # 只有存活的 worker 在心跳时续期
+        clock.now += 60
+        await alive.refresh_session_members({"collab_1": ["1"]})
+        clock.now += 60
+        members = await alive.get_session_members("collab_1")
+        ttl = await alive.redis.ttl(RedisBackplane.MEMBERS_KEY.format(session_id="collab_1"))
+        await alive.redis.close()
+        await crashed.redis.close()
+        return members, ttl
+
+    members, ttl = asyncio.run(scenario())
+    assert members == {"1"}
+    assert 0 < ttl <= 90
+
+
+def test_redis_member_removal_is_per_worker(redis_server, clock):
+    async def scenario():
+        first = RedisBackplane("redis://test", worker_id="a")
+        second = RedisBackplane("redis://test", worker_id="b")
+        # 同一用户在两个 worker 上各有一个连接，其中一个离开后仍是成员
+        await first.add_session_member("collab_1", "7")
+        await second.add_session_member("collab_1", "7")
+        await first.remove_session_member("collab_1", "7")
+        still_member = await first.get_session_members("collab_1")
+        await second.remove_session_member("collab_1", "7")
+        gone = await first.get_session_members("collab_1")
+        await first.redis.close()
+        await second.redis.close()
+        return still_member, gone
+
+    still_member, gone = asyncio.run(scenario())
+    assert still_member == {"7"}
+    assert gone == set()
+
+
+def test_redis_publish_reaches_other_workers_only(redis_server):
+    async def scenario():
+        received = {"a": [], "b": []}
+
+        def handler(name):
+            async def handle(scope, target, message):
+                received[name].append((scope, target, message))
+            return handle
+
+        a = RedisBackplane("redis://test", worker_id="a")
+        b = RedisBackplane("redis://test", worker_id="b")
+        await a.start(handler("a"))
+        await b.start(handler("b"))
+        await a.publish("session", "collab_1", {"type": "ping"})
+        for _ in range(50):
+            if received["b"]:
+                break
+            await asyncio.sleep(0.01)
+        await a.close()
+        await b.close()
+        return received
+
+    received = asyncio.run(scenario())
+    assert received["b"] == [("session", "collab_1", {"type": "ping"})]
+    assert received["a"] == []
+
+
+class BrokenPubSub:
+    """第一次读取即连接中断的订阅"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def listen(self):
+        raise ConnectionError("connection reset by peer")
+        yield  # pragma: no cover
+
+    async def close(self):
+        self.closed = True
+
+
+def test_redis_listener_reconnects_after_connection_error(redis_server):
+    async def scenario():
+        received = []
+
+        async def handle(scope, target, message):
+            received.append(message)
+
+        listener = RedisBackplane("redis://test", worker_id="listener")
+        publisher = RedisBackplane("redis://test", worker_id="publisher")
+        listener._handler = handle
+        broken = listener._pubsub = BrokenPubSub()
+        listener._listener = asyncio.create_task(listener._listen())
+
+        # 等待重新订阅
+        for _ in range(100):
+            if listener._pubsub is not None and listener._pubsub is not broken \
+                    and listener._pubsub.subscribed:
+                break
+            await asyncio.sleep(0.01)
+        await publisher.publish("course", "c1", {"type": "after_reconnect"})
+        for _ in range(100):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+
+        task_alive = not listener._listener.done()
+        await listener.close()
+        await publisher.redis.close()
+        return broken.closed, task_alive, received
+
+    broken_closed, task_alive, received = asyncio.run(scenario())
+    assert broken_closed
+    assert task_alive
+    assert received == [{"type": "after_reconnect"}]
+
+
+def test_manager_refreshes_members_of_local_sessions(fake_socket):
+    class RecordingBackplane(InMemoryBackplane):
+        def __init__(self):
+            super().__init__()
+            self.refreshed = []
+
+        async def refresh_session_members(self, members):
+            self.refreshed.append(members)
+
+    async def scenario():
+        backplane = RecordingBackplane()
+        manager = WebSocketManager(backplane)
+        await manager.start()
+        connection = await manager.connect(fake_socket(), 5, "professor")
+        await manager.join_collaboration_session(connection, "a1")
+        await manager.refresh_session_members()
+        await manager.stop()
+        return backplane.refreshed
+
+    assert asyncio.run(scenario()) == [{"collab_a1": ["5"]}]
+
+
+def test_session_broadcast_fans_out_across_workers(fake_socket):
+    async def scenario():
+        broker = InMemoryBroker()
+        worker_a = WebSocketManager(InMemoryBackplane(broker, "a"))
+        worker_b = WebSocketManager(InMemoryBackplane(broker, "b"))
+        await worker_a.start()
+        await worker_b.start()
+
+        socket_a, socket_b = fake_socket(), fake_socket()
+        conn_a = await worker_a.connect(socket_a, 1, "professor")
+        conn_b = await worker_b.connect(socket_b, 2, "grader")
+        await worker_a.join_collaboration_session(conn_a, "a1")
+        await worker_b.join_collaboration_session(conn_b, "a1")
+
+        await worker_a.broadcast_sequenced("collab_a1", {"type": "note", "text": "hi"})
+        await worker_a.send_personal_message({"type": "direct"}, 2)
+        members = await worker_a.backplane.get_session_members("collab_a1")
+        replay = await worker_b.get_replay("collab_a1", 0)
+
+        await worker_a.stop()
+        await worker_b.stop()
+        return socket_b, members, replay
+
+    socket_b, members, replay = asyncio.run(scenario())
+    notes = socket_b.of_type("note")
+    assert [note["seq"] for note in notes] == [1]
+    assert socket_b.of_type("direct")
+    assert members == {"1", "2"}
+    # 其他 worker 上也记录了带序列号的消息，重连到任一 worker 都能补发
+    assert [message["seq"] for message in replay] == [1]
+
+
+def test_redis_leases_are_shared_across_workers(redis_server):
+    async def scenario():
+        worker_a = RedisBackplane("redis://test", worker_id="a")
+        worker_b = RedisBackplane("redis://test", worker_id="b")
+        first, _ = await worker_a.update_leases("s1", lambda leases: leases.acquire("a1", "s1", None, "1"))
+        with pytest.raises(LeaseConflictError):
+            await worker_b.update_leases("s1", lambda leases: leases.acquire("a1", "s1", "c1", "2"))
+        with pytest.raises(LeaseError):
+            await worker_b.update_leases("s1", lambda leases: leases.check_write("s1", {"c1"}, "2", None))
+        await worker_b.update_leases("s1", lambda leases: leases.check_write("s1", {"c1"}, "1", first.token))
+        listed = await worker_b.get_assignment_leases("a1")
+
+        # 过期的租约由下一次操作移除并返回，新租约的令牌大于之前所有令牌
+        short, _ = await worker_a.update_leases("s2", lambda leases: leases.acquire("a1", "s2", None, "1", 0.05))
+        await asyncio.sleep(0.1)
+        taken, expired = await worker_b.update_leases("s2", lambda leases: leases.acquire("a1", "s2", None, "2"))
+        released, _ = await worker_b.update_leases("s1", lambda leases: leases.release("s1", None, "1"))
+        remaining = await worker_a.get_assignment_leases("a1")
+        await worker_a.redis.close()
+        await worker_b.redis.close()
+        return first, listed, short, taken, expired, released, remaining
+
+    first, listed, short, taken, expired, released, remaining = asyncio.run(scenario())
+    assert [(lease.submission_id, lease.holder, lease.token) for lease in listed] == [("s1", "1", first.token)]
+    assert [(lease.holder, lease.token) for lease in expired] == [("1", short.token)]
+    assert first.token < short.token < taken.token
+    assert released.token == first.token
+    assert [(lease.submission_id, lease.holder) for lease in remaining] == [("s2", "2")]
+
+
+def test_leases_are_shared_across_workers(fake_socket):
+    async def scenario():
+        broker = InMemoryBroker()
+        worker_a = WebSocketManager(InMemoryBackplane(broker, "a"))
+        worker_b = WebSocketManager(InMemoryBackplane(broker, "b"))
+        await worker_a.start()
+        await worker_b.start()
+        socket_b = fake_socket()
+        conn_b = await worker_b.connect(socket_b, 2, "grader")
+        await worker_b.join_collaboration_session(conn_b, "a1")
+
+        first = await worker_a.acquire_lease("a1", "s1", None, "1")
+        with pytest.raises(LeaseConflictError):
+            await worker_b.acquire_lease("a1", "s1", "c1", "2", connection_id=conn_b.connection_id)
+        with pytest.raises(LeaseError):
+            await worker_b.check_lease_write("s1", {"c1"}, "2", None)
+        listed = await worker_b.get_leases("a1")
+        await worker_a.release_lease("s1", None, "1", first.token)
+        second = await worker_b.acquire_lease("a1", "s1", "c1", "2", connection_id=conn_b.connection_id)
+
+        await worker_a.stop()
+        await worker_b.stop()
+        return socket_b, first, second, listed
+
+    socket_b, first, second, listed = asyncio.run(scenario())
+    assert [(lease["holder"], lease["token"]) for lease in listed] == [("1", first.token)]
+    assert second.token > first.token
+    events = [(message["type"], message["lease"]["holder"]) for message in socket_b.sent
+              if message["type"].startswith("lease_")]
+    assert events == [("lease_acquired", "1"), ("lease_released", "1"), ("lease_acquired", "2")]
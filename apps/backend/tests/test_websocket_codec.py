@@ -0,0 +1,76 @@
+"""
+WebSocket 编解码与协议协商测试
+"""
+
+import pytest
+
+from app.core.constants import UserRole
+from app.core.websocket_codec import (
+    FLAG_DEFLATE,
+    FLAG_RAW,
+    JSON_CODEC,
+    MsgpackCodec,
+    negotiate_codec,
+)
+
+msgpack = pytest.importorskip("msgpack")
+
+MESSAGE = {"type": "grade_delta", "seq": 7, "changes": {"feedback": "well done " * 200}}
+
+
+def test_msgpack_round_trip_and_compression_threshold():
+    compressed = MsgpackCodec(compress_threshold=64)
+    plain = MsgpackCodec()
+
+    small = compressed.encode({"type": "ping"})
+    large = compressed.encode(MESSAGE)
+    uncompressed = plain.encode(MESSAGE)
+
+    assert small[:1] == FLAG_RAW
+    assert large[:1] == FLAG_DEFLATE and len(large) < len(uncompressed) // 4
+    assert uncompressed[:1] == FLAG_RAW
+    assert compressed.decode(large) == plain.decode(uncompressed) == MESSAGE
+    assert compressed.decode('{"type": "pong"}') == {"type": "pong"}
+    with pytest.raises(ValueError):
+        plain.decode(b"\x07" + msgpack.packb({}))
+
+
+def test_incompressible_payload_is_sent_raw():
+    codec = MsgpackCodec(compress_threshold=16)
+    frame = codec.encode({"blob": bytes(range(256))})
+    assert frame[:1] == FLAG_RAW
+
+
+@pytest.mark.parametrize("subprotocols, query, expected", [
+    (["unknown", "deeprubric.msgpack+deflate"], {}, ("deeprubric.msgpack+deflate", "deeprubric.msgpack+deflate")),
+    (["deeprubric.msgpack", "deeprubric.json"], {}, ("deeprubric.msgpack", "deeprubric.msgpack")),
+    ([], {"protocol": "deeprubric.msgpack"}, (None, "deeprubric.msgpack")),
+    ([], {"protocol": "xml"}, (None, "deeprubric.json")),
+    ([], {}, (None, "deeprubric.json")),
+])
+def test_negotiation(fake_socket, subprotocols, query, expected):
+    accepted, codec = negotiate_codec(fake_socket(subprotocols, query))
+    assert (accepted, codec.name) == expected
+
+
+def test_notification_socket_speaks_msgpack(client, make_user, access_token):
+    student = make_user(UserRole.STUDENT)
+    codec = MsgpackCodec(compress_threshold=1024)
+    with client.websocket_connect(
+        f"/api/v1/ws/notifications?token={access_token(student)}",
+        subprotocols=["deeprubric.msgpack+deflate"],
+    ) as websocket:
+        assert websocket.accepted_subprotocol == "deeprubric.msgpack+deflate"
+        established = codec.decode(websocket.receive_bytes())
+        websocket.send_bytes(codec.encode({"type": "subscribe_course", "course_id": "c1"}))
+        subscribed = codec.decode(websocket.receive_bytes())
+
+    assert established["type"] == "connection_established"
+    assert subscribed["type"] == "course_subscribed"
+
+
+def test_json_is_the_default(client, make_user, access_token):
+    student = make_user(UserRole.STUDENT)
+    with client.websocket_connect(f"/api/v1/ws/notifications?token={access_token(student)}") as websocket:
+        established = JSON_CODEC.decode(websocket.receive_text())
+    assert established["type"] == "connection_established"
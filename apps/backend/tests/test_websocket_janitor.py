@@ -0,0 +1,142 @@
+"""
+WebSocket 后台清理任务测试
+"""
+
+import asyncio
+import time
+
+from app.core.websocket_janitor import WebSocketJanitor
+from app.core.websocket_manager import WebSocketManager
+
+
+def run(scenario):
+    async def wrapper():
+        manager = WebSocketManager()
+        await manager.start()
+        try:
+            return await scenario(manager)
+        finally:
+            await manager.stop()
+    return asyncio.run(wrapper())
+
+
+def test_silent_connections_are_evicted_and_others_pinged(fake_socket):
+    async def scenario(manager):
+        janitor = WebSocketJanitor(manager, heartbeat_interval=10, missed_heartbeats=2)
+        silent, alive = fake_socket(), fake_socket()
+        silent_connection = await manager.connect(silent, 1, "student")
+        alive_connection = await manager.connect(alive, 2, "student")
+        silent_connection.last_seen = time.monotonic() - 25
+        await manager.touch(alive_connection)
+
+        await janitor.run_once()
+        return silent, alive, list(manager.active_connections), alive_connection.connection_id, manager.get_metrics()
+
+    silent, alive, connections, alive_id, metrics = run(scenario)
+    assert silent.closed_with == 1001
+    assert connections == [alive_id]
+    assert alive.of_type("ping") and not silent.of_type("ping")
+    assert metrics["evicted_connections"] == 1
+    assert metrics["heartbeats_sent"] == 1
+
+
+def test_failed_ping_disconnects(fake_socket):
+    async def scenario(manager):
+        socket = fake_socket()
+        await manager.connect(socket, 1, "student")
+        socket.fail_sends = True
+        await WebSocketJanitor(manager).run_once()
+        return manager.active_connections
+
+    assert run(scenario) == {}
+
+
+def test_idle_sessions_expire_in_batches(fake_socket):
+    async def scenario(manager):
+        janitor = WebSocketJanitor(manager, session_idle_timeout=0, batch_size=3)
+        connection = await manager.connect(fake_socket(), 1, "professor")
+        for index in range(7):
+            await manager.join_collaboration_session(connection, f"a{index}")
+            # 有重放记录的会话在最后一个用户离开后保留到空闲过期
+            await manager.broadcast_sequenced(f"collab_a{index}", {"type": "note"})
+        for index in range(1, 7):
+            await manager.leave_collaboration_session(connection, f"collab_a{index}")
+        await asyncio.sleep(0.01)
+
+        await janitor.run_once()
+        return set(manager.collaboration_sessions), manager.get_metrics()["expired_sessions"]
+
+    sessions, expired = run(scenario)
+    # 仍有在线用户的会话保留
+    assert sessions == {"collab_a0"}
+    assert expired == 6
+
+
+def test_expired_leases_are_released_and_announced(fake_socket):
+    async def scenario(manager):
+        socket = fake_socket()
+        connection = await manager.connect(socket, 1, "professor")
+        await manager.join_collaboration_session(connection, "a1")
+        await manager.acquire_lease("a1", "s1", None, "1", ttl=1, connection_id=connection.connection_id)
+        await asyncio.sleep(1.05)
+        await WebSocketJanitor(manager).run_once()
+        return socket, manager.leases.get("s1")
+
+    socket, lease = run(scenario)
+    assert lease is None
+    assert [message["lease"]["submission_id"] for message in socket.of_type("lease_expired")] == ["s1"]
+
+
+def test_expired_lease_seen_on_lookup_is_still_announced(fake_socket):
+    async def scenario(manager):
+        socket = fake_socket()
+        connection = await manager.connect(socket, 1, "professor")
+        await manager.join_collaboration_session(connection, "a1")
+        await manager.acquire_lease("a1", "s1", None, "1", ttl=0.05, connection_id=connection.connection_id)
+        await asyncio.sleep(0.1)
+        # 查询时过期的租约不会被悄悄移除，清理任务仍会解除归属并通知会话
+        looked_up = manager.leases.get("s1"), await manager.get_lease("s1")
+        await WebSocketJanitor(manager).run_once()
+        return socket, looked_up, dict(manager.connection_leases), dict(manager.lease_connections)
+
+    socket, looked_up, connection_leases, lease_connections = run(scenario)
+    assert looked_up == (None, None)
+    assert [message["lease"]["submission_id"] for message in socket.of_type("lease_expired")] == ["s1"]
+    assert connection_leases == {} and lease_connections == {}
+
+
+def test_expired_lease_taken_over_is_announced_before_acquire(fake_socket):
+    async def scenario(manager):
+        socket = fake_socket()
+        connection = await manager.connect(socket, 1, "professor")
+        await manager.join_collaboration_session(connection, "a1")
+        first = await manager.acquire_lease("a1", "s1", None, "1", ttl=0.05, connection_id=connection.connection_id)
+        await asyncio.sleep(0.1)
+        second = await manager.acquire_lease("a1", "s1", None, "2")
+        await WebSocketJanitor(manager).run_once()
+        return socket, first, second, dict(manager.connection_leases)
+
+    socket, first, second, connection_leases = run(scenario)
+    events = [(message["type"], message["lease"]["holder"]) for message in socket.sent
+              if message["type"].startswith("lease_")]
+    assert events == [("lease_acquired", "1"), ("lease_expired", "1"), ("lease_acquired", "2")]
+    assert second.token > first.token
+    assert connection_leases == {}
+
+
+def test_start_and_stop_run_the_loop(fake_socket):
+    async def scenario(manager):
+        janitor = WebSocketJanitor(manager, heartbeat_interval=0.01, missed_heartbeats=100)
+        socket = fake_socket()
+        await manager.connect(socket, 1, "student")
+        await janitor.start()
+        await asyncio.sleep(0.05)
+        await janitor.stop()
+        pings = len(socket.of_type("ping"))
+        await asyncio.sleep(0.03)
+        return pings, len(socket.of_type("ping")), janitor._task
+
+    pings, later, task = run(scenario)
+    assert pings >= 2
+    assert later == pings
+    assert task is None
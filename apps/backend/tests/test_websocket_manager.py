@@ -0,0 +1,212 @@
+"""
+WebSocketManager 连接管理测试
+同一用户可以同时持有多个连接，断开一个连接只清理它自己的会话成员关系和租约
+"""
+
+import asyncio
+
+from app.core.websocket_backplane import InMemoryBackplane
+from app.core.websocket_manager import WebSocketManager
+
+
+def run(scenario):
+    async def wrapper():
+        manager = WebSocketManager()
+        await manager.start()
+        try:
+            return await scenario(manager)
+        finally:
+            await manager.stop()
+    return asyncio.run(wrapper())
+
+
+def test_connections_of_one_user_are_kept_separately(fake_socket):
+    async def scenario(manager):
+        notifications = await manager.connect(fake_socket(), 1, "professor")
+        collab = await manager.connect(fake_socket(), 1, "professor")
+        await manager.join_collaboration_session(collab, "a1")
+        await manager.acquire_lease("a1", "s1", None, "1", connection_id=collab.connection_id)
+
+        await manager.disconnect(notifications)
+        session = await manager.get_session_info("collab_a1")
+        return (
+            list(manager.active_connections),
+            set(session.active_users),
+            manager.leases.get("s1"),
+            collab.connection_id
+        )
+
+    connections, active_users, lease, collab_id = run(scenario)
+    assert connections == [collab_id]
+    assert active_users == {"1"}
+    assert lease is not None and lease.holder == "1"
+
+
+def test_disconnect_releases_only_the_connection_leases(fake_socket):
+    async def scenario(manager):
+        first = await manager.connect(fake_socket(), 1, "grader")
+        second = await manager.connect(fake_socket(), 1, "grader")
+        await manager.join_collaboration_session(first, "a1")
+        await manager.join_collaboration_session(second, "a2")
+        await manager.acquire_lease("a1", "s1", None, "1", connection_id=first.connection_id)
+        await manager.acquire_lease("a2", "s2", None, "1", connection_id=second.connection_id)
+        # 通过 REST 获取的租约不属于任何连接，只会过期或显式释放
+        await manager.acquire_lease("a1", "s3", None, "1")
+
+        await manager.disconnect(first)
+        return manager.leases.get("s1"), manager.leases.get("s2"), manager.leases.get("s3")
+
+    first_lease, second_lease, rest_lease = run(scenario)
+    assert first_lease is None
+    assert second_lease is not None
+    assert rest_lease is not None
+
+
+def test_stale_socket_does_not_tear_down_reconnected_socket(fake_socket):
+    async def scenario(manager):
+        stale_socket = fake_socket()
+        stale = await manager.connect(stale_socket, 1, "grader")
+        await manager.join_collaboration_session(stale, "a1")
+        lease = await manager.acquire_lease("a1", "s1", "c1", "1", connection_id=stale.connection_id)
+
+        # 客户端重连，旧连接的 finally 在新连接建立之后才执行
+        fresh = await manager.connect(fake_socket(), 1, "grader")
+        await manager.join_collaboration_session(fresh, "a1")
+        await manager.leave_collaboration_session(stale, "collab_a1")
+        await manager.disconnect(stale)
+        # 重复断开（例如发送失败时已清理）直接忽略
+        await manager.disconnect(stale)
+
+        after_stale = manager.leases.get("s1", "c1")
+        session = await manager.get_session_info("collab_a1")
+        members = set(session.active_users)
+        await manager.broadcast_to_session("collab_a1", {"type": "note"})
+        fresh_notes = fresh.websocket.of_type("note")
+
+        await manager.disconnect(fresh)
+        return lease, after_stale, members, fresh_notes, manager.leases.get("s1", "c1")
+
+    lease, after_stale, members, fresh_notes, after_fresh = run(scenario)
+    assert after_stale is not None and after_stale.token == lease.token
+    assert members == {"1"}
+    assert len(fresh_notes) == 1
+    assert after_fresh is None
+
+
+def test_failed_send_disconnects_only_that_socket(fake_socket):
+    async def scenario(manager):
+        broken_socket = fake_socket()
+        broken = await manager.connect(broken_socket, 1, "professor")
+        healthy = await manager.connect(fake_socket(), 1, "professor")
+        await manager.join_collaboration_session(broken, "a1")
+        await manager.join_collaboration_session(healthy, "a1")
+
+        broken_socket.fail_sends = True
+        await manager.broadcast_to_session("collab_a1", {"type": "note"})
+        await manager.send_personal_message({"type": "direct"}, 1)
+        session = await manager.get_session_info("collab_a1")
+        return list(manager.active_connections), set(session.active_users), healthy
+
+    connections, members, healthy = run(scenario)
+    assert connections == [healthy.connection_id]
+    assert members == {"1"}
+    assert len(healthy.websocket.of_type("note")) == 1
+    assert len(healthy.websocket.of_type("direct")) == 1
+
+
+def test_user_leaves_session_when_last_connection_leaves(fake_socket):
+    async def scenario(manager):
+        observer = await manager.connect(fake_socket(), 2, "professor")
+        await manager.join_collaboration_session(observer, "a1")
+        tabs = [await manager.connect(fake_socket(), 1, "grader") for _ in range(2)]
+        for tab in tabs:
+            await manager.join_collaboration_session(tab, "a1")
+
+        await manager.disconnect(tabs[0])
+        after_first = await manager.get_active_users_in_session("collab_a1")
+        left_after_first = observer.websocket.of_type("user_left")
+        await manager.disconnect(tabs[1])
+        after_second = await manager.get_active_users_in_session("collab_a1")
+        return after_first, list(left_after_first), after_second, observer.websocket.of_type("user_left")
+
+    after_first, left_after_first, after_second, left = run(scenario)
+    assert sorted(user["user_id"] for user in after_first) == ["1", "2"]
+    assert left_after_first == []
+    assert [user["user_id"] for user in after_second] == ["2"]
+    assert [message["user_id"] for message in left] == ["1"]
+
+
+def test_rejected_delta_is_reported_to_the_submitter_only(fake_socket):
+    async def scenario(manager):
+        manager.coalescer.interval = 0.01
+        author = await manager.connect(fake_socket(), 1, "grader")
+        observer = await manager.connect(fake_socket(), 2, "grader")
+        await manager.join_collaboration_session(author, "a1")
+        await manager.join_collaboration_session(observer, "a1")
+        await manager.submit_grade_delta("collab_a1", "s1", "1", {"feedback": "abc"},
+                                         connection_id=author.connection_id)
+        await asyncio.sleep(0.05)
+
+        # 两个增量在窗口内合并，第二个的偏移超出范围，整个合并结果被拒绝
+        await manager.submit_grade_delta("collab_a1", "s1", "1", {"total_score": 5},
+                                         connection_id=author.connection_id)
+        await manager.submit_grade_delta("collab_a1", "s1", "1", {"feedback_splices": [[10, 0, "x"]]},
+                                         connection_id=author.connection_id)
+        await asyncio.sleep(0.05)
+        snapshot = await manager.get_grading_snapshot("collab_a1")
+        return author.websocket, observer.websocket, snapshot
+
+    author, observer, snapshot = run(scenario)
+    assert len(observer.of_type("grade_delta")) == 1
+    errors = [message for message in author.of_type("session_status_update") if message["status"] == "error"]
+    assert len(errors) == 1
+    assert errors[0]["details"]["submission_id"] == "s1"
+    assert errors[0]["details"]["draft"]["feedback"] == "abc"
+    assert snapshot["seq"] == 1
+    assert snapshot["drafts"]["s1"]["total_score"] is None
+    assert not [message for message in observer.of_type("session_status_update") if message["status"] == "error"]
+
+
+def test_concurrent_commits_are_sequenced_in_apply_order(fake_socket):
+    class SlowFirstSequence(InMemoryBackplane):
+        """第一次分配序列号时等待，让第二个提交在此期间进入"""
+
+        def __init__(self):
+            super().__init__()
+            self.release = asyncio.Event()
+            self.calls = 0
+
+        async def next_sequence(self, session_id):
+            self.calls += 1
+            if self.calls == 1:
+                await self.release.wait()
+            return await super().next_sequence(session_id)
+
+    async def scenario():
+        backplane = SlowFirstSequence()
+        manager = WebSocketManager(backplane)
+        await manager.start()
+        first = await manager.connect(fake_socket(), 1, "grader")
+        second = await manager.connect(fake_socket(), 2, "grader")
+        await manager.join_collaboration_session(first, "a1")
+        await manager.join_collaboration_session(second, "a1")
+
+        earlier = asyncio.create_task(manager.submit_grade_delta("collab_a1", "s1", "1", {"total_score": 1}))
+        await asyncio.sleep(0.01)
+        later = asyncio.create_task(manager.submit_grade_delta("collab_a1", "s1", "2", {"total_score": 2}))
+        await asyncio.sleep(0.01)
+        backplane.release.set()
+        await asyncio.gather(earlier, later)
+
+        snapshot = await manager.get_grading_snapshot("collab_a1")
+        replay = await manager.get_replay("collab_a1", 0)
+        await manager.stop()
+        return first.websocket.of_type("grade_delta"), snapshot, replay
+
+    deltas, snapshot, replay = asyncio.run(scenario())
+    # 按序列号重放，最后生效的值与服务端草稿一致
+    ordered = sorted(deltas, key=lambda message: message["seq"])
+    assert [message["changes"]["total_score"] for message in ordered] == [1, 2]
+    assert [message["seq"] for message in deltas] == [1, 2]
+    assert snapshot["drafts"]["s1"]["total_score"] == 2
+    assert [message["changes"]["total_score"] for message in replay] == [1, 2]
@@ -0,0 +1,89 @@
+"""
+空闲连接和会话的内存布局测试
+"""
+
+import asyncio
+import importlib.util
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.core.config import settings
+from app.core.websocket_manager import CollaborationSession, UserConnection, WebSocketManager, monotonic_to_iso
+
+BENCH_PATH = Path(__file__).parent.parent / "scripts" / "bench_websocket_memory.py"
+
+
+@pytest.fixture(scope="module")
+def bench():
+    spec = importlib.util.spec_from_file_location("bench_websocket_memory", BENCH_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_connection_and_session_are_slotted():
+    connection = UserConnection(user_id="1", websocket=None, role="grader")
+    session = CollaborationSession(session_id="collab_a1", assignment_id="a1")
+
+    for instance in (connection, session):
+        assert not hasattr(instance, "__dict__")
+        with pytest.raises(AttributeError):
+            instance.unexpected = True
+    assert isinstance(connection.joined_at, float)
+    assert connection.last_seen == connection.joined_at
+
+
+def test_repeated_ids_are_shared():
+    first = UserConnection(user_id="1", websocket=None, role="".join(["gra", "der"]), course_id="".join(["c", "1"]))
+    second = UserConnection(user_id="2", websocket=None, role="".join(["gra", "der"]), course_id="".join(["c", "1"]))
+    assert first.role is second.role
+    assert first.course_id is second.course_id
+
+
+def test_session_buffers_are_allocated_on_first_use(monkeypatch):
+    monkeypatch.setattr(settings, "WEBSOCKET_REPLAY_BUFFER_SIZE", 3)
+    session = CollaborationSession(session_id="collab_a1", assignment_id="a1")
+    assert session.drafts is None and session.replay is None
+
+    session.get_draft("s1")
+    for seq in range(1, 6):
+        session.record({"seq": seq})
+
+    assert list(session.drafts) == ["s1"]
+    assert [message["seq"] for message in session.replay] == [3, 4, 5]
+    assert session.seq == 5
+
+
+def test_joined_only_sessions_carry_no_buffers(fake_socket):
+    async def scenario():
+        manager = WebSocketManager()
+        await manager.start()
+        for user_id in range(20):
+            connection = await manager.connect(fake_socket(), user_id, "grader")
+            await manager.join_collaboration_session(connection, "a1")
+        session = manager.collaboration_sessions["collab_a1"]
+        await manager.stop()
+        return session
+
+    session = asyncio.run(scenario())
+    assert len(session.active_users) == 20
+    assert session.drafts is None and session.replay is None
+
+
+def test_timestamps_are_converted_only_for_output():
+    connection = UserConnection(user_id="1", websocket=None, role="student")
+    exposed = datetime.fromisoformat(monotonic_to_iso(connection.joined_at))
+    assert abs((datetime.utcnow() - exposed).total_seconds()) < 5
+
+
+def test_compact_layout_uses_less_memory_than_legacy(bench):
+    legacy = bench.object_cost(bench.LegacyUserConnection, 2000)
+    compact = bench.object_cost(UserConnection, 2000)
+    (_, legacy_sessions), legacy_total = bench.measure(bench.build_legacy, 2000, 50)
+    (_, compact_sessions), compact_total = bench.measure(bench.build_compact, 2000, 50)
+
+    assert compact < legacy
+    assert compact_total < legacy_total
+    assert len(compact_sessions) == len(legacy_sessions) == 40
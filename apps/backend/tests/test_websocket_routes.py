@@ -0,0 +1,219 @@
+"""
+WebSocket 路由测试
+通过挂载在 /api/v1/ws 下的真实路由和 JWT 认证依赖连接
+"""
+
+import time
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.core.constants import UserRole
+from app.core.websocket_manager import websocket_manager
+
+
+def receive_until(websocket, predicate):
+    """读取消息直到满足条件，返回期间收到的全部消息"""
+    messages = []
+    while True:
+        messages.append(websocket.receive_json())
+        if predicate(messages[-1]):
+            return messages
+
+
+def wait_until(condition, timeout=2.0):
+    """等待服务端处理完断开等异步事件"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_notification_socket_rejects_missing_token(client):
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect("/api/v1/ws/notifications") as websocket:
+            websocket.receive_json()
+    assert exc_info.value.code == 1008
+
+
+def test_notification_socket_rejects_invalid_token(client):
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect("/api/v1/ws/notifications?token=not-a-jwt") as websocket:
+            websocket.receive_json()
+    assert exc_info.value.code == 1008
+
+
+def test_notification_socket_accepts_token_query(client, make_user, access_token):
+    student = make_user(UserRole.STUDENT)
+    with client.websocket_connect(f"/api/v1/ws/notifications?token={access_token(student)}") as websocket:
+        established = websocket.receive_json()
+        websocket.send_json({"type": "subscribe_course", "course_id": "c1"})
+        subscribed = websocket.receive_json()
+
+    assert established["type"] == "connection_established"
+    assert established["user_id"] == str(student.id)
+    assert established["role"] == "student"
+    assert established["unread_count"] == 0
+    assert subscribed == {**subscribed, "type": "course_subscribed", "course_id": "c1"}
+
+
+def test_collaboration_socket_accepts_authorization_header(client, make_user, auth_headers):
+    professor = make_user(UserRole.PROFESSOR)
+    with client.websocket_connect(
+        "/api/v1/ws/collaboration/route-a1", headers=auth_headers(professor)
+    ) as websocket:
+        messages = receive_until(websocket, lambda message: message["type"] == "grading_snapshot")
+
+    joined = next(message for message in messages if message.get("status") == "session_joined")
+    snapshot = messages[-1]
+    assert messages[0]["type"] == "user_joined"
+    assert [user["user_id"] for user in joined["details"]["active_users"]] == [str(professor.id)]
+    assert snapshot["drafts"] == {}
+
+
+def test_collaboration_socket_rejects_students(client, make_user, access_token):
+    student = make_user(UserRole.STUDENT)
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect(
+            f"/api/v1/ws/collaboration/route-a2?token={access_token(student)}"
+        ) as websocket:
+            websocket.receive_json()
+    assert exc_info.value.code == 1008
+
+
+def test_collaboration_status_route_is_mounted(client, make_user, auth_headers):
+    professor = make_user(UserRole.PROFESSOR)
+    response = client.get("/api/v1/ws/collaboration/route-a3/status", headers=auth_headers(professor))
+    assert response.status_code == 200
+    assert response.json()["status"] == "inactive"
+
+
+def test_closing_notification_socket_keeps_collaboration_lease(client, make_user, access_token, auth_headers):
+    professor = make_user(UserRole.PROFESSOR)
+    user_id = str(professor.id)
+    token = access_token(professor)
+    with client.websocket_connect(f"/api/v1/ws/collaboration/route-a4?token={token}") as collab:
+        receive_until(collab, lambda message: message["type"] == "grading_snapshot")
+        collab.send_json({"type": "lease_acquire", "submission_id": "s1"})
+        granted = receive_until(collab, lambda message: message.get("status") == "lease_granted")[-1]
+
+        with client.websocket_connect(f"/api/v1/ws/notifications?token={token}") as notifications:
+            notifications.receive_json()
+            assert len(websocket_manager.user_connections[user_id]) == 2
+        wait_until(lambda: len(websocket_manager.user_connections.get(user_id, ())) == 1)
+
+        status = client.get(
+            "/api/v1/ws/collaboration/route-a4/status", headers=auth_headers(professor)
+        ).json()
+        assert [user["user_id"] for user in status["active_users"]] == [user_id]
+        assert [lease["token"] for lease in status["leases"]] == [granted["details"]["token"]]
+
+    wait_until(lambda: websocket_manager.leases.get("s1") is None)
+
+
+def test_lock_routes_are_mounted(client, make_user, auth_headers):
+    first, second = make_user(UserRole.PROFESSOR), make_user(UserRole.PROFESSOR)
+    url = "/api/v1/ws/collaboration/route-a5"
+
+    locked = client.post(f"{url}/lock?submission_id=s9", headers=auth_headers(first))
+    conflict = client.post(f"{url}/lock?submission_id=s9", headers=auth_headers(second))
+    lease = client.get(f"{url}/leases/s9", headers=auth_headers(second)).json()["lease"]
+    unlocked = client.post(f"{url}/unlock?submission_id=s9", headers=auth_headers(first))
+
+    assert locked.status_code == 200
+    assert locked.json()["lease"]["holder"] == str(first.id)
+    assert conflict.status_code == 409
+    assert lease["holder"] == str(first.id)
+    assert unlocked.json()["released"] == 1
+
+
+def test_teaching_assistants_can_join_and_lock(client, make_user, access_token, auth_headers):
+    assistant = make_user(UserRole.TA)
+    with client.websocket_connect(
+        f"/api/v1/ws/collaboration/route-a6?token={access_token(assistant)}"
+    ) as websocket:
+        messages = receive_until(websocket, lambda message: message["type"] == "grading_snapshot")
+    locked = client.post(
+        "/api/v1/ws/collaboration/route-a6/lock?submission_id=s1", headers=auth_headers(assistant)
+    )
+
+    assert any(message.get("status") == "session_joined" for message in messages)
+    assert locked.status_code == 200
+
+
+def test_reconnect_with_last_seq_replays_missed_deltas(client, make_user, access_token):
+    professor, assistant = make_user(UserRole.PROFESSOR), make_user(UserRole.TA)
+    url = "/api/v1/ws/collaboration/route-a7"
+    is_delta = lambda message: message["type"] == "grade_delta"
+
+    with client.websocket_connect(f"{url}?token={access_token(professor)}") as editor:
+        receive_until(editor, lambda message: message["type"] == "grading_snapshot")
+
+        with client.websocket_connect(f"{url}?token={access_token(assistant)}") as viewer:
+            receive_until(viewer, lambda message: message["type"] == "grading_snapshot")
+            editor.send_json({"type": "grade_delta", "submission_id": "s1",
+                              "changes": {"criteria_scores": {"c1": 3}}})
+            seen = receive_until(viewer, is_delta)[-1]
+
+        # 断线期间的两次修改
+        editor.send_json({"type": "grade_delta", "submission_id": "s1",
+                          "changes": {"criteria_scores": {"c2": 4}}})
+        receive_until(editor, is_delta)
+        editor.send_json({"type": "grade_delta", "submission_id": "s1",
+                          "changes": {"feedback": "good"}})
+        receive_until(editor, is_delta)
+
+        with client.websocket_connect(
+            f"{url}?token={access_token(assistant)}&last_seq={seen['seq']}"
+        ) as viewer:
+            replay = receive_until(viewer, lambda message: message["type"] == "replay")[-1]
+            viewer.send_json({"type": "resume", "last_seq": 0})
+            full = receive_until(viewer, lambda message: message["type"] == "replay")[-1]
+
+    assert [message["changes"] for message in replay["messages"]] == [
+        {"criteria_scores": {"c2": 4}},
+        {"feedback": "good"},
+    ]
+    assert [message["seq"] for message in full["messages"]] == [
+        seen["seq"]] + [message["seq"] for message in replay["messages"]]
+
+
+def test_resume_beyond_replay_buffer_sends_snapshot(client, make_user, access_token, monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "WEBSOCKET_REPLAY_BUFFER_SIZE", 2)
+    assistant = make_user(UserRole.TA)
+    with client.websocket_connect(
+        f"/api/v1/ws/collaboration/route-a8?token={access_token(assistant)}"
+    ) as websocket:
+        receive_until(websocket, lambda message: message["type"] == "grading_snapshot")
+        for score in range(4):
+            websocket.send_json({"type": "grade_delta", "submission_id": "s1",
+                                 "changes": {"total_score": score}})
+            receive_until(websocket, lambda message: message["type"] == "grade_delta")
+        websocket.send_json({"type": "resume", "last_seq": 0})
+        snapshot = receive_until(websocket, lambda message: message["type"] in ("replay", "grading_snapshot"))[-1]
+
+    assert snapshot["type"] == "grading_snapshot"
+    assert snapshot["drafts"]["s1"]["total_score"] == 3
+    assert snapshot["seq"] == 4
+
+
+def test_malformed_splices_are_rejected_with_an_error_frame(client, make_user, access_token):
+    assistant = make_user(UserRole.TA)
+    is_error = lambda message: message.get("status") == "error"
+    with client.websocket_connect(
+        f"/api/v1/ws/collaboration/route-a9?token={access_token(assistant)}"
+    ) as websocket:
+        receive_until(websocket, lambda message: message["type"] == "grading_snapshot")
+        websocket.send_json({"type": "grade_delta", "submission_id": "s1",
+                             "changes": {"feedback_splices": [["x", 0, 1]]}})
+        malformed = receive_until(websocket, is_error)[-1]
+        websocket.send_json({"type": "grade_delta", "submission_id": "s1",
+                             "changes": {"feedback_splices": [[5, 0, "x"]]}})
+        out_of_range = receive_until(websocket, is_error)[-1]
+        websocket.send_json({"type": "request_snapshot"})
+        snapshot = receive_until(websocket, lambda message: message["type"] == "grading_snapshot")[-1]
+
+    assert "feedback_splices" in malformed["details"]["error"]
+    assert out_of_range["details"]["draft"]["feedback"] == ""
+    assert snapshot["seq"] == 0